@@ -0,0 +1,27 @@
+"""
+Pass/fail bookkeeping shared by the benchmarks: every check of a run is
+recorded, and the failures are reported together at the end.
+
+    check = Checks()
+    check(rows == 3, f"{rows} rows stored")
+    ...
+    return check.report()
+"""
+from typing import List
+
+
+class Checks:
+    """check(ok, message) records message when ok is falsy; report() prints them and returns the exit code"""
+
+    def __init__(self):
+        self.failures: List[str] = []
+
+    def __call__(self, ok, message: str):
+        if not ok:
+            self.failures.append(message)
+
+    def report(self) -> int:
+        for message in self.failures:
+            print(f"FAIL: {message}")
+        print("OK" if not self.failures else f"{len(self.failures)} check(s) failed")
+        return 1 if self.failures else 0
@@ -0,0 +1,147 @@
+"""
+Readers vs. a long-running writer, old access pattern vs. the pooled WAL layer.
+
+    cd backend && python -m benchmarks.db_concurrency
+
+A writer thread repeatedly holds a write transaction open for WRITE_HOLD seconds
+while reader threads call get_site in a loop. With the legacy rollback journal the
+readers stall for the whole transaction; with WAL they keep reading the last
+committed snapshot. A second section measures event-loop stalls when the same
+reads are made from async code synchronously vs. through database.aio.
+"""
+import asyncio
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+import database
+from benchmarks.checks import Checks
+
+WRITE_HOLD = 0.2
+DURATION = 2.0
+READERS = 4
+
+
+def _seed(n: int = 200):
+    for i in range(n):
+        database.create_pending_site(f"site-{i}", {"product_type": f"product {i}"})
+        database.update_site_success_with_meta(f"site-{i}", "<html>" + "x" * 20000 + "</html>", {})
+
+
+def _legacy_get_site(site_id: str):
+    # The original pattern: a fresh rollback-journal connection per call
+    conn = sqlite3.connect(database.DB_PATH, timeout=30)
+    conn.execute("PRAGMA journal_mode=DELETE")
+    row = conn.execute("SELECT * FROM sites WHERE id = ?", (site_id,)).fetchone()
+    conn.close()
+    return row
+
+
+def _writer(stop: threading.Event, legacy: bool):
+    conn = sqlite3.connect(database.DB_PATH, isolation_level=None, timeout=30)
+    conn.execute("PRAGMA journal_mode=%s" % ("DELETE" if legacy else "WAL"))
+    i = 0
+    while not stop.is_set():
+        # EXCLUSIVE = the lock a rollback-journal writer holds while committing;
+        # under WAL it only excludes other writers.
+        conn.execute("BEGIN EXCLUSIVE")
+        conn.execute("UPDATE sites SET error_message = ? WHERE id = ?", (str(i), f"site-{i % 200}"))
+        time.sleep(WRITE_HOLD)
+        conn.execute("COMMIT")
+        time.sleep(0.01)
+        i += 1
+    conn.close()
+
+
+def _read_latencies(read, stop: threading.Event, out: list):
+    i = 0
+    while not stop.is_set():
+        start = time.perf_counter()
+        read(f"site-{i % 200}")
+        out.append(time.perf_counter() - start)
+        i += 1
+
+
+def _run_readers(read, legacy: bool):
+    stop = threading.Event()
+    latencies: list = []
+    threads = [threading.Thread(target=_writer, args=(stop, legacy))]
+    threads += [threading.Thread(target=_read_latencies, args=(read, stop, latencies)) for _ in range(READERS)]
+    for t in threads:
+        t.start()
+    time.sleep(DURATION)
+    stop.set()
+    for t in threads:
+        t.join()
+    return latencies
+
+
+def _report(label: str, latencies: list):
+    latencies = sorted(latencies)
+    p = lambda q: latencies[min(len(latencies) - 1, int(len(latencies) * q))] * 1000
+    print(f"{label:<28} reads={len(latencies):>7}  p50={p(0.5):7.2f}ms  p99={p(0.99):7.2f}ms  max={latencies[-1] * 1000:7.2f}ms")
+
+
+async def _loop_stall(read_async: bool) -> float:
+    """Max gap between 5ms ticks of a heartbeat task while 200 reads run"""
+    gaps = []
+    done = asyncio.Event()
+
+    async def heartbeat():
+        last = time.perf_counter()
+        while not done.is_set():
+            await asyncio.sleep(0.005)
+            now = time.perf_counter()
+            gaps.append(now - last)
+            last = now
+
+    async def reads():
+        for i in range(200):
+            if read_async:
+                await database.aio.get_site(f"site-{i}")
+            else:
+                database.get_site(f"site-{i}")
+                await asyncio.sleep(0)
+        done.set()
+
+    await asyncio.gather(heartbeat(), reads())
+    return max(gaps) * 1000 if gaps else 0.0
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_PATH = os.path.join(tmp, "bench.db")
+        database.init_db()
+        _seed()
+        database.close_all()
+
+        # Legacy: rollback journal + connection per call
+        conn = sqlite3.connect(database.DB_PATH)
+        conn.execute("PRAGMA journal_mode=DELETE")
+        conn.close()
+        legacy = _run_readers(_legacy_get_site, legacy=True)
+
+        # Pooled WAL layer
+        pooled = _run_readers(database.get_site, legacy=False)
+
+        print(f"writer holds its transaction {WRITE_HOLD * 1000:.0f}ms, {READERS} readers, {DURATION:.0f}s")
+        _report("legacy (rollback journal)", legacy)
+        _report("pooled WAL", pooled)
+
+        blocking = asyncio.run(_loop_stall(read_async=False))
+        offloaded = asyncio.run(_loop_stall(read_async=True))
+        print(f"event loop max stall: sync calls {blocking:.2f}ms, database.aio {offloaded:.2f}ms")
+
+        database.close_all()
+        # Readers are no longer serialized behind the writer
+        check = Checks()
+        check(max(pooled) < WRITE_HOLD / 2, f"pooled readers waited on the writer: max {max(pooled) * 1000:.1f}ms")
+        check(len(pooled) > len(legacy), f"pooled layer served fewer reads than legacy ({len(pooled)} vs {len(legacy)})")
+        return check.report()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
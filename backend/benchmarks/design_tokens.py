@@ -0,0 +1,277 @@
+"""
+Design-token distillation: stylesheet fetch, extracted tokens, and prompt size against smart mode.
+
+    cd backend && GEMINI_API_KEY=dummy python -m benchmarks.design_tokens
+
+Serves a reference page in-process (httpx.MockTransport) that links SHEETS
+stylesheets after SHEET_LATENCY each: Google Fonts, the site CSS (which
+@imports one more), a slider bundle, a vendor sheet larger than
+STYLESHEET_MAX_BYTES and one that 404s. Checks:
+- the sheets are fetched concurrently (wall time well under one after another,
+  never more than STYLESHEET_CONCURRENCY in flight) and the @import is followed
+- the oversized sheet is cut at STYLESHEET_MAX_BYTES, the missing one skipped
+- the summary finds the brand color first, the fonts, the container max-width,
+  the breakpoints and the libraries (GSAP, Swiper) without false positives
+- in design mode the reference part of the prompt is at least REDUCTION times
+  smaller than in smart mode
+- a design-mode generation runs end to end against a temporary database, and
+  a repeat reference is served from the reference cache without refetching CSS
+- a summary distilled while a stylesheet was down (503) is not cached, and one
+  older than DESIGN_TOKENS_TTL is distilled again
+- the stored site is listed by /gallery and /gallery/search with mode=design
+- a reference page larger than the whole reference cache is still served
+Exits non-zero if a check fails.
+"""
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("GEMINI_RPM", "6000")
+os.environ.setdefault("IMAGE_POOL_VALIDATE", "0")
+
+import httpx
+from fastapi.testclient import TestClient
+
+import database
+import main
+from benchmarks import stand_ins
+from benchmarks.checks import Checks
+from services import design_tokens
+from services.design_tokens import (
+    DESIGN_TOKENS_TTL,
+    STYLESHEET_CONCURRENCY,
+    STYLESHEET_MAX_BYTES,
+    distill_reference,
+    fetch_stylesheets,
+)
+from services.gemini_service import BROWSER_HEADERS, gemini_service
+from services.metrics import metrics
+from services.prompt_budget import count_tokens
+from services.reference_cache import ReferenceCache
+
+SHEET_LATENCY = 0.2
+REDUCTION = 10
+MAX_SUMMARY_TOKENS = 1500
+BRAND = "#ff5a5f"
+REFERENCE_URL = "https://shop.example.com/"
+
+SITE_CSS = (
+    "@import url('components.css');\n"
+    f":root {{ --brand: {BRAND}; --ink: #1a1a1a; --font-base: 'Pretendard', sans-serif; }}\n"
+    "body { font-family: 'Pretendard', -apple-system, sans-serif; color: #1a1a1a; background: #fafafa; font-size: 16px; }\n"
+    ".container { max-width: 1200px; margin: 0 auto; }\n"
+    + "".join(f".btn-{i} {{ background: {BRAND}; color: #fff; border-radius: 8px; transition: all .3s cubic-bezier(.2,.8,.2,1); }}\n"
+              f".card-{i}:hover {{ box-shadow: 0 4px 12px rgba(0, 0, 0, 0.08); transform: translateY(-4px); }}\n" for i in range(40))
+    + "h1 { font: 700 48px/1.2 'Playfair Display', serif; }\nh2 { font-size: 2rem; font-weight: 700; }\n"
+    ".grid { display: grid; gap: 24px; }\n.row { display: flex; }\n"
+    "@media (min-width: 768px) { .grid { grid-template-columns: repeat(2, 1fr); } }\n"
+    "@media (min-width: 1200px) { .grid { grid-template-columns: repeat(4, 1fr); } }\n"
+    "@media (max-width: 767px) { .container { padding: 0 16px; } }\n"
+    "@keyframes fade-up { from { opacity: 0 } to { opacity: 1 } }\n"
+    "/* .legacy { color: #00ff00 } */\n"
+)
+COMPONENTS_CSS = ".badge { background: hsl(45, 100%, 50%); }\n.footer { background-color: rgb(17 24 39); }\n"
+GOOGLE_FONTS_CSS = "".join(
+    f"@font-face {{ font-family: 'Noto Sans KR'; src: url(https://fonts.gstatic.com/s/{i}.woff2); unicode-range: U+{i:04x}; }}\n"
+    for i in range(120))
+SWIPER_CSS = ".swiper { overflow: hidden; }\n.swiper-slide { flex-shrink: 0; }\n"
+VENDOR_CSS = ".vendor { color: #123456; }\n" * (STYLESHEET_MAX_BYTES // 20)
+
+STYLESHEETS = {
+    "https://fonts.googleapis.com/css2?family=Noto+Sans+KR:wght@400;700": GOOGLE_FONTS_CSS,
+    "https://shop.example.com/css/site.css": SITE_CSS,
+    "https://shop.example.com/css/components.css": COMPONENTS_CSS,
+    "https://cdn.jsdelivr.net/npm/swiper@11/swiper-bundle.min.css": SWIPER_CSS,
+    "https://shop.example.com/css/vendor.css": VENDOR_CSS,
+}
+INLINE_COLOR = " style='color: #666666'"
+SHEETS = 5  # linked for screen (the print sheet is not), one of them missing
+
+REFERENCE_PAGE = (
+    "<!DOCTYPE html><html lang='ko'><head><meta charset='utf-8'><title>Example Shop</title>"
+    "<meta name='theme-color' content='#ff5a5f'>"
+    "<link rel='preconnect' href='https://fonts.gstatic.com'>"
+    "<link rel='stylesheet' href='https://fonts.googleapis.com/css2?family=Noto+Sans+KR:wght@400;700'>"
+    "<link rel='stylesheet' href='/css/site.css'>"
+    "<link rel='stylesheet' href='https://cdn.jsdelivr.net/npm/swiper@11/swiper-bundle.min.css'>"
+    "<link rel='stylesheet' href='css/vendor.css'>"
+    "<link rel='stylesheet' href='/css/missing.css'>"
+    "<link rel='stylesheet' href='/css/print.css' media='print'>"
+    "<script src='https://cdnjs.cloudflare.com/ajax/libs/gsap/3.12.2/gsap.min.js'></script>"
+    "<script src='https://cdn.jsdelivr.net/npm/swiper@11/swiper-bundle.min.js'></script>"
+    "<style>.hero { min-height: 80vh; background: #fafafa; }</style></head><body>"
+    "<header class='site-header'><nav class='gnb'><a href='/'>HOME</a></nav></header>"
+    "<main><div class='hero'><div class='swiper'><div class='swiper-wrapper'>"
+    + "".join(f"<div class='swiper-slide'><img src='/banner/{i}.jpg' alt='banner {i}'></div>" for i in range(5))
+    + "</div></div></div>"
+    + "".join(f"<section class='product-section row'><div class='card-{i % 40}'><h2>상품 {i}</h2>"
+              f"<p{INLINE_COLOR if i % 10 == 0 else ''}>{'부드러운 사용감과 오래가는 품질을 경험해 보세요. ' * 4}</p>"
+              f"<img src='https://cdn.example.com/p/{i}.jpg' alt='상품 {i}'><a class='btn-{i % 40}' href='/p/{i}'>구매하기</a>"
+              "</div></section>" for i in range(300))
+    + "</main><footer class='footer'>고객센터 1588-0000</footer>"
+    "<script>gsap.registerPlugin(ScrollTrigger); new Swiper('.swiper', { loop: true });</script></body></html>"
+)
+
+
+class SheetServer:
+    """Reference page and stylesheets after SHEET_LATENCY; counts requests and concurrency"""
+
+    def __init__(self):
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.down: set = set()  # stylesheet URLs answering 503
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        url = str(request.url)
+        if url == REFERENCE_URL:
+            await asyncio.sleep(0.05)
+            return httpx.Response(200, text=REFERENCE_PAGE, headers={"content-type": "text/html; charset=utf-8"})
+        self.requests += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(SHEET_LATENCY)
+        finally:
+            self.in_flight -= 1
+        if url in self.down:
+            return httpx.Response(503, text="unavailable")
+        if url not in STYLESHEETS:
+            return httpx.Response(404, text="not found")
+        return httpx.Response(200, text=STYLESHEETS[url], headers={"content-type": "text/css; charset=utf-8"})
+
+    def client(self) -> httpx.AsyncClient:
+        return httpx.AsyncClient(transport=httpx.MockTransport(self.handle), follow_redirects=True)
+
+
+async def _distillation(check):
+    server = SheetServer()
+    async with server.client() as client:
+        scan = design_tokens.scan_page(REFERENCE_PAGE, REFERENCE_URL)
+        check(len(scan.stylesheets) == SHEETS and not any("print.css" in url for url in scan.stylesheets),
+              f"stylesheet links found: {scan.stylesheets}")
+        start = time.perf_counter()
+        sheets = await fetch_stylesheets(scan.stylesheets, client, BROWSER_HEADERS)
+        elapsed = time.perf_counter() - start
+        sequential = (SHEETS + 1) * SHEET_LATENCY
+        print(f"stylesheets: {len(sheets)} fetched of {server.requests} requested in {elapsed:.2f}s "
+              f"(one after another: {sequential:.2f}s), max {server.max_in_flight} in flight")
+        check(elapsed < sequential / 2, f"stylesheet fetch took {elapsed:.2f}s, not concurrent")
+        check(1 < server.max_in_flight <= STYLESHEET_CONCURRENCY, f"{server.max_in_flight} stylesheet requests in flight")
+        check(len(sheets) == len(STYLESHEETS), f"{len(sheets)} stylesheets fetched, expected {len(STYLESHEETS)} (with the @import)")
+        check(max(map(len, sheets)) <= STYLESHEET_MAX_BYTES, "oversized stylesheet not cut")
+
+        start = time.perf_counter()
+        summary, complete = await distill_reference(REFERENCE_PAGE, REFERENCE_URL, client, BROWSER_HEADERS)
+        elapsed = time.perf_counter() - start
+    check(complete, "a stylesheet that is gone (404) made the summary incomplete")
+    tokens = json.loads(summary)
+    print(f"summary: {len(summary)} chars, {count_tokens(summary)} tokens, distilled in {elapsed:.2f}s")
+    print(json.dumps(tokens, ensure_ascii=False)[:900])
+
+    palette = list(tokens.get("palette", {}))
+    fonts, layout = tokens.get("fonts", {}), tokens.get("layout", {})
+    check(palette[:1] == [BRAND], f"brand color not first in the palette: {palette[:3]}")
+    check("#123456" in palette, "color from the vendor stylesheet missing")
+    check("#ffbf00" in palette and "#111827" in palette, "hsl()/rgb() colors from the @imported sheet missing")
+    check("#00ff00" not in palette, "color inside a CSS comment counted")
+    check(tokens.get("variables", {}).get("--brand") == BRAND, "custom properties not kept")
+    check(list(fonts.get("families", {}))[:1] == ["Pretendard"] and "Playfair Display" in fonts.get("families", {}),
+          f"font families: {fonts.get('families')}")
+    check(fonts.get("webfonts") == ["Noto Sans KR"], f"webfonts: {fonts.get('webfonts')}")
+    check({"16px", "48px", "2rem"} <= set(fonts.get("sizes", {})), f"font sizes: {fonts.get('sizes')}")
+    check("1200px" in layout.get("max_width", {}), f"max-width: {layout.get('max_width')}")
+    check(layout.get("breakpoints") == {"min-width": ["768px", "1200px"], "max-width": ["767px"]},
+          f"breakpoints: {layout.get('breakpoints')}")
+    check(tokens.get("libraries") == ["GSAP", "Swiper"], f"libraries: {tokens.get('libraries')}")
+    check(tokens.get("source", {}).get("fetched") == len(STYLESHEETS), f"source: {tokens.get('source')}")
+    check(count_tokens(summary) <= MAX_SUMMARY_TOKENS, f"summary is {count_tokens(summary)} tokens")
+    return summary
+
+
+def _prompt_sizes(check, summary: str):
+    smart = gemini_service._clean_html(REFERENCE_PAGE)
+    sizes = {}
+    for mode, reference in (("smart", smart), ("design", summary)):
+        with_reference = gemini_service._build_budgeted_prompt("수제 비누", REFERENCE_URL, "미니멀", mode, reference, True, [])
+        without = gemini_service._build_prompt("수제 비누", REFERENCE_URL, "미니멀", mode, "", False, [])
+        sizes[mode] = (count_tokens(with_reference), count_tokens(with_reference) - count_tokens(without))
+    print(f"prompt tokens: smart {sizes['smart'][0]} (reference {sizes['smart'][1]}), "
+          f"design {sizes['design'][0]} (reference {sizes['design'][1]}), "
+          f"reference {sizes['smart'][1] / sizes['design'][1]:.0f}x smaller, prompt {sizes['smart'][0] / sizes['design'][0]:.1f}x smaller")
+    check(sizes["design"][1] * REDUCTION <= sizes["smart"][1], "design mode reference not an order of magnitude smaller")
+
+
+async def _generation(check, server: SheetServer):
+    stand_ins.install(gemini_service, stand_ins.StandInModel(latency=0.1, chunks=3, jitter=0),
+                      httpx.MockTransport(server.handle), unsplash=False)
+    async with metrics.track_generation("design-1", 1) as trace:
+        result = await gemini_service.generate_website_content("수제 비누", REFERENCE_URL, "미니멀", mode="design")
+    check(len(result.get("html", "")) > 100, "design-mode generation did not produce a page")
+    check(0 < trace.values.get("reference_tokens", 0) <= MAX_SUMMARY_TOKENS,
+          f"design-mode generation sent {trace.values.get('reference_tokens')} reference tokens")
+    requests = server.requests
+    html, ok = await gemini_service._fetch_reference_async(REFERENCE_URL, "design")
+    check(ok and json.loads(html).get("palette") and server.requests == requests,
+          "repeat design-mode reference refetched its stylesheets")
+    await _expiry(check, server)
+
+    request = {"product_type": "수제 비누", "design_style": "미니멀", "reference_url": REFERENCE_URL,
+               "generation_mode": "design"}
+    database.create_pending_site("design-1", request)
+    database.update_site_success_with_meta("design-1", result["html"], request)
+    tiny = ReferenceCache(max_bytes=1024)
+    async with httpx.AsyncClient(transport=httpx.MockTransport(server.handle)) as http:
+        prepared = await tiny.get_prepared("https://shop.example.com/css/site.css", "raw", http, BROWSER_HEADERS, str)
+    check(prepared is not None and len(prepared) > 1024, "a page larger than the reference cache was evicted as it was stored")
+
+    client = TestClient(main.app)
+    for path in ("/gallery?mode=design", "/gallery/search?q=비누&mode=design"):
+        response = client.get(path)
+        ids = [item["id"] for item in response.json().get("items", [])] if response.status_code == 200 else []
+        check(ids == ["design-1"], f"{path}: {response.status_code} {ids}")
+
+
+async def _expiry(check, server: SheetServer):
+    # Once the stored summary is older than DESIGN_TOKENS_TTL the stylesheets are fetched again;
+    # while one of them is down the summary is used but not stored
+    database.get_connection().execute("UPDATE reference_outputs SET created_at = created_at - ?", (DESIGN_TOKENS_TTL + 1,))
+    site_css = "https://shop.example.com/css/site.css"
+    server.down.add(site_css)
+    attempts = []
+    for _ in range(2):
+        requests = server.requests
+        html, ok = await gemini_service._fetch_reference_async(REFERENCE_URL, "design")
+        attempts.append((ok, server.requests - requests, json.loads(html).get("source", {}).get("fetched") if ok else None))
+    server.down.discard(site_css)
+    for _ in range(2):
+        requests = server.requests
+        html, ok = await gemini_service._fetch_reference_async(REFERENCE_URL, "design")
+        attempts.append((ok, server.requests - requests, json.loads(html).get("source", {}).get("fetched") if ok else None))
+    print(f"expired summary, site.css down twice then back: (ok, stylesheet requests, sheets used) {attempts}")
+    check(all(ok for ok, _, _ in attempts), "design-mode reference failed during a stylesheet outage")
+    check(attempts[0][1] > 0, f"summary older than DESIGN_TOKENS_TTL was not redistilled: {attempts[0]}")
+    check(attempts[1][1] > 0, "summary distilled during a stylesheet outage was cached")
+    check(attempts[2][1] > 0 and attempts[2][2] == len(STYLESHEETS), f"recovered stylesheet not picked up: {attempts[2]}")
+    check(attempts[3][1] == 0, "complete summary was not cached once the stylesheet recovered")
+
+
+def run() -> int:
+    check = Checks()
+
+    summary = asyncio.run(_distillation(check))
+    _prompt_sizes(check, summary)
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_PATH = os.path.join(tmp, "design_tokens.db")
+        database.init_db()
+        asyncio.run(_generation(check, SheetServer()))
+
+    print()
+    return check.report()
+
+
+if __name__ == "__main__":
+    sys.exit(run())
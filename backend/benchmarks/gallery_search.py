@@ -0,0 +1,148 @@
+"""
+Gallery search latency as the store grows (1k -> 10k -> 100k completed sites).
+
+    cd backend && python -m benchmarks.gallery_search [--max 100000]
+
+Seeds a temporary database with synthetic completed sites (Korean and English
+product types, explanations and key points drawn from a fixed vocabulary, so a
+term's match count grows with the store) and times search_sites for a rare
+term, a term matching ~20% of sites, a multi-word query, filtered queries and
+the second page of each. Exits non-zero if a p95 at the largest size exceeds
+LATENCY_BUDGET_MS, if a "flat" query's median grows more than MAX_GROWTH x
+from the smallest size, or if a filtered query's median is more than
+MAX_FILTER_COST x that of the same text unfiltered at the same size (medians:
+a p95 of RUNS samples moves by milliseconds with scheduler noise alone).
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import database
+from benchmarks.checks import Checks
+
+SIZES = [1_000, 10_000, 100_000]
+RUNS = 30
+LATENCY_BUDGET_MS = 50.0
+MAX_GROWTH = 4.0
+MAX_FILTER_COST = 3.0
+
+PRODUCTS = ["비누", "캔들", "향수", "디퓨저", "쿠키", "케이크", "원두", "녹차", "머그", "그릇", "니트", "원피스",
+            "운동화", "가방", "지갑", "반지", "목걸이", "노트", "인형", "화분", "soap", "candle", "coffee", "sneakers"]
+MODIFIERS = ["수제", "천연", "유기농", "빈티지", "프리미엄", "handmade", "organic", "", "", ""]
+STYLES = ["미니멀", "모던", "빈티지", "내추럴", "럭셔리"]
+PHRASES = ["넓은 여백과 큰 상품 이미지로", "따뜻한 색감의 배경과", "카드형 그리드 레이아웃으로", "상단 히어로 배너와",
+           "리뷰 섹션을 강조하여", "모바일에서도 읽기 쉬운 타이포그래피로", "clean hero section with", "a bold call to action and"]
+POINTS = ["반응형 그리드", "고정 헤더", "장바구니 버튼 강조", "후기 캐러셀", "sticky navigation", "large product photos",
+          "무료 배송 배너", "브랜드 스토리 섹션"]
+MODES = ["smart", "smart", "smart", "raw", "none"]
+
+# label, search_sites kwargs, bound: "flat" latency must stay flat as the store grows; a label
+# means within MAX_FILTER_COST x of that (unfiltered) query at the same size. Unbounded (None)
+# queries intersect or filter whole posting lists, so they only have to meet the budget.
+QUERIES = [
+    ("rare term", dict(text="목걸이"), "flat"),
+    ("common term (~20%)", dict(text="미니멀"), "flat"),
+    ("word prefix", dict(text="케이"), "flat"),
+    ("recent sort", dict(text="미니멀", sort="recent"), "flat"),
+    ("unfiltered term", dict(text="캔들"), "flat"),
+    ("mode filter", dict(text="캔들", mode="raw"), "unfiltered term"),
+    ("two words", dict(text="수제 비누"), None),
+    ("date range", dict(text="coffee", created_from=datetime(2023, 3, 1), created_before=datetime(2023, 4, 1)), None),
+]
+
+
+def _rows(start: int, count: int, rng: random.Random):
+    base = datetime(2023, 1, 1)
+    for i in range(start, start + count):
+        product = " ".join(filter(None, [rng.choice(MODIFIERS), rng.choice(PRODUCTS)]))
+        style = rng.choice(STYLES)
+        meta = {
+            "product_type": product,
+            "design_style": style,
+            "generation_mode": rng.choice(MODES),
+            "explanation": f"{product}의 매력을 살리기 위해 " + " ".join(rng.sample(PHRASES, 3)) + " 구성했습니다.",
+            "key_points": rng.sample(POINTS, 3),
+        }
+        # Spread creation over two years, in insertion order
+        created_at = base + timedelta(minutes=i * 10)
+        yield (f"site-{i}", product, style, created_at, database.json.dumps(meta, ensure_ascii=False))
+
+
+def _grow(current: int, target: int, rng: random.Random):
+    with database.transaction() as conn:
+        conn.executemany('''
+            INSERT INTO sites (id, product_type, design_style, status, created_at, meta_data)
+            VALUES (?, ?, ?, 'completed', ?, ?)
+        ''', _rows(current, target - current, rng))
+
+
+def _time(fn) -> float:
+    start = time.perf_counter()
+    fn()
+    return (time.perf_counter() - start) * 1000
+
+
+def _measure(kwargs) -> tuple:
+    first = [_time(lambda: database.search_sites(limit=24, **kwargs)) for _ in range(RUNS)]
+    _, cursor = database.search_sites(limit=24, **kwargs)
+    second = []
+    if cursor:
+        second = [_time(lambda: database.search_sites(limit=24, cursor=cursor, **kwargs)) for _ in range(RUNS)]
+    return first, second
+
+
+def _p(samples, q: float) -> float:
+    return statistics.quantiles(samples, n=100)[q - 1] if len(samples) > 1 else (samples[0] if samples else 0.0)
+
+
+def run(max_size: int = SIZES[-1]) -> int:
+    sizes = [size for size in SIZES if size <= max_size]
+    rng = random.Random(7)
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_PATH = os.path.join(tmp, "search.db")
+        database.init_db()
+        current = 0
+        for size in sizes:
+            start = time.perf_counter()
+            _grow(current, size, rng)
+            current = size
+            print(f"\n{size:,} sites (seeded in {time.perf_counter() - start:.1f}s)")
+            print(f"  {'query':<22} {'matches':>8} {'p50':>8} {'p95':>8} {'page 2 p95':>11}")
+            for label, kwargs, _ in QUERIES:
+                matches = database._fetchone(
+                    "SELECT COUNT(*) FROM sites_fts WHERE sites_fts MATCH ?",
+                    (database.build_search_query(kwargs["text"]),),
+                )[0]
+                first, second = _measure(kwargs)
+                results[(label, size)] = (_p(first, 50), _p(first, 95))
+                print(f"  {label:<22} {matches:>8,} {_p(first, 50):>6.2f}ms {_p(first, 95):>6.2f}ms "
+                      f"{(f'{_p(second, 95):.2f}ms') if second else '-':>11}")
+        database.close_all()
+
+    check = Checks()
+    smallest, largest = sizes[0], sizes[-1]
+    for label, _, bound in QUERIES:
+        (p50, p95), small_p50 = results[(label, largest)], results[(label, smallest)][0]
+        check(p95 <= LATENCY_BUDGET_MS, f"{label}: p95 {p95:.1f}ms at {largest:,} sites exceeds {LATENCY_BUDGET_MS}ms")
+        # Absolute floor so sub-millisecond noise at the small size doesn't count as growth
+        check(bound != "flat" or p50 <= MAX_GROWTH * max(small_p50, 2.0),
+              f"{label}: median grew from {small_p50:.1f}ms to {p50:.1f}ms")
+        if bound not in (None, "flat"):
+            unfiltered = results[(bound, largest)][0]
+            check(p50 <= MAX_FILTER_COST * max(unfiltered, 1.0),
+                  f"{label}: median {p50:.1f}ms at {largest:,} sites, {bound} {unfiltered:.1f}ms")
+
+    print()
+    return check.report()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--max", type=int, default=SIZES[-1], help="largest store size to build")
+    sys.exit(run(parser.parse_args().max))
@@ -0,0 +1,263 @@
+"""
+Per-stage generation metrics: are the stages recorded, and what does recording cost.
+
+    cd backend && GEMINI_API_KEY=dummy python -m benchmarks.generation_metrics
+
+Runs process_generation for SITES sites against a temporary database. The model
+is a stand-in that streams its answer in chunks over MODEL_LATENCY seconds, and
+reference pages and Unsplash are served in-process (httpx.MockTransport) after
+REFERENCE_LATENCY / UNSPLASH_LATENCY, so every stage runs its real code. Some
+sites fail their first model call (one retry), one fails every call. Then checks:
+- one generation_metrics row per site with the stages it ran, model_call and
+  reference_fetch at least the injected latency, prompt budget token counts,
+  retries and error rows recorded
+- the stages on the critical path account for the end-to-end time
+- /metrics is well-formed Prometheus text (cumulative buckets, counts agree with
+  the table), /admin/generation-metrics and /sites/{id}/generation-metrics answer
+- recording costs under MAX_OVERHEAD of a generation
+Exits non-zero if a check fails.
+"""
+import asyncio
+import json
+import os
+import re
+import statistics
+import sys
+import tempfile
+import time
+
+# Keep the shared limiters out of what is measured
+os.environ.setdefault("GEMINI_RPM", "6000")
+os.environ.setdefault("UNSPLASH_PER_HOUR", "100000")
+os.environ.setdefault("IMAGE_POOL_VALIDATE", "0")
+
+import httpx
+from fastapi.testclient import TestClient
+
+import database
+import main
+from benchmarks.checks import Checks
+from services.gemini_service import METADATA_SEPARATOR, gemini_service
+from services.metrics import STAGES, metrics
+from services.prompt_budget import PROMPT_TOKEN_BUDGET
+
+SITES = 24
+MODEL_LATENCY = 0.3
+MODEL_CHUNKS = 6
+REFERENCE_LATENCY = 0.08
+UNSPLASH_LATENCY = 0.05
+# Recording (stage timers, histogram updates, the generation_metrics insert) per generation
+MAX_OVERHEAD = 0.01
+# Time on the critical path not attributed to any stage (scheduling, callbacks, logging)
+MAX_UNATTRIBUTED_MS = 50.0
+
+REFERENCE_PAGE = (
+    "<!DOCTYPE html><html><head><style>body{margin:0}.hero{padding:4rem}</style></head><body>"
+    + "".join(f'<section class="hero grid"><h2>Section {i}</h2><p>{"text " * 80}</p>'
+              f'<svg><path d="{"M0 0 L10 10 " * 40}"/></svg></section>' for i in range(40))
+    + "</body></html>"
+)
+RESPONSE = ("<!DOCTYPE html><html><body>" + "<section><h2>Product</h2><p>detail</p></section>" * 200
+            + f"</body></html>\n{METADATA_SEPARATOR}\n"
+            + json.dumps({"explanation": "ok", "key_points": ["a"], "color_palette": ["#112233", "#ffffff"]}))
+
+
+class _Chunk:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class _Usage:
+    prompt_token_count = 1234
+    candidates_token_count = 567
+
+
+class _Stream:
+    """Streamed answer in MODEL_CHUNKS chunks; reports usage like the SDK once consumed"""
+
+    def __init__(self, text: str):
+        self.text = text
+        self.usage_metadata = _Usage()
+
+    async def __aiter__(self):
+        size = -(-len(self.text) // MODEL_CHUNKS)
+        for i in range(0, len(self.text), size):
+            await asyncio.sleep(MODEL_LATENCY / MODEL_CHUNKS)
+            yield _Chunk(self.text[i:i + size])
+
+
+class StandInModel:
+    def __init__(self):
+        self.calls = {}
+
+    async def generate_content_async(self, prompt, stream=False):
+        if "stock photo search" in prompt:
+            count = len(re.findall(r"^\s*\d+\. ", prompt, re.MULTILINE))
+            return _Chunk(json.dumps(["soap bar"] * count))
+        product = re.search(r"flaky-\d+|broken-\d+", prompt)
+        if product:
+            self.calls[product.group()] = self.calls.get(product.group(), 0) + 1
+            if product.group().startswith("broken") or self.calls[product.group()] == 1:
+                await asyncio.sleep(MODEL_LATENCY / 3)
+                raise RuntimeError("stand-in model failure")
+        return _Stream(RESPONSE)
+
+
+async def _serve(request: httpx.Request) -> httpx.Response:
+    if request.url.host == "api.unsplash.com":
+        await asyncio.sleep(UNSPLASH_LATENCY)
+        count = int(request.url.params.get("count", "1"))
+        photos = [{"id": f"photo-{time.perf_counter_ns()}-{i}", "urls": {"raw": f"https://images.unsplash.com/photo-{i}?ixid=stand-in-{'x' * 40}"}}
+                  for i in range(count)]
+        return httpx.Response(200, json=photos)
+    await asyncio.sleep(REFERENCE_LATENCY)
+    # A page per site: identical pages share one prepared output, and a site that hits it has no clean_html
+    page = REFERENCE_PAGE.replace("<body>", f"<body><h1>{request.url.path}</h1>")
+    return httpx.Response(200, text=page, headers={"Content-Type": "text/html"})
+
+
+def _products():
+    for i in range(SITES):
+        if i == SITES - 1:
+            yield f"site-{i}", f"broken-{i} 수제 비누"
+        elif i % 6 == 5:
+            yield f"site-{i}", f"flaky-{i} 수제 비누"
+        else:
+            yield f"site-{i}", f"product-{i} 수제 비누"
+
+
+async def _generate() -> float:
+    gemini_service.pipeline = "async"
+    gemini_service.stream = True
+    gemini_service.model = StandInModel()
+    gemini_service.unsplash_access_key = "stand-in"
+    gemini_service._http = httpx.AsyncClient(transport=httpx.MockTransport(_serve))
+
+    async def one(site_id: str, product: str):
+        payload = {"product_type": product, "design_style": "minimal",
+                   "reference_url": f"https://reference.test/{site_id}", "generation_mode": "smart"}
+        await database.aio.create_pending_site(site_id, payload)
+        try:
+            await main.process_generation(site_id, payload)
+        except RuntimeError:
+            pass
+
+    start = time.perf_counter()
+    await asyncio.gather(*[one(site_id, product) for site_id, product in _products()])
+    elapsed = time.perf_counter() - start
+    await gemini_service.aclose()
+    return elapsed
+
+
+def _parse_exposition(text: str) -> dict:
+    """{(name, labels): value} for every sample line; raises on a malformed line"""
+    samples = {}
+    for line in text.splitlines():
+        if not line or line.startswith("#"):
+            continue
+        match = re.fullmatch(r'([a-zA-Z_:][a-zA-Z0-9_:]*)(\{[^}]*\})? (\S+)', line)
+        if match is None:
+            raise ValueError(f"malformed sample: {line!r}")
+        samples[(match.group(1), match.group(2) or "")] = float(match.group(3))
+    return samples
+
+
+def _recording_overhead() -> float:
+    """Seconds spent recording one generation: its stage timers, adds and the finish (persist + observe)"""
+    async def measure():
+        runs = 200
+        start = time.perf_counter()
+        for i in range(runs):
+            async with metrics.track_generation(f"overhead-{i}", 1):
+                for stage in STAGES:
+                    with metrics.stage(stage):
+                        pass
+                for name in database.GENERATION_METRIC_VALUES:
+                    metrics.add(name, 1)
+        return (time.perf_counter() - start) / runs
+    return asyncio.run(measure())
+
+
+def run() -> int:
+    check = Checks()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_PATH = os.path.join(tmp, "generation_metrics.db")
+        database.init_db()
+        wall = asyncio.run(_generate())
+
+        rows = {row["site_id"]: row for row in database._fetchall("SELECT * FROM generation_metrics")}
+        print(f"{SITES} generations in {wall:.2f}s, {len(rows)} generation_metrics rows\n")
+        check(len(rows) == SITES, f"{len(rows)} rows for {SITES} generations")
+
+        completed = [row for row in rows.values() if row["status"] == "completed"]
+        print(f"{'stage':<16} {'p50':>9} {'p95':>9} {'max':>9}")
+        summary = database.summarize_generation_metrics(0)
+        for stage, stats in [("total", summary["total_ms"]), *summary["stages_ms"].items()]:
+            if stats:
+                print(f"{stage:<16} {stats['p50']:>7.1f}ms {stats['p95']:>7.1f}ms {stats['max']:>7.1f}ms")
+        print(f"averages: {summary['averages']}\n")
+
+        for stage in STAGES:
+            if stage != "model_queue":
+                check(all(row[f"{stage}_ms"] is not None for row in completed), f"{stage} missing from completed rows")
+        unattributed = []
+        for row in completed:
+            check(row["model_call_ms"] >= MODEL_LATENCY * 1000 * 0.95, f"{row['site_id']}: model_call {row['model_call_ms']}ms")
+            check(row["reference_fetch_ms"] >= REFERENCE_LATENCY * 1000 * 0.95, f"{row['site_id']}: reference_fetch {row['reference_fetch_ms']}ms")
+            check(0 < row["clean_html_ms"] <= row["reference_fetch_ms"], f"{row['site_id']}: clean_html not within reference_fetch")
+            check(row["prompt_chars"] > 0 and row["response_chars"] == len(RESPONSE), f"{row['site_id']}: sizes not recorded")
+            check(row["prompt_tokens"] >= _Usage.prompt_token_count and row["response_tokens"] >= _Usage.candidates_token_count,
+                  f"{row['site_id']}: API token counts not used")
+            check(row["prompt_budget_tokens"] == PROMPT_TOKEN_BUDGET and 0 < row["prompt_tokens_estimate"] <= PROMPT_TOKEN_BUDGET
+                  and row["reference_tokens"] > 0, f"{row['site_id']}: prompt budget not recorded")
+            # prepare runs reference and keywords -> images concurrently; the rest is sequential
+            check(row["prepare_ms"] >= max(row["reference_fetch_ms"], row["keywords_ms"] + row["images_ms"]),
+                  f"{row['site_id']}: prepare shorter than the stages it runs")
+            critical = (row["prepare_ms"] + row["prompt_build_ms"] + (row["model_queue_ms"] or 0) + row["model_call_ms"]
+                        + row["parse_ms"] + row["optimize_ms"] + row["db_write_ms"] + row["preview_ms"])
+            unattributed.append(row["total_ms"] - critical)
+            check(critical <= row["total_ms"] + 1, f"{row['site_id']}: stages add up to more than the total")
+        print(f"unattributed time per generation: median {statistics.median(unattributed):.1f}ms, max {max(unattributed):.1f}ms")
+        check(max(unattributed) <= MAX_UNATTRIBUTED_MS, f"{max(unattributed):.0f}ms of a generation not attributed to a stage")
+
+        flaky = [row for row in rows.values() if "flaky" in database.get_site(row["site_id"])["product_type"]]
+        check(flaky and all(row["model_retries"] == 1 and row["status"] == "completed" for row in flaky), "model retries not recorded")
+        broken = rows[f"site-{SITES - 1}"]
+        check(broken["status"] == "error" and "stand-in model failure" in (broken["error"] or ""), "failed generation not recorded")
+        check(broken["model_call_ms"] is not None and broken["db_write_ms"] is None, "failed generation has the wrong stages")
+
+        client = TestClient(main.app)
+        response = client.get("/metrics")
+        check(response.status_code == 200 and response.headers["content-type"].startswith("text/plain"), "/metrics not served as text")
+        try:
+            samples = _parse_exposition(response.text)
+        except ValueError as e:
+            samples = {}
+            check(False, str(e))
+        buckets = [(labels, value) for (name, labels), value in samples.items()
+                   if name == "generation_stage_seconds_bucket" and 'stage="model_call"' in labels]
+        values = [value for _, value in buckets]
+        check(values == sorted(values), "model_call buckets not cumulative")
+        check(samples.get(("generation_stage_seconds_count", '{stage="model_call"}')) == len(rows),
+              "model_call histogram count differs from the table")
+        check(samples.get(("generations_total", '{status="completed"}')) == len(completed), "completed counter differs from the table")
+        check(samples.get(("generation_model_retries_total", "")) == sum(row["model_retries"] for row in rows.values()),
+              "retry counter differs from the table")
+        check(client.get("/admin/generation-metrics").json()["attempts"] == len(rows), "/admin/generation-metrics disagrees")
+        check(len(client.get("/sites/site-0/generation-metrics").json()["attempts"]) == 1, "/sites/{id}/generation-metrics disagrees")
+        check(client.get("/sites/missing/generation-metrics").status_code == 404, "unknown site not a 404")
+
+        overhead = _recording_overhead()
+        per_generation = statistics.median([row["total_ms"] for row in completed]) / 1000
+        print(f"recording cost per generation: {overhead * 1e6:.0f}us ({overhead / per_generation:.2%} of a {per_generation * 1000:.0f}ms generation)")
+        check(overhead <= MAX_OVERHEAD * per_generation, f"recording costs {overhead / per_generation:.1%} of a generation")
+        check(metrics.persist_errors == 0, f"{metrics.persist_errors} metrics rows failed to persist")
+        database.close_all()
+
+    print()
+    return check.report()
+
+
+if __name__ == "__main__":
+    sys.exit(run())
@@ -0,0 +1,194 @@
+"""
+Differential check and benchmark: streaming clean_html vs. the original
+BeautifulSoup-based GeminiService._clean_html (kept below, unchanged, as the
+reference implementation).
+
+    cd backend && python -m benchmarks.html_cleaner
+
+Every corpus document must clean to the same output with both implementations
+(no byte budget). The benchmark then times both on synthetic e-commerce pages
+of increasing size. Exits non-zero if any document differs.
+"""
+import difflib
+import random
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+from bs4 import BeautifulSoup, Comment
+
+from services.html_cleaner import clean_html
+
+
+# --- reference implementation (GeminiService._clean_html before the rewrite) ---
+
+def legacy_clean_html(html_content: str) -> str:
+    """
+    Smart Filtering: Clean HTML to keep only structure and style-relevant tags.
+    Removes noise like SVG paths, base64 images, and long text.
+    """
+    try:
+        soup = BeautifulSoup(html_content, 'html.parser')
+
+        # 1. Remove completely useless tags
+        for tag in soup(['noscript', 'iframe', 'object', 'embed']):
+            tag.decompose()
+
+        # 2. Remove comments
+        for comment in soup.find_all(string=lambda text: isinstance(text, Comment)):
+            comment.extract()
+
+        # 3. Clean SVG: Keep tag but remove paths (too long)
+        for svg in soup.find_all('svg'):
+            svg.clear() # Remove children (paths)
+            svg.attrs = {k: v for k, v in svg.attrs.items() if k in ['class', 'id', 'width', 'height', 'viewbox']}
+            svg.string = "SVG_ICON" # Placeholder
+
+        # 4. Clean Images: Remove base64 src
+        for img in soup.find_all('img'):
+            src = img.get('src', '')
+            if src.startswith('data:'):
+                img['src'] = 'BASE64_IMAGE_REMOVED'
+            # Remove other attributes except critical ones
+            img.attrs = {k: v for k, v in img.attrs.items() if k in ['src', 'class', 'id', 'alt']}
+
+        # 5. Clean Scripts: Keep src (libraries), remove inline content
+        for script in soup.find_all('script'):
+            if script.get('src'):
+                # Keep external scripts (libraries)
+                script.string = "" 
+            else:
+                # Remove inline scripts completely (usually logic, not style)
+                script.decompose()
+
+        # 6. Clean Text: Truncate long text nodes
+        for text in soup.find_all(string=True):
+            if len(text) > 50 and text.parent.name not in ['style', 'script']:
+                text.replace_with(text[:50] + "...")
+
+        # 7. Clean Attributes: Remove data-*, aria-*, on* events
+        for tag in soup.find_all(True):
+            attrs = dict(tag.attrs)
+            for key in attrs:
+                if key.startswith('data-') or key.startswith('aria-') or key.startswith('on'):
+                    del tag.attrs[key]
+
+        return str(soup)
+
+    except Exception as e:
+        print(f"[{datetime.now()}] HTML cleaning failed: {e}")
+        return html_content[:20000] # Fallback to truncation
+
+
+# --- corpus ---------------------------------------------------------------
+
+LONG = "이 상품은 천연 재료로 만든 수제 비누입니다. 피부에 자극이 적고 향이 은은합니다. " * 3
+
+CORPUS = {
+    "basic": "<!DOCTYPE html><html><head><title>Shop</title></head><body><h1>Hello</h1></body></html>",
+    "long_text": f"<div><p>{LONG}</p><span>short</span>{LONG}</div>",
+    "entities": "<p>Fish &amp; Chips &lt;b&gt; &nbsp; caf&eacute; &#8361;1,000 &copy;</p><p title='a &amp; b'>x</p>",
+    "comments": "<div>before<!-- a comment -->after<!--[if IE]><p>ie</p><![endif]--></div>",
+    "removed_tags": "<noscript><img src=x></noscript><iframe src=y><p>in</p></iframe><object data=z><param name=a></object><embed src=e><p>kept</p>",
+    "svg": '<a href="/"><svg viewBox="0 0 24 24" width="24" height="24" class="icon" fill="none" data-x="1"><path d="M0 0L24 24"/><g><circle r="3"/></g></svg>Home</a><svg/>',
+    "images": '<img src="data:image/png;base64,AAAA" alt="a" class="c" width="10" loading="lazy"><img src="/a.jpg" srcset="/a@2x.jpg 2x" id="i" data-src="/b.jpg"><img>',
+    "scripts": '<script>var x = 1 < 2;</script><script src="https://cdn.jsdelivr.net/npm/gsap.js" defer>ignored()</script><script src="">empty</script><script type="application/ld+json">{"a":1}</script>',
+    "styles": "<style>.a > .b { color: #333; content: \"&amp;\"; }</style><p style='color:red'>x</p>",
+    "attributes": '<div class="  a   b  " data-id="1" aria-label="l" onclick="go()" one="1" id="main" hidden role="main">t</div><a rel=" nofollow  noopener " href="?a=1&amp;b=2">l</a>',
+    "quotes": """<div title='say "hi"' alt="it's" lang='x"y&apos;z'>q</div>""",
+    "malformed": "<div><p>one<p>two</div>stray</span><b>bold<i>both</b>italic</i><ul><li>a<li>b</ul>",
+    "unclosed": "<html><body><div><section><p>never closed",
+    "self_closing": "<div/>after<br/><br></br><input type=text disabled><hr>",
+    "doctype_long": '<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.0 Transitional//EN" "http://www.w3.org/TR/xhtml1/DTD/xhtml1-transitional.dtd"><html><body>x</body></html>',
+    "ie_conditional": "<div><![if IE]><p>ie</p><![endif]><![if !IE]>other<![endif]></div>",
+    "pi_cdata": '<?xml version="1.0" encoding="UTF-8"?><svg><![CDATA[x]]></svg><![CDATA[short]]>',
+    "uppercase": '<DIV CLASS="Upper" OnClick="x()"><IMG SRC="/u.png" ALT="u"></DIV>',
+    "nested_removed": "<noscript><noscript>inner</noscript>still removed</noscript><p>after</p>",
+    "text_in_title_textarea": f"<title>{LONG}</title><textarea>{LONG}</textarea>",
+    "whitespace": "<ul>\n  <li>one</li>\n  <li>two</li>\n</ul>\n<p> \t </p><pre>\n  keep\n  <b>  </b></pre><textarea>   </textarea>",
+}
+
+
+def synthetic_page(products: int, seed: int = 0) -> str:
+    """An e-commerce-like page: header, SVG icons, inline/JSON scripts, tracking attrs, product grid"""
+    rng = random.Random(seed)
+    parts = [
+        "<!DOCTYPE html><html lang='ko'><head><meta charset='utf-8'><title>Shop</title>",
+        "<link rel='stylesheet' href='https://cdn.example.com/app.css'>",
+        "<style>" + ".p{display:grid;grid-template-columns:repeat(4,1fr)}" * 20 + "</style>",
+        "<script>window.dataLayer=[];" + "track('x');" * 200 + "</script>",
+        "<script src='https://cdn.jsdelivr.net/npm/swiper/swiper-bundle.min.js'></script></head><body>",
+        "<header class='gnb' data-module='header'><nav aria-label='main'>",
+    ]
+    for i in range(12):
+        parts.append(f"<a href='/c/{i}' onclick='ga({i})'><svg viewBox='0 0 24 24'>" + "<path d='M0 0L24 24Z'/>" * 10 + f"</svg>Category {i}</a>")
+    parts.append("</nav></header><main><ul class='p'>")
+    for i in range(products):
+        price = rng.randint(1000, 99000)
+        parts.append(
+            f"<li class='item item-{i % 7}' data-product-id='{i}' data-price='{price}'>"
+            f"<!-- product {i} --><a href='/p/{i}' aria-label='product {i}'>"
+            f"<img src='data:image/gif;base64,{'R0lGOD' * 20}' data-src='/img/{i}.jpg' alt='상품 {i}' width='300' height='300' loading='lazy'>"
+            f"<p class='name'>{LONG[: rng.randint(20, len(LONG))]}</p><span class='price'>&#8361;{price:,}</span>"
+            f"</a><noscript><img src='/img/{i}.jpg'></noscript></li>"
+        )
+    parts.append("</ul></main><footer>" + "<p>회사 정보 및 약관 안내</p>" * 20 + "</footer></body></html>")
+    return "".join(parts)
+
+
+def differential() -> int:
+    failures = 0
+    documents = dict(CORPUS)
+    documents["synthetic_50"] = synthetic_page(50)
+    for name, html in documents.items():
+        expected = legacy_clean_html(html)
+        actual = clean_html(html)
+        if expected == actual:
+            print(f"  ok    {name}")
+            continue
+        failures += 1
+        print(f"  DIFF  {name}")
+        for line in difflib.unified_diff(expected.splitlines(), actual.splitlines(), "legacy", "streaming", lineterm="", n=1):
+            print("        " + line[:160])
+    return failures
+
+
+def _measure(fn, html: str, repeat: int):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(html)
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    fn(html)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak
+
+
+def benchmark():
+    print(f"{'page':>10} {'input':>9} | {'legacy':>9} {'peak':>8} | {'streaming':>9} {'peak':>8} | {'speedup':>7} | {'60KB budget':>11}")
+    for products in (100, 500, 2000):
+        html = synthetic_page(products)
+        legacy_time, legacy_peak = _measure(legacy_clean_html, html, 3)
+        stream_time, stream_peak = _measure(clean_html, html, 3)
+        budget_time, _ = _measure(lambda h: clean_html(h, max_bytes=60000), html, 3)
+        print(
+            f"{products:>7} pr {len(html) / 1024:>7.0f}KB | {legacy_time * 1000:>7.0f}ms {legacy_peak / 2**20:>6.1f}MB |"
+            f" {stream_time * 1000:>7.0f}ms {stream_peak / 2**20:>6.1f}MB | {legacy_time / stream_time:>6.1f}x | {budget_time * 1000:>9.0f}ms"
+        )
+
+
+def main():
+    print("Differential corpus (legacy vs streaming):")
+    failures = differential()
+    print()
+    benchmark()
+    if failures:
+        print(f"\n{failures} document(s) differ")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,369 @@
+"""
+Bytes saved by the output optimizer (services/html_optimizer.py) and checks that
+it is safe.
+
+    cd backend && python -m benchmarks.html_optimizer
+
+Optimizes a page shaped like the generator's output (indented markup, a <style>
+block, an inline script, Google Fonts, Unsplash product photos) and reports raw
+and gzip sizes before and after. Checks lazy loading, srcset, preconnect hints
+and idempotence, that an image-heavy page whose srcset would outweigh the
+minification is never stored larger than it was generated, and that compact
+pages (the benchmarks' stand-in page, a small pretty-printed page) still get lazy
+loading, preconnect hints and display=swap when that makes them larger. The JS and CSS
+minifiers are checked on their risky cases (regex literals, template literals
+containing //, ASI-dependent line breaks, </script> inside strings, calc()
+spacing); if node is on PATH, every JS case and the page's script must also print
+the same output before and after minification. Finally the optimized and
+original versions are stored and served through the API against a temporary
+database. Exits non-zero if a check fails.
+"""
+import gzip
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("GEMINI_API_KEY", "benchmark")
+
+from fastapi.testclient import TestClient
+
+import database
+import main
+from benchmarks.checks import Checks
+from benchmarks.stand_ins import STAND_IN_PAGE
+from services.html_optimizer import OPTIMIZE_EAGER_IMAGES, minify_css, minify_js, optimize_html
+
+PRODUCTS = 8
+PHOTO = ("https://images.unsplash.com/photo-15{n:02d}7712345678-abcdef{n:02d}?crop=entropy&amp;cs=tinysrgb"
+         "&amp;fit=max&amp;fm=jpg&amp;ixid=M3w1NjAxNjB8MHwxfHNlYXJjaHwxfHxzb2FwfGVufDB8fHx8MTcwMDAwMDAwMHww"
+         "&amp;ixlib=rb-4.0.3&amp;q=80&amp;w=1080")
+
+SCRIPT = """
+    // Cart state
+    const cart = [];
+    let total = 0
+    const fmt = (n) => `₩${n.toLocaleString('en-US')}`;
+
+    /* Add a product and
+       update the badge */
+    function addToCart(id, price) {
+        cart.push({ id, price });
+        total += price
+        ;[id].forEach(x => x)
+        return cart.length
+    }
+
+    const slug = (s) => s.toLowerCase().replace(/[^a-z0-9]+/g, '-').replace(/^-|-$/g, '');
+    const ratio = total / 2 / 1;
+    let i = 0
+    i
+    ++i
+    const label = 'it\\'s "quoted" // not a comment';
+    for (let n = 1; n <= 3; n++) addToCart(n, n * 12500);
+    console.log(cart.length, total, fmt(total), slug('  Handmade  Soap #1 '), ratio, i, label);
+"""
+
+
+def _page() -> str:
+    cards = "\n".join(f"""
+                <article class="product-card">
+                    <img src="{PHOTO.format(n=n)}" alt="수제 비누 {n}호" class="product-image">
+                    <div class="product-info">
+                        <h3 class="product-name">수제 비누 {n}호</h3>
+                        <p class="product-price">₩{12000 + n * 500:,}</p>
+                        <button class="btn btn-primary" onclick="addToCart({n}, {12000 + n * 500})">
+                            장바구니 담기
+                        </button>
+                    </div>
+                </article>""" for n in range(PRODUCTS))
+    rules = "\n".join(f"""
+        /* section {n} */
+        .section-{n} {{
+            padding: {n * 4}px 24px;
+            color: #333333;
+            background: linear-gradient(135deg, #fafafa 0%, #f0f0f0 100%);
+        }}""" for n in range(40))
+    return f"""<!DOCTYPE html>
+<html lang="ko">
+    <head>
+        <meta charset="UTF-8">
+        <meta name="viewport" content="width=device-width, initial-scale=1.0">
+        <title>Handmade Soap Studio</title>
+        <link href="https://fonts.googleapis.com/css2?family=Noto+Sans+KR:wght@400;700&amp;family=Playfair+Display" rel="stylesheet">
+        <style>
+            :root {{
+                --primary: #2d6a4f;
+                --accent: #f4a261;
+            }}
+            body {{
+                font-family: 'Noto Sans KR', sans-serif;
+                margin: 0;
+            }}
+            .grid > .product-card {{
+                display: grid;
+                grid-template-columns: repeat(auto-fill, minmax(240px, 1fr));
+            }}
+            {rules}
+        </style>
+        <script type="application/ld+json">
+            {{"@context": "https://schema.org", "@type": "Store", "name": "Handmade Soap Studio"}}
+        </script>
+    </head>
+    <body>
+        <!-- Header -->
+        <header class="site-header">
+            <img src="https://example.com/logo.svg" alt="logo" class="logo">
+            <nav>
+                <a href="#shop">Shop</a> <a href="#about">About</a>
+                <ul class="menu">
+                    <li>New</li>
+                    <li>Best</li>
+                </ul>
+            </nav>
+        </header>
+        <section class="hero">
+            <img src="{PHOTO.format(n=99)}" alt="hero">
+            <h1>Handmade  Soap  Studio</h1>
+            <p>Cold-process soap,&nbsp;cured\u00a0for six weeks.</p>
+        </section>
+        <main id="shop" class="grid">{cards}
+        </main>
+        <pre class="recipe">
+  olive oil   70%
+  coconut oil 30%
+        </pre>
+        <script>{SCRIPT}</script>
+    </body>
+</html>
+"""
+
+
+# Scripts whose meaning hinges on whitespace: newline-sensitive statements (ASI),
+# regex vs division, template literals and comment-like text in strings.
+# (script, text the minified script must still contain)
+JS_CASES = [
+    ("const s = 'a  b'\nif (s)  /a  b/.test(s) && console.log('regex after if (...)')", "/a  b/"),
+    ("const q = (8)  /  2  /  1, r = /[/]  '/.source\nconsole.log(q, r)", "/[/]  '/"),
+    ("let i = 4\nconst q = i++ / 2 / 1\nconsole.log(q, i)", None),
+    ("const u = `https://x.test//${'a'}//  ${ {k: 1}.k }`\nconsole.log(u) // done", "`https://x.test//${'a'}//  ${ {k: 1}.k }`"),
+    ("const end = '<\\/script>', tag = '</scr' + 'ipt>'\nconsole.log(end, tag)", "'<\\/script>'"),
+    ("let a = 2, b = 3\nconsole.log(a < !--b, b)", "< !--b"),
+    ("let c = 1\nlet d = c\n++d\nconsole.log(c, d)", "\n++d"),
+    ("function f() { return\n42 }\nconsole.log(f())", "return\n42"),
+]
+JS_NODE_CASES = [
+    "const x = 10, g = 2\nconsole.log(x / 2 / g, '/not/' + 'a regex', /a\\/b/.test('a/b'))",
+    "const s = `line 1\n    line ${1 + 1}  // kept`\nconsole.log(s)",
+    "let n = 5\nn\n--n\nconsole.log(n, n - -1, n+ +1, 'a' + + '1')",
+    "const r = [1, 2, 3].map(v => v * 2)\n;(function () { console.log(r.join(',')) })()",
+    "var url = 'http://example.com/path' // trailing comment\nconsole.log(url, typeof /x/g)",
+    "if (1) { console.log('a') }\nelse { console.log('b') }\nconsole.log(void 0, 3 in [1, 2, 3, 4])",
+]
+
+
+def _node(script: str) -> subprocess.CompletedProcess:
+    return subprocess.run(["node", "-e", script], capture_output=True, text=True, timeout=30)
+
+
+# (stylesheet, text the minified stylesheet must still contain)
+CSS_CASES = [
+    (".a { width: calc(100% - 2 * var(--gap)); }", "width:calc(100% - 2 * var(--gap))"),
+    (".a { margin: calc(-1 * (8px + 2vw)) }", "calc(-1 * (8px + 2vw))"),
+    (".nav :hover, .a > .b { color: red; }", ".nav :hover,.a>.b{color:red}"),
+    ("@media screen and (max-width: 767px) { .a { content: 'x  ;  y' } }", "@media screen and (max-width:767px){.a{content:'x  ;  y'}}"),
+]
+
+
+# Markup the tokenizer must not split: a ">" inside a quoted attribute value.
+# (page, text the optimized page must still contain)
+HTML_CASES = [
+    ('<img src="a.jpg">' * OPTIMIZE_EAGER_IMAGES + '<img src="b.jpg" alt="Tom > Jerry" class="x">',
+     '<img src="b.jpg" alt="Tom > Jerry" class="x" loading="lazy" decoding="async">'),
+    ("<a title='1 > 0' href='#a'>  x  </a>", "<a title='1 > 0' href='#a'> x </a>"),
+    ('<script data-note="a > b">let  a = 1</script>', '<script data-note="a > b">let a=1</script>'),
+]
+
+
+def _scripts(check):
+    for script, kept in JS_CASES:
+        minified = minify_js(script)
+        check("</script" not in minified.lower(), f"minified script closes the <script>: {minified!r}")
+        check(kept is None or kept in minified, f"{kept!r} lost in {minified!r}")
+    for css, kept in CSS_CASES:
+        minified = minify_css(css)
+        check(kept in minified, f"{kept!r} lost in {minified!r}")
+    for html, kept in HTML_CASES:
+        optimized, _ = optimize_html(html)
+        check(kept in optimized, f"{kept!r} lost in {optimized!r}")
+    print(f"{len(JS_CASES)} JS, {len(CSS_CASES)} CSS and {len(HTML_CASES)} markup edge cases minified")
+
+    if not shutil.which("node"):
+        print("node not found: script equivalence skipped\n")
+        return
+    scripts = [SCRIPT, *(script for script, _ in JS_CASES), *JS_NODE_CASES]
+    for n, script in enumerate(scripts):
+        minified = minify_js(script)
+        before, after = _node(script), _node(minified)
+        check(before.returncode == 0, f"script {n}: original does not run: {before.stderr.strip()}")
+        check(after.returncode == 0 and after.stdout == before.stdout,
+              f"script {n}: minified output differs: {after.stdout!r} != {before.stdout!r} {after.stderr.strip()}")
+    print(f"node: {len(scripts)} scripts print the same output before and after minification\n")
+
+
+def _optimize(check, html: str):
+    start = time.perf_counter()
+    optimized, stats = optimize_html(html)
+    elapsed = (time.perf_counter() - start) * 1000
+    raw_gz, opt_gz = len(gzip.compress(html.encode())), len(gzip.compress(optimized.encode()))
+    # srcset/sizes add markup (and save far more in image bytes); the rest is minification
+    responsive = sum(len(attrs) for attrs in re.findall(r' srcset="[^"]*" sizes="[^"]*"', optimized))
+    minified = 1 - (stats["optimized_bytes"] - responsive) / stats["original_bytes"]
+    saved = 1 - stats["optimized_bytes"] / stats["original_bytes"]
+    saved_gz = 1 - opt_gz / raw_gz
+    print(f"{'':<10} {'raw':>9} {'gzip':>9}")
+    print(f"{'original':<10} {stats['original_bytes']:>8,}B {raw_gz:>8,}B")
+    print(f"{'optimized':<10} {stats['optimized_bytes']:>8,}B {opt_gz:>8,}B")
+    print(f"{'saved':<10} {saved:>9.1%} {saved_gz:>9.1%}   ({elapsed:.1f}ms)")
+    print(f"minification saved {minified:.1%}; srcset/sizes added {responsive:,}B for {stats['srcset_images']} images")
+    print(f"stats: {stats}\n")
+
+    check(minified >= 0.25, f"minification saved only {minified:.1%} of the raw bytes")
+    check(saved > 0, f"optimized page is {-saved:.1%} larger than the original")
+    check(saved_gz > 0, "gzip size did not shrink")
+
+    images = re.findall(r"<img\b[^>]*>", optimized)
+    check(len(images) == PRODUCTS + 2, f"{len(images)} images after optimizing")
+    check(all("loading=" not in tag for tag in images[:OPTIMIZE_EAGER_IMAGES]), "above-the-fold images were made lazy")
+    check(all('loading="lazy"' in tag and 'decoding="async"' in tag for tag in images[OPTIMIZE_EAGER_IMAGES:]),
+          "below-the-fold images are not lazy")
+    check(stats["lazy_images"] == len(images) - OPTIMIZE_EAGER_IMAGES, f"lazy_images = {stats['lazy_images']}")
+    unsplash = [tag for tag in images if "images.unsplash.com" in tag]
+    check(len(unsplash) == PRODUCTS + 1 and all("srcset=" in tag and 'sizes="100vw"' in tag for tag in unsplash),
+          "Unsplash images without a srcset")
+    check(all("auto=format" in tag and "fm=jpg" not in tag and "ixlib" not in tag and "ixid=" in tag for tag in unsplash),
+          "Unsplash URLs not switched to auto=format (or lost their ixid)")
+    check(all(" 640w" in tag and " 1080w" in tag and "w=1600" not in tag for tag in unsplash),
+          "srcset should offer 640w and the image's own 1080w, nothing wider")
+
+    head = optimized[:optimized.index("</head>")]
+    for hint in ('<link rel="preconnect" href="https://fonts.googleapis.com">',
+                 '<link rel="preconnect" href="https://fonts.gstatic.com" crossorigin>',
+                 '<link rel="preconnect" href="https://images.unsplash.com">'):
+        check(hint in head, f"missing {hint}")
+    check(head.index("preconnect") < head.index("fonts.googleapis.com/css2"), "preconnect after the font stylesheet")
+    check("display=swap" in head, "Google Fonts link without display=swap")
+
+    check("cured\u00a0for" in optimized and "&nbsp;" in optimized, "non-breaking spaces were collapsed")
+    check("  olive oil   70%\n" in optimized, "<pre> content changed")
+    check("<!-- Header -->" not in optimized and "/* section" not in optimized, "comments left in")
+    check('"name": "Handmade Soap Studio"}' in optimized, "JSON-LD was rewritten")
+    check('<a href="#shop">Shop</a> <a href="#about">About</a>' in optimized, "space between inline elements lost")
+    check('<li>New</li> <li>Best</li>' in optimized, "space between (possibly inline-block) list items dropped")
+    check("</header><section" in optimized, "whitespace between block containers kept")
+
+    again, _ = optimize_html(optimized)
+    check(again == optimized, "optimizing twice changes the page again")
+    return optimized
+
+
+def _image_heavy(check):
+    # Compact markup, many photos: srcset would cost more than minifying saves
+    images = "\n".join(f'            <img src="{PHOTO.format(n=n)}" alt="{n}">' for n in range(40))
+    html = f"<!DOCTYPE html><html><head><title>Lookbook</title></head><body><main>\n{images}\n</main></body></html>"
+    optimized, stats = optimize_html(html)
+    print(f"image-heavy page: {stats}")
+    check(stats["optimized_bytes"] <= stats["original_bytes"], "image-heavy page grew")
+    check(stats["srcset_images"] == 0 and stats["optimized_bytes"] < stats["original_bytes"],
+          "image-heavy page should keep the optimization without srcset")
+    check(optimized.count('loading="lazy"') == 40 - OPTIMIZE_EAGER_IMAGES, "image-heavy page lost lazy loading")
+
+    tiny, stats = optimize_html("<p>x</p>")
+    check(tiny == "<p>x</p>" and stats["optimized_bytes"] == stats["original_bytes"],
+          "a page with nothing to optimize changed")
+
+
+def _compact(check):
+    # Already-compact pages: the added attributes outweigh what minifying saves, but are
+    # still applied; only srcset is held back when it would grow the page
+    stand_in = STAND_IN_PAGE.replace("{product}", "수제 비누")
+    fonts = '<link href="https://fonts.googleapis.com/css2?family=Noto+Sans+KR" rel="stylesheet">'
+    photos = "\n".join(f"""
+            <div class="card">
+                <img src="https://images.unsplash.com/photo-{n}?w=1200" alt="{n}">
+            </div>""" for n in range(8))
+    pretty = f"<!DOCTYPE html>\n<html>\n    <head>\n        {fonts}\n    </head>\n    <body>{photos}\n    </body>\n</html>"
+    for name, html in (("stand-in page", stand_in), ("pretty-printed page", pretty)):
+        optimized, stats = optimize_html(html)
+        print(f"{name}: {stats}")
+        images = re.findall(r"<img\b[^>]*>", optimized)
+        check(stats["lazy_images"] == len(images) - OPTIMIZE_EAGER_IMAGES > 0, f"{name}: lazy_images = {stats['lazy_images']}")
+        check(all('loading="lazy"' in tag and 'decoding="async"' in tag for tag in images[OPTIMIZE_EAGER_IMAGES:]),
+              f"{name}: below-the-fold images are not lazy")
+        check('<link rel="preconnect" href="https://images.unsplash.com">' in optimized, f"{name}: no Unsplash preconnect")
+        check(stats["srcset_images"] == 0 or stats["optimized_bytes"] < stats["original_bytes"],
+              f"{name}: srcset kept although the page grew")
+        check(optimize_html(optimized)[0] == optimized, f"{name}: optimizing twice changes the page again")
+    check("display=swap" in optimized and "fonts.gstatic.com" in optimized,
+          "pretty-printed page without display=swap or the font preconnects")
+    print()
+
+
+def _serving(check, original: str, optimized: str):
+    client = TestClient(main.app)
+    meta = {"product_type": "soap", "design_style": "minimal", "color_palette": ["#2d6a4f"]}
+    for site_id in ("optimized", "clone"):
+        database.create_pending_site(site_id, meta)
+        database.update_site_success_with_meta(site_id, optimized, meta, original)
+    database.create_pending_site("plain", meta)
+    database.update_site_success_with_meta("plain", original, meta, original)
+
+    served = client.get("/sites/optimized/html", headers={"accept-encoding": "identity"})
+    check(served.status_code == 200 and served.text == optimized, "/html does not serve the optimized version")
+    kept = client.get("/sites/optimized/html?original=true", headers={"accept-encoding": "identity"})
+    check(kept.status_code == 200 and kept.text == original, "?original=true does not serve the original")
+    check(served.headers["etag"] != kept.headers["etag"], "both versions share an ETag")
+    check(client.get("/results/optimized").json()["html_content"] == optimized, "/results/{id} returns the original")
+    plain = client.get("/sites/plain/html?original=true", headers={"accept-encoding": "identity"})
+    check(plain.status_code == 200 and plain.text == original, "?original=true fails on an unoptimized site")
+
+    info = client.get("/sites/optimized/optimization").json()
+    print(f"/sites/optimized/optimization: {info}")
+    check(info["optimized"] and info["bytes_saved"] == len(original.encode()) - len(optimized.encode()),
+          "optimization endpoint reports the wrong bytes saved")
+    check(client.get("/sites/plain/optimization").json()["bytes_saved"] == 0, "unoptimized site reports savings")
+    check(client.get("/sites/missing/optimization").status_code == 404, "optimization of a missing site")
+
+    usage = database.html_store_usage()
+    print(f"html store: {usage}\n")
+    check(usage["blobs"] == 2 and usage["optimized_sites"] == 2, "versions are not shared across sites")
+    check(usage["optimizer_bytes_saved"] == 2 * info["bytes_saved"], "html_store_usage bytes saved")
+
+    for site_id in ("optimized", "plain"):
+        database.delete_site(site_id)
+    check(database.html_store_usage()["blobs"] == 2, "deleting one site dropped blobs still in use")
+    database.delete_site("clone")
+    check(database.html_store_usage()["blobs"] == 0, "blobs left behind after deleting every site")
+
+
+def run() -> int:
+    check = Checks()
+
+    original = _page()
+    optimized = _optimize(check, original)
+    _image_heavy(check)
+    _compact(check)
+    _scripts(check)
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_PATH = os.path.join(tmp, "html_optimizer.db")
+        database.init_db()
+        _serving(check, original, optimized)
+
+    return check.report()
+
+
+if __name__ == "__main__":
+    sys.exit(run())
@@ -0,0 +1,115 @@
+"""
+Bytes on the wire for the API's read endpoints, with and without HTTP caching.
+
+    cd backend && python -m benchmarks.http_caching
+
+Runs the app in-process against a temporary database seeded with completed
+sites. For /results, /gallery and /sites/{id}/html it compares an uncompressed
+first visit, a br/gzip first visit and a revisit with If-None-Match, and checks
+that validators behave: 304 while nothing changed, a new ETag once the gallery
+changes. Exits non-zero if a check fails.
+"""
+import os
+import sys
+import tempfile
+
+os.environ.setdefault("GEMINI_API_KEY", "benchmark")
+
+from fastapi.testclient import TestClient
+
+import database
+import main
+from benchmarks.checks import Checks
+
+SITES = 60
+
+
+def _site_html(i: int) -> str:
+    cards = "".join(
+        f'<article class="product-card"><img src="https://images.unsplash.com/photo-{i}-{n}?w=1200" alt="상품 {n}">'
+        f'<h3>수제 비누 {n}호</h3><p class="price">₩{12000 + n * 500:,}</p>'
+        f'<button class="btn btn-primary" onclick="addToCart({n})">장바구니 담기</button></article>'
+        for n in range(40)
+    )
+    style = "".join(f".section-{n} {{ padding: {n}px 24px; color: #333; background: #fafafa; }}\n" for n in range(120))
+    return (
+        f"<!DOCTYPE html><html lang='ko'><head><meta charset='utf-8'><style>{style}</style></head>"
+        f"<body><header><h1>Site {i}</h1></header><main class='grid'>{cards}</main>"
+        f"<script>document.querySelectorAll('.btn').forEach(b => b.addEventListener('click', () => {{}}));</script></body></html>"
+    )
+
+
+def _seed():
+    for i in range(SITES):
+        site_id = f"site-{i}"
+        database.create_pending_site(site_id, {"product_type": f"product {i}", "design_style": "minimal"})
+        meta = {"product_type": f"product {i}", "explanation": "설명 " * 50, "key_points": ["a", "b"], "color_palette": ["#111", "#fff"]}
+        database.update_site_success_with_meta(site_id, _site_html(i), meta)
+
+
+def _wire(response) -> int:
+    # Compressed size as transferred (TestClient decodes the body for us)
+    return response.num_bytes_downloaded
+
+
+def _measure(client: TestClient, path: str, extra=None):
+    identity = client.get(path, headers={"accept-encoding": "identity", **(extra or {})})
+    encoded = client.get(path, headers={"accept-encoding": "br, gzip", **(extra or {})})
+    revisit = client.get(path, headers={"accept-encoding": "br, gzip", "if-none-match": encoded.headers["etag"], **(extra or {})})
+    return identity, encoded, revisit
+
+
+def run() -> int:
+    check = Checks()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_PATH = os.path.join(tmp, "bench.db")
+        database.init_db()
+        _seed()
+        client = TestClient(main.app)
+
+        print(f"{'endpoint':<28} {'identity':>10} {'encoded':>10} {'revisit':>8} {'saved (encoded)':>16}")
+        for label, path in [
+            ("/results/{id}", "/results/site-7"),
+            ("/gallery (24, default)", "/gallery"),
+            ("/gallery (html_content)", "/gallery?limit=10&fields=id,html_content"),
+            ("/sites/{id}/html", "/sites/site-7/html"),
+        ]:
+            identity, encoded, revisit = _measure(client, path)
+            check(identity.status_code == 200 and encoded.status_code == 200, f"{label}: expected 200s")
+            check(revisit.status_code == 304, f"{label}: revisit returned {revisit.status_code}, expected 304")
+            check(encoded.headers.get("content-encoding") in ("br", "gzip"), f"{label}: response not compressed")
+            check(identity.content == encoded.content, f"{label}: decoded bodies differ")
+            saved = 1 - _wire(encoded) / _wire(identity)
+            print(f"{label:<28} {_wire(identity):>9}B {_wire(encoded):>9}B {_wire(revisit):>7}B {saved:>15.0%}")
+
+        # Completed sites are immutable; pending ones are only cached briefly
+        check("immutable" in client.get("/results/site-7").headers.get("cache-control", ""), "completed site not immutable")
+
+        # Gallery validator follows the change counter
+        etag = client.get("/gallery").headers["etag"]
+        check(client.get("/gallery", headers={"if-none-match": etag}).status_code == 304, "gallery: unchanged page not 304")
+        database.create_pending_site("site-new", {"product_type": "new"})
+        check(client.get("/gallery", headers={"if-none-match": etag}).status_code == 304, "gallery: pending site changed the ETag")
+        database.update_site_success_with_meta("site-new", _site_html(999), {})
+        changed = client.get("/gallery", headers={"if-none-match": etag})
+        check(changed.status_code == 200 and changed.headers["etag"] != etag, "gallery: new completed site kept the old ETag")
+
+        # Pending results keep one ETag while the response is unchanged, a new one once it finishes
+        check(client.get("/results/site-missing").status_code == 404, "unknown site not 404")
+        database.create_pending_site("site-p", {"product_type": "p"})
+        first = client.get("/results/site-p")
+        check(first.headers.get("cache-control", "").startswith("max-age="), "pending result not short-lived")
+        check(client.get("/results/site-p", headers={"if-none-match": first.headers["etag"]}).status_code == 304, "pending: unchanged result not 304")
+        database.update_site_error("site-p", "boom")
+        failed = client.get("/results/site-p", headers={"if-none-match": first.headers["etag"]})
+        check(failed.status_code == 200 and failed.json()["status"] == "error", "pending: failure kept the old ETag")
+        check(failed.headers.get("cache-control") == "no-cache", "failed result cached without revalidation")
+
+        database.close_all()
+
+    return check.report()
+
+
+if __name__ == "__main__":
+    sys.exit(run())
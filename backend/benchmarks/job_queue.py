@@ -0,0 +1,127 @@
+"""
+Job queue wakeups and lost leases.
+
+    cd backend && python -m benchmarks.job_queue
+
+Runs a JobQueue against a temporary database and checks that:
+- a job enqueued while an idle worker is in the middle of its lease query is
+  picked up at once, not after the next poll
+- when another worker takes over the lease, the heartbeat cancels the running
+  handler before it writes its result, and the old worker can no longer
+  complete or fail the job
+Exits non-zero if a check fails.
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+import database
+from benchmarks.checks import Checks
+from services.job_queue import JobQueue
+
+POLL_INTERVAL = 30.0   # long enough that only a wakeup can explain a prompt start
+MAX_START_DELAY = 1.0
+
+
+async def _missed_wakeup(check):
+    started = asyncio.Event()
+
+    async def handler(job_id, payload):
+        started.set()
+
+    async def on_failure(job_id, error):
+        pass
+
+    queue = JobQueue(handler, on_failure, concurrency=1, poll_interval=POLL_INTERVAL)
+    loop = asyncio.get_running_loop()
+    lease_next_job = database.lease_next_job
+    racing = {"armed": False}
+
+    def lease_during_enqueue(worker_id, lease_seconds):
+        job = lease_next_job(worker_id, lease_seconds)
+        if racing["armed"] and job is None:
+            # The query has already looked; the job arrives and notify() fires
+            # before the worker goes back to waiting
+            racing["armed"] = False
+            database.enqueue_job("late-job", {})
+            asyncio.run_coroutine_threadsafe(_notify(queue), loop).result()
+        return job
+
+    database.lease_next_job = lease_during_enqueue
+    try:
+        await queue.start()
+        await asyncio.sleep(0.1)  # worker is idle
+        racing["armed"] = True
+        queue.notify()            # next pass runs the racing lease query
+        began = time.perf_counter()
+        try:
+            await asyncio.wait_for(started.wait(), timeout=POLL_INTERVAL / 2)
+        except asyncio.TimeoutError:
+            pass
+        delay = time.perf_counter() - began
+        print(f"job enqueued during a lease query started after {delay:.2f}s (poll interval {POLL_INTERVAL:.0f}s)")
+        check(started.is_set() and delay < MAX_START_DELAY, f"job enqueued during a lease query waited {delay:.2f}s")
+    finally:
+        database.lease_next_job = lease_next_job
+        await queue.stop()
+
+
+async def _notify(queue: JobQueue):
+    queue.notify()
+
+
+async def _lost_lease(check):
+    lease_seconds = 0.3
+    running = asyncio.Event()
+    wrote = []
+    failures = []
+
+    async def handler(job_id, payload):
+        running.set()
+        await asyncio.sleep(lease_seconds * 5)
+        wrote.append(job_id)  # stands in for update_site_success_with_meta
+
+    async def on_failure(job_id, error):
+        failures.append(job_id)
+
+    queue = JobQueue(handler, on_failure, concurrency=1, lease_seconds=lease_seconds, poll_interval=0.05)
+    database.enqueue_job("stolen-job", {})
+    await queue.start()
+    try:
+        await asyncio.wait_for(running.wait(), timeout=2)
+        # Another worker takes the job over (as after a stall past lease expiry)
+        with database.transaction() as conn:
+            conn.execute("UPDATE jobs SET lease_owner = 'other-worker', lease_expires_at = ? WHERE id = 'stolen-job'",
+                         (time.time() + 3600,))
+        await asyncio.sleep(lease_seconds * 6)
+    finally:
+        await queue.stop()
+
+    job = database._fetchone("SELECT status, lease_owner FROM jobs WHERE id = 'stolen-job'")
+    print(f"stolen lease: handler wrote={bool(wrote)}, job status={job['status']}, owner={job['lease_owner']}")
+    check(not wrote, "handler kept running and wrote its result after the lease was lost")
+    check(not failures, "on_failure ran for a job whose lease was lost")
+    check(job["status"] == "running" and job["lease_owner"] == "other-worker",
+          f"old worker changed a job it no longer leases ({job['status']}, {job['lease_owner']})")
+    check(not database.complete_job("stolen-job", "someone-else"), "complete_job succeeded without the lease")
+    check(not database.fail_job("stolen-job", "someone-else", "boom"), "fail_job succeeded without the lease")
+
+
+def run() -> int:
+    check = Checks()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_PATH = os.path.join(tmp, "job_queue.db")
+        database.init_db()
+        asyncio.run(_missed_wakeup(check))
+        asyncio.run(_lost_lease(check))
+        database.close_all()
+
+    print()
+    return check.report()
+
+
+if __name__ == "__main__":
+    sys.exit(run())
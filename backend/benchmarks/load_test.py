@@ -0,0 +1,347 @@
+"""
+Offline load test: the backend against synthetic stores, with stand-ins for Gemini,
+Unsplash and reference pages, at increasing concurrency.
+
+    cd backend && python -m benchmarks.load_test [--sizes 1000,10000,100000] [--json out.json] [--baseline old.json]
+
+For each store size it builds (or reuses, with --store-dir) a synthetic sites.db
+(benchmarks/synthetic_store.py), starts benchmarks/stand_in_server.py on a copy
+of it in a subprocess, and runs closed-loop scenarios for --duration seconds per
+concurrency level:
+- gallery:  GET /gallery first pages and deeper cursor pages
+- results:  GET /results/{id} of random completed sites
+- generate: POST /generate, then poll /results/{id} until it finishes (latency is
+            end to end; throughput is finished generations per second)
+Reported per level: requests, errors, throughput, p50/p95/p99 latency and the
+server's peak RSS, plus server startup time and idle RSS per store. --json saves
+the numbers; --baseline compares against a saved run and fails on a p95 or
+throughput regression beyond --tolerance. Model and HTTP behaviour (latency,
+streaming, error rates, replayed fixtures) are passed through to the server; see
+`python -m benchmarks.stand_in_server --help`.
+
+Gemini RPM/TPM and Unsplash hourly limits are lifted unless set in the
+environment (quota is not what is measured here); GENERATION_WORKERS and the
+other server settings apply as usual. Client and server share the machine,
+so compare runs from the same host.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import httpx
+
+from benchmarks.checks import Checks
+from benchmarks.synthetic_store import build_store
+
+SIZES = [1_000, 10_000, 100_000]
+CONCURRENCY = [1, 4, 16, 64]
+GENERATE_CONCURRENCY = [1, 4, 16]
+DURATION = 5.0
+POLL_INTERVAL = 0.25
+STARTUP_TIMEOUT = 180.0
+GENERATION_TIMEOUT = 120.0
+# Reference URLs the generate scenario picks from (repeats exercise the reference cache)
+REFERENCE_URLS = [f"https://reference-{n}.test/" for n in range(20)]
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Passed to benchmarks.stand_in_server as-is
+SERVER_OPTIONS = [
+    ("--model", str, "stand-in"), ("--http", str, "stand-in"), ("--fixtures", str, None), ("--record", str, None),
+    ("--speed", float, 1.0), ("--model-latency", float, 1.0), ("--model-chunks", int, 8),
+    ("--model-error-rate", float, 0.0), ("--reference-latency", float, 0.3), ("--unsplash-latency", float, 0.2),
+    ("--http-error-rate", float, 0.0), ("--jitter", float, 0.2),
+]
+
+
+def _rss_mb(pid: int) -> Optional[float]:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class Server:
+    """stand_in_server in a subprocess, working directory = a copy of the store"""
+
+    def __init__(self, store_path: str, work_dir: str, server_args: List[str], env: Dict[str, str]):
+        os.makedirs(work_dir, exist_ok=True)
+        shutil.copy(store_path, os.path.join(work_dir, "sites.db"))
+        self.port = _free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.log_path = os.path.join(work_dir, "server.log")
+        self._log = open(self.log_path, "w")
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "benchmarks.stand_in_server", "--port", str(self.port), *server_args],
+            cwd=work_dir, env=env, stdout=self._log, stderr=subprocess.STDOUT,
+        )
+
+    def wait_ready(self) -> float:
+        start = time.perf_counter()
+        while time.perf_counter() - start < STARTUP_TIMEOUT:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"server exited with {self.process.returncode}, see {self.log_path}")
+            try:
+                if httpx.get(self.url + "/", timeout=1.0).status_code == 200:
+                    return time.perf_counter() - start
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.1)
+        raise RuntimeError(f"server not ready after {STARTUP_TIMEOUT}s, see {self.log_path}")
+
+    def rss_mb(self) -> Optional[float]:
+        return _rss_mb(self.process.pid)
+
+    def stop(self):
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        self._log.close()
+
+
+def _percentiles(samples: List[float]) -> Dict[str, Optional[float]]:
+    if len(samples) < 2:
+        value = samples[0] if samples else None
+        return {"p50": value, "p95": value, "p99": value}
+    cuts = statistics.quantiles(samples, n=100, method="inclusive")
+    return {"p50": cuts[49], "p95": cuts[94], "p99": cuts[98]}
+
+
+async def _closed_loop(concurrency: int, duration: float, request: Callable[[random.Random], Awaitable[bool]],
+                       server: Server) -> Dict[str, Any]:
+    """`concurrency` workers issue requests back to back for `duration` seconds; latencies in ms"""
+    latencies: List[float] = []
+    errors = 0
+    peak_rss = [server.rss_mb() or 0.0]
+    deadline = time.perf_counter() + duration
+
+    async def worker(n: int):
+        nonlocal errors
+        rng = random.Random(n)
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                ok = await request(rng)
+            except (httpx.HTTPError, asyncio.TimeoutError):
+                ok = False
+            latencies.append((time.perf_counter() - start) * 1000)
+            errors += not ok
+
+    async def sample_rss():
+        while True:
+            peak_rss[0] = max(peak_rss[0], server.rss_mb() or 0.0)
+            await asyncio.sleep(0.1)
+
+    sampler = asyncio.create_task(sample_rss())
+    start = time.perf_counter()
+    await asyncio.gather(*[worker(n) for n in range(concurrency)])
+    elapsed = time.perf_counter() - start
+    sampler.cancel()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput": (len(latencies) - errors) / elapsed,
+        **_percentiles(latencies),
+        "peak_rss_mb": peak_rss[0],
+    }
+
+
+def _sample_ids(store_path: str, count: int = 2000) -> List[str]:
+    conn = sqlite3.connect(store_path)
+    try:
+        return [row[0] for row in conn.execute(
+            "SELECT id FROM sites WHERE status = 'completed' ORDER BY random() LIMIT ?", (count,))]
+    finally:
+        conn.close()
+
+
+async def _scenarios(client: httpx.AsyncClient, site_ids: List[str]) -> Dict[str, Callable[[random.Random], Awaitable[bool]]]:
+    # Cursors of the first pages, fetched once: deeper pages are what infinite scroll asks for
+    cursors: List[Optional[str]] = [None]
+    for _ in range(10):
+        page = (await client.get("/gallery", params={"limit": 24, **({"cursor": cursors[-1]} if cursors[-1] else {})})).json()
+        if not page.get("next_cursor"):
+            break
+        cursors.append(page["next_cursor"])
+
+    async def gallery(rng: random.Random) -> bool:
+        cursor = None if rng.random() < 0.7 else rng.choice(cursors)
+        response = await client.get("/gallery", params={"limit": 24, **({"cursor": cursor} if cursor else {})})
+        return response.status_code == 200
+
+    async def results(rng: random.Random) -> bool:
+        response = await client.get(f"/results/{rng.choice(site_ids)}")
+        return response.status_code == 200
+
+    async def generate(rng: random.Random) -> bool:
+        response = await client.post("/generate", json={
+            "product_type": f"부하 테스트 {rng.choice(['비누', '캔들', '원두', '니트'])} {uuid.uuid4().hex[:8]}",
+            "design_style": rng.choice(["미니멀", "모던", "빈티지"]),
+            "reference_url": rng.choice(REFERENCE_URLS),
+            "generation_mode": rng.choice(["smart", "smart", "raw", "none"]),
+        })
+        if response.status_code != 200:
+            return False
+        site_id = response.json()["id"]
+        deadline = time.perf_counter() + GENERATION_TIMEOUT
+        while time.perf_counter() < deadline:
+            await asyncio.sleep(POLL_INTERVAL)
+            status = (await client.get(f"/results/{site_id}")).json()["status"]
+            if status != "pending":
+                return status == "completed"
+        return False
+
+    return {"gallery": gallery, "results": results, "generate": generate}
+
+
+async def _run_store(server: Server, site_ids: List[str], args) -> List[Dict[str, Any]]:
+    levels = {"gallery": args.concurrency, "results": args.concurrency, "generate": args.generate_concurrency}
+    rows = []
+    limits = httpx.Limits(max_connections=max(args.concurrency + args.generate_concurrency), max_keepalive_connections=64)
+    async with httpx.AsyncClient(base_url=server.url, timeout=httpx.Timeout(60.0), limits=limits) as client:
+        scenarios = await _scenarios(client, site_ids)
+        for name in args.scenarios:
+            for concurrency in levels[name]:
+                result = await _closed_loop(concurrency, args.duration, scenarios[name], server)
+                rows.append({"scenario": name, "concurrency": concurrency, **result})
+                _print_row(rows[-1])
+    return rows
+
+
+def _ms(value: Optional[float]) -> str:
+    return f"{value:>8.1f}" if value is not None else f"{'-':>8}"
+
+
+def _print_header():
+    print(f"{'scenario':<10} {'conc':>5} {'requests':>9} {'errors':>7} {'req/s':>8} "
+          f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'peak RSS':>9}")
+
+
+def _print_row(row: Dict[str, Any]):
+    print(f"{row['scenario']:<10} {row['concurrency']:>5} {row['requests']:>9} {row['errors']:>7} {row['throughput']:>8.1f} "
+          f"{_ms(row['p50'])} {_ms(row['p95'])} {_ms(row['p99'])} {row['peak_rss_mb']:>7.0f}MB")
+
+
+def _compare(results: List[Dict[str, Any]], baseline_path: str, tolerance: float) -> List[str]:
+    with open(baseline_path) as f:
+        baseline = {(row["sites"], row["scenario"], row["concurrency"]): row for row in json.load(f)["results"]}
+    regressions = []
+    for row in results:
+        old = baseline.get((row["sites"], row["scenario"], row["concurrency"]))
+        if old is None:
+            continue
+        label = f"{row['sites']:,} sites, {row['scenario']} x{row['concurrency']}"
+        if old["p95"] and row["p95"] and row["p95"] > old["p95"] * (1 + tolerance):
+            regressions.append(f"{label}: p95 {old['p95']:.1f}ms -> {row['p95']:.1f}ms")
+        if old["throughput"] and row["throughput"] < old["throughput"] * (1 - tolerance):
+            regressions.append(f"{label}: throughput {old['throughput']:.1f} -> {row['throughput']:.1f}/s")
+    return regressions
+
+
+def _server_args(args) -> List[str]:
+    server_args = []
+    for flag, _, default in SERVER_OPTIONS:
+        value = getattr(args, flag[2:].replace("-", "_"))
+        if value is not None and value != default:
+            server_args += [flag, str(value)]
+    return server_args
+
+
+def run(args) -> int:
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, [BACKEND_DIR, os.environ.get("PYTHONPATH")]))}
+    for name, value in (("GEMINI_RPM", "100000"), ("GEMINI_TPM", "1000000000"), ("UNSPLASH_PER_HOUR", "1000000")):
+        env.setdefault(name, value)
+    # Real services (and fixtures recorded from them) can fail; the stand-ins only fail when told to
+    expect_errors = args.model_error_rate > 0 or args.http_error_rate > 0 or "real" in (args.model, args.http)
+
+    store_dir = args.store_dir or tempfile.mkdtemp(prefix="load-test-stores-")
+    work_root = tempfile.mkdtemp(prefix="load-test-")
+    results, stores, check = [], [], Checks()
+    try:
+        for size in args.sizes:
+            store_path = build_store(os.path.join(store_dir, str(size)), size)
+            server = Server(store_path, os.path.join(work_root, str(size)), _server_args(args), env)
+            try:
+                startup = server.wait_ready()
+                idle_rss = server.rss_mb()
+                stores.append({"sites": size, "startup_s": startup, "idle_rss_mb": idle_rss})
+                print(f"\n{size:,} sites: server ready in {startup:.1f}s, idle RSS {idle_rss or 0:.0f}MB")
+                _print_header()
+                for row in asyncio.run(_run_store(server, _sample_ids(store_path), args)):
+                    results.append({"sites": size, **row})
+                    check(not row["errors"] or expect_errors,
+                          f"{size:,} sites, {row['scenario']} x{row['concurrency']}: {row['errors']} error(s)")
+            finally:
+                server.stop()
+    finally:
+        shutil.rmtree(work_root, ignore_errors=True)
+        if not args.store_dir:
+            shutil.rmtree(store_dir, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({
+                "meta": {
+                    "host": platform.node(), "cpus": os.cpu_count(), "python": platform.python_version(),
+                    "duration": args.duration, "server_args": _server_args(args),
+                    "generation_workers": env.get("GENERATION_WORKERS", "2"),
+                },
+                "stores": stores,
+                "results": results,
+            }, f, indent=2)
+        print(f"\nsaved {args.json}")
+    if args.baseline:
+        check.failures += _compare(results, args.baseline, args.tolerance)
+
+    print()
+    return check.report()
+
+
+def _int_list(text: str) -> List[int]:
+    return [int(part) for part in text.split(",") if part]
+
+
+def _parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--sizes", type=_int_list, default=SIZES, help="store sizes, comma-separated")
+    parser.add_argument("--scenarios", type=lambda text: text.split(","), default=["gallery", "results", "generate"])
+    parser.add_argument("--concurrency", type=_int_list, default=CONCURRENCY, help="levels for gallery/results")
+    parser.add_argument("--generate-concurrency", type=_int_list, default=GENERATE_CONCURRENCY)
+    parser.add_argument("--duration", type=float, default=DURATION, help="seconds per concurrency level")
+    parser.add_argument("--store-dir", help="keep built stores here and reuse them across runs")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--baseline", help="results file of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed p95/throughput change vs the baseline")
+    for flag, kind, default in SERVER_OPTIONS:
+        parser.add_argument(flag, type=kind, default=default, help="passed to the stand-in server")
+    return parser
+
+
+if __name__ == "__main__":
+    sys.exit(run(_parser().parse_args()))
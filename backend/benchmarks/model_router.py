@@ -0,0 +1,258 @@
+"""
+Model router: backend choice, circuit breakers, failover and backoff.
+
+    cd backend && GEMINI_API_KEY=dummy python -m benchmarks.model_router
+
+Builds a ModelRouter over two API keys x two models (primary, fallback) whose
+models are stand-ins with scripted latency and failures, with breaker
+cooldowns and Retry-After values shrunk to fractions of a second. Checks:
+- with one key LATENCY_RATIO times slower, most sequential calls go to the fast
+  one, and concurrent calls spill onto the slow one instead of queueing
+- a 429 moves the call to the other key at once, without backoff, and keeps its
+  key out of rotation until its Retry-After has passed
+- BREAKER_FAILURES consecutive 503s trip a key's breaker; with both primary keys
+  tripped calls fail over to the fallback model, and after the cooldown one
+  half-open probe closes the breaker and traffic returns to the primary
+- a bad request is not retried; an unrecoverable outage raises
+  ModelUnavailableError instead of waiting past MODEL_ROUTER_MAX_WAIT
+- retries of the same backend wait a jittered, bounded backoff
+- a routed generation through GeminiService survives a failing primary, and
+  /admin/model-router reports per-backend health
+Exits non-zero if a check fails.
+"""
+import asyncio
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("BREAKER_FAILURES", "3")
+os.environ.setdefault("BREAKER_COOLDOWN", "0.5")
+os.environ.setdefault("MODEL_ROUTER_MAX_WAIT", "2")
+os.environ.setdefault("MODEL_ROUTER_BACKOFF_BASE", "0.05")
+os.environ.setdefault("MODEL_ROUTER_BACKOFF_MAX", "0.2")
+os.environ.setdefault("GEMINI_RPM", "60000")
+os.environ.setdefault("UNSPLASH_PER_HOUR", "100000")
+os.environ.setdefault("IMAGE_POOL_VALIDATE", "0")
+
+from fastapi.testclient import TestClient
+from google.api_core import exceptions as api_exceptions
+
+import database
+import main
+from benchmarks import stand_ins
+from benchmarks.checks import Checks
+from services import model_router
+from services.gemini_service import gemini_service
+from services.model_router import ModelRouter, ModelUnavailableError
+from services.rate_limiter import rate_limits
+
+FAST = 0.02
+LATENCY_RATIO = 4
+RETRY_AFTER = 0.4
+
+
+class ScriptedModel:
+    """Answers after `latency` seconds, or raises whatever `failure()` returns"""
+
+    def __init__(self, latency: float = FAST):
+        self.latency = latency
+        self.failure = lambda: None
+        self.calls = 0
+
+    async def generate_content_async(self, prompt, stream=False):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        error = self.failure()
+        if error is not None:
+            raise error
+        return stand_ins._Response(f"answer to {prompt}")
+
+
+async def _text(response) -> str:
+    return response.text
+
+
+def _fresh_buckets():
+    # Backends register their buckets by name; each scenario starts with full ones
+    for name in [name for name in rate_limits.buckets if name.split(":")[-1].startswith(("primary@", "fallback@"))]:
+        del rate_limits.buckets[name]
+
+
+def _router():
+    _fresh_buckets()
+    router = ModelRouter(["key-a", "key-b"], ["primary", "fallback"])
+    models = {backend.name: ScriptedModel() for backend in router.backends}
+    for backend in router.backends:
+        backend.model = models[backend.name]
+    return router, models
+
+
+async def _scenarios(check):
+    # Latency-aware choice
+    router, models = _router()
+    models["primary@key1"].latency = FAST * LATENCY_RATIO
+    for i in range(30):
+        await router.call(f"seq {i}", _text)
+    fast, slow = models["primary@key2"].calls, models["primary@key1"].calls
+    print(f"sequential: fast key {fast} calls, slow key {slow} calls")
+    check(fast >= 24, f"latency-aware choice sent only {fast}/30 calls to the fast key")
+    check(models["fallback@key1"].calls + models["fallback@key2"].calls == 0, "fallback model used while the primary was healthy")
+    before = slow
+    await asyncio.gather(*(router.call(f"burst {i}", _text) for i in range(12)))
+    print(f"burst of 12: slow key took {models['primary@key1'].calls - before}")
+    check(models["primary@key1"].calls > before, "concurrent calls did not spill onto the second key")
+
+    # 429: immediate failover, key kept out until Retry-After
+    router, models = _router()
+    limited = models["primary@key1"]
+    limited.failure = lambda: api_exceptions.ResourceExhausted(f"Quota exceeded, retry in {RETRY_AFTER}s")
+    router.backends[1].latency["generation"] = 1.0  # make key1 the first choice
+    start = time.perf_counter()
+    await router.call("rate limited", _text)
+    elapsed = time.perf_counter() - start
+    check(limited.calls == 1 and models["primary@key2"].calls == 1, "429 did not move the call to the other key")
+    check(router.stats["failovers"] == 1 and router.stats["backoff_seconds"] == 0, "failover after a 429 waited a backoff")
+    check(elapsed < 4 * FAST + 0.05, f"failover after a 429 took {elapsed * 1000:.0f}ms")
+    breaker = router.backends[0].breaker.snapshot()
+    check(breaker["state"] == "open" and 0 < breaker["open_for"] <= RETRY_AFTER, f"429 left the breaker {breaker}")
+    for i in range(5):
+        await router.call(f"while limited {i}", _text)
+    check(limited.calls == 1, "rate-limited key called before its Retry-After")
+    limited.failure = lambda: None
+    await asyncio.sleep(RETRY_AFTER + 0.05)
+    router.backends[1].latency["generation"] = 1.0
+    await router.call("after retry-after", _text)
+    check(limited.calls == 2 and router.backends[0].breaker.state == "closed", "key not back after its Retry-After")
+
+    # 503s: trip, failover to the fallback model, half-open recovery
+    router, models = _router()
+    for name in ("primary@key1", "primary@key2"):
+        models[name].failure = lambda: api_exceptions.ServiceUnavailable("backend overloaded")
+    for i in range(4):
+        await router.call(f"outage {i}", _text)
+    states = {b.name: b.breaker.state for b in router.backends}
+    print(f"after 503s: {states}, fallback calls {router.stats['fallback_model_calls']}")
+    check(states["primary@key1"] == states["primary@key2"] == "open", "503s did not trip the primary breakers")
+    check(router.stats["fallback_model_calls"] >= 1, "no failover to the fallback model")
+    fallback_before = router.stats["fallback_model_calls"]
+    await router.call("during outage", _text)
+    check(router.stats["fallback_model_calls"] == fallback_before + 1 and models["primary@key1"].calls + models["primary@key2"].calls == 6,
+          "tripped backends still called, or the fallback model not used directly")
+    for name in ("primary@key1", "primary@key2"):
+        models[name].failure = lambda: None
+    await asyncio.sleep(float(os.environ["BREAKER_COOLDOWN"]) + 0.05)
+    check({b.breaker.snapshot()["state"] for b in router.backends[:2]} == {"half_open"}, "breakers not half-open after the cooldown")
+    await router.call("probe 1", _text)
+    await router.call("probe 2", _text)
+    await router.call("back on primary", _text)
+    states = {b.name: b.breaker.state for b in router.backends}
+    check(states["primary@key1"] == states["primary@key2"] == "closed", f"probes did not close the breakers: {states}")
+    check(router.stats["fallback_model_calls"] == fallback_before + 1, "traffic did not return to the primary model")
+
+    # A failed probe doubles the cooldown
+    router, models = _router()
+    for backend in router.backends:
+        models[backend.name].failure = lambda: api_exceptions.ServiceUnavailable("down")
+    with_breaker = router.backends[0].breaker
+    for _ in range(3):
+        with_breaker.on_failure()
+    first = with_breaker.cooldown
+    await asyncio.sleep(float(os.environ["BREAKER_COOLDOWN"]) * 1.1)
+    with_breaker.claim()
+    with_breaker.on_failure()
+    check(with_breaker.state == "open" and with_breaker.cooldown == first * 2, "failed probe did not reopen with a doubled cooldown")
+
+    # Client errors are final; an outage with no end in sight fails fast
+    router, models = _router()
+    for model in models.values():
+        model.failure = lambda: api_exceptions.InvalidArgument("bad request")
+    try:
+        await router.call("bad", _text)
+        check(False, "client error swallowed")
+    except api_exceptions.InvalidArgument:
+        check(sum(m.calls for m in models.values()) == 1, "client error retried")
+    for model in models.values():
+        model.failure = lambda: api_exceptions.TooManyRequests("quota exceeded, retry in 60s")
+    start = time.perf_counter()
+    try:
+        await router.call("exhausted", _text)
+        check(False, "call succeeded with every key exhausted")
+    except api_exceptions.TooManyRequests:
+        pass
+    try:
+        await router.call("exhausted again", _text)
+        check(False, "call succeeded with every breaker open")
+    except ModelUnavailableError as e:
+        print(f"all exhausted: {e}")
+    check(time.perf_counter() - start < 1.0, "exhausted router waited instead of giving up")
+
+    # Jittered backoff on the same backend
+    _fresh_buckets()
+    router = ModelRouter(["key-a"], ["primary"])
+    flaky = ScriptedModel()
+    failures = iter([RuntimeError("flaky"), RuntimeError("flaky")])
+    flaky.failure = lambda: next(failures, None)
+    router.backends[0].model = flaky
+    await router.call("flaky", _text)
+    check(flaky.calls == 3 and router.stats["retries"] == 2 and router.stats["backoff_seconds"] > 0, "same-backend retry without backoff")
+    delays = [router._backoff(attempt) for attempt in range(1, 6) for _ in range(200)]
+    check(min(delays) >= 0 and max(delays) <= model_router.MODEL_ROUTER_BACKOFF_MAX, "backoff outside its bounds")
+    check(statistics.pstdev(delays) > 0.02, "backoff has no jitter")
+
+
+def _service_generation(check):
+    stand_ins.install(gemini_service, stand_ins.StandInModel(latency=0.1, chunks=3, jitter=0), stand_ins.stand_in_transport(0.01, 0.01))
+    router = gemini_service.router
+    # Primary key fails every call with a 503; a second key answers
+    extra = model_router.Backend(router.primary.model_name, 1, None, 0)
+    extra.model = gemini_service.model
+    extra.latency["generation"] = 1.0  # the failing key is tried first
+    router.backends[0].model = _Failing(gemini_service.model)
+    router.backends.append(extra)
+
+    async def generate():
+        return await gemini_service.generate_website_content("수제 비누", "https://example.com", "minimal")
+
+    result = asyncio.run(generate())
+    check("html" in result and len(result["html"]) > 100, "routed generation did not produce a page")
+    snapshot = TestClient(main.app).get("/admin/model-router").json()
+    backends = snapshot["backends"]
+    print(f"/admin/model-router: { {name: (b['calls'], b['successes'], b['breaker']['state']) for name, b in backends.items()} }")
+    check(set(backends) == {backend.name for backend in router.backends}, "/admin/model-router lists the wrong backends")
+    check(backends[router.primary.name]["server_error"] >= 1 and backends[extra.name]["successes"] >= 1,
+          "/admin/model-router does not show the failover")
+
+
+class _Failing:
+    """Wraps a model so every generation call ends in a 503"""
+
+    def __init__(self, model):
+        self.model = model
+
+    async def generate_content_async(self, prompt, stream=False):
+        if stand_ins.KEYWORD_PROMPT_MARKER in prompt:
+            return await self.model.generate_content_async(prompt, stream=stream)
+        await asyncio.sleep(0.01)
+        raise api_exceptions.ServiceUnavailable("stand-in outage")
+
+
+def run() -> int:
+    random.seed(11)
+    check = Checks()
+
+    asyncio.run(_scenarios(check))
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_PATH = os.path.join(tmp, "model_router.db")
+        database.init_db()
+        _service_generation(check)
+        database.close_all()
+
+    print()
+    return check.report()
+
+
+if __name__ == "__main__":
+    sys.exit(run())
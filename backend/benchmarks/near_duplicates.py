@@ -0,0 +1,187 @@
+"""
+Near-duplicate lookups (MinHash + LSH buckets) as the store grows, and their accuracy.
+
+    cd backend && python -m benchmarks.near_duplicates [--max 100000]
+
+Seeds a temporary database through the same path as completed generations
+(_store_fingerprint), with synthetic shingle sets: most sites are unrelated
+pages sharing common boilerplate, the rest come in families of near-identical
+variants. At each size it times get_near_duplicates and counts the LSH
+candidates it compares, then checks precision/recall against a brute-force
+scan of every stored signature. Finally it fingerprints real HTML: runs that
+differ only in scripts, image URLs and prices must come out as duplicates,
+different products must not. Exits non-zero if a check fails, the p95 at the
+largest size is over LATENCY_BUDGET_MS, or latency grows more than MAX_GROWTH x
+across the sizes.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import database
+import minhash
+from benchmarks.checks import Checks
+
+SIZES = [10_000, 100_000]
+QUERIES = 200
+LATENCY_BUDGET_MS = 20.0
+MAX_GROWTH = 3.0
+MIN_RECALL = 0.95
+MIN_PRECISION = 0.99
+
+SHINGLES = 400
+# Boilerplate every generated page shares (nav, footer, grid markup)
+BOILERPLATE = 80
+FAMILY_SIZE = 5
+# Share of sites that belong to a near-duplicate family
+FAMILY_SHARE = 0.2
+# Chance that a new group of sites is a family, so that FAMILY_SHARE of all sites are in one
+_FAMILY_ODDS = FAMILY_SHARE / (FAMILY_SIZE * (1 - FAMILY_SHARE) + FAMILY_SHARE)
+
+
+def _sites(start: int, count: int, rng: np.random.Generator, boilerplate: np.ndarray):
+    """(site_id, shingle hashes); families of FAMILY_SIZE variants with ~3-8% of shingles replaced"""
+    i = start
+    while i < start + count:
+        base = np.concatenate([boilerplate, rng.integers(0, 1 << 32, SHINGLES - BOILERPLATE, dtype=np.uint64)])
+        members = FAMILY_SIZE if rng.random() < _FAMILY_ODDS else 1
+        for _ in range(min(members, start + count - i)):
+            hashes = base.copy()
+            if members > 1:
+                changed = rng.choice(np.arange(BOILERPLATE, SHINGLES), int(SHINGLES * rng.uniform(0.03, 0.08)), replace=False)
+                hashes[changed] = rng.integers(0, 1 << 32, len(changed), dtype=np.uint64)
+            yield f"site-{i}", np.unique(hashes)
+            i += 1
+
+
+def _grow(current: int, target: int, rng: np.random.Generator, boilerplate: np.ndarray, signatures: dict):
+    with database.transaction() as conn:
+        for site_id, hashes in _sites(current, target - current, rng, boilerplate):
+            signature = minhash.signature(hashes)
+            signatures[site_id] = signature
+            conn.execute("INSERT INTO sites (id, status, created_at) VALUES (?, 'completed', ?)", (site_id, f"{len(signatures):09d}"))
+            database._store_fingerprint(conn, site_id, signature)
+
+
+def _candidates(site_id: str) -> int:
+    signature = minhash.from_blob(database._fetchone("SELECT signature FROM site_fingerprints WHERE site_id = ?", (site_id,))[0])
+    buckets = minhash.band_buckets(signature)
+    return database._fetchone(
+        f"SELECT COUNT(DISTINCT site_id) FROM site_lsh_buckets WHERE bucket IN ({', '.join('?' for _ in buckets)})",
+        buckets,
+    )[0] - 1
+
+
+def _p(samples, q: int) -> float:
+    return statistics.quantiles(samples, n=100)[q - 1]
+
+
+def _real_html_checks(check):
+    def page(product: str, run: int, tagline: str = "자연에서 온") -> str:
+        cards = "".join(
+            f'<article class="card shadow"><img src="https://images.unsplash.com/photo-{run}-{n}?w=800" alt="{product} {n}">'
+            f'<h3>{product} 컬렉션 {n}</h3><p class="price">₩{(run + 1) * 1000 + n * 500:,}</p>'
+            f'<p>{product}의 부드러운 사용감과 오래가는 품질을 경험해 보세요. 매일 쓰기 좋은 제품입니다.</p></article>'
+            for n in range(8)
+        )
+        return (
+            f"<!DOCTYPE html><html><head><style>.card{{padding:{run}px}}</style>"
+            f"<script>window.seed = {run}; console.log('{run}')</script></head>"
+            f"<body><header class='hero'><h1>{product} 스토어</h1><p>{tagline} {product}</p></header>"
+            f"<main class='grid grid-cols-3'>{cards}</main><footer>고객센터 1588-{run:04d}</footer></body></html>"
+        )
+
+    soap = minhash.fingerprint(page("수제 비누", 1))
+    rerun = minhash.fingerprint(page("수제 비누", 2))
+    edited = minhash.fingerprint(page("수제 비누", 3, tagline="제주에서 온"))
+    candle = minhash.fingerprint(page("향초 캔들", 1))
+    print(f"\nreal HTML: re-run {minhash.similarity(soap, rerun):.2f}, edited hero "
+          f"{minhash.similarity(soap, edited):.2f}, other product {minhash.similarity(soap, candle):.2f}")
+    check(minhash.similarity(soap, rerun) >= minhash.NEAR_DUPLICATE_THRESHOLD, "re-run with new images/prices not a duplicate")
+    check(minhash.NEAR_DUPLICATE_THRESHOLD <= minhash.similarity(soap, edited) < 1.0, "page with an edited hero not a near-duplicate")
+    check(minhash.similarity(soap, candle) < minhash.NEAR_DUPLICATE_THRESHOLD, "different product counted as a duplicate")
+    check(minhash.fingerprint("<script>render()</script>") is None, "script-only page got a fingerprint")
+    check(set(minhash.band_buckets(soap)) & set(minhash.band_buckets(rerun)), "re-run shares no LSH bucket")
+
+
+def run(max_size: int = SIZES[-1]) -> int:
+    check = Checks()
+
+    sizes = [size for size in SIZES if size <= max_size]
+    rng = np.random.default_rng(5)
+    boilerplate = rng.integers(0, 1 << 32, BOILERPLATE, dtype=np.uint64)
+    pick = random.Random(5)
+    signatures: dict = {}
+    latency = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_PATH = os.path.join(tmp, "near_duplicates.db")
+        database.init_db()
+        current = 0
+        print(f"{'sites':>8} {'seed':>7} {'candidates':>11} {'p50':>8} {'p95':>8} {'precision':>10} {'recall':>7}")
+        for size in sizes:
+            start = time.perf_counter()
+            _grow(current, size, rng, boilerplate, signatures)
+            current = size
+            seeded = time.perf_counter() - start
+
+            ids = list(signatures)
+            matrix = np.stack([signatures[site_id] for site_id in ids])
+            queries = pick.sample(ids, QUERIES)
+            samples, candidates, found_total, true_total, correct = [], [], 0, 0, 0
+            for site_id in queries:
+                t = time.perf_counter()
+                found = database.get_near_duplicates(site_id, minhash.NEAR_DUPLICATE_THRESHOLD, 100)
+                samples.append((time.perf_counter() - t) * 1000)
+                candidates.append(_candidates(site_id))
+                # Brute force: compare against every stored signature
+                agreement = (matrix == signatures[site_id]).mean(axis=1)
+                truth = {ids[j] for j in np.flatnonzero(agreement >= minhash.NEAR_DUPLICATE_THRESHOLD)} - {site_id}
+                found_ids = {item["id"] for item in found}
+                found_total += len(found_ids)
+                true_total += len(truth)
+                correct += len(found_ids & truth)
+            precision = correct / found_total if found_total else 1.0
+            recall = correct / true_total if true_total else 1.0
+            latency[size] = _p(samples, 95)
+            print(f"{size:>8,} {seeded:>6.1f}s {statistics.mean(candidates):>11.1f} {_p(samples, 50):>6.2f}ms "
+                  f"{_p(samples, 95):>6.2f}ms {precision:>10.3f} {recall:>7.3f}")
+            check(precision >= MIN_PRECISION, f"{size:,} sites: precision {precision:.3f} below {MIN_PRECISION}")
+            check(recall >= MIN_RECALL, f"{size:,} sites: recall {recall:.3f} below {MIN_RECALL}")
+            check(statistics.mean(candidates) < 50, f"{size:,} sites: {statistics.mean(candidates):.0f} candidates per query")
+
+        largest, smallest = sizes[-1], sizes[0]
+        check(latency[largest] <= LATENCY_BUDGET_MS, f"p95 {latency[largest]:.1f}ms at {largest:,} sites over {LATENCY_BUDGET_MS}ms")
+        # Absolute floor so sub-millisecond noise at the small size doesn't count as growth
+        check(latency[largest] <= MAX_GROWTH * max(latency[smallest], 1.0),
+              f"p95 grew from {latency[smallest]:.2f}ms to {latency[largest]:.2f}ms")
+
+        # Collapsed gallery: one entry per family
+        start = time.perf_counter()
+        items, cursor = database.get_gallery_page(24, collapse_duplicates=True)
+        page_ms = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        clusters = database.count_completed_sites(collapse_duplicates=True)
+        count_ms = (time.perf_counter() - start) * 1000
+        print(f"\ncollapsed gallery: {clusters:,} clusters for {len(signatures):,} sites "
+              f"(page {page_ms:.2f}ms, total {count_ms:.0f}ms)")
+        check(page_ms <= LATENCY_BUDGET_MS, f"collapsed gallery page took {page_ms:.1f}ms")
+        check(clusters < len(signatures), "no clusters collapsed")
+        check(all(item["duplicates"] >= 0 for item in items), "collapsed page without duplicate counts")
+        database.close_all()
+
+    _real_html_checks(check)
+
+    print()
+    return check.report()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--max", type=int, default=SIZES[-1], help="largest store size to build")
+    sys.exit(run(parser.parse_args().max))
@@ -0,0 +1,139 @@
+"""
+Palette similarity queries over a large store, and index load time.
+
+    cd backend && python -m benchmarks.palette_index [--sites 100000]
+
+Seeds a temporary database with completed sites carrying random 3-6 color
+palettes, then:
+- checks the vectorized ranking against a direct per-site ΔE computation
+- times search() and similar_to() at the full size (p50/p95)
+- compares building the index from the database with reloading it from the
+  .npz cache, and checks that a reload reconciles sites added or deleted
+  while the index was not running
+Exits non-zero if a check fails or the p95 is over LATENCY_BUDGET_MS.
+"""
+import argparse
+import json
+import math
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import database
+from benchmarks.checks import Checks
+from services.palette_index import PaletteIndex, hex_to_lab, index_path, parse_palette
+
+LATENCY_BUDGET_MS = 50.0
+RUNS = 50
+
+
+def _palette(rng: random.Random) -> list:
+    # Clustered around a base hue, as generated palettes usually are
+    base = [rng.randrange(256) for _ in range(3)]
+    colors = [f"#{''.join(f'{max(0, min(255, c + rng.randint(-60, 60))):02x}' for c in base)}"
+              for _ in range(rng.randint(2, 4))]
+    return colors + ["#ffffff", "#222222"][:rng.randint(0, 2)]
+
+
+def _seed(count: int, rng: random.Random, start: int = 0):
+    base = datetime(2024, 1, 1)
+    with database.transaction() as conn:
+        conn.executemany('''
+            INSERT INTO sites (id, product_type, design_style, status, created_at, meta_data)
+            VALUES (?, ?, 'modern', 'completed', ?, ?)
+        ''', (
+            (f"site-{i}", f"product {i}", base + timedelta(minutes=i),
+             json.dumps({"color_palette": _palette(rng) if i % 50 else []}))
+            for i in range(start, start + count)
+        ))
+
+
+def _reference_distance(a: list, b: list) -> float:
+    lab_a, lab_b = hex_to_lab(a).tolist(), hex_to_lab(b).tolist()
+    a_to_b = sum(min(math.dist(p, q) for q in lab_b) for p in lab_a) / len(lab_a)
+    b_to_a = sum(min(math.dist(p, q) for q in lab_a) for p in lab_b) / len(lab_b)
+    return (a_to_b + b_to_a) / 2
+
+
+def _timed(fn) -> tuple:
+    samples, result = [], None
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        result = fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return result, statistics.median(samples), statistics.quantiles(samples, n=100)[94]
+
+
+def run(sites: int) -> int:
+    check = Checks()
+
+    rng = random.Random(11)
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_PATH = os.path.join(tmp, "palettes.db")
+        database.init_db()
+        _seed(sites, rng)
+
+        index = PaletteIndex()
+        start = time.perf_counter()
+        index.load()
+        build_seconds = time.perf_counter() - start
+        index.save()
+        print(f"{len(index):,} palettes indexed from the database in {build_seconds:.2f}s "
+              f"({index.snapshot()['memory_bytes'] / 1e6:.1f} MB in memory, "
+              f"{os.path.getsize(index_path()) / 1e6:.1f} MB on disk)")
+        check(len(index) == sites - (sites + 49) // 50, "sites with palettes missing from the index")
+
+        # Ranking matches a direct computation on a sample of the store
+        palettes = database.get_site_palettes([f"site-{i}" for i in range(0, min(sites, 2000))])
+        query = ["#1e3a5f", "#f4a261", "#ffffff"]
+        expected = sorted(((_reference_distance(query, parse_palette(p)), site_id)
+                           for site_id, p in palettes.items() if parse_palette(p)))[:10]
+        sample = PaletteIndex()
+        for site_id, palette in palettes.items():
+            sample.add(site_id, palette)
+        got = sample.search(query, 10)
+        check([site_id for site_id, _ in got] == [site_id for _, site_id in expected], "ranking differs from reference")
+        check(all(abs(d - round(e, 2)) < 0.02 for (_, d), (e, _) in zip(got, expected)), "distances differ from reference")
+
+        print(f"\n{'query':<34} {'p50':>8} {'p95':>8}")
+        for label, fn in [
+            ("search, 1 color", lambda: index.search("#ff6b6b", 12)),
+            ("search, 3 colors", lambda: index.search(query, 12)),
+            ("search, 6 colors", lambda: index.search("#264653,#2a9d8f,#e9c46a,#f4a261,#e76f51,#fff", 12)),
+            ("similar_to(site-7)", lambda: index.similar_to("site-7", 12)),
+            ("search, limit 100", lambda: index.search(query, 100)),
+        ]:
+            result, p50, p95 = _timed(fn)
+            print(f"{label:<34} {p50:>6.2f}ms {p95:>6.2f}ms")
+            check(p95 <= LATENCY_BUDGET_MS, f"{label}: p95 {p95:.1f}ms over {LATENCY_BUDGET_MS}ms")
+        similar = index.similar_to("site-7", 5)
+        check(similar and all(site_id != "site-7" for site_id, _ in similar), "similar_to returned the site itself")
+        check(index.search(parse_palette(palettes["site-7"]), 1)[0] == ("site-7", 0.0), "exact palette is not the best match")
+
+        # Startup: reload the cache file, picking up changes made while the index was down
+        _seed(100, rng, start=sites)
+        database.delete_site("site-7")
+        reloaded = PaletteIndex()
+        start = time.perf_counter()
+        reloaded.load()
+        load_seconds = time.perf_counter() - start
+        print(f"\nreload from {os.path.basename(index_path())} + reconcile: {load_seconds:.2f}s "
+              f"(vs {build_seconds:.2f}s from the database)")
+        check(reloaded.stats["loaded_from_file"], "cache file was not used")
+        check(len(reloaded) == len(index) + 98 - 1, "reload did not reconcile added/deleted sites")
+        check(reloaded.similar_to("site-7", 1) is None, "deleted site still indexed")
+        check(reloaded.search(query, 5) == [m for m in index.search(query, 6) if m[0] != "site-7"][:5],
+              "reloaded index ranks differently")
+        database.close_all()
+
+    return check.report()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sites", type=int, default=100_000)
+    sys.exit(run(parser.parse_args().sites))
@@ -0,0 +1,80 @@
+"""
+Event-loop blocking of GeminiService: GEMINI_PIPELINE=sync vs. async.
+
+    cd backend && GEMINI_API_KEY=dummy python -m benchmarks.pipeline_blocking
+
+The model is replaced by a stand-in that takes MODEL_LATENCY seconds per call
+(time.sleep for the blocking SDK call, asyncio.sleep for the async one), so no
+quota is spent. CONCURRENCY generations run at once next to a heartbeat task;
+the report shows total wall time and the longest heartbeat gap.
+"""
+import asyncio
+import os
+import time
+
+# Don't let the shared rate limiter dominate what is being measured here
+os.environ.setdefault("GEMINI_RPM", "6000")
+
+from services.gemini_service import gemini_service
+
+MODEL_LATENCY = 0.5
+CONCURRENCY = 4
+RESPONSE = '<!DOCTYPE html><html><body>ok</body></html>\n<<<METADATA_SEPARATOR>>>\n{"explanation": "", "key_points": [], "color_palette": []}'
+
+
+class _Response:
+    text = RESPONSE
+
+
+class StandInModel:
+    """Returns RESPONSE after MODEL_LATENCY; with stream=True as a single chunk"""
+
+    def generate_content(self, prompt, stream=False):
+        time.sleep(MODEL_LATENCY)
+        return [_Response()] if stream else _Response()
+
+    async def generate_content_async(self, prompt, stream=False):
+        await asyncio.sleep(MODEL_LATENCY)
+        if not stream:
+            return _Response()
+
+        async def chunks():
+            yield _Response()
+        return chunks()
+
+
+async def _run(pipeline: str):
+    gemini_service.pipeline = pipeline
+    gemini_service.model = StandInModel()
+    gemini_service.min_request_interval = 0
+    gaps = []
+    done = asyncio.Event()
+
+    async def heartbeat():
+        last = time.perf_counter()
+        while not done.is_set():
+            await asyncio.sleep(0.01)
+            now = time.perf_counter()
+            gaps.append(now - last)
+            last = now
+
+    async def generations():
+        await asyncio.gather(*[
+            gemini_service.generate_website_content(f"product {i}", "", "minimal", mode="none")
+            for i in range(CONCURRENCY)
+        ])
+        done.set()
+
+    start = time.perf_counter()
+    await asyncio.gather(heartbeat(), generations())
+    return time.perf_counter() - start, max(gaps)
+
+
+def main():
+    for pipeline in ("sync", "async"):
+        wall, stall = asyncio.run(_run(pipeline))
+        print(f"{pipeline:<6} {CONCURRENCY} generations: wall {wall:.2f}s, max event-loop stall {stall * 1000:.0f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Prompt budgeting: does every prompt fit PROMPT_TOKEN_BUDGET, and is the right part of the reference kept.
+
+    cd backend && GEMINI_API_KEY=dummy python -m benchmarks.prompt_budget
+
+Builds reference pages from PAGE_SECTIONS sizes (a <head> with a large
+stylesheet and an inline script, then header/nav/hero and many deep product
+sections) and runs them through fit_reference and the full prompt builder in
+raw and smart mode. Checks:
+- every fitted reference and every whole prompt is within its token budget, and
+  prompt size no longer grows with the reference page
+- what is kept is the head (first CSS rules before any inline script body), then
+  the top of the body (header, nav, hero); the deepest sections are what is cut
+- fitted HTML leaves no element open, and the cut is marked
+- a page that fits is passed through untouched
+- the estimator's scale converges on API-reported counts
+- fitting a REFERENCE_RAW_MAX_CHARS page takes under MAX_FIT_MS
+Exits non-zero if a check fails.
+"""
+import os
+import statistics
+import sys
+import time
+
+os.environ.setdefault("GEMINI_API_KEY", "benchmark")
+
+from benchmarks.checks import Checks
+from services.gemini_service import REFERENCE_RAW_MAX_CHARS, gemini_service
+from services.prompt_budget import (
+    PROMPT_TOKEN_BUDGET,
+    TokenEstimator,
+    _closing_tags,
+    count_tokens,
+    fit_reference,
+)
+
+PAGE_SECTIONS = [5, 40, 200, 1200]
+BUDGETS = [1000, 4000, 12000]
+MAX_FIT_MS = 250.0
+
+
+def _page(sections: int) -> str:
+    css = "".join(f".rule-{i} {{ margin: {i % 40}px auto; color: #{i * 2654435761 % (1 << 24):06x}; }}\n" for i in range(1500))
+    script = "window.__STATE__ = " + repr([{"id": i, "name": f"item {i}"} for i in range(800)]) + ";"
+    body = "".join(
+        f'<section class="product-section depth-{i}"><div class="row"><div class="col"><h2>Section {i}</h2>'
+        f'<p>상품 설명 {i} lorem ipsum dolor sit amet</p><img src="https://example.com/{i}.jpg" alt="p{i}"><br>'
+        f'<a class="btn" href="/p/{i}">구매하기</a></div></div></section>\n' for i in range(sections)
+    )
+    return (
+        "<!DOCTYPE html><html lang='ko'><head><meta charset='utf-8'><title>Shop</title>"
+        "<link rel='stylesheet' href='https://fonts.googleapis.com/css2?family=Noto+Sans+KR'>"
+        f"<script>{script}</script><style>:root {{ --brand: #ff5a5f; }}\n{css}</style></head>"
+        "<body><header class='site-header'><nav class='gnb'><a href='/'>HOME</a></nav></header>"
+        "<main><div class='hero hero-main'><h1>Premium Shop</h1></div>"
+        f"{body}<div class='last-section'>END OF PAGE</div></main></body></html>"
+    )
+
+
+def run() -> int:
+    check = Checks()
+
+    small = "<html><head><style>body{margin:0}</style></head><body><h1>hi</h1></body></html>"
+    check(fit_reference(small, 1000)[0] == small, "a page within budget was changed")
+
+    print(f"{'sections':>8} {'page tokens':>12} {'budget':>7} {'kept':>6} {'dropped':>8} {'fit ms':>7}")
+    for sections in PAGE_SECTIONS:
+        page = _page(sections)
+        page_tokens = count_tokens(page)
+        for budget in BUDGETS:
+            start = time.perf_counter()
+            fitted, kept, dropped = fit_reference(page, budget)
+            elapsed = (time.perf_counter() - start) * 1000
+            print(f"{sections:>8} {page_tokens:>12} {budget:>7} {kept:>6} {dropped:>8} {elapsed:>7.1f}")
+            label = f"{sections} sections / {budget} tokens"
+            check(count_tokens(fitted) <= budget, f"{label}: fitted reference is {count_tokens(fitted)} tokens")
+            if page_tokens <= budget:
+                continue
+            check(":root { --brand: #ff5a5f; }" in fitted and ".rule-0 " in fitted, f"{label}: first CSS rules lost")
+            check("window.__STATE__" not in fitted, f"{label}: inline head script kept while cutting")
+            check("site-header" in fitted and "hero-main" in fitted, f"{label}: top of the body lost")
+            check("END OF PAGE" not in fitted and "lower page content omitted" in fitted, f"{label}: deep content not the part cut")
+            check(_closing_tags(fitted) == "", f"{label}: fitted HTML leaves {_closing_tags(fitted)} open")
+            check(fitted.rstrip().endswith("</html>"), f"{label}: fitted HTML not closed")
+
+    # Whole prompts in both modes stay within the budget whatever the page size
+    sizes = []
+    for sections in PAGE_SECTIONS:
+        page = _page(sections)
+        for mode, reference in (("raw", page[:REFERENCE_RAW_MAX_CHARS]), ("smart", gemini_service._clean_html(page))):
+            start = time.perf_counter()
+            prompt = gemini_service._build_budgeted_prompt("수제 비누", "https://example.com", "미니멀", mode,
+                                                           reference, True, [])
+            elapsed = (time.perf_counter() - start) * 1000
+            tokens = count_tokens(prompt)
+            sizes.append(tokens)
+            check(tokens <= PROMPT_TOKEN_BUDGET, f"{mode} prompt for {sections} sections is {tokens} tokens")
+            check(elapsed <= MAX_FIT_MS, f"{mode} prompt for {sections} sections took {elapsed:.0f}ms to build")
+    print(f"prompt tokens over all pages: min {min(sizes)}, max {max(sizes)}, budget {PROMPT_TOKEN_BUDGET}")
+
+    # Calibration converges on the API's counts
+    estimator = TokenEstimator()
+    samples = [_page(sections) for sections in (3, 10, 30)]
+    for i in range(30):
+        text = samples[i % len(samples)]
+        estimator.observe(text, round(estimator.raw(text) * 1.3))
+    errors = [abs(estimator.count(text) / round(estimator.raw(text) * 1.3) - 1) for text in samples]
+    print(f"calibration: scale {estimator.scale:.3f} after {estimator.observations} observations, "
+          f"max error {max(errors):.2%}")
+    check(statistics.mean(errors) < 0.02, "estimator did not converge on reported token counts")
+
+    print()
+    return check.report()
+
+
+if __name__ == "__main__":
+    sys.exit(run())
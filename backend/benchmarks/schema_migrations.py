@@ -0,0 +1,192 @@
+"""
+Upgrading a large pre-migration store, and what the promoted columns buy.
+
+    cd backend && python -m benchmarks.schema_migrations [--sites 100000]
+
+Builds a temporary database with the original sites schema (everything in
+meta_data), then:
+- runs init_db on it and checks every row was backfilled to match meta_data,
+  and that running it again changes nothing
+- re-runs the migration while another thread keeps writing, and reports how
+  long those writes waited (the backfill commits every SCHEMA_BACKFILL_BATCH rows)
+- compares a generation_mode filtered gallery page and a page of typed fields
+  against the same queries over meta_data JSON
+Exits non-zero if a check fails, a write waited more than MAX_WRITE_STALL_MS or
+the indexed mode filter is not faster than the JSON scan.
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+import database
+from benchmarks.checks import Checks
+
+MAX_WRITE_STALL_MS = 250.0
+RUNS = 30
+
+MODES = ["smart"] * 16 + ["raw"] * 3 + ["none"]
+
+
+def _seed_legacy(path: str, count: int, rng: random.Random):
+    # The schema init_db started from, written with a plain connection
+    conn = database.sqlite3.connect(path)
+    conn.execute('''
+        CREATE TABLE sites (
+            id TEXT PRIMARY KEY, product_type TEXT, design_style TEXT, reference_url TEXT,
+            html_content TEXT, status TEXT DEFAULT 'pending', error_message TEXT,
+            created_at TIMESTAMP, meta_data TEXT
+        )
+    ''')
+    base = datetime(2024, 1, 1)
+
+    def rows():
+        for i in range(count):
+            meta = {
+                "product_type": f"product {i}",
+                "explanation": "레퍼런스의 구조를 반영해 여백을 넓히고 " * 4,
+                "key_points": [f"point {n}" for n in range(rng.randint(2, 5))],
+                "color_palette": [f"#{rng.randrange(1 << 24):06x}" for _ in range(rng.randint(3, 6))],
+            }
+            # Older requests did not send a mode; a few rows are not valid JSON at all
+            if i % 4:
+                meta["generation_mode"] = rng.choice(MODES)
+            meta_data = json.dumps(meta, ensure_ascii=False) if i % 500 else "{broken"
+            status = "completed" if i % 10 else "error"
+            yield (f"site-{i}", f"product {i}", "modern", status, base + timedelta(minutes=i), meta_data)
+
+    conn.executemany('''
+        INSERT INTO sites (id, product_type, design_style, status, created_at, meta_data)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', rows())
+    conn.commit()
+    conn.close()
+
+
+def _expected(meta_data: str) -> tuple:
+    try:
+        meta = json.loads(meta_data)
+    except ValueError:
+        return None, None, None, "smart"
+    return (meta.get("explanation"), meta.get("key_points"), meta.get("color_palette"),
+            meta.get("generation_mode") or "smart")
+
+
+def _timed(fn) -> float:
+    samples = []
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.quantiles(samples, n=100)[94]
+
+
+def run(sites: int) -> int:
+    check = Checks()
+
+    rng = random.Random(3)
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_PATH = os.path.join(tmp, "legacy.db")
+        _seed_legacy(database.DB_PATH, sites, rng)
+
+        start = time.perf_counter()
+        database.init_db()
+        upgrade_seconds = time.perf_counter() - start
+        info = database.schema_info()
+        migration_ms = sum(migration["duration_ms"] for migration in info["migrations"])
+        print(f"{sites:,} legacy sites upgraded to schema {info['version']} in {upgrade_seconds:.1f}s "
+              f"(migrations {migration_ms / 1000:.1f}s, the rest is the search index and blob store)")
+        check(info["version"] == database.SCHEMA_VERSION, "schema version not recorded")
+
+        mismatched = 0
+        for row in database._fetchall(f"SELECT meta_data, {', '.join(database.META_COLUMNS)} FROM sites"):
+            stored = (row["explanation"], *(json.loads(row[c]) if row[c] else None for c in database.JSON_COLUMNS),
+                      row["generation_mode"])
+            mismatched += stored != _expected(row["meta_data"])
+        check(mismatched == 0, f"{mismatched} row(s) backfilled differently from meta_data")
+
+        revisions = database._fetchone("SELECT SUM(revision) FROM sites")[0]
+        database.init_db()
+        check(database._fetchone("SELECT SUM(revision) FROM sites")[0] == revisions, "second init_db touched the rows again")
+
+        # Backfill again with a writer running alongside
+        with database.transaction() as conn:
+            conn.execute("PRAGMA user_version = 0")
+            conn.execute("UPDATE sites SET explanation = NULL, key_points = NULL, color_palette = NULL, generation_mode = NULL")
+        waits, stop = [], threading.Event()
+
+        def writer():
+            i = 0
+            while not stop.is_set():
+                start = time.perf_counter()
+                database.create_pending_site(f"live-{i}", {"product_type": "live", "generation_mode": "raw"})
+                waits.append((time.perf_counter() - start) * 1000)
+                i += 1
+                time.sleep(0.005)
+
+        thread = threading.Thread(target=writer)
+        thread.start()
+        start = time.perf_counter()
+        database._run_migrations()
+        backfill_seconds = time.perf_counter() - start
+        stop.set()
+        thread.join()
+        print(f"backfill with a concurrent writer: {backfill_seconds:.1f}s, {len(waits)} writes, "
+              f"p50 {statistics.median(waits):.1f}ms, max {max(waits):.1f}ms")
+        check(max(waits) <= MAX_WRITE_STALL_MS, f"a write waited {max(waits):.0f}ms during the backfill")
+        check(database._fetchone("SELECT COUNT(*) FROM sites WHERE generation_mode IS NULL")[0] == 0, "rows left unfilled")
+        check(database.get_site("live-0")["generation_mode"] == "raw", "row written during the backfill lost its columns")
+
+        # Same page, indexed column vs JSON
+        json_filter = '''
+            SELECT id, product_type, design_style, reference_url, created_at FROM sites
+            WHERE status = 'completed' AND json_valid(meta_data)
+            AND COALESCE(json_extract(meta_data, '$.generation_mode'), 'smart') = ?
+            ORDER BY created_at DESC, id DESC LIMIT 24
+        '''
+        print(f"\n{'query':<40} {'p95':>9}")
+        for mode in ("raw", "none"):
+            indexed = _timed(lambda: database.get_gallery_page(24, mode=mode))
+            scanned = _timed(lambda: database._fetchall(json_filter, (mode,)))
+            print(f"{f'mode={mode}, generation_mode column':<40} {indexed:>7.2f}ms")
+            print(f"{f'mode={mode}, json_extract(meta_data)':<40} {scanned:>7.2f}ms")
+            items, _ = database.get_gallery_page(24, mode=mode)
+            check([item["id"] for item in items] == [row["id"] for row in database._fetchall(json_filter, (mode,))],
+                  f"mode={mode}: column and JSON filters disagree")
+            check(indexed < scanned, f"mode={mode}: indexed filter not faster than the JSON scan")
+            json_count = f"SELECT COUNT(*) FROM ({json_filter.replace('LIMIT 24', '')})"
+            check(database.count_completed_sites(mode=mode) == database._fetchone(json_count, (mode,))[0],
+                  f"mode={mode}: count differs")
+        indexed = _timed(lambda: database.count_completed_sites(mode="none"))
+        scanned = _timed(lambda: database._fetchone(json_count, ("none",)))
+        print(f"{'total for mode=none, column':<40} {indexed:>7.2f}ms")
+        print(f"{'total for mode=none, json_extract':<40} {scanned:>7.2f}ms")
+        check(indexed < scanned, "indexed count not faster than the JSON scan")
+
+        fields = ["id", "created_at", "key_points", "color_palette"]
+        typed = _timed(lambda: database.get_gallery_page(100, fields=fields))
+        parsed = _timed(lambda: [
+            {**dict(row), **json.loads(row["meta_data"])} for row in database._fetchall(
+                "SELECT id, created_at, meta_data FROM sites WHERE status = 'completed' "
+                "ORDER BY created_at DESC, id DESC LIMIT 100")
+        ])
+        print(f"{'100 rows, typed key_points/color_palette':<40} {typed:>7.2f}ms")
+        print(f"{'100 rows, meta_data parsed whole':<40} {parsed:>7.2f}ms")
+        items, _ = database.get_gallery_page(3, fields=fields)
+        check(all(isinstance(item["color_palette"], list) for item in items), "color_palette not returned as a list")
+        database.close_all()
+
+    print()
+    return check.report()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sites", type=int, default=100_000)
+    sys.exit(run(parser.parse_args().sites))
@@ -0,0 +1,70 @@
+"""
+The backend with its model and outbound HTTP replaced by stand-ins (benchmarks/stand_ins.py).
+
+    cd /path/to/store && PYTHONPATH=/path/to/backend python -m benchmarks.stand_in_server --port 8100
+
+Serves main.app from the sites.db in the working directory (see
+benchmarks/synthetic_store.py), like the real server. --model and --http pick
+stand-in (default), replay (fixtures from --fixtures) or real (spends quota);
+--record DIR writes every model answer and HTTP response that passes through to
+DIR as fixtures. Started by benchmarks/load_test.py.
+"""
+import argparse
+import os
+
+
+def _parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--model", choices=["stand-in", "replay", "real"], default="stand-in")
+    parser.add_argument("--http", choices=["stand-in", "replay", "real"], default="stand-in")
+    parser.add_argument("--fixtures", help="fixture directory for --model/--http replay")
+    parser.add_argument("--record", help="write fixtures of everything the model and HTTP answer to this directory")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay faster (>1) or slower than recorded")
+    parser.add_argument("--model-latency", type=float, default=1.0, help="seconds per generation")
+    parser.add_argument("--model-chunks", type=int, default=8, help="streamed chunks per generation")
+    parser.add_argument("--model-error-rate", type=float, default=0.0)
+    parser.add_argument("--reference-latency", type=float, default=0.3)
+    parser.add_argument("--unsplash-latency", type=float, default=0.2)
+    parser.add_argument("--http-error-rate", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.2, help="latencies vary by +/- this fraction")
+    return parser
+
+
+def main():
+    args = _parser().parse_args()
+    if args.model != "real":
+        os.environ.setdefault("GEMINI_API_KEY", "stand-in")
+
+    import httpx
+    import uvicorn
+
+    import main as backend
+    from benchmarks import stand_ins
+    from services.gemini_service import gemini_service
+
+    if args.model == "stand-in":
+        model = stand_ins.StandInModel(args.model_latency, args.model_chunks, error_rate=args.model_error_rate, jitter=args.jitter)
+    elif args.model == "replay":
+        model = stand_ins.ReplayModel(args.fixtures, args.speed)
+    else:
+        model = gemini_service.model
+
+    if args.http == "stand-in":
+        transport = stand_ins.stand_in_transport(args.reference_latency, args.unsplash_latency, args.http_error_rate, args.jitter)
+    elif args.http == "replay":
+        transport = stand_ins.ReplayTransport(args.fixtures, args.speed)
+    else:
+        transport = httpx.AsyncHTTPTransport(limits=httpx.Limits(max_connections=20, max_keepalive_connections=10))
+
+    if args.record:
+        model = stand_ins.RecordingModel(model, args.record)
+        transport = stand_ins.RecordingTransport(transport, args.record)
+    stand_ins.install(gemini_service, model, transport, unsplash=args.http != "real")
+
+    uvicorn.run(backend.app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
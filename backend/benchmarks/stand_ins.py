@@ -0,0 +1,411 @@
+"""
+Offline stand-ins for the Gemini model and the HTTP endpoints GeminiService calls
+(reference pages, Unsplash), plus record/replay of real responses as fixtures.
+
+- StandInModel: answers generation prompts with a page streamed in chunks over
+  a configurable latency, keyword prompts with a JSON array; can fail a share
+  of calls. Reports usage_metadata like the SDK.
+- stand_in_transport(...): httpx transport serving reference pages, Unsplash
+  photos/random and image URLs after a configurable latency and error rate.
+- RecordingModel / RecordingTransport wrap a model or transport (real or not)
+  and write every exchange to a fixtures directory as JSON.
+- ReplayModel / ReplayTransport serve those fixtures back with the recorded
+  timing (scaled by `speed`): the exact prompt/URL when it was recorded, else
+  one recorded for the same kind of request.
+- install(service, model, transport) points a GeminiService at them.
+
+Record real traffic once (spends quota) with
+    python -m benchmarks.stand_in_server --model real --http real --record fixtures/
+and replay it with --model replay --http replay --fixtures fixtures/.
+"""
+import asyncio
+import glob
+import hashlib
+import itertools
+import json
+import os
+import random
+import re
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+from services.gemini_service import METADATA_SEPARATOR
+
+KEYWORD_PROMPT_MARKER = "stock photo search"
+# Headers kept in HTTP fixtures (cache validators matter to the reference cache)
+RECORDED_HEADERS = ("content-type", "etag", "last-modified", "cache-control")
+
+STAND_IN_PAGE = (
+    "<!DOCTYPE html><html lang='ko'><head><meta charset='utf-8'><script src='https://cdn.tailwindcss.com'></script>"
+    "<style>.card{transition:transform .3s}.card:hover{transform:translateY(-4px)}</style></head><body>"
+    "<header class='hero'><h1>{product} 스토어</h1></header><main class='grid grid-cols-3 gap-6'>"
+    + "".join(f"<article class='card'><img src='https://images.unsplash.com/photo-{n}?w=1200' alt='상품 {n}'>"
+              f"<h3>{{product}} {n}</h3><p class='price'>₩{12000 + n * 500:,}</p>"
+              f"<p>{'부드러운 사용감과 오래가는 품질을 경험해 보세요. ' * 3}</p></article>" for n in range(24))
+    + "</main><footer>고객센터 1588-0000</footer></body></html>"
+)
+STAND_IN_METADATA = json.dumps({
+    "explanation": "레퍼런스의 넓은 여백과 카드형 그리드를 반영했습니다.",
+    "key_points": ["반응형 그리드", "고정 헤더", "장바구니 버튼 강조"],
+    "color_palette": ["#1f2937", "#f9fafb", "#d97706"],
+}, ensure_ascii=False)
+STAND_IN_REFERENCE = (
+    "<!DOCTYPE html><html><head><style>body{margin:0}.hero{padding:4rem}</style></head><body>"
+    + "".join(f'<section class="hero grid"><h2>Section {i}</h2><p>{"text " * 80}</p>'
+              f'<svg><path d="{"M0 0 L10 10 " * 40}"/></svg></section>' for i in range(40))
+    + "</body></html>"
+)
+
+
+def _sha(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _jittered(seconds: float, jitter: float) -> float:
+    return max(0.0, seconds * random.uniform(1 - jitter, 1 + jitter))
+
+
+class StandInError(RuntimeError):
+    pass
+
+
+class _Chunk:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class _Usage:
+    def __init__(self, prompt_tokens: int, response_tokens: int):
+        self.prompt_token_count = prompt_tokens
+        self.candidates_token_count = response_tokens
+
+
+class _Response:
+    """Non-streamed response"""
+
+    def __init__(self, text: str, usage: Optional[_Usage] = None):
+        self.text = text
+        self.usage_metadata = usage
+
+
+class _Stream:
+    """Streamed response: (delay before chunk, text) pairs; usage like the SDK once consumed"""
+
+    def __init__(self, chunks: List[Tuple[float, str]], usage: Optional[_Usage] = None):
+        self.chunks = chunks
+        self.usage_metadata = usage
+
+    @property
+    def text(self) -> str:
+        return "".join(text for _, text in self.chunks)
+
+    async def __aiter__(self):
+        for delay, text in self.chunks:
+            if delay:
+                await asyncio.sleep(delay)
+            yield _Chunk(text)
+
+    def __iter__(self):
+        for delay, text in self.chunks:
+            if delay:
+                time.sleep(delay)
+            yield _Chunk(text)
+
+
+class StandInModel:
+    """
+    Stand-in for genai.GenerativeModel. A generation takes `latency` seconds (x
+    1 +/- jitter): the first chunk after `first_chunk` of it, the rest spread over
+    `chunks` chunks. `error_rate` of generation calls raise StandInError after a
+    third of the latency. `fail(prompt, call_number)` can force failures.
+    """
+
+    def __init__(self, latency: float = 1.0, chunks: int = 8, first_chunk: float = 0.3,
+                 error_rate: float = 0.0, jitter: float = 0.2, keyword_latency: float = 0.3, fail=None):
+        self.latency = latency
+        self.chunks = max(1, chunks)
+        self.first_chunk = first_chunk
+        self.error_rate = error_rate
+        self.jitter = jitter
+        self.keyword_latency = keyword_latency
+        self.fail = fail
+        self.calls: Dict[str, int] = {}
+
+    def _answer(self, prompt: str, stream: bool):
+        if KEYWORD_PROMPT_MARKER in prompt:
+            count = len(re.findall(r"^\s*\d+\. ", prompt, re.MULTILINE))
+            return _jittered(self.keyword_latency, self.jitter), _Response(json.dumps(["handmade soap bar"] * count))
+
+        key = _sha(prompt)
+        self.calls[key] = self.calls.get(key, 0) + 1
+        latency = _jittered(self.latency, self.jitter)
+        if random.random() < self.error_rate or (self.fail is not None and self.fail(prompt, self.calls[key])):
+            return latency / 3, StandInError("stand-in model failure")
+
+        product = re.search(r'"([^"\n]{1,80})"', prompt)
+        text = (STAND_IN_PAGE.replace("{product}", product.group(1) if product else "상품")
+                + f"\n{METADATA_SEPARATOR}\n{STAND_IN_METADATA}")
+        usage = _Usage(max(1, len(prompt) // 3), max(1, len(text) // 3))
+        if not stream:
+            return latency, _Response(text, usage)
+        size = -(-len(text) // self.chunks)
+        pieces = [text[i:i + size] for i in range(0, len(text), size)]
+        if len(pieces) == 1:
+            return latency, _Stream([(0.0, text)], usage)
+        rest = latency * (1 - self.first_chunk) / (len(pieces) - 1)
+        return latency * self.first_chunk, _Stream([(0.0 if i == 0 else rest, piece) for i, piece in enumerate(pieces)], usage)
+
+    async def generate_content_async(self, prompt, stream: bool = False):
+        delay, answer = self._answer(prompt, stream)
+        await asyncio.sleep(delay)
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+    def generate_content(self, prompt, stream: bool = False):
+        delay, answer = self._answer(prompt, stream)
+        time.sleep(delay)
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+
+def stand_in_transport(reference_latency: float = 0.3, unsplash_latency: float = 0.2, error_rate: float = 0.0,
+                       jitter: float = 0.2) -> httpx.AsyncBaseTransport:
+    """Reference pages (any host), Unsplash photos/random, and 200s for image URLs"""
+    photo_ids = itertools.count()
+
+    async def handle(request: httpx.Request) -> httpx.Response:
+        if request.url.host == "images.unsplash.com":
+            return httpx.Response(200, headers={"content-type": "image/jpeg"})
+        unsplash = request.url.host == "api.unsplash.com"
+        await asyncio.sleep(_jittered(unsplash_latency if unsplash else reference_latency, jitter))
+        if random.random() < error_rate:
+            return httpx.Response(503, text="stand-in error")
+        if unsplash:
+            count = int(request.url.params.get("count", "1"))
+            photos = []
+            for _ in range(count):
+                n = next(photo_ids)
+                photos.append({"id": f"stand-in-{n}", "urls": {"raw": f"https://images.unsplash.com/photo-stand-in-{n:08d}?ixid=M3w1MjM0NTZ8MHwxfHJhbmRvbXx8fHx8fHx8fDE3MDA"}})
+            return httpx.Response(200, json=photos)
+        return httpx.Response(200, text=STAND_IN_REFERENCE, headers={"content-type": "text/html; charset=utf-8"})
+
+    return httpx.MockTransport(handle)
+
+
+# -- record / replay -------------------------------------------------------------
+
+def _write_fixture(directory: str, name: str, fixture: Dict[str, Any]):
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, name)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(fixture, f, ensure_ascii=False)
+    os.replace(path + ".tmp", path)
+
+
+def _load_fixtures(directory: str, prefix: str) -> List[Dict[str, Any]]:
+    fixtures = []
+    for path in sorted(glob.glob(os.path.join(directory, f"{prefix}-*.json"))):
+        with open(path, encoding="utf-8") as f:
+            fixtures.append(json.load(f))
+    return fixtures
+
+
+def _usage_dict(usage) -> Optional[Dict[str, int]]:
+    if usage is None:
+        return None
+    return {"prompt_token_count": getattr(usage, "prompt_token_count", 0) or 0,
+            "candidates_token_count": getattr(usage, "candidates_token_count", 0) or 0}
+
+
+class RecordingModel:
+    """
+    Passes calls to `model` and writes each answer (chunks with their timing) to
+    model-<hash>.json. A streamed answer reaches the caller once it has finished.
+    """
+
+    def __init__(self, model, directory: str):
+        self.model = model
+        self.directory = directory
+
+    def _save(self, prompt: str, stream: bool, chunks: List[Tuple[float, str]], usage, error: Optional[str] = None):
+        key = _sha(prompt)
+        _write_fixture(self.directory, f"model-{key[:24]}.json", {
+            "prompt_sha256": key,
+            "kind": "keywords" if KEYWORD_PROMPT_MARKER in prompt else "generation",
+            "stream": stream,
+            "prompt_chars": len(prompt),
+            "chunks": chunks,
+            "usage": _usage_dict(usage),
+            "error": error,
+        })
+
+    async def generate_content_async(self, prompt, stream: bool = False):
+        start = time.perf_counter()
+        try:
+            response = await self.model.generate_content_async(prompt, stream=stream)
+            if not stream:
+                self._save(prompt, False, [(time.perf_counter() - start, response.text)], getattr(response, "usage_metadata", None))
+                return response
+            chunks, last = [], start
+            async for chunk in response:
+                now = time.perf_counter()
+                try:
+                    text = chunk.text
+                except Exception:
+                    text = ""
+                chunks.append((now - last, text))
+                last = now
+        except Exception as e:
+            self._save(prompt, stream, [(time.perf_counter() - start, "")], None, f"{type(e).__name__}: {e}")
+            raise
+        usage = getattr(response, "usage_metadata", None)
+        self._save(prompt, True, chunks, usage)
+        return _Stream([(0.0, text) for _, text in chunks], usage)
+
+    def generate_content(self, prompt, stream: bool = False):
+        start = time.perf_counter()
+        response = self.model.generate_content(prompt, stream=stream)
+        if stream:
+            response = _Stream([(0.0, chunk.text) for chunk in response], getattr(response, "usage_metadata", None))
+        self._save(prompt, stream, [(time.perf_counter() - start, response.text)], getattr(response, "usage_metadata", None))
+        return response
+
+
+class ReplayModel:
+    """Serves model-*.json fixtures with their recorded timing divided by `speed`"""
+
+    def __init__(self, directory: str, speed: float = 1.0):
+        fixtures = _load_fixtures(directory, "model")
+        if not fixtures:
+            raise FileNotFoundError(f"no model fixtures in {directory}")
+        self.speed = speed
+        self.by_prompt = {fixture["prompt_sha256"]: fixture for fixture in fixtures}
+        self.by_kind = {kind: itertools.cycle([f for f in fixtures if f["kind"] == kind]) for kind in ("keywords", "generation")
+                        if any(f["kind"] == kind for f in fixtures)}
+        self.exact = 0
+        self.substituted = 0
+
+    def _fixture(self, prompt: str) -> Dict[str, Any]:
+        fixture = self.by_prompt.get(_sha(prompt))
+        if fixture is not None:
+            self.exact += 1
+            return fixture
+        self.substituted += 1
+        kind = "keywords" if KEYWORD_PROMPT_MARKER in prompt else "generation"
+        pool = self.by_kind.get(kind) or next(iter(self.by_kind.values()))
+        return next(pool)
+
+    def _answer(self, prompt: str, stream: bool):
+        fixture = self._fixture(prompt)
+        chunks = [(delay / self.speed, text) for delay, text in fixture["chunks"]]
+        usage = _Usage(*fixture["usage"].values()) if fixture.get("usage") else None
+        if fixture.get("error"):
+            return sum(delay for delay, _ in chunks), StandInError(f"replayed: {fixture['error']}")
+        if stream:
+            first, rest = chunks[0][0], [(0.0, chunks[0][1])] + chunks[1:]
+            return first, _Stream(rest, usage)
+        return sum(delay for delay, _ in chunks), _Response("".join(text for _, text in chunks), usage)
+
+    async def generate_content_async(self, prompt, stream: bool = False):
+        delay, answer = self._answer(prompt, stream)
+        await asyncio.sleep(delay)
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+    def generate_content(self, prompt, stream: bool = False):
+        delay, answer = self._answer(prompt, stream)
+        time.sleep(delay)
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+
+def _request_key(request: httpx.Request) -> str:
+    # Unsplash's client id travels in a header, so URLs are safe to store
+    return _sha(f"{request.method} {request.url}")
+
+
+class RecordingTransport(httpx.AsyncBaseTransport):
+    """Passes requests to `transport` and writes each response to http-<hash>.json"""
+
+    def __init__(self, transport: httpx.AsyncBaseTransport, directory: str):
+        self.transport = transport
+        self.directory = directory
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        start = time.perf_counter()
+        response = await self.transport.handle_async_request(request)
+        body = await response.aread()
+        elapsed = time.perf_counter() - start
+        if not (response.headers.get("content-type") or "").startswith("image/"):
+            _write_fixture(self.directory, f"http-{_request_key(request)[:24]}.json", {
+                "method": request.method,
+                "url": str(request.url),
+                "host_path": f"{request.url.host}{request.url.path}",
+                "status": response.status_code,
+                "headers": {name: response.headers[name] for name in RECORDED_HEADERS if name in response.headers},
+                "body": body.decode("utf-8", errors="replace"),
+                "elapsed": elapsed,
+            })
+        return httpx.Response(response.status_code, headers=response.headers, content=body, request=request)
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+class ReplayTransport(httpx.AsyncBaseTransport):
+    """
+    Serves http-*.json fixtures: the recorded URL, else one recorded for the same
+    host and path (another Unsplash query), else any recorded reference page for a
+    reference URL. Unsplash without a fixture is a 404; image URLs always answer 200.
+    """
+
+    def __init__(self, directory: str, speed: float = 1.0):
+        fixtures = _load_fixtures(directory, "http")
+        self.speed = speed
+        self.by_url = {_sha(f"{f['method']} {f['url']}"): f for f in fixtures}
+        by_path: Dict[str, List[Dict[str, Any]]] = {}
+        for fixture in fixtures:
+            by_path.setdefault(fixture["host_path"], []).append(fixture)
+        self.by_path = {path: itertools.cycle(items) for path, items in by_path.items()}
+        pages = [f for f in fixtures if not f["host_path"].startswith("api.unsplash.com")]
+        self.pages = itertools.cycle(pages) if pages else None
+        self.exact = 0
+        self.substituted = 0
+        self.missing = 0
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        if request.url.host == "images.unsplash.com":
+            return httpx.Response(200, headers={"content-type": "image/jpeg"}, request=request)
+        fixture = self.by_url.get(_request_key(request))
+        if fixture is not None:
+            self.exact += 1
+        elif f"{request.url.host}{request.url.path}" in self.by_path:
+            self.substituted += 1
+            fixture = next(self.by_path[f"{request.url.host}{request.url.path}"])
+        elif request.url.host != "api.unsplash.com" and self.pages is not None:
+            self.substituted += 1
+            fixture = next(self.pages)
+        else:
+            self.missing += 1
+            return httpx.Response(404, text="no fixture", request=request)
+        await asyncio.sleep(fixture["elapsed"] / self.speed)
+        return httpx.Response(fixture["status"], headers=fixture["headers"], content=fixture["body"].encode("utf-8"), request=request)
+
+
+def install(service, model=None, transport: Optional[httpx.AsyncBaseTransport] = None, unsplash: bool = True):
+    """Point a GeminiService at a model and/or HTTP transport (None keeps the current one)"""
+    if model is not None:
+        service.model = model
+    if transport is not None:
+        service._http = httpx.AsyncClient(
+            transport=transport, timeout=httpx.Timeout(10.0), follow_redirects=True)
+        if unsplash and not service.unsplash_access_key:
+            # The stand-in and replayed Unsplash need no key; a non-empty one turns the image stage on
+            service.unsplash_access_key = "stand-in"
+
@@ -0,0 +1,200 @@
+"""
+Synthetic sites.db stores for load tests.
+
+    cd backend && python -m benchmarks.synthetic_store --sites 100000 --out /tmp/stores/100k
+
+Writes <out>/sites.db (the server opens sites.db in its working directory) with
+`sites` completed sites (plus ~4% failed ones) spread over two years: Korean and
+English product types, explanations, palettes and modes drawn from a fixed
+vocabulary, ~10KB pages built from TEMPLATES layouts with per-site products
+and image URLs (so every page is its own HTML blob), previews, and MinHash
+fingerprints. Rows go straight into the tables in batches rather than through
+update_site_success_with_meta, which would fingerprint every page and take an
+hour at 100k; the search index and promoted columns are filled by the same
+triggers as in production. A store that already has the requested size and the
+current schema version is reused.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+import database
+import minhash
+from services.preview_service import preview_service
+
+TEMPLATES = 40
+BATCH = 2000
+ERROR_SHARE = 0.04
+# Every FAMILY_EVERY-th site re-generates the previous one (a near-duplicate)
+FAMILY_EVERY = 12
+
+PRODUCTS = ["비누", "캔들", "향수", "디퓨저", "쿠키", "케이크", "원두", "녹차", "머그", "그릇", "니트", "원피스",
+            "운동화", "가방", "지갑", "반지", "목걸이", "노트", "인형", "화분", "soap", "candle", "coffee", "sneakers"]
+MODIFIERS = ["수제", "천연", "유기농", "빈티지", "프리미엄", "handmade", "organic", "", "", ""]
+STYLES = ["미니멀", "모던", "빈티지", "내추럴", "럭셔리"]
+PHRASES = ["넓은 여백과 큰 상품 이미지로", "따뜻한 색감의 배경과", "카드형 그리드 레이아웃으로", "상단 히어로 배너와",
+           "리뷰 섹션을 강조하여", "모바일에서도 읽기 쉬운 타이포그래피로", "clean hero section with", "a bold call to action and"]
+POINTS = ["반응형 그리드", "고정 헤더", "장바구니 버튼 강조", "후기 캐러셀", "sticky navigation", "large product photos",
+          "무료 배송 배너", "브랜드 스토리 섹션"]
+MODES = ["smart"] * 16 + ["raw"] * 3 + ["none"]
+
+
+def _template(n: int) -> str:
+    """A page layout with {product}, {image} and {price} placeholders"""
+    rng = random.Random(n)
+    columns = rng.choice([2, 3, 4])
+    cards = "".join(
+        f'<article class="card card-{n} shadow-{rng.randint(1, 3)}"><img src="{{image}}-{k}" alt="{{product}} {k}" class="w-full">'
+        f'<h3 class="text-lg">{{product}} 컬렉션 {k}</h3><p class="price">₩{{price}}</p>'
+        f'<p>{" ".join(rng.sample(PHRASES, 2))} 매일 쓰기 좋은 {{product}}입니다.</p>'
+        f'<button class="btn btn-{n}" onclick="addToCart({k})">장바구니 담기</button></article>'
+        for k in range(rng.randint(8, 14))
+    )
+    style = "".join(f".section-{n}-{k} {{ padding: {k * 4}px 24px; color: #{rng.randrange(1 << 24):06x}; }}\n" for k in range(30))
+    return (
+        f"<!DOCTYPE html><html lang='ko'><head><meta charset='utf-8'><title>{{product}}</title>"
+        f"<script src='https://cdn.tailwindcss.com'></script><style>{style}</style></head>"
+        f"<body><header class='hero hero-{n}'><h1>{{product}} 스토어</h1><p>{rng.choice(PHRASES)}</p></header>"
+        f"<main class='grid grid-cols-{columns} gap-6'>{cards}</main>"
+        f"<footer>고객센터 1588-{n:04d}</footer><script>window.addEventListener('load', () => {{}})</script></body></html>"
+    )
+
+
+class _Layouts:
+    def __init__(self):
+        self.pages = [_template(n) for n in range(TEMPLATES)]
+        # Previews and fingerprints are computed per layout; sites perturb the signature below
+        self.previews = [preview_service.render_preview(page) for page in self.pages]
+        self.signatures = [minhash.fingerprint(page) for page in self.pages]
+
+
+def _site(i: int, rng: random.Random, np_rng: np.random.Generator, layouts: _Layouts, previous):
+    if previous is not None and i % FAMILY_EVERY == 0 and previous["status"] == "completed":
+        # Same request again: same layout and product, different images and prices
+        site = dict(previous, id=f"site-{i}", seed=i)
+        signature = previous["signature"].copy()
+        changed = np_rng.choice(minhash.MINHASH_PERMUTATIONS, 6, replace=False)
+        signature[changed] = np_rng.integers(0, 1 << 32, len(changed), dtype=np.uint32)
+        return dict(site, signature=signature, cluster=previous["cluster"])
+
+    layout = rng.randrange(TEMPLATES)
+    product = " ".join(filter(None, [rng.choice(MODIFIERS), rng.choice(PRODUCTS)]))
+    signature = layouts.signatures[layout].copy()
+    # Different products on one layout share boilerplate, not most of the page
+    changed = np_rng.random(minhash.MINHASH_PERMUTATIONS) < 0.6
+    signature[changed] = np_rng.integers(0, 1 << 32, int(changed.sum()), dtype=np.uint32)
+    return {
+        "id": f"site-{i}",
+        "seed": i,
+        "layout": layout,
+        "product": product,
+        "style": rng.choice(STYLES),
+        "mode": rng.choice(MODES),
+        "status": "error" if rng.random() < ERROR_SHARE else "completed",
+        "explanation": f"{product}의 매력을 살리기 위해 " + " ".join(rng.sample(PHRASES, 3)) + " 구성했습니다.",
+        "key_points": rng.sample(POINTS, 3),
+        "palette": [f"#{rng.randrange(1 << 24):06x}" for _ in range(rng.randint(3, 6))],
+        "signature": signature,
+        "cluster": f"site-{i}",
+    }
+
+
+def _write(conn, site: dict, created_at: datetime, layouts: _Layouts):
+    meta = {
+        "product_type": site["product"],
+        "design_style": site["style"],
+        "generation_mode": site["mode"],
+    }
+    if site["status"] == "error":
+        conn.execute('''
+            INSERT INTO sites (id, product_type, design_style, status, error_message, stage, created_at, meta_data)
+            VALUES (?, ?, ?, 'error', 'Failed to generate content after 2 attempts', 'error', ?, ?)
+        ''', (site["id"], site["product"], site["style"], created_at, json.dumps(meta, ensure_ascii=False)))
+        return
+
+    meta.update(explanation=site["explanation"], key_points=site["key_points"], color_palette=site["palette"])
+    fill = {"product": site["product"], "image": f"https://images.unsplash.com/photo-{site['seed']}?w=1200", "price": f"{12000 + site['seed'] % 90 * 500:,}"}
+    html = layouts.pages[site["layout"]]
+    preview = layouts.previews[site["layout"]]
+    for key, value in fill.items():
+        html = html.replace("{" + key + "}", value)
+        preview = preview.replace("{" + key + "}", value)
+    content_hash = database._store_html_blob(conn, html)
+    conn.execute('''
+        INSERT INTO sites (id, product_type, design_style, status, stage, created_at, meta_data, html_hash, preview_html)
+        VALUES (?, ?, ?, 'completed', 'completed', ?, ?, ?, ?)
+    ''', (site["id"], site["product"], site["style"], created_at, json.dumps(meta, ensure_ascii=False), content_hash, preview))
+    conn.execute('INSERT INTO site_fingerprints (site_id, signature, cluster_id, created_at) VALUES (?, ?, ?, ?)',
+                 (site["id"], minhash.to_blob(site["signature"]), site["cluster"], time.time()))
+    conn.executemany('INSERT OR IGNORE INTO site_lsh_buckets (bucket, site_id) VALUES (?, ?)',
+                     [(bucket, site["id"]) for bucket in minhash.band_buckets(site["signature"])])
+
+
+def _current(path: str, sites: int) -> bool:
+    if not os.path.exists(path):
+        return False
+    conn = database.sqlite3.connect(path)
+    try:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        count = conn.execute("SELECT COUNT(*) FROM sites WHERE id LIKE 'site-%'").fetchone()[0]
+    except database.sqlite3.Error:
+        return False
+    finally:
+        conn.close()
+    return version == database.SCHEMA_VERSION and count == sites
+
+
+def build_store(out_dir: str, sites: int, seed: int = 7) -> str:
+    """Path of <out_dir>/sites.db holding `sites` synthetic sites (built unless already current)"""
+    os.makedirs(out_dir, exist_ok=True)
+    path = os.path.join(out_dir, "sites.db")
+    if _current(path, sites):
+        return path
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+    previous_path = database.DB_PATH
+    database.DB_PATH = path
+    try:
+        database.init_db()
+        rng = random.Random(seed)
+        np_rng = np.random.default_rng(seed)
+        layouts = _Layouts()
+        base = datetime.now() - timedelta(days=730)
+        step = timedelta(days=730) / max(sites, 1)
+        start = time.perf_counter()
+        previous = None
+        for batch_start in range(0, sites, BATCH):
+            with database.transaction() as conn:
+                for i in range(batch_start, min(sites, batch_start + BATCH)):
+                    site = _site(i, rng, np_rng, layouts, previous)
+                    _write(conn, site, base + step * i, layouts)
+                    previous = site
+        with database.transaction() as conn:
+            conn.execute("UPDATE change_counters SET value = value + 1 WHERE name = 'gallery'")
+        database._fetchall("PRAGMA optimize")
+        # The load test copies sites.db alone
+        database._fetchall("PRAGMA wal_checkpoint(TRUNCATE)")
+        print(f"[{datetime.now()}] Built {sites:,} synthetic sites in {time.perf_counter() - start:.1f}s "
+              f"({os.path.getsize(path) / 1e6:.0f} MB): {path}")
+    finally:
+        database.close_all()
+        database.DB_PATH = previous_path
+    return path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sites", type=int, default=10_000)
+    parser.add_argument("--out", required=True, help="directory for sites.db")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+    build_store(args.out, args.sites, args.seed)
+    sys.exit(0)
@@ -1,115 +1,1701 @@
 import sqlite3
 import json
-from datetime import datetime
-from typing import Optional, Dict, Any, List
+import base64
+import gzip
+import hashlib
+from html import escape as html_escape
+import os
+import re
+import unicodedata
+import asyncio
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Callable, Optional, Dict, Any, List, Tuple
+
+import minhash
 
 DB_PATH = "sites.db"
 
+# Threads allowed to run queries for async callers (see `run` / `aio`)
+DB_MAX_WORKERS = int(os.getenv("DB_MAX_WORKERS", "4"))
+
+# Applied to every pooled connection. journal_mode=WAL is persistent on the file,
+# the rest are per-connection.
+PRAGMAS = [
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA mmap_size=67108864",
+    "PRAGMA foreign_keys=ON",
+]
+
+# Generated HTML lives in html_blobs, gzip-compressed and keyed by content hash;
+# sites.html_hash points at it. Rows written before the blob store keep their text in
+# sites.html_content until init_db migrates them. Reads select HTML_CONTENT_SQL, so
+# `html_content` is always the decompressed text whichever column holds it.
+HTML_BLOB_ENCODING = "gzip"
+HTML_BLOB_LEVEL = 9
+HTML_MIGRATION_BATCH = 200
+HTML_CONTENT_SQL = (
+    "inflate_html(sites.html_content, "
+    "(SELECT body FROM html_blobs WHERE content_hash = sites.html_hash)) AS html_content"
+)
+
+# Rows updated per transaction when a migration backfills a column, and the pause
+# between transactions (seconds) so writers in other processes, whose busy handler
+# polls with growing sleeps, get the lock instead of waiting out the whole backfill
+SCHEMA_BACKFILL_BATCH = 2000
+SCHEMA_BACKFILL_PAUSE = 0.02
+
+# meta_data fields promoted to columns (migration 1). The JSON arrays are decoded
+# before rows are returned, so the API serves typed values.
+META_COLUMNS = ["explanation", "key_points", "color_palette", "generation_mode"]
+JSON_COLUMNS = ["key_points", "color_palette"]
+GENERATION_MODES = ["smart", "raw", "none", "design"]
+
+# Per-attempt generation breakdown (migration 2, see services/metrics.py): one
+# <stage>_ms column per pipeline stage, plus sizes and retry counts
+GENERATION_METRIC_STAGES = [
+    "prepare", "reference_fetch", "clean_html", "keywords", "images", "prompt_build",
+    "model_queue", "model_call", "parse", "optimize", "progress_write", "db_write", "preview",
+]
+GENERATION_METRIC_VALUES = ["prompt_chars", "prompt_tokens", "response_chars", "response_tokens", "model_retries"]
+# Prompt budgeting (migration 3, see services/prompt_budget.py): the budget, the local
+# estimate of the prompt actually sent, and reference HTML tokens kept / cut to fit
+PROMPT_BUDGET_VALUES = ["prompt_budget_tokens", "prompt_tokens_estimate", "reference_tokens", "reference_tokens_dropped"]
+GENERATION_METRIC_VALUES += PROMPT_BUDGET_VALUES
+
+# Columns returned by get_site (preview_html is served separately). meta_data is
+# kept for clients that still parse it.
+SITE_COLUMNS = ["id", "product_type", "design_style", "reference_url", "html_content", "status", "error_message",
+                "created_at", *META_COLUMNS, "meta_data"]
+
+# Columns the gallery is allowed to project. html_content is opt-in only.
+GALLERY_FIELDS = ["id", "product_type", "design_style", "reference_url", "created_at", *META_COLUMNS, "html_content", "meta_data"]
+DEFAULT_GALLERY_FIELDS = ["id", "product_type", "design_style", "reference_url", "created_at"]
+
+# Gallery search (sites_fts, see search_sites). Relevance is ranked among the
+# SEARCH_CANDIDATES most recent matches, so a term matching half the store costs
+# the same as a rare one.
+SEARCH_SORTS = ["relevance", "recent"]
+SEARCH_CANDIDATES = int(os.getenv("SEARCH_CANDIDATES", "1000"))
+SEARCH_MAX_TERMS = 8
+# bm25 weights per sites_fts column: product_type, design_style, explanation, key_points,
+# generation_mode (filter only, never ranked)
+SEARCH_WEIGHTS = (10.0, 4.0, 1.0, 2.0, 0.0)
+SEARCH_TEXT_COLUMNS = "{product_type design_style explanation key_points}"
+SEARCH_FIELDS = ["id", "product_type", "design_style", "reference_url", "created_at"]
+
+# ---------------------------------------------------------------------------
+# Connection pool: one long-lived connection per thread, reopened if DB_PATH changes
+# ---------------------------------------------------------------------------
+
+_local = threading.local()
+_connections: List[sqlite3.Connection] = []
+_connections_lock = threading.Lock()
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+def _inflate_html(text: Optional[str], blob: Optional[bytes]) -> Optional[str]:
+    """SQL function: legacy text column if set, else the decompressed blob"""
+    if text is not None or blob is None:
+        return text
+    return gzip.decompress(blob).decode("utf-8")
+
+def _open_connection(path: str) -> sqlite3.Connection:
+    # isolation_level=None: statements autocommit, writes use explicit BEGIN IMMEDIATE
+    conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False, timeout=5.0)
+    conn.row_factory = sqlite3.Row
+    conn.create_function("inflate_html", 2, _inflate_html, deterministic=True)
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    with _connections_lock:
+        _connections.append(conn)
+    return conn
+
+def get_connection() -> sqlite3.Connection:
+    """Get this thread's pooled connection, opening it on first use"""
+    conn = getattr(_local, "conn", None)
+    if conn is None or getattr(_local, "path", None) != DB_PATH:
+        if conn is not None:
+            _discard_connection(conn)
+        conn = _open_connection(DB_PATH)
+        _local.conn = conn
+        _local.path = DB_PATH
+    return conn
+
+def _discard_connection(conn: sqlite3.Connection):
+    with _connections_lock:
+        if conn in _connections:
+            _connections.remove(conn)
+    conn.close()
+
+def close_all():
+    """Close every pooled connection and the executor (shutdown / tests)"""
+    global _executor
+    with _connections_lock:
+        conns = list(_connections)
+        _connections.clear()
+    for conn in conns:
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+    _local.__dict__.clear()
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False)
+            _executor = None
+
+@contextmanager
+def transaction():
+    """Write transaction on this thread's connection. Takes the write lock up front."""
+    conn = get_connection()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    else:
+        conn.execute("COMMIT")
+
+def _fetchone(query: str, params: Any = ()) -> Optional[sqlite3.Row]:
+    return get_connection().execute(query, params).fetchone()
+
+def _fetchall(query: str, params: Any = ()) -> List[sqlite3.Row]:
+    return get_connection().execute(query, params).fetchall()
+
+# ---------------------------------------------------------------------------
+# Async facade: run blocking queries on a bounded executor, off the event loop
+# ---------------------------------------------------------------------------
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=DB_MAX_WORKERS, thread_name_prefix="db")
+        return _executor
+
+async def run(fn, *args, **kwargs):
+    """Run a blocking database function on the DB executor and await its result"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_executor(), functools.partial(fn, *args, **kwargs))
+
+class _AsyncFacade:
+    """`await database.aio.get_site(site_id)` is the non-blocking form of `database.get_site(site_id)`"""
+
+    def __getattr__(self, name: str):
+        fn = globals().get(name)
+        if name.startswith("_") or not callable(fn):
+            raise AttributeError(name)
+
+        async def call(*args, **kwargs):
+            return await run(fn, *args, **kwargs)
+        call.__name__ = name
+        return call
+
+aio = _AsyncFacade()
+
+# ---------------------------------------------------------------------------
+# Schema & queries
+# ---------------------------------------------------------------------------
+
 def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS sites (
-            id TEXT PRIMARY KEY,
-            product_type TEXT,
-            design_style TEXT,
-            reference_url TEXT,
-            html_content TEXT,
-            status TEXT DEFAULT 'pending',
-            error_message TEXT,
-            created_at TIMESTAMP,
-            meta_data TEXT
-        )
+    with transaction() as conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS sites (
+                id TEXT PRIMARY KEY,
+                product_type TEXT,
+                design_style TEXT,
+                reference_url TEXT,
+                html_content TEXT,
+                status TEXT DEFAULT 'pending',
+                error_message TEXT,
+                created_at TIMESTAMP,
+                meta_data TEXT
+            )
+        ''')
+        # Columns added after the original schema
+        existing = {row[1] for row in conn.execute("PRAGMA table_info(sites)")}
+        if "preview_html" not in existing:
+            conn.execute("ALTER TABLE sites ADD COLUMN preview_html TEXT")
+        # Streaming progress while a site is pending (cleared on completion)
+        if "stage" not in existing:
+            conn.execute("ALTER TABLE sites ADD COLUMN stage TEXT")
+        if "partial_html" not in existing:
+            conn.execute("ALTER TABLE sites ADD COLUMN partial_html TEXT")
+        # Normalized generation request (see services/generation_cache.py) and, for
+        # sites served from the result cache, the site they were cloned from
+        if "request_key" not in existing:
+            conn.execute("ALTER TABLE sites ADD COLUMN request_key TEXT")
+        if "cloned_from" not in existing:
+            conn.execute("ALTER TABLE sites ADD COLUMN cloned_from TEXT")
+        if "html_hash" not in existing:
+            conn.execute("ALTER TABLE sites ADD COLUMN html_hash TEXT")
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS html_blobs (
+                content_hash TEXT PRIMARY KEY,
+                encoding TEXT NOT NULL,
+                body BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                stored_size INTEGER NOT NULL
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_sites_html_hash ON sites (html_hash)')
+        # HTTP validators: revision changes on every update of a row, the "gallery"
+        # counter whenever the set of completed sites (or their fields) changes
+        if "revision" not in existing:
+            conn.execute("ALTER TABLE sites ADD COLUMN revision INTEGER NOT NULL DEFAULT 0")
+        conn.execute('''
+            CREATE TRIGGER IF NOT EXISTS sites_revision AFTER UPDATE ON sites
+            WHEN NEW.revision = OLD.revision
+            BEGIN
+                UPDATE sites SET revision = OLD.revision + 1 WHERE id = NEW.id;
+            END
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                applied_at REAL NOT NULL,
+                duration_ms REAL NOT NULL
+            )
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS change_counters (
+                name TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            )
+        ''')
+        conn.execute("INSERT OR IGNORE INTO change_counters (name, value) VALUES ('gallery', 0)")
+        conn.execute('''
+            CREATE TRIGGER IF NOT EXISTS gallery_counter_insert AFTER INSERT ON sites
+            WHEN NEW.status = 'completed'
+            BEGIN
+                UPDATE change_counters SET value = value + 1 WHERE name = 'gallery';
+            END
+        ''')
+        conn.execute('''
+            CREATE TRIGGER IF NOT EXISTS gallery_counter_update
+            AFTER UPDATE OF status, product_type, design_style, reference_url, created_at, meta_data, html_hash, html_content ON sites
+            WHEN NEW.status = 'completed' OR OLD.status = 'completed'
+            BEGIN
+                UPDATE change_counters SET value = value + 1 WHERE name = 'gallery';
+            END
+        ''')
+        conn.execute('''
+            CREATE TRIGGER IF NOT EXISTS gallery_counter_delete AFTER DELETE ON sites
+            WHEN OLD.status = 'completed'
+            BEGIN
+                UPDATE change_counters SET value = value + 1 WHERE name = 'gallery';
+            END
+        ''')
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_sites_request_key
+            ON sites (request_key, status, created_at DESC)
+        ''')
+        # Gallery keyset pagination: WHERE status = ? ORDER BY created_at DESC, id DESC
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_sites_status_created
+            ON sites (status, created_at DESC, id DESC)
+        ''')
+        # Durable generation queue (one job per site, see services/job_queue.py)
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'queued',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                max_attempts INTEGER NOT NULL DEFAULT 3,
+                available_at REAL NOT NULL,
+                lease_owner TEXT,
+                lease_expires_at REAL,
+                last_error TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        ''')
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_jobs_status_available
+            ON jobs (status, available_at, created_at)
+        ''')
+        # Reference page cache (see services/reference_cache.py):
+        # URL -> content hash, raw HTML stored once per hash, prepared output per (hash, variant)
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS reference_pages (
+                url TEXT PRIMARY KEY,
+                content_hash TEXT NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                fetched_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+        ''')
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_reference_pages_access
+            ON reference_pages (last_access)
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS reference_blobs (
+                content_hash TEXT PRIMARY KEY,
+                body TEXT NOT NULL,
+                size INTEGER NOT NULL
+            )
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS reference_outputs (
+                content_hash TEXT NOT NULL,
+                variant TEXT NOT NULL,
+                output TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                PRIMARY KEY (content_hash, variant)
+            )
+        ''')
+        # Per-keyword Unsplash photo pools (see services/image_pool.py)
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS image_pool (
+                keyword TEXT NOT NULL,
+                photo_id TEXT NOT NULL,
+                url TEXT NOT NULL,
+                added_at REAL NOT NULL,
+                served_count INTEGER NOT NULL DEFAULT 0,
+                last_served REAL,
+                PRIMARY KEY (keyword, photo_id)
+            )
+        ''')
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_image_pool_serve
+            ON image_pool (keyword, served_count, last_served)
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS image_pool_keywords (
+                keyword TEXT PRIMARY KEY,
+                requests INTEGER NOT NULL DEFAULT 0,
+                last_requested REAL NOT NULL,
+                last_refill REAL
+            )
+        ''')
+        # Product description -> stock-photo keywords (see services/keyword_cache.py)
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS keyword_translations (
+                normalized TEXT PRIMARY KEY,
+                product_type TEXT NOT NULL,
+                keywords TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+        ''')
+        # Full-text index over completed sites (see search_sites). rowid is sites.rowid;
+        # the triggers below keep it in sync with inserts, updates and deletes.
+        # generation_mode is indexed so the mode filter is part of the MATCH.
+        fts_exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sites_fts'"
+        ).fetchone() is not None
+        conn.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS sites_fts USING fts5(
+                product_type, design_style, explanation, key_points, generation_mode, site_id UNINDEXED,
+                tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+            )
+        ''')
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS sites_fts_insert AFTER INSERT ON sites
+            WHEN NEW.status = 'completed'
+            BEGIN
+                INSERT INTO sites_fts (rowid, product_type, design_style, explanation, key_points, generation_mode, site_id)
+                VALUES (NEW.rowid, {_search_document_sql("NEW")});
+            END
+        ''')
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS sites_fts_update
+            AFTER UPDATE OF status, product_type, design_style, meta_data ON sites
+            WHEN NEW.status = 'completed' OR OLD.status = 'completed'
+            BEGIN
+                DELETE FROM sites_fts WHERE rowid = OLD.rowid;
+                INSERT INTO sites_fts (rowid, product_type, design_style, explanation, key_points, generation_mode, site_id)
+                SELECT NEW.rowid, {_search_document_sql("NEW")} WHERE NEW.status = 'completed';
+            END
+        ''')
+        conn.execute('''
+            CREATE TRIGGER IF NOT EXISTS sites_fts_delete AFTER DELETE ON sites
+            WHEN OLD.status = 'completed'
+            BEGIN
+                DELETE FROM sites_fts WHERE rowid = OLD.rowid;
+            END
+        ''')
+        # Near-duplicate detection (see minhash.py): one MinHash signature per
+        # completed site, its LSH band buckets, and the cluster of near-duplicates it joined
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS site_fingerprints (
+                site_id TEXT PRIMARY KEY,
+                signature BLOB NOT NULL,
+                cluster_id TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_site_fingerprints_cluster ON site_fingerprints (cluster_id)')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS site_lsh_buckets (
+                bucket INTEGER NOT NULL,
+                site_id TEXT NOT NULL,
+                PRIMARY KEY (bucket, site_id)
+            ) WITHOUT ROWID
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_site_lsh_buckets_site ON site_lsh_buckets (site_id)')
+        conn.execute('''
+            CREATE TRIGGER IF NOT EXISTS sites_fingerprint_delete AFTER DELETE ON sites
+            BEGIN
+                DELETE FROM site_lsh_buckets WHERE site_id = OLD.id;
+                DELETE FROM site_fingerprints WHERE site_id = OLD.id;
+            END
+        ''')
+        # VACUUM may renumber the rowids of sites (it has no INTEGER PRIMARY KEY), so
+        # rebuild the index when it is new or no longer lines up with the table
+        if not fts_exists or conn.execute('''
+            SELECT 1 FROM sites_fts f LEFT JOIN sites s ON s.rowid = f.rowid
+            WHERE s.id IS NOT f.site_id LIMIT 1
+        ''').fetchone():
+            _rebuild_search_index(conn)
+
+    _migrate_html_to_blobs()
+    _run_migrations()
+
+def _search_document_sql(alias: str) -> str:
+    """Indexed values of one sites row (`alias` is NEW or a table alias)"""
+    return (
+        f"{alias}.product_type, {alias}.design_style, "
+        f"json_extract({alias}.meta_data, '$.explanation'), "
+        f"(SELECT group_concat(value, ' ') FROM json_each({alias}.meta_data, '$.key_points')), "
+        f"COALESCE(json_extract({alias}.meta_data, '$.generation_mode'), 'smart'), "
+        f"{alias}.id"
+    )
+
+def _rebuild_search_index(conn: sqlite3.Connection):
+    conn.execute("DELETE FROM sites_fts")
+    conn.execute(f'''
+        INSERT INTO sites_fts (rowid, product_type, design_style, explanation, key_points, generation_mode, site_id)
+        SELECT s.rowid, {_search_document_sql("s")} FROM sites s WHERE s.status = 'completed'
     ''')
-    conn.commit()
-    conn.close()
 
-def create_pending_site(site_id: str, data: Dict[str, Any]):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('''
-        INSERT INTO sites (id, product_type, design_style, reference_url, status, created_at, meta_data)
-        VALUES (?, ?, ?, ?, 'pending', ?, ?)
+# ---------------------------------------------------------------------------
+# Versioned migrations
+# ---------------------------------------------------------------------------
+# The tables above predate versioning and are created idempotently on every start.
+# Later schema changes are numbered migrations, applied in order by _run_migrations;
+# PRAGMA user_version holds the last one applied and schema_migrations records when.
+# A migration may be interrupted (or run by two processes at once) and must be safe
+# to run again: check before altering, and backfill in batches so writers are never
+# blocked for long.
+
+def _add_columns(conn: sqlite3.Connection, table: str, columns: List[Tuple[str, str]]):
+    existing = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+    for name, definition in columns:
+        if name not in existing:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {definition}")
+
+def _backfill(table: str, assignments: str, label: str, batch: int = SCHEMA_BACKFILL_BATCH):
+    """
+    UPDATE every row of `table` with `assignments`, one rowid range per transaction.
+    Rows inserted after it starts are left alone: the migration's triggers already
+    cover them.
+    """
+    end = _fetchone(f"SELECT MAX(rowid) FROM {table}")[0] or 0
+    last, updated = 0, 0
+    while True:
+        with transaction() as conn:
+            rowids = [row[0] for row in conn.execute(
+                f"SELECT rowid FROM {table} WHERE rowid > ? AND rowid <= ? ORDER BY rowid LIMIT ?", (last, end, batch)
+            )]
+            if rowids:
+                conn.execute(f"UPDATE {table} SET {assignments} WHERE rowid BETWEEN ? AND ?", (rowids[0], rowids[-1]))
+        if not rowids:
+            break
+        last = rowids[-1]
+        updated += len(rowids)
+        time.sleep(SCHEMA_BACKFILL_PAUSE)
+    if updated:
+        print(f"[{datetime.now()}] Backfilled {label} for {updated} row(s)")
+
+def _meta_columns_sql(meta: str) -> str:
+    """SET list deriving the promoted meta_data columns from `meta` (a column or NEW.meta_data)"""
+    def array(path: str) -> str:
+        return f"CASE WHEN json_type({meta}, '{path}') = 'array' THEN json_extract({meta}, '{path}') END"
+    valid = f"json_valid({meta})"
+    return (
+        f"explanation = CASE WHEN {valid} THEN json_extract({meta}, '$.explanation') END, "
+        f"key_points = CASE WHEN {valid} THEN {array('$.key_points')} END, "
+        f"color_palette = CASE WHEN {valid} THEN {array('$.color_palette')} END, "
+        f"generation_mode = COALESCE(CASE WHEN {valid} THEN json_extract({meta}, '$.generation_mode') END, 'smart')"
+    )
+
+def _promote_meta_fields():
+    """
+    explanation, key_points, color_palette and generation_mode as real columns, kept
+    in sync with meta_data by triggers, so they can be read without parsing JSON
+    and generation_mode can be filtered through an index.
+    """
+    with transaction() as conn:
+        _add_columns(conn, "sites", [
+            ("explanation", "TEXT"),
+            ("key_points", "TEXT"),       # JSON array
+            ("color_palette", "TEXT"),    # JSON array
+            ("generation_mode", "TEXT"),
+        ])
+        for event in ("INSERT", "UPDATE OF meta_data"):
+            name = "sites_meta_columns_" + event.split()[0].lower()
+            conn.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {name} AFTER {event} ON sites
+                BEGIN
+                    UPDATE sites SET {_meta_columns_sql("NEW.meta_data")} WHERE rowid = NEW.rowid;
+                END
+            ''')
+        # Gallery filtered by mode: WHERE status = ? AND generation_mode = ? ORDER BY created_at DESC, id DESC
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_sites_status_mode_created
+            ON sites (status, generation_mode, created_at DESC, id DESC)
+        ''')
+    _backfill("sites", _meta_columns_sql("meta_data"), "promoted meta_data columns")
+
+def _create_generation_metrics():
+    with transaction() as conn:
+        stage_columns = "".join(f"{stage}_ms REAL,\n" for stage in GENERATION_METRIC_STAGES)
+        value_columns = "".join(f"{name} INTEGER NOT NULL DEFAULT 0,\n" for name in GENERATION_METRIC_VALUES)
+        conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS generation_metrics (
+                id INTEGER PRIMARY KEY,
+                site_id TEXT NOT NULL,
+                attempt INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                started_at REAL NOT NULL,
+                total_ms REAL NOT NULL,
+                {stage_columns}{value_columns}error TEXT
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_generation_metrics_site ON generation_metrics (site_id)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_generation_metrics_started ON generation_metrics (started_at)')
+
+def _add_prompt_budget_columns():
+    # A database created after this migration was written already has them from migration 2
+    with transaction() as conn:
+        _add_columns(conn, "generation_metrics", [(name, "INTEGER NOT NULL DEFAULT 0") for name in PROMPT_BUDGET_VALUES])
+
+def _add_original_html():
+    # sites.original_html_hash: the HTML as generated when html_hash holds the optimized
+    # copy (services/html_optimizer.py); NULL when what is served is what was generated
+    with transaction() as conn:
+        _add_columns(conn, "sites", [("original_html_hash", "TEXT")])
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_sites_original_html_hash ON sites (original_html_hash)')
+        _add_columns(conn, "generation_metrics", [("optimize_ms", "REAL")])
+
+def _add_prepare_stage():
+    # prepare_ms: wall time of input preparation, which runs reference_fetch and
+    # keywords -> images concurrently (services/gemini_service.py)
+    with transaction() as conn:
+        _add_columns(conn, "generation_metrics", [("prepare_ms", "REAL")])
+
+def _add_reference_output_age():
+    # created_at: when a prepared reference output was computed, so variants that depend on
+    # more than the page (design mode: its stylesheets) can expire (services/reference_cache.py)
+    with transaction() as conn:
+        _add_columns(conn, "reference_outputs", [("created_at", "REAL")])
+
+MIGRATIONS: List[Tuple[int, str, Callable[[], None]]] = [
+    (1, "promote meta_data fields to columns", _promote_meta_fields),
+    (2, "generation_metrics table", _create_generation_metrics),
+    (3, "prompt budget columns in generation_metrics", _add_prompt_budget_columns),
+    (4, "original HTML of optimized sites", _add_original_html),
+    (5, "prepare stage in generation_metrics", _add_prepare_stage),
+    (6, "age of prepared reference outputs", _add_reference_output_age),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+def _run_migrations():
+    current = _fetchone("PRAGMA user_version")[0]
+    for version, name, migrate in MIGRATIONS:
+        if version <= current:
+            continue
+        start = time.perf_counter()
+        migrate()
+        with transaction() as conn:
+            # Another process may have finished it meanwhile; recording twice is harmless
+            conn.execute(f"PRAGMA user_version = {version}")
+            conn.execute('''
+                INSERT OR REPLACE INTO schema_migrations (version, name, applied_at, duration_ms)
+                VALUES (?, ?, ?, ?)
+            ''', (version, name, time.time(), round((time.perf_counter() - start) * 1000, 1)))
+        print(f"[{datetime.now()}] Applied migration {version}: {name}")
+
+def schema_info() -> Dict[str, Any]:
+    return {
+        "version": _fetchone("PRAGMA user_version")[0],
+        "latest": SCHEMA_VERSION,
+        "migrations": [dict(row) for row in _fetchall("SELECT * FROM schema_migrations ORDER BY version")],
+    }
+
+def _migrate_html_to_blobs():
+    """Move html_content text written before the blob store into html_blobs, in batches"""
+    moved = 0
+    while True:
+        with transaction() as conn:
+            rows = conn.execute('''
+                SELECT id, html_content FROM sites
+                WHERE html_content IS NOT NULL AND html_hash IS NULL
+                LIMIT ?
+            ''', (HTML_MIGRATION_BATCH,)).fetchall()
+            for row in rows:
+                _set_site_html(conn, row["id"], row["html_content"])
+        moved += len(rows)
+        if len(rows) < HTML_MIGRATION_BATCH:
+            break
+    if moved:
+        print(f"[{datetime.now()}] Moved HTML of {moved} site(s) into html_blobs")
+
+def _store_html_blob(conn: sqlite3.Connection, html: str) -> str:
+    """Compress and store HTML once per content hash. Returns the hash."""
+    raw = html.encode("utf-8")
+    content_hash = hashlib.sha256(raw).hexdigest()
+    exists = conn.execute('SELECT 1 FROM html_blobs WHERE content_hash = ?', (content_hash,)).fetchone()
+    if not exists:
+        # mtime=0 keeps the gzip bytes (and anything derived from them) stable
+        body = gzip.compress(raw, compresslevel=HTML_BLOB_LEVEL, mtime=0)
+        conn.execute('''
+            INSERT INTO html_blobs (content_hash, encoding, body, size, stored_size)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (content_hash, HTML_BLOB_ENCODING, body, len(raw), len(body)))
+    return content_hash
+
+def _set_site_html(conn: sqlite3.Connection, site_id: str, html: Optional[str]):
+    previous = conn.execute('SELECT html_hash FROM sites WHERE id = ?', (site_id,)).fetchone()
+    content_hash = _store_html_blob(conn, html) if html is not None else None
+    conn.execute('UPDATE sites SET html_hash = ?, html_content = NULL WHERE id = ?', (content_hash, site_id))
+    if previous and previous["html_hash"] != content_hash:
+        _release_html_blob(conn, previous["html_hash"])
+
+def _set_site_original_html(conn: sqlite3.Connection, site_id: str, html: Optional[str]):
+    previous = conn.execute('SELECT original_html_hash FROM sites WHERE id = ?', (site_id,)).fetchone()
+    content_hash = _store_html_blob(conn, html) if html is not None else None
+    conn.execute('UPDATE sites SET original_html_hash = ? WHERE id = ?', (content_hash, site_id))
+    if previous and previous["original_html_hash"] != content_hash:
+        _release_html_blob(conn, previous["original_html_hash"])
+
+def _release_html_blob(conn: sqlite3.Connection, content_hash: Optional[str]):
+    """Drop a blob no site points at any more"""
+    if content_hash:
+        conn.execute('''
+            DELETE FROM html_blobs WHERE content_hash = ?
+            AND NOT EXISTS (SELECT 1 FROM sites WHERE html_hash = ? OR original_html_hash = ?)
+        ''', (content_hash, content_hash, content_hash))
+
+def create_pending_site(site_id: str, data: Dict[str, Any], request_key: Optional[str] = None):
+    with transaction() as conn:
+        _insert_pending_site(conn, site_id, data, request_key)
+
+def _insert_pending_site(conn: sqlite3.Connection, site_id: str, data: Dict[str, Any], request_key: Optional[str]):
+    conn.execute('''
+        INSERT INTO sites (id, product_type, design_style, reference_url, status, created_at, meta_data, request_key)
+        VALUES (?, ?, ?, ?, 'pending', ?, ?, ?)
     ''', (
         site_id,
         data.get("product_type"),
         data.get("design_style"),
         data.get("reference_url"),
         datetime.now(),
-        json.dumps(data)
+        json.dumps(data),
+        request_key
     ))
-    conn.commit()
-    conn.close()
 
-def update_site_success_with_meta(site_id: str, html_content: str, meta_data: Dict[str, Any]):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('''
-        UPDATE sites 
-        SET html_content = ?, status = 'completed', meta_data = ?
-        WHERE id = ?
-    ''', (html_content, json.dumps(meta_data), site_id))
-    conn.commit()
-    conn.close()
+def admit_generation(site_id: str, data: Dict[str, Any], request_key: str,
+                     pending_window: Optional[float], cache_max_age: Optional[float]) -> Tuple[str, str]:
+    """
+    Atomically decide how a generation request is served. Returns (site_id, outcome):
+    - ("<site_id>", "cached"): with cache_max_age, an original (not cloned) site with the
+      same key created within that many seconds was cloned into site_id
+    - ("<pending id>", "attached"): an identical request created within pending_window
+      seconds is still pending; the caller follows that site instead
+    - ("<site_id>", "created"): a new pending site was inserted; the caller enqueues it
+    """
+    now = datetime.now()
+    with transaction() as conn:
+        if cache_max_age is not None:
+            row = conn.execute('''
+                SELECT id, html_content, html_hash, original_html_hash, preview_html, meta_data FROM sites
+                WHERE request_key = ? AND status = 'completed' AND cloned_from IS NULL AND created_at >= ?
+                ORDER BY created_at DESC LIMIT 1
+            ''', (request_key, now - timedelta(seconds=cache_max_age))).fetchone()
+            if row:
+                meta_data = json.loads(row["meta_data"]) if row["meta_data"] else {}
+                meta_data.update(data)
+                conn.execute('''
+                    INSERT INTO sites (id, product_type, design_style, reference_url, html_content, html_hash,
+                                       original_html_hash, preview_html, status, stage, created_at, meta_data,
+                                       request_key, cloned_from)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, 'completed', 'completed', ?, ?, ?, ?)
+                ''', (
+                    site_id, data.get("product_type"), data.get("design_style"), data.get("reference_url"),
+                    row["html_content"], row["html_hash"], row["original_html_hash"], row["preview_html"], now,
+                    json.dumps(meta_data),
+                    request_key, row["id"]
+                ))
+                # Same HTML: same fingerprint and cluster
+                conn.execute('''
+                    INSERT INTO site_fingerprints (site_id, signature, cluster_id, created_at)
+                    SELECT ?, signature, cluster_id, ? FROM site_fingerprints WHERE site_id = ?
+                ''', (site_id, time.time(), row["id"]))
+                conn.execute('''
+                    INSERT INTO site_lsh_buckets (bucket, site_id)
+                    SELECT bucket, ? FROM site_lsh_buckets WHERE site_id = ?
+                ''', (site_id, row["id"]))
+                return site_id, "cached"
+
+        if pending_window is not None:
+            row = conn.execute('''
+                SELECT id FROM sites
+                WHERE request_key = ? AND status = 'pending' AND created_at >= ?
+                ORDER BY created_at DESC LIMIT 1
+            ''', (request_key, now - timedelta(seconds=pending_window))).fetchone()
+            if row:
+                return row["id"], "attached"
+
+        _insert_pending_site(conn, site_id, data, request_key)
+        return site_id, "created"
+
+def update_site_success_with_meta(site_id: str, html_content: str, meta_data: Dict[str, Any],
+                                  original_html: Optional[str] = None):
+    """
+    Complete a site. html_content is what gets served; original_html is the HTML as
+    generated when html_content is an optimized copy of it (kept for ?original=true)
+    """
+    # Fingerprint before taking the write lock
+    signature = _fingerprint(site_id, html_content)
+    with transaction() as conn:
+        _set_site_html(conn, site_id, html_content)
+        _set_site_original_html(conn, site_id, original_html if original_html != html_content else None)
+        conn.execute('''
+            UPDATE sites
+            SET status = 'completed', meta_data = ?, stage = 'completed', partial_html = NULL
+            WHERE id = ?
+        ''', (json.dumps(meta_data), site_id))
+        if signature is not None:
+            _store_fingerprint(conn, site_id, signature)
 
 def update_site_success(site_id: str, html_content: str):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('''
-        UPDATE sites 
-        SET html_content = ?, status = 'completed'
-        WHERE id = ?
-    ''', (html_content, site_id))
-    conn.commit()
-    conn.close()
+    signature = _fingerprint(site_id, html_content)
+    with transaction() as conn:
+        _set_site_html(conn, site_id, html_content)
+        _set_site_original_html(conn, site_id, None)
+        conn.execute("UPDATE sites SET status = 'completed' WHERE id = ?", (site_id,))
+        if signature is not None:
+            _store_fingerprint(conn, site_id, signature)
 
 def update_site_error(site_id: str, error_message: str):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('''
-        UPDATE sites 
-        SET error_message = ?, status = 'error'
-        WHERE id = ?
-    ''', (error_message, site_id))
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        conn.execute('''
+            UPDATE sites
+            SET error_message = ?, status = 'error', stage = 'error', partial_html = NULL
+            WHERE id = ?
+        ''', (error_message, site_id))
+
+def update_site_preview(site_id: str, preview_html: str):
+    with transaction() as conn:
+        conn.execute('''
+            UPDATE sites
+            SET preview_html = ?
+            WHERE id = ?
+        ''', (preview_html, site_id))
+
+def update_site_progress(site_id: str, stage: str, html_delta: str = "", reset: bool = False):
+    """Record the current pipeline stage and append streamed HTML (reset=True starts it over)"""
+    with transaction() as conn:
+        if reset:
+            conn.execute('''
+                UPDATE sites
+                SET stage = ?, partial_html = ?
+                WHERE id = ? AND status = 'pending'
+            ''', (stage, html_delta, site_id))
+        else:
+            conn.execute('''
+                UPDATE sites
+                SET stage = ?, partial_html = COALESCE(partial_html, '') || ?
+                WHERE id = ? AND status = 'pending'
+            ''', (stage, html_delta, site_id))
+
+def get_site_progress(site_id: str, offset: int = 0) -> Optional[Dict[str, Any]]:
+    """
+    State for the SSE stream: status, stage, error/meta and the streamed HTML after
+    `offset` characters. partial_length lets the caller detect a reset (retry).
+    """
+    row = _fetchone('''
+        SELECT id, status, stage, error_message, meta_data,
+               COALESCE(length(partial_html), 0) AS partial_length,
+               substr(partial_html, ? + 1) AS partial_delta
+        FROM sites WHERE id = ?
+    ''', (offset, site_id))
+    if row:
+        return dict(row)
+    return None
+
+def _site_columns_sql(columns: List[str]) -> str:
+    return ", ".join(HTML_CONTENT_SQL if column == "html_content" else column for column in columns)
+
+def _site_dict(row: sqlite3.Row) -> Dict[str, Any]:
+    """Row as a dict with the JSON array columns decoded"""
+    site = dict(row)
+    for column in JSON_COLUMNS:
+        if site.get(column) is not None:
+            site[column] = json.loads(site[column])
+    return site
 
 def get_site(site_id: str) -> Optional[Dict[str, Any]]:
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
-    c.execute('SELECT * FROM sites WHERE id = ?', (site_id,))
-    row = c.fetchone()
-    conn.close()
-    
+    row = _fetchone(f'SELECT {_site_columns_sql(SITE_COLUMNS)} FROM sites WHERE id = ?', (site_id,))
+    if row:
+        return _site_dict(row)
+    return None
+
+def get_site_state(site_id: str) -> Optional[Dict[str, Any]]:
+    """Cheap validator lookup for /results: status and row revision"""
+    row = _fetchone('SELECT id, status, revision FROM sites WHERE id = ?', (site_id,))
+    if row:
+        return dict(row)
+    return None
+
+def get_change_counter(name: str) -> int:
+    row = _fetchone('SELECT value FROM change_counters WHERE name = ?', (name,))
+    return row["value"] if row else 0
+
+def get_site_preview(site_id: str) -> Optional[Dict[str, Any]]:
+    """Get what the preview endpoint needs: status, stored preview and (for lazy backfill) the full HTML"""
+    row = _fetchone(f'SELECT id, status, preview_html, {HTML_CONTENT_SQL} FROM sites WHERE id = ?', (site_id,))
     if row:
         return dict(row)
     return None
 
+def get_site_html_blob(site_id: str, original: bool = False) -> Optional[Dict[str, Any]]:
+    """
+    Stored (compressed) HTML of a site for serving as-is: status, content_hash, encoding, body, size.
+    original=True returns the HTML as generated (the served HTML when it was not optimized).
+    """
+    column = "COALESCE(s.original_html_hash, s.html_hash)" if original else "s.html_hash"
+    row = _fetchone(f'''
+        SELECT s.status, {column} AS content_hash, b.encoding, b.body, b.size
+        FROM sites s LEFT JOIN html_blobs b ON b.content_hash = {column}
+        WHERE s.id = ?
+    ''', (site_id,))
+    if row:
+        return dict(row)
+    return None
+
+def get_site_html_optimization(site_id: str) -> Optional[Dict[str, Any]]:
+    """Sizes of the generated vs served HTML of a site; None if it does not exist"""
+    row = _fetchone('''
+        SELECT s.status, s.original_html_hash IS NOT NULL AS optimized,
+               COALESCE(o.size, b.size) AS original_bytes, b.size AS optimized_bytes,
+               COALESCE(o.stored_size, b.stored_size) AS original_stored_bytes, b.stored_size AS optimized_stored_bytes
+        FROM sites s
+        LEFT JOIN html_blobs b ON b.content_hash = s.html_hash
+        LEFT JOIN html_blobs o ON o.content_hash = s.original_html_hash
+        WHERE s.id = ?
+    ''', (site_id,))
+    if not row:
+        return None
+    info = dict(row)
+    info["optimized"] = bool(info["optimized"])
+    if info["optimized_bytes"] is not None:
+        info["bytes_saved"] = info["original_bytes"] - info["optimized_bytes"]
+        info["stored_bytes_saved"] = info["original_stored_bytes"] - info["optimized_stored_bytes"]
+    return info
+
+def html_store_usage() -> Dict[str, Any]:
+    row = _fetchone('''
+        SELECT
+            (SELECT COUNT(*) FROM sites WHERE html_hash IS NOT NULL) AS sites,
+            COUNT(*) AS blobs,
+            COALESCE(SUM(size), 0) AS raw_bytes,
+            COALESCE(SUM(stored_size), 0) AS stored_bytes,
+            (SELECT COALESCE(SUM(b.size), 0) FROM sites s JOIN html_blobs b ON b.content_hash = s.html_hash) AS logical_bytes,
+            (SELECT COUNT(*) FROM sites WHERE original_html_hash IS NOT NULL) AS optimized_sites,
+            (SELECT COALESCE(SUM(o.size - b.size), 0) FROM sites s
+             JOIN html_blobs b ON b.content_hash = s.html_hash
+             JOIN html_blobs o ON o.content_hash = s.original_html_hash) AS optimizer_bytes_saved
+        FROM html_blobs
+    ''')
+    usage = dict(row)
+    # raw / stored: gzip; logical / raw: bytes saved by sites sharing a blob
+    usage["compression_ratio"] = round(usage["raw_bytes"] / usage["stored_bytes"], 2) if usage["stored_bytes"] else 0.0
+    usage["dedup_ratio"] = round(usage["logical_bytes"] / usage["raw_bytes"], 2) if usage["raw_bytes"] else 0.0
+    return usage
+
 def get_all_sites() -> List[Dict[str, Any]]:
     """Get all completed sites for gallery"""
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
-    c.execute('''
-        SELECT id, product_type, design_style, reference_url, created_at, html_content 
-        FROM sites 
+    rows = _fetchall(f'''
+        SELECT id, product_type, design_style, reference_url, created_at, {HTML_CONTENT_SQL}
+        FROM sites
         WHERE status = 'completed'
         ORDER BY created_at DESC
     ''')
-    result = [dict(row) for row in c.fetchall()]
-    conn.close()
-    return result
+    return [dict(row) for row in rows]
+
+def encode_cursor(created_at: str, site_id: str) -> str:
+    """Encode a (created_at, id) keyset position as an opaque URL-safe token"""
+    raw = json.dumps([created_at, site_id]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+def decode_cursor(cursor: str) -> Tuple[str, str]:
+    """Decode a cursor produced by encode_cursor. Raises ValueError if malformed."""
+    try:
+        created_at, site_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {e}")
+    return str(created_at), str(site_id)
+
+# Completed sites in the same near-duplicate cluster as `sites` (the site itself included).
+# CROSS JOIN keeps SQLite from driving the lookup from idx_sites_status_created.
+_CLUSTER_MEMBERS_SQL = '''
+    FROM site_fingerprints f
+    CROSS JOIN site_fingerprints d ON d.cluster_id = f.cluster_id
+    CROSS JOIN sites n ON n.id = d.site_id AND n.status = 'completed'
+    WHERE f.site_id = sites.id
+'''
+
+def get_gallery_page(limit: int, cursor: Optional[str] = None, fields: Optional[List[str]] = None,
+                     collapse_duplicates: bool = False, mode: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    Get one page of completed sites, newest first, using keyset pagination on (created_at, id).
+    Returns (items, next_cursor); next_cursor is None on the last page.
+    With collapse_duplicates, each near-duplicate cluster is represented by its newest
+    site, which carries a `duplicates` count of the other sites in the cluster.
+    `mode` keeps only sites of that generation_mode (idx_sites_status_mode_created).
+    """
+    fields = fields or DEFAULT_GALLERY_FIELDS
+    unknown = [f for f in fields if f not in GALLERY_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    if mode is not None and mode not in GENERATION_MODES:
+        raise ValueError(f"Unknown mode: {mode}")
+    # id and created_at are always needed to build the next cursor
+    columns = ["id", "created_at"] + [f for f in fields if f not in ("id", "created_at")]
+
+    query = f"SELECT {_site_columns_sql(columns)}"
+    if collapse_duplicates:
+        query += f", (SELECT COUNT(*) {_CLUSTER_MEMBERS_SQL} AND n.id != sites.id) AS duplicates"
+    query += " FROM sites WHERE status = 'completed'"
+    params: List[Any] = []
+    if mode:
+        query += " AND generation_mode = ?"
+        params.append(mode)
+    if collapse_duplicates:
+        query += f" AND NOT EXISTS (SELECT 1 {_CLUSTER_MEMBERS_SQL} AND (n.created_at, n.id) > (sites.created_at, sites.id))"
+    if cursor:
+        created_at, site_id = decode_cursor(cursor)
+        query += " AND (created_at, id) < (?, ?)"
+        params.extend([created_at, site_id])
+    query += " ORDER BY created_at DESC, id DESC LIMIT ?"
+    # Fetch one extra row to know whether another page exists
+    params.append(limit + 1)
+
+    rows = [_site_dict(row) for row in _fetchall(query, params)]
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(last["created_at"], last["id"])
+    return rows, next_cursor
+
+def count_completed_sites(collapse_duplicates: bool = False, mode: Optional[str] = None) -> int:
+    """
+    Count completed sites (served from idx_sites_status_created, or with `mode` from
+    idx_sites_status_mode_created), or with collapse_duplicates the number of
+    near-duplicate clusters among them.
+    """
+    condition = "sites.status = 'completed'" + (" AND sites.generation_mode = ?" if mode else "")
+    params = [mode] if mode else []
+    if collapse_duplicates:
+        return _fetchone(f'''
+            SELECT COUNT(DISTINCT COALESCE(f.cluster_id, sites.id)) FROM sites
+            LEFT JOIN site_fingerprints f ON f.site_id = sites.id
+            WHERE {condition}
+        ''', params)[0]
+    return _fetchone(f"SELECT COUNT(*) FROM sites WHERE {condition}", params)[0]
+
+def get_completed_site_ids() -> List[str]:
+    """Ids of all completed sites (read from idx_sites_status_created alone)"""
+    return [row[0] for row in _fetchall("SELECT id FROM sites WHERE status = 'completed'")]
+
+def get_site_palettes(site_ids: Optional[List[str]] = None) -> Dict[str, Any]:
+    """
+    color_palette of completed sites by id (absent if the site has none),
+    for the given ids or, with None, for every completed site.
+    """
+    query = '''
+        SELECT id, color_palette FROM sites
+        WHERE status = 'completed' AND color_palette IS NOT NULL
+    '''
+    if site_ids is None:
+        batches = [_fetchall(query)]
+    else:
+        batches = (
+            _fetchall(f"{query} AND id IN ({', '.join('?' for _ in chunk)})", chunk)
+            for chunk in (site_ids[start:start + 500] for start in range(0, len(site_ids), 500))
+        )
+    palettes: Dict[str, Any] = {}
+    for rows in batches:
+        for row in rows:
+            palettes[row["id"]] = json.loads(row["color_palette"])
+    return palettes
+
+def get_completed_sites(site_ids: List[str]) -> List[Dict[str, Any]]:
+    """Gallery fields plus color_palette for completed sites, in the order of site_ids"""
+    if not site_ids:
+        return []
+    rows = _fetchall(f'''
+        SELECT {", ".join(DEFAULT_GALLERY_FIELDS)}, color_palette
+        FROM sites WHERE id IN ({", ".join("?" for _ in site_ids)}) AND status = 'completed'
+    ''', site_ids)
+    by_id = {}
+    for row in rows:
+        site = _site_dict(row)
+        by_id[site["id"]] = site
+    return [by_id[site_id] for site_id in site_ids if site_id in by_id]
+
+def build_search_query(text: str) -> str:
+    """
+    FTS5 MATCH expression for free text: every word must match the start of an
+    indexed word, so "비누" also finds "비누를" and "비누의". Raises ValueError if
+    the text has no words.
+    """
+    terms = re.findall(r"\w+", unicodedata.normalize("NFKC", text).lower())
+    if not terms:
+        raise ValueError("Search query has no searchable words")
+    phrases = " ".join(f'"{term}"*' for term in terms[:SEARCH_MAX_TERMS])
+    return f"{SEARCH_TEXT_COLUMNS} : ({phrases})"
+
+def _search_token(value: str) -> str:
+    token = re.sub(r"\W", "", value.lower())
+    if not token:
+        raise ValueError(f"Invalid filter value: {value!r}")
+    return token
+
+def _encode_search_cursor(sort: str, score: Optional[float], rowid: int) -> str:
+    raw = json.dumps([sort, score, rowid]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+def _decode_search_cursor(cursor: str, sort: str) -> Tuple[Optional[float], int]:
+    try:
+        cursor_sort, score, rowid = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        score = None if score is None else float(score)
+        rowid = int(rowid)
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {e}")
+    if cursor_sort != sort:
+        raise ValueError("Invalid cursor: it belongs to a different sort order")
+    return score, rowid
+
+def search_sites(text: str, limit: int, cursor: Optional[str] = None, sort: str = "relevance",
+                 created_from: Optional[datetime] = None, created_before: Optional[datetime] = None,
+                 mode: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    Full-text search over completed sites (product_type, design_style and the
+    explanation / key_points in meta_data).
+
+    sort="relevance" orders by bm25 among the SEARCH_CANDIDATES most recent matches;
+    sort="recent" is newest first and stops reading the index after one page.
+    created_from / created_before bound created_at; mode (generation_mode) is matched
+    in the index itself.
+    Each item carries a `snippet` with matches wrapped in <mark> (the rest is
+    HTML-escaped). Returns (items, next_cursor); raises ValueError on a bad query or cursor.
+    """
+    if sort not in SEARCH_SORTS:
+        raise ValueError(f"Unknown sort: {sort}")
+    text_match = build_search_query(text)
+    match = text_match if mode is None else f'{text_match} AND generation_mode : "{_search_token(mode)}"'
+
+    filters = ""
+    params: List[Any] = [match]
+    if created_from is not None:
+        filters += " AND s.created_at >= ?"
+        params.append(created_from)
+    if created_before is not None:
+        filters += " AND s.created_at < ?"
+        params.append(created_before)
+
+    columns = ", ".join(f"s.{column}" for column in SEARCH_FIELDS)
+    mode_sql = "COALESCE(json_extract(s.meta_data, '$.generation_mode'), 'smart') AS generation_mode"
+    after = _decode_search_cursor(cursor, sort) if cursor else None
+    if sort == "relevance":
+        weights = ", ".join(str(weight) for weight in SEARCH_WEIGHTS)
+        # Without a created_at bound the candidates come from the index alone; reading
+        # the sites row of every match costs as much as ranking it
+        candidate_join = " JOIN sites s ON s.rowid = sites_fts.rowid" if filters else ""
+        # Sites rows are only read for the page, not for every candidate
+        after_sql = " WHERE score > ? OR (score = ? AND rid < ?)" if after else ""
+        query = f'''
+            WITH candidates AS (
+                SELECT sites_fts.rowid AS rid, bm25(sites_fts, {weights}) AS score
+                FROM sites_fts{candidate_join}
+                WHERE sites_fts MATCH ?{filters}
+                ORDER BY sites_fts.rowid DESC LIMIT ?
+            ), page AS (
+                SELECT rid, score FROM candidates{after_sql}
+                ORDER BY score, rid DESC LIMIT ?
+            )
+            SELECT {columns}, {mode_sql}, p.rid, p.score
+            FROM page p JOIN sites s ON s.rowid = p.rid
+            ORDER BY p.score, p.rid DESC
+        '''
+        params.append(SEARCH_CANDIDATES)
+        if after:
+            params.extend([after[0], after[0], after[1]])
+    else:
+        query = f'''
+            SELECT {columns}, {mode_sql}, sites_fts.rowid AS rid, NULL AS score
+            FROM sites_fts JOIN sites s ON s.rowid = sites_fts.rowid
+            WHERE sites_fts MATCH ?{filters}
+        '''
+        if after:
+            query += " AND sites_fts.rowid < ?"
+            params.append(after[1])
+        query += " ORDER BY sites_fts.rowid DESC LIMIT ?"
+    # Fetch one extra row to know whether another page exists
+    params.append(limit + 1)
+
+    rows = [dict(row) for row in _fetchall(query, params)]
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = _encode_search_cursor(sort, rows[-1]["score"], rows[-1]["rid"])
+
+    # Snippets only for the page being returned. FTS5 seeks on the rowid range; the
+    # unary + keeps the IN list from being passed to it instead, which would make it
+    # walk every match.
+    snippets = {}
+    if rows:
+        rids = [row["rid"] for row in rows]
+        placeholders = ", ".join("?" for _ in rids)
+        for row in _fetchall(f'''
+            SELECT rowid, snippet(sites_fts, -1, char(2), char(3), '…', 12) AS snippet
+            FROM sites_fts
+            WHERE sites_fts MATCH ? AND rowid BETWEEN ? AND ? AND +rowid IN ({placeholders})
+        ''', [text_match, min(rids), max(rids)] + rids):
+            snippets[row["rowid"]] = row["snippet"]
+
+    items = []
+    for row in rows:
+        rid, score = row.pop("rid"), row.pop("score")
+        if score is not None:
+            # bm25 is lower-is-better; expose higher-is-better
+            row["score"] = round(-score, 6)
+        snippet = html_escape(snippets.get(rid) or "")
+        row["snippet"] = snippet.replace("\x02", "<mark>").replace("\x03", "</mark>")
+        items.append(row)
+    return items, next_cursor
 
 def delete_site(site_id: str) -> bool:
-    """Delete a site by ID"""
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('DELETE FROM sites WHERE id = ?', (site_id,))
-    deleted = c.rowcount > 0
-    conn.commit()
-    conn.close()
-    return deleted
+    """Delete a site by ID (and its HTML blobs if no other site shares them)"""
+    with transaction() as conn:
+        row = conn.execute('SELECT html_hash, original_html_hash FROM sites WHERE id = ?', (site_id,)).fetchone()
+        cur = conn.execute('DELETE FROM sites WHERE id = ?', (site_id,))
+        if row:
+            _release_html_blob(conn, row["html_hash"])
+            _release_html_blob(conn, row["original_html_hash"])
+        return cur.rowcount > 0
+
+# ---------------------------------------------------------------------------
+# Near-duplicate detection (MinHash signatures + LSH buckets, see minhash.py)
+# ---------------------------------------------------------------------------
+
+def _fingerprint(site_id: str, html: str) -> Optional[Any]:
+    """MinHash signature of a page; None if it has no content or fingerprinting fails"""
+    try:
+        return minhash.fingerprint(html)
+    except Exception as e:
+        print(f"[{datetime.now()}] Fingerprinting {site_id} failed: {e}")
+        return None
+
+def _similar_sites(conn: sqlite3.Connection, signature: Any, exclude: str, threshold: float) -> List[Tuple[str, float, str]]:
+    """
+    Completed sites sharing an LSH bucket with `signature` whose estimated similarity
+    is at least `threshold`, as (site_id, similarity, cluster_id), most similar first.
+    """
+    buckets = minhash.band_buckets(signature)
+    # CROSS JOIN pins the join order: start from the buckets, never from the sites
+    rows = conn.execute(f'''
+        SELECT f.site_id, f.signature, f.cluster_id
+        FROM (SELECT DISTINCT site_id FROM site_lsh_buckets WHERE bucket IN ({", ".join("?" for _ in buckets)})) c
+        CROSS JOIN site_fingerprints f ON f.site_id = c.site_id
+        CROSS JOIN sites s ON s.id = f.site_id
+        WHERE c.site_id != ? AND s.status = 'completed'
+    ''', buckets + [exclude]).fetchall()
+    matches = []
+    for row in rows:
+        similarity = minhash.similarity(signature, minhash.from_blob(row["signature"]))
+        if similarity >= threshold:
+            matches.append((row["site_id"], similarity, row["cluster_id"]))
+    matches.sort(key=lambda match: -match[1])
+    return matches
+
+def _store_fingerprint(conn: sqlite3.Connection, site_id: str, signature: Any):
+    """Index a site's signature; it joins the cluster of its most similar near-duplicate"""
+    matches = _similar_sites(conn, signature, site_id, minhash.NEAR_DUPLICATE_THRESHOLD)
+    cluster_id = matches[0][2] if matches else site_id
+    conn.execute('''
+        INSERT OR REPLACE INTO site_fingerprints (site_id, signature, cluster_id, created_at)
+        VALUES (?, ?, ?, ?)
+    ''', (site_id, minhash.to_blob(signature), cluster_id, time.time()))
+    conn.execute('DELETE FROM site_lsh_buckets WHERE site_id = ?', (site_id,))
+    conn.executemany(
+        'INSERT OR IGNORE INTO site_lsh_buckets (bucket, site_id) VALUES (?, ?)',
+        [(bucket, site_id) for bucket in minhash.band_buckets(signature)],
+    )
+    # Collapsed gallery pages depend on clusters
+    conn.execute("UPDATE change_counters SET value = value + 1 WHERE name = 'gallery'")
+
+def get_near_duplicates(site_id: str, threshold: float, limit: int) -> Optional[List[Dict[str, Any]]]:
+    """
+    Near-duplicates of a completed site (gallery fields + similarity), most similar
+    first. Only sites sharing an LSH bucket are compared, so the cost depends on the
+    number of candidates rather than the number of sites. A site stored before
+    fingerprinting existed is fingerprinted first. None if the site is not completed.
+    """
+    row = _fetchone('''
+        SELECT s.status, f.signature FROM sites s LEFT JOIN site_fingerprints f ON f.site_id = s.id
+        WHERE s.id = ?
+    ''', (site_id,))
+    if not row or row["status"] != "completed":
+        return None
+    if row["signature"] is not None:
+        signature = minhash.from_blob(row["signature"])
+    else:
+        signature = _fingerprint_stored_site(site_id)
+        if signature is None:
+            return []
+
+    matches = _similar_sites(get_connection(), signature, site_id, threshold)[:limit]
+    if not matches:
+        return []
+    similarity = {match_id: round(value, 3) for match_id, value, _ in matches}
+    rows = _fetchall(f'''
+        SELECT {", ".join(DEFAULT_GALLERY_FIELDS)} FROM sites WHERE id IN ({", ".join("?" for _ in similarity)})
+    ''', list(similarity))
+    sites = {row["id"]: dict(row) for row in rows}
+    return [{**sites[match_id], "similarity": value} for match_id, value in similarity.items() if match_id in sites]
+
+def _fingerprint_stored_site(site_id: str) -> Optional[Any]:
+    row = _fetchone(f"SELECT {HTML_CONTENT_SQL} FROM sites WHERE id = ?", (site_id,))
+    signature = _fingerprint(site_id, row["html_content"]) if row and row["html_content"] else None
+    if signature is not None:
+        with transaction() as conn:
+            # The site may have been deleted or fingerprinted meanwhile
+            pending = conn.execute('''
+                SELECT 1 FROM sites s WHERE s.id = ? AND s.status = 'completed'
+                AND NOT EXISTS (SELECT 1 FROM site_fingerprints f WHERE f.site_id = s.id)
+            ''', (site_id,)).fetchone()
+            if pending:
+                _store_fingerprint(conn, site_id, signature)
+    return signature
+
+def backfill_fingerprints(batch: int, after: Optional[str] = None) -> Tuple[int, Optional[str]]:
+    """
+    Fingerprint up to `batch` completed sites stored before fingerprinting existed,
+    oldest first, continuing after the `after` cursor (sites without fingerprintable
+    content are skipped, not retried). Returns (sites tried, cursor for the next batch).
+    """
+    query = '''
+        SELECT s.id, s.created_at FROM sites s
+        WHERE s.status = 'completed' AND NOT EXISTS (SELECT 1 FROM site_fingerprints f WHERE f.site_id = s.id)
+    '''
+    params: List[Any] = []
+    if after:
+        query += " AND (s.created_at, s.id) > (?, ?)"
+        params.extend(decode_cursor(after))
+    rows = _fetchall(query + " ORDER BY s.created_at, s.id LIMIT ?", params + [batch])
+    for row in rows:
+        _fingerprint_stored_site(row["id"])
+    return len(rows), (encode_cursor(rows[-1]["created_at"], rows[-1]["id"]) if rows else after)
+
+def fingerprint_usage() -> Dict[str, int]:
+    row = _fetchone('''
+        SELECT
+            (SELECT COUNT(*) FROM site_fingerprints) AS fingerprinted,
+            (SELECT COUNT(DISTINCT cluster_id) FROM site_fingerprints) AS clusters,
+            (SELECT COUNT(*) FROM site_lsh_buckets) AS buckets,
+            (SELECT COUNT(*) FROM sites s WHERE s.status = 'completed'
+                AND NOT EXISTS (SELECT 1 FROM site_fingerprints f WHERE f.site_id = s.id)) AS unfingerprinted
+    ''')
+    return dict(row)
+
+# ---------------------------------------------------------------------------
+# Generation metrics (see services/metrics.py)
+# ---------------------------------------------------------------------------
+
+def record_generation_metrics(row: Dict[str, Any]):
+    columns = [column for column in row if column in _GENERATION_METRIC_COLUMNS]
+    with transaction() as conn:
+        conn.execute(
+            f"INSERT INTO generation_metrics ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)})",
+            [row[column] for column in columns],
+        )
+
+def get_generation_metrics(site_id: str) -> List[Dict[str, Any]]:
+    """Every recorded attempt of one site's generation, oldest first"""
+    return [dict(row) for row in _fetchall(
+        "SELECT * FROM generation_metrics WHERE site_id = ? ORDER BY id", (site_id,)
+    )]
+
+def summarize_generation_metrics(since: float) -> Dict[str, Any]:
+    """
+    p50/p95/max per stage and end to end over the attempts started since `since`
+    (epoch seconds). Percentiles are nearest-rank over the attempts that ran the stage.
+    """
+    rows = _fetchall(f'''
+        SELECT status, total_ms, {", ".join(f"{stage}_ms" for stage in GENERATION_METRIC_STAGES)},
+               {", ".join(GENERATION_METRIC_VALUES)}
+        FROM generation_metrics WHERE started_at >= ?
+    ''', (since,))
+
+    def percentiles(values: List[float]) -> Optional[Dict[str, float]]:
+        if not values:
+            return None
+        values = sorted(values)
+        rank = lambda q: values[min(len(values) - 1, max(0, int(round(q * len(values) + 0.5)) - 1))]
+        return {"count": len(values), "p50": rank(0.5), "p95": rank(0.95), "max": values[-1]}
+
+    completed = [row for row in rows if row["status"] == "completed"]
+    return {
+        "attempts": len(rows),
+        "errors": len(rows) - len(completed),
+        "total_ms": percentiles([row["total_ms"] for row in completed]),
+        "stages_ms": {
+            stage: percentiles([row[f"{stage}_ms"] for row in completed if row[f"{stage}_ms"] is not None])
+            for stage in GENERATION_METRIC_STAGES
+        },
+        "averages": {
+            name: round(sum(row[name] for row in completed) / len(completed), 1) if completed else 0
+            for name in GENERATION_METRIC_VALUES
+        },
+    }
+
+_GENERATION_METRIC_COLUMNS = {
+    "site_id", "attempt", "status", "started_at", "total_ms", "error",
+    *(f"{stage}_ms" for stage in GENERATION_METRIC_STAGES), *GENERATION_METRIC_VALUES,
+}
+
+# ---------------------------------------------------------------------------
+# Generation job queue
+# ---------------------------------------------------------------------------
+
+def enqueue_job(job_id: str, payload: Dict[str, Any], max_attempts: int = 3, delay: float = 0.0):
+    now = time.time()
+    with transaction() as conn:
+        conn.execute('''
+            INSERT INTO jobs (id, payload, status, attempts, max_attempts, available_at, created_at, updated_at)
+            VALUES (?, ?, 'queued', 0, ?, ?, ?, ?)
+        ''', (job_id, json.dumps(payload), max_attempts, now + delay, now, now))
+
+def lease_next_job(worker_id: str, lease_seconds: float) -> Optional[Dict[str, Any]]:
+    """
+    Atomically claim the oldest runnable job: a queued job whose backoff has elapsed,
+    or a running job whose lease expired (its worker died without finishing it).
+    """
+    now = time.time()
+    with transaction() as conn:
+        row = conn.execute('''
+            SELECT * FROM jobs
+            WHERE (status = 'queued' AND available_at <= ?)
+               OR (status = 'running' AND lease_expires_at < ?)
+            ORDER BY available_at, created_at
+            LIMIT 1
+        ''', (now, now)).fetchone()
+        if row is None:
+            return None
+        conn.execute('''
+            UPDATE jobs
+            SET status = 'running', attempts = attempts + 1, lease_owner = ?, lease_expires_at = ?, updated_at = ?
+            WHERE id = ?
+        ''', (worker_id, now + lease_seconds, now, row["id"]))
+    job = dict(row)
+    job["attempts"] += 1
+    job["payload"] = json.loads(job["payload"])
+    return job
+
+def heartbeat_job(job_id: str, worker_id: str, lease_seconds: float) -> bool:
+    """Extend a lease. Returns False if the job is no longer leased by this worker."""
+    now = time.time()
+    with transaction() as conn:
+        cur = conn.execute('''
+            UPDATE jobs
+            SET lease_expires_at = ?, updated_at = ?
+            WHERE id = ? AND status = 'running' AND lease_owner = ?
+        ''', (now + lease_seconds, now, job_id, worker_id))
+        return cur.rowcount > 0
+
+def complete_job(job_id: str, worker_id: str) -> bool:
+    """Mark a job done. Returns False (and changes nothing) if worker_id no longer holds the lease."""
+    with transaction() as conn:
+        cur = conn.execute('''
+            UPDATE jobs
+            SET status = 'done', lease_owner = NULL, lease_expires_at = NULL, updated_at = ?
+            WHERE id = ? AND status = 'running' AND lease_owner = ?
+        ''', (time.time(), job_id, worker_id))
+        return cur.rowcount > 0
+
+def fail_job(job_id: str, worker_id: str, error: str, retry_delay: Optional[float] = None) -> bool:
+    """
+    Record a failed attempt. With retry_delay the job is re-queued, otherwise it is failed for good.
+    Returns False (and changes nothing) if worker_id no longer holds the lease.
+    """
+    now = time.time()
+    with transaction() as conn:
+        if retry_delay is None:
+            cur = conn.execute('''
+                UPDATE jobs
+                SET status = 'failed', last_error = ?, lease_owner = NULL, lease_expires_at = NULL, updated_at = ?
+                WHERE id = ? AND status = 'running' AND lease_owner = ?
+            ''', (error, now, job_id, worker_id))
+        else:
+            cur = conn.execute('''
+                UPDATE jobs
+                SET status = 'queued', last_error = ?, available_at = ?, lease_owner = NULL, lease_expires_at = NULL, updated_at = ?
+                WHERE id = ? AND status = 'running' AND lease_owner = ?
+            ''', (error, now + retry_delay, now, job_id, worker_id))
+        return cur.rowcount > 0
+
+def recover_orphaned_jobs(max_attempts: int = 3) -> int:
+    """
+    Startup recovery. Re-queues running jobs whose lease has expired, and enqueues
+    sites left 'pending' without a job (created before the queue existed) with
+    `max_attempts`. Returns the number of jobs recovered.
+    """
+    now = time.time()
+    with transaction() as conn:
+        requeued = conn.execute('''
+            UPDATE jobs
+            SET status = 'queued', available_at = ?, lease_owner = NULL, lease_expires_at = NULL, updated_at = ?
+            WHERE status = 'running' AND lease_expires_at < ?
+        ''', (now, now, now)).rowcount
+        orphans = conn.execute('''
+            SELECT id, meta_data FROM sites
+            WHERE status = 'pending' AND id NOT IN (SELECT id FROM jobs)
+        ''').fetchall()
+        for row in orphans:
+            conn.execute('''
+                INSERT INTO jobs (id, payload, status, attempts, max_attempts, available_at, created_at, updated_at)
+                VALUES (?, ?, 'queued', 0, ?, ?, ?, ?)
+            ''', (row["id"], row["meta_data"] or "{}", max_attempts, now, now, now))
+    return requeued + len(orphans)
+
+def get_job_queue_info(job_id: str) -> Optional[Dict[str, Any]]:
+    """Queue state for /results: job status, attempts, 1-based position among queued jobs and queue depth"""
+    row = _fetchone('SELECT id, status, attempts, available_at, created_at, last_error FROM jobs WHERE id = ?', (job_id,))
+    if row is None:
+        return None
+    depth = _fetchone("SELECT COUNT(*) FROM jobs WHERE status IN ('queued', 'running')")[0]
+    info = {"state": row["status"], "attempts": row["attempts"], "depth": depth, "position": None}
+    if row["status"] == "queued":
+        info["position"] = _fetchone('''
+            SELECT COUNT(*) FROM jobs
+            WHERE status = 'queued' AND (available_at, created_at) < (?, ?)
+        ''', (row["available_at"], row["created_at"]))[0] + 1
+    return info
+
+# ---------------------------------------------------------------------------
+# Reference page cache
+# ---------------------------------------------------------------------------
+
+def get_reference_page(url: str) -> Optional[Dict[str, Any]]:
+    row = _fetchone('SELECT * FROM reference_pages WHERE url = ?', (url,))
+    if row:
+        return dict(row)
+    return None
+
+def get_reference_blob(content_hash: str) -> Optional[str]:
+    row = _fetchone('SELECT body FROM reference_blobs WHERE content_hash = ?', (content_hash,))
+    return row["body"] if row else None
+
+def store_reference_page(url: str, body: str, etag: Optional[str], last_modified: Optional[str]) -> str:
+    """Store a fetched page (raw HTML deduplicated by content hash). Returns the hash."""
+    content_hash = hashlib.sha256(body.encode("utf-8")).hexdigest()
+    now = time.time()
+    with transaction() as conn:
+        conn.execute('''
+            INSERT OR IGNORE INTO reference_blobs (content_hash, body, size)
+            VALUES (?, ?, ?)
+        ''', (content_hash, body, len(body.encode("utf-8"))))
+        conn.execute('''
+            INSERT INTO reference_pages (url, content_hash, etag, last_modified, fetched_at, last_access)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(url) DO UPDATE SET
+                content_hash = excluded.content_hash, etag = excluded.etag,
+                last_modified = excluded.last_modified, fetched_at = excluded.fetched_at,
+                last_access = excluded.last_access
+        ''', (url, content_hash, etag, last_modified, now, now))
+    return content_hash
+
+def touch_reference_page(url: str, revalidated: bool = False):
+    """Mark a cache hit (LRU); revalidated=True also restarts the TTL"""
+    now = time.time()
+    with transaction() as conn:
+        if revalidated:
+            conn.execute('UPDATE reference_pages SET last_access = ?, fetched_at = ? WHERE url = ?', (now, now, url))
+        else:
+            conn.execute('UPDATE reference_pages SET last_access = ? WHERE url = ?', (now, url))
+
+def get_reference_output(content_hash: str, variant: str, max_age: Optional[float] = None) -> Optional[str]:
+    """Stored output of (content_hash, variant); with max_age, only one computed within that many seconds"""
+    if max_age is None:
+        row = _fetchone('SELECT output FROM reference_outputs WHERE content_hash = ? AND variant = ?',
+                        (content_hash, variant))
+    else:
+        row = _fetchone('SELECT output FROM reference_outputs WHERE content_hash = ? AND variant = ? AND created_at >= ?',
+                        (content_hash, variant, time.time() - max_age))
+    return row["output"] if row else None
+
+def store_reference_output(content_hash: str, variant: str, output: str):
+    with transaction() as conn:
+        conn.execute('''
+            INSERT OR REPLACE INTO reference_outputs (content_hash, variant, output, size, created_at)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (content_hash, variant, output, len(output.encode("utf-8")), time.time()))
+
+def reference_cache_usage() -> Dict[str, int]:
+    row = _fetchone('''
+        SELECT
+            (SELECT COUNT(*) FROM reference_pages) AS pages,
+            (SELECT COUNT(*) FROM reference_blobs) AS blobs,
+            (SELECT COUNT(*) FROM reference_outputs) AS outputs,
+            (SELECT COALESCE(SUM(size), 0) FROM reference_blobs)
+                + (SELECT COALESCE(SUM(size), 0) FROM reference_outputs) AS bytes
+    ''')
+    return dict(row)
+
+def evict_reference_cache(max_bytes: int, keep: Optional[str] = None) -> int:
+    """
+    Drop least-recently-used pages until raw + prepared bytes fit in max_bytes.
+    Blobs and outputs no longer referenced by any page go with them. The page at
+    `keep` (the one just stored) is never dropped, even if it alone is over the
+    limit; it goes first on a later eviction. Returns pages evicted.
+    """
+    evicted = 0
+    with transaction() as conn:
+        def total() -> int:
+            return conn.execute('''
+                SELECT (SELECT COALESCE(SUM(size), 0) FROM reference_blobs)
+                     + (SELECT COALESCE(SUM(size), 0) FROM reference_outputs)
+            ''').fetchone()[0]
 
-# Initialize on module load
-init_db()
+        while total() > max_bytes:
+            oldest = conn.execute(
+                'SELECT url FROM reference_pages WHERE url IS NOT ? ORDER BY last_access LIMIT 1', (keep,)
+            ).fetchone()
+            if oldest is None:
+                break
+            conn.execute('DELETE FROM reference_pages WHERE url = ?', (oldest["url"],))
+            conn.execute('DELETE FROM reference_blobs WHERE content_hash NOT IN (SELECT content_hash FROM reference_pages)')
+            conn.execute('DELETE FROM reference_outputs WHERE content_hash NOT IN (SELECT content_hash FROM reference_pages)')
+            evicted += 1
+    return evicted
+
+# ---------------------------------------------------------------------------
+# Keyword translations
+# ---------------------------------------------------------------------------
+
+def get_keyword_translation(normalized: str) -> Optional[str]:
+    row = _fetchone('SELECT keywords FROM keyword_translations WHERE normalized = ?', (normalized,))
+    return row["keywords"] if row else None
+
+def store_keyword_translations(rows: List[Tuple[str, str, str]]):
+    """Store (normalized text, original product_type, keywords) rows"""
+    now = time.time()
+    with transaction() as conn:
+        conn.executemany('''
+            INSERT OR REPLACE INTO keyword_translations (normalized, product_type, keywords, created_at)
+            VALUES (?, ?, ?, ?)
+        ''', [(normalized, product_type, keywords, now) for normalized, product_type, keywords in rows])
+
+def count_keyword_translations() -> int:
+    return _fetchone('SELECT COUNT(*) FROM keyword_translations')[0]
+
+# ---------------------------------------------------------------------------
+# Image pool
+# ---------------------------------------------------------------------------
+
+def take_pool_images(keyword: str, count: int, exclude: Optional[List[str]] = None,
+                     allow_reuse: bool = False) -> Tuple[List[str], int]:
+    """
+    Mark up to `count` photos of a keyword's pool as served and return their URLs,
+    plus how many unserved photos remain. Only never-served photos are taken unless
+    allow_reuse, which falls back to the least-served, least-recently-served ones.
+    URLs in `exclude` (already handed to this caller) are skipped.
+    """
+    now = time.time()
+    exclude = exclude or []
+    placeholders = ",".join("?" * len(exclude))
+    with transaction() as conn:
+        conn.execute('''
+            INSERT INTO image_pool_keywords (keyword, requests, last_requested) VALUES (?, 1, ?)
+            ON CONFLICT(keyword) DO UPDATE SET requests = requests + 1, last_requested = excluded.last_requested
+        ''', (keyword, now))
+        rows = conn.execute(f'''
+            SELECT photo_id, url FROM image_pool
+            WHERE keyword = ? {"" if allow_reuse else "AND served_count = 0"}
+              {f"AND url NOT IN ({placeholders})" if exclude else ""}
+            ORDER BY served_count, COALESCE(last_served, 0), added_at
+            LIMIT ?
+        ''', (keyword, *exclude, count)).fetchall()
+        conn.executemany('''
+            UPDATE image_pool SET served_count = served_count + 1, last_served = ?
+            WHERE keyword = ? AND photo_id = ?
+        ''', [(now, keyword, row["photo_id"]) for row in rows])
+        unserved = conn.execute(
+            'SELECT COUNT(*) FROM image_pool WHERE keyword = ? AND served_count = 0', (keyword,)
+        ).fetchone()[0]
+    return [row["url"] for row in rows], unserved
+
+def add_pool_images(keyword: str, photos: List[Tuple[str, str]], max_per_keyword: int) -> int:
+    """Add (photo_id, url) pairs to a pool (known photos are ignored), then prune the most-served beyond the cap"""
+    now = time.time()
+    with transaction() as conn:
+        before = conn.total_changes
+        conn.executemany('''
+            INSERT OR IGNORE INTO image_pool (keyword, photo_id, url, added_at) VALUES (?, ?, ?, ?)
+        ''', [(keyword, photo_id, url, now) for photo_id, url in photos])
+        added = conn.total_changes - before
+        conn.execute('''
+            INSERT INTO image_pool_keywords (keyword, requests, last_requested, last_refill) VALUES (?, 0, ?, ?)
+            ON CONFLICT(keyword) DO UPDATE SET last_refill = excluded.last_refill
+        ''', (keyword, now, now))
+        conn.execute('''
+            DELETE FROM image_pool WHERE keyword = ? AND photo_id IN (
+                SELECT photo_id FROM image_pool WHERE keyword = ?
+                ORDER BY served_count DESC, COALESCE(last_served, 0)
+                LIMIT MAX(0, (SELECT COUNT(*) FROM image_pool WHERE keyword = ?) - ?)
+            )
+        ''', (keyword, keyword, keyword, max_per_keyword))
+    return added
+
+def get_low_image_pools(low_water: int, active_since: float, limit: int = 10) -> List[str]:
+    """Recently requested keywords with fewer than low_water unserved photos, emptiest first"""
+    rows = _fetchall('''
+        SELECT k.keyword,
+               (SELECT COUNT(*) FROM image_pool p WHERE p.keyword = k.keyword AND p.served_count = 0) AS unserved
+        FROM image_pool_keywords k
+        WHERE k.last_requested >= ?
+        GROUP BY k.keyword
+        HAVING unserved < ?
+        ORDER BY unserved, k.last_requested DESC
+        LIMIT ?
+    ''', (active_since, low_water, limit))
+    return [row["keyword"] for row in rows]
+
+def image_pool_usage() -> Dict[str, int]:
+    row = _fetchone('''
+        SELECT
+            (SELECT COUNT(*) FROM image_pool_keywords) AS keywords,
+            (SELECT COUNT(*) FROM image_pool) AS photos,
+            (SELECT COUNT(*) FROM image_pool WHERE served_count = 0) AS unserved
+    ''')
+    return dict(row)
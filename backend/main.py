@@ -1,4 +1,5 @@
-from fastapi import FastAPI, HTTPException, BackgroundTasks
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import HTMLResponse, JSONResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import Optional
@@ -6,16 +7,33 @@ import uvicorn
 import os
 from dotenv import load_dotenv
 import uuid
+import asyncio
+import time
+import gzip
+import json
+from datetime import date, datetime, timedelta
 
 # Load environment variables
 load_dotenv()
 
 # Import services
 from services.gemini_service import gemini_service
+from services.preview_service import preview_service
+from services.job_queue import JobQueue
+from services.progress_hub import progress_hub
+from services.rate_limiter import rate_limits
+from services.reference_cache import reference_cache
+from services.generation_cache import generation_cache
+from services.palette_index import palette_index, parse_palette
+from services.near_duplicates import near_duplicates
+from services.metrics import metrics
+from services.html_optimizer import optimize_html
+from services.http_cache import (
+    CompressionMiddleware, IMMUTABLE, PENDING_MAX_AGE, REVALIDATE,
+    accepts_encoding, is_not_modified, make_etag,
+)
 import database
-
-# Initialize DB
-database.init_db()
+from minhash import NEAR_DUPLICATE_THRESHOLD
 
 app = FastAPI(title="Responsive Shopping Website Generator")
 
@@ -27,12 +45,20 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# br/gzip for JSON and HTML responses (already-encoded and streamed responses pass through)
+app.add_middleware(CompressionMiddleware)
+
+# gallery / search `mode` filter: any generation_mode a site can be created with
+GENERATION_MODE_PATTERN = "^(" + "|".join(database.GENERATION_MODES) + ")$"
 
 class GenerateRequest(BaseModel):
     product_type: str
     reference_url: Optional[str] = None
     design_style: str
-    generation_mode: Optional[str] = "smart" # smart, none, raw
+    generation_mode: Optional[str] = "smart" # smart, none, raw, design
+    # Opt-in: reuse a recent identical generation instead of running a new one
+    use_cache: Optional[bool] = False
+    cache_max_age: Optional[int] = None # seconds, default GENERATION_CACHE_MAX_AGE
 
 class GenerateResponse(BaseModel):
     id: str
@@ -43,64 +69,480 @@ class GenerateResponse(BaseModel):
 async def root():
     return {"message": "API is running", "docs": "/docs"}
 
-@app.post("/generate", response_model=GenerateResponse)
-async def generate_site(request: GenerateRequest, background_tasks: BackgroundTasks):
-    site_id = str(uuid.uuid4())
+async def process_generation(site_id: str, payload: dict):
+    """Job handler: generate one site. Raises on failure so the queue can retry."""
+    req = GenerateRequest(**payload)
+    print(f"Starting generation for {site_id}...")
+    job = await database.aio.get_job_queue_info(site_id)
     
-    # Create pending record immediately
-    database.create_pending_site(site_id, request.dict())
+    async def on_progress(stage: str, html_delta: str, reset: bool):
+        with metrics.stage("progress_write"):
+            await database.aio.update_site_progress(site_id, stage, html_delta, reset)
+        progress_hub.publish(site_id)
     
-    async def process_generation(site_id: str, req: GenerateRequest):
+    # Stage timings of this attempt go to generation_metrics and /metrics
+    async with metrics.track_generation(site_id, job["attempts"] if job else 1):
+        # Call Gemini
+        result = await gemini_service.generate_website_content(
+            product_type=req.product_type,
+            reference_url=req.reference_url or "",
+            design_style=req.design_style,
+            mode=req.generation_mode or "smart",
+            on_progress=on_progress
+        )
+        
+        html_content = result.get("html", "")
+        
+        # Minified, lazy-loading, srcset version is what gets served; the original is kept
+        # for ?original=true. A failure here only costs the optimization.
+        original_html = html_content
         try:
-            print(f"Starting generation for {site_id}...")
-            # Call Gemini
-            result = await gemini_service.generate_website_content(
-                product_type=req.product_type,
-                reference_url=req.reference_url or "",
-                design_style=req.design_style,
-                mode=req.generation_mode or "smart"
-            )
-            
-            html_content = result.get("html", "")
-            
-            # Update metadata with design info
-            req_data = req.dict()
+            with metrics.stage("optimize"):
+                html_content, stats = await asyncio.to_thread(optimize_html, original_html)
+                print(f"Optimized {site_id}: {stats['original_bytes']} -> {stats['optimized_bytes']} bytes")
+        except Exception as e:
+            print(f"HTML optimization failed for {site_id}: {e}")
+            html_content = original_html
+        
+        # Update DB on success (timed with the metadata it stores and the listeners it wakes)
+        with metrics.stage("db_write"):
+            req_data = req.dict(exclude={"use_cache", "cache_max_age"})
             req_data.update({
                 "explanation": result.get("explanation"),
                 "key_points": result.get("key_points"),
                 "color_palette": result.get("color_palette")
             })
-            
-            # Update DB on success
-            database.update_site_success_with_meta(site_id, html_content, req_data)
+            await database.aio.update_site_success_with_meta(site_id, html_content, req_data, original_html)
+            progress_hub.publish(site_id)
+            palette_index.add(site_id, req_data["color_palette"])
             print(f"Site {site_id} generated successfully.")
-            
+        
+        # Gallery thumbnail; a failure here must not fail the generation
+        try:
+            with metrics.stage("preview"):
+                preview_html = await asyncio.to_thread(preview_service.render_preview, original_html)
+                await database.aio.update_site_preview(site_id, preview_html)
         except Exception as e:
-            print(f"Generation failed for {site_id}: {e}")
-            database.update_site_error(site_id, str(e))
-            
-    background_tasks.add_task(process_generation, site_id, request)
+            print(f"Preview rendering failed for {site_id}: {e}")
+
+async def on_generation_failed(site_id: str, error: str):
+    print(f"Generation failed for {site_id}: {error}")
+    await database.aio.update_site_error(site_id, error)
+    progress_hub.publish(site_id)
+
+generation_queue = JobQueue(process_generation, on_generation_failed)
+
+@app.on_event("startup")
+async def startup():
+    # Schema and migrations for DB_PATH; not at import, so importing the app (benchmarks,
+    # tools) never touches ./sites.db before the caller picks a database
+    await asyncio.to_thread(database.init_db)
+    await generation_queue.start()
+    gemini_service.start()
+    await asyncio.to_thread(palette_index.load)
+    palette_index.start()
+    near_duplicates.start()
+
+@app.post("/generate", response_model=GenerateResponse)
+async def generate_site(request: GenerateRequest):
+    site_id = str(uuid.uuid4())
+    
+    data = request.dict(exclude={"use_cache", "cache_max_age"})
+    
+    # Attach to an identical pending generation, clone a cached result, or create a pending record
+    site_id, outcome = await generation_cache.admit(site_id, data, bool(request.use_cache), request.cache_max_age)
+    if outcome == "attached":
+        return {"id": site_id, "status": "pending", "message": "Attached to identical generation in progress"}
+    if outcome == "cached":
+        palettes = await database.aio.get_site_palettes([site_id])
+        palette_index.add(site_id, palettes.get(site_id))
+        return {"id": site_id, "status": "completed", "message": "Served from recent identical generation"}
     
-    return {"id": site_id, "status": "pending", "message": "Generation started"}
+    # Hand the new pending record to the worker pool
+    await generation_queue.enqueue(site_id, data)
+    
+    return {"id": site_id, "status": "pending", "message": "Generation queued"}
 
 @app.get("/results/{site_id}")
-async def get_result(site_id: str):
-    site = database.get_site(site_id)
-    if not site:
+async def get_result(site_id: str, request: Request):
+    """
+    Finished sites are validated by row revision before anything else is read, so a
+    revisit costs one indexed lookup and a 304. Pending responses (which include the
+    live queue position) are validated by their body and only cached briefly.
+    """
+    state = await database.aio.get_site_state(site_id)
+    if not state:
         raise HTTPException(status_code=404, detail="Site not found")
-    return site
+    
+    if state["status"] != "pending":
+        etag = make_etag("site", site_id, state["revision"])
+        headers = {"ETag": etag, "Cache-Control": IMMUTABLE if state["status"] == "completed" else REVALIDATE}
+        if is_not_modified(request.headers, etag):
+            return Response(status_code=304, headers=headers)
+        site = await database.aio.get_site(site_id)
+        if site is None:
+            # Deleted since the state lookup
+            raise HTTPException(status_code=404, detail="Site not found")
+        return JSONResponse(content=site, headers=headers)
+    
+    site = await database.aio.get_site(site_id)
+    if site is None:
+        raise HTTPException(status_code=404, detail="Site not found")
+    if site["status"] == "pending":
+        # state (queued/running), 1-based position, queue depth, attempts so far
+        site["queue"] = await database.aio.get_job_queue_info(site_id)
+    body = json.dumps(site, ensure_ascii=False)
+    etag = make_etag("pending", body)
+    headers = {"ETag": etag, "Cache-Control": f"max-age={PENDING_MAX_AGE}, must-revalidate"}
+    if is_not_modified(request.headers, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+# Max wait between SSE state checks when no in-process update arrives
+SSE_POLL_SECONDS = 2.0
+SSE_KEEPALIVE_SECONDS = 15.0
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.get("/results/{site_id}/stream")
+async def stream_result(site_id: str, request: Request):
+    """
+    Server-Sent Events for a generation:
+    - progress: {stage, chars, queue}
+    - partial:  {offset, html, reset} streamed HTML appended at offset (reset: start over)
+    - complete: {id, status, meta_data} with meta_data parsed
+    - error:    {id, status, message}
+    """
+    if not await database.aio.get_site_progress(site_id, 0):
+        raise HTTPException(status_code=404, detail="Site not found")
+    
+    async def events():
+        offset = 0
+        last_progress = None
+        last_sent = time.monotonic()
+        while not await request.is_disconnected():
+            state = await database.aio.get_site_progress(site_id, offset)
+            if state is None:
+                yield _sse("error", {"id": site_id, "status": "error", "message": "Site not found"})
+                return
+            
+            if state["status"] == "completed":
+                meta = json.loads(state["meta_data"]) if state["meta_data"] else {}
+                yield _sse("complete", {"id": site_id, "status": "completed", "meta_data": meta})
+                return
+            if state["status"] == "error":
+                yield _sse("error", {"id": site_id, "status": "error", "message": state["error_message"]})
+                return
+            
+            if state["partial_length"] < offset:
+                # Generation was retried: the client starts the HTML over
+                offset = 0
+                yield _sse("partial", {"offset": 0, "html": "", "reset": True})
+                last_sent = time.monotonic()
+                continue
+            if state["partial_delta"]:
+                yield _sse("partial", {"offset": offset, "html": state["partial_delta"], "reset": False})
+                offset += len(state["partial_delta"])
+                last_sent = time.monotonic()
+            
+            progress = {
+                "stage": state["stage"] or "queued",
+                "chars": state["partial_length"],
+                "queue": await database.aio.get_job_queue_info(site_id),
+            }
+            if progress != last_progress:
+                yield _sse("progress", progress)
+                last_progress = progress
+                last_sent = time.monotonic()
+            elif time.monotonic() - last_sent >= SSE_KEEPALIVE_SECONDS:
+                yield ": keepalive\n\n"
+                last_sent = time.monotonic()
+            
+            await progress_hub.wait(site_id, SSE_POLL_SECONDS)
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 @app.get("/gallery")
-async def get_gallery():
-    return database.get_all_sites()
+async def get_gallery(
+    request: Request,
+    limit: int = Query(24, ge=1, le=100),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    collapse_duplicates: bool = False,
+    mode: Optional[str] = Query(None, pattern=GENERATION_MODE_PATTERN),
+):
+    """
+    Completed sites, newest first. Pass the returned next_cursor back as `cursor`
+    to get the following page. `fields` is a comma-separated projection; html_content
+    is only included when explicitly requested. With `collapse_duplicates`, only the
+    newest site of each near-duplicate cluster is listed, with a `duplicates` count.
+    `mode` keeps only sites generated in that generation_mode.
+    """
+    field_list = [f.strip() for f in fields.split(",") if f.strip()] if fields else None
+    
+    # Any change to completed sites bumps the counter, so an unchanged counter means
+    # the page is unchanged and can be answered without running the query
+    version = await database.aio.get_change_counter("gallery")
+    etag = make_etag("gallery", version, limit, cursor, fields, collapse_duplicates, mode)
+    headers = {"ETag": etag, "Cache-Control": REVALIDATE}
+    if is_not_modified(request.headers, etag):
+        return Response(status_code=304, headers=headers)
+    
+    try:
+        items, next_cursor = await database.aio.get_gallery_page(limit, cursor, field_list, collapse_duplicates, mode)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return JSONResponse(content={
+        "items": items,
+        "next_cursor": next_cursor,
+        "total": await database.aio.count_completed_sites(collapse_duplicates, mode),
+    }, headers=headers)
+
+@app.get("/gallery/search")
+async def search_gallery(
+    request: Request,
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(24, ge=1, le=100),
+    cursor: Optional[str] = None,
+    sort: str = Query("relevance", pattern="^(relevance|recent)$"),
+    created_from: Optional[date] = None,
+    created_to: Optional[date] = None,
+    mode: Optional[str] = Query(None, pattern=GENERATION_MODE_PATTERN),
+):
+    """
+    Full-text search over completed sites: product type, design style and the
+    generated explanation / key points. `sort` is relevance (bm25, with a <mark>ed
+    snippet per item) or recent. created_from / created_to are inclusive dates,
+    `mode` filters on generation_mode. Paginate with next_cursor like /gallery.
+    """
+    # Same validator as /gallery: results only change when completed sites do
+    version = await database.aio.get_change_counter("gallery")
+    etag = make_etag("gallery-search", version, q, limit, cursor, sort, created_from, created_to, mode)
+    headers = {"ETag": etag, "Cache-Control": REVALIDATE}
+    if is_not_modified(request.headers, etag):
+        return Response(status_code=304, headers=headers)
+    
+    try:
+        items, next_cursor = await database.aio.search_sites(
+            q, limit, cursor, sort,
+            created_from=datetime.combine(created_from, datetime.min.time()) if created_from else None,
+            created_before=datetime.combine(created_to + timedelta(days=1), datetime.min.time()) if created_to else None,
+            mode=mode,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return JSONResponse(content={"items": items, "next_cursor": next_cursor}, headers=headers)
+
+@app.get("/gallery/similar-palette")
+async def similar_palette(
+    request: Request,
+    colors: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(12, ge=1, le=100),
+):
+    """
+    Completed sites whose color palettes are closest to `colors` (comma-separated
+    hex codes, '#' optional), nearest first. `distance` is the mean best-match ΔE
+    between the palettes in CIELAB (0 = identical, under ~10 = close).
+    """
+    version = await database.aio.get_change_counter("gallery")
+    etag = make_etag("similar-palette", version, colors, limit)
+    headers = {"ETag": etag, "Cache-Control": REVALIDATE}
+    if is_not_modified(request.headers, etag):
+        return Response(status_code=304, headers=headers)
+    
+    try:
+        matches = await asyncio.to_thread(palette_index.search, colors, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return JSONResponse(content={
+        "colors": parse_palette(colors),
+        "items": await _with_distances(matches),
+    }, headers=headers)
+
+async def _with_distances(matches: list) -> list:
+    """Gallery rows for (site_id, distance) matches, in match order"""
+    distances = dict(matches)
+    sites = await database.aio.get_completed_sites([site_id for site_id, _ in matches])
+    return [{**site, "distance": distances[site["id"]]} for site in sites]
+
+@app.get("/sites/{site_id}/preview")
+async def get_site_preview(site_id: str, request: Request):
+    """Static, script-free thumbnail HTML for the gallery. Immutable once the site is completed."""
+    site = await database.aio.get_site_preview(site_id)
+    if not site or site["status"] != "completed":
+        raise HTTPException(status_code=404, detail="Preview not found")
+    
+    preview_html = site["preview_html"]
+    if not preview_html:
+        # Sites generated before previews existed are rendered on first request
+        preview_html = await asyncio.to_thread(preview_service.render_preview, site["html_content"] or "")
+        await database.aio.update_site_preview(site_id, preview_html)
+    
+    etag = make_etag(preview_html)
+    headers = {"ETag": etag, "Cache-Control": IMMUTABLE}
+    if is_not_modified(request.headers, etag):
+        return Response(status_code=304, headers=headers)
+    return HTMLResponse(content=preview_html, headers=headers)
+
+@app.get("/sites/{site_id}/html")
+async def get_site_html(site_id: str, request: Request, original: bool = False):
+    """
+    The generated page as a document: the optimized version unless original=true.
+    The stored gzip blob is sent as-is with Content-Encoding when the client accepts
+    gzip, otherwise it is decompressed.
+    """
+    blob = await database.aio.get_site_html_blob(site_id, original)
+    if not blob or blob["status"] != "completed" or blob["body"] is None:
+        raise HTTPException(status_code=404, detail="Site not found")
+    
+    compressed = accepts_encoding(request.headers, blob["encoding"])
+    etag = '"' + blob["content_hash"][:32] + ("-" + blob["encoding"] if compressed else "") + '"'
+    headers = {"ETag": etag, "Cache-Control": IMMUTABLE, "Vary": "Accept-Encoding"}
+    if is_not_modified(request.headers, etag):
+        return Response(status_code=304, headers=headers)
+    if compressed:
+        headers["Content-Encoding"] = blob["encoding"]
+        return Response(content=blob["body"], media_type="text/html; charset=utf-8", headers=headers)
+    return Response(content=gzip.decompress(blob["body"]), media_type="text/html; charset=utf-8", headers=headers)
+
+@app.get("/sites/{site_id}/optimization")
+async def get_site_optimization(site_id: str):
+    """Bytes the output optimizer saved on this site (raw and as stored gzip)"""
+    info = await database.aio.get_site_html_optimization(site_id)
+    if not info or info["status"] != "completed":
+        raise HTTPException(status_code=404, detail="Site not found")
+    return info
+
+@app.get("/sites/{site_id}/similar")
+async def similar_sites(site_id: str, request: Request, limit: int = Query(12, ge=1, le=100)):
+    """Completed sites with the closest color palettes to this one (see /gallery/similar-palette)"""
+    version = await database.aio.get_change_counter("gallery")
+    etag = make_etag("similar", version, site_id, limit)
+    headers = {"ETag": etag, "Cache-Control": REVALIDATE}
+    if is_not_modified(request.headers, etag):
+        return Response(status_code=304, headers=headers)
+    
+    matches = await asyncio.to_thread(palette_index.similar_to, site_id, limit)
+    if matches is None:
+        # Not indexed: unknown, unfinished, or completed without a palette
+        state = await database.aio.get_site_state(site_id)
+        if not state or state["status"] != "completed":
+            raise HTTPException(status_code=404, detail="Site not found")
+        matches = []
+    return JSONResponse(content={"id": site_id, "items": await _with_distances(matches)}, headers=headers)
+
+@app.get("/sites/{site_id}/near-duplicates")
+async def get_near_duplicates(
+    site_id: str,
+    request: Request,
+    threshold: float = Query(NEAR_DUPLICATE_THRESHOLD, ge=0.5, le=1.0),
+    limit: int = Query(12, ge=1, le=100),
+):
+    """
+    Completed sites whose HTML is nearly the same as this one (estimated Jaccard
+    similarity of their tag/text shingles >= threshold), most similar first.
+    Candidates come from the LSH band index, so thresholds much below 0.7 miss pairs.
+    """
+    version = await database.aio.get_change_counter("gallery")
+    etag = make_etag("near-duplicates", version, site_id, threshold, limit)
+    headers = {"ETag": etag, "Cache-Control": REVALIDATE}
+    if is_not_modified(request.headers, etag):
+        return Response(status_code=304, headers=headers)
+    
+    items = await near_duplicates.find(site_id, threshold, limit)
+    if items is None:
+        raise HTTPException(status_code=404, detail="Site not found")
+    return JSONResponse(content={"id": site_id, "threshold": threshold, "items": items}, headers=headers)
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus text exposition: per-stage generation latency histograms, sizes, retries and outcomes"""
+    return Response(content=metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/admin/generation-metrics")
+async def get_generation_metrics_summary(hours: float = Query(24, gt=0, le=24 * 30)):
+    """p50/p95/max per generation stage over the last `hours`, from the generation_metrics table"""
+    return await database.aio.summarize_generation_metrics(time.time() - hours * 3600)
+
+@app.get("/sites/{site_id}/generation-metrics")
+async def get_site_generation_metrics(site_id: str):
+    """Stage breakdown of every generation attempt of one site"""
+    attempts = await database.aio.get_generation_metrics(site_id)
+    if not attempts:
+        raise HTTPException(status_code=404, detail="No generation metrics for this site")
+    return {"id": site_id, "attempts": attempts}
+
+@app.get("/admin/rate-limits")
+async def get_rate_limits():
+    """Outbound API limiter state: tokens, adaptive rates, 429 count and time spent waiting"""
+    return rate_limits.snapshot()
+
+@app.get("/admin/model-router")
+async def get_model_router():
+    """Gemini backends (API key x model): breaker state, latency, error counts and failovers"""
+    return gemini_service.router.snapshot()
+
+@app.get("/admin/reference-cache")
+async def get_reference_cache_stats():
+    """Reference page cache hit rates and storage usage"""
+    return await reference_cache.snapshot()
+
+@app.get("/admin/keyword-cache")
+async def get_keyword_cache_stats():
+    """Product keyword translation memo: hit rates and how many misses each model call served"""
+    return await gemini_service.keyword_cache.snapshot()
+
+@app.get("/admin/image-pool")
+async def get_image_pool_stats():
+    """Unsplash image pool: warm/cold takes, refills and pool sizes"""
+    return await gemini_service.image_pool.snapshot()
+
+@app.get("/admin/generation-cache")
+async def get_generation_cache_stats():
+    """/generate coalescing: requests attached to in-flight jobs, result cache hits and misses"""
+    return generation_cache.snapshot()
+
+@app.get("/admin/html-store")
+async def get_html_store_stats():
+    """Compressed HTML blob store: blob count, raw vs stored bytes, compression and dedup ratios"""
+    return await database.aio.html_store_usage()
+
+@app.get("/admin/palette-index")
+async def get_palette_index_stats():
+    """Palette similarity index: indexed sites, memory, query latency, sync/save counts"""
+    return palette_index.snapshot()
+
+@app.get("/admin/schema")
+async def get_schema_info():
+    """Schema version of sites.db and when each migration was applied"""
+    return await database.aio.schema_info()
+
+@app.get("/admin/near-duplicates")
+async def get_near_duplicate_stats():
+    """Near-duplicate index: fingerprinted sites, clusters, LSH bucket rows, backfill progress, query latency"""
+    return await near_duplicates.snapshot()
 
 @app.delete("/sites/{site_id}")
 async def delete_site(site_id: str):
     """Delete a site by ID"""
-    deleted = database.delete_site(site_id)
+    deleted = await database.aio.delete_site(site_id)
     if not deleted:
         raise HTTPException(status_code=404, detail="Site not found")
+    palette_index.remove(site_id)
     return {"message": "Site deleted successfully"}
 
+@app.on_event("shutdown")
+async def shutdown():
+    await generation_queue.stop()
+    await gemini_service.aclose()
+    await palette_index.stop()
+    await near_duplicates.stop()
+    database.close_all()
+
 if __name__ == "__main__":
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
@@ -0,0 +1,111 @@
+import hashlib
+import os
+import re
+import zlib
+from html.parser import HTMLParser
+from typing import List, Optional
+
+import numpy as np
+
+# Signature length and LSH banding. Two sites share a band bucket with probability
+# 1 - (1 - J^ROWS)^BANDS: with 21 x 6 (the last 2 values are not banded) that is
+# 0.998 at the default 0.8 threshold, 0.28 at 0.5 and 0.015 at 0.3.
+MINHASH_PERMUTATIONS = 128
+LSH_BANDS = 21
+LSH_ROWS = 6
+# Tokens per shingle
+SHINGLE_SIZE = 5
+# Estimated Jaccard similarity from which two sites count as near-duplicates
+NEAR_DUPLICATE_THRESHOLD = float(os.getenv("NEAR_DUPLICATE_THRESHOLD", "0.8"))
+
+# Content that says nothing about the page (and differs between identical runs)
+SKIPPED_TAGS = {'script', 'noscript', 'svg'}
+
+_MERSENNE = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64(0xFFFFFFFF)
+# Fixed permutations: signatures stored in the database must stay comparable.
+# a, b < 2^32 and hashes < 2^32, so a * h + b fits in 64 bits.
+_rng = np.random.RandomState(0x5EED)
+_A = _rng.randint(1, 1 << 32, MINHASH_PERMUTATIONS, dtype=np.uint64)[:, None]
+_B = _rng.randint(0, 1 << 32, MINHASH_PERMUTATIONS, dtype=np.uint64)[:, None]
+
+_WORD = re.compile(r"[^\W\d_]+|\d+", re.UNICODE)
+
+
+class _Tokenizer(HTMLParser):
+    """Tag tokens (name + sorted classes) and lower-cased words, in document order"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.tokens: List[str] = []
+        self._skip = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIPPED_TAGS:
+            self._skip += 1
+            return
+        if self._skip:
+            return
+        # Attribute values other than class (image URLs, ids, inline handlers) vary
+        # between otherwise identical generations
+        classes = sorted(value.split() for name, value in attrs if name == "class" and value)
+        self.tokens.append("<" + ".".join([tag] + [c for group in classes for c in group]))
+
+    def handle_endtag(self, tag):
+        if tag in SKIPPED_TAGS:
+            self._skip = max(0, self._skip - 1)
+
+    def handle_data(self, data):
+        if self._skip:
+            return
+        for word in _WORD.findall(data.lower()):
+            # Prices, counts and dates change between runs; the shape does not
+            self.tokens.append("0" if word.isdigit() else word)
+
+
+def shingle_hashes(html: str) -> np.ndarray:
+    """32-bit hashes of the distinct SHINGLE_SIZE-token shingles of a page"""
+    tokenizer = _Tokenizer()
+    tokenizer.feed(html)
+    tokenizer.close()
+    tokens = tokenizer.tokens
+    if len(tokens) < SHINGLE_SIZE:
+        shingles = [" ".join(tokens)] if tokens else []
+    else:
+        shingles = [" ".join(tokens[i:i + SHINGLE_SIZE]) for i in range(len(tokens) - SHINGLE_SIZE + 1)]
+    return np.unique(np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles), dtype=np.uint64, count=len(shingles)))
+
+
+def signature(hashes: np.ndarray) -> Optional[np.ndarray]:
+    """MinHash signature (MINHASH_PERMUTATIONS uint32 values); None for an empty set"""
+    if len(hashes) == 0:
+        return None
+    permuted = ((_A * hashes[None, :] + _B) % _MERSENNE) & _MAX_HASH
+    return permuted.min(axis=1).astype(np.uint32)
+
+
+def fingerprint(html: str) -> Optional[np.ndarray]:
+    return signature(shingle_hashes(html))
+
+
+def band_buckets(sig: np.ndarray) -> List[int]:
+    """One signed 64-bit bucket key per band (the band number is part of the key)"""
+    buckets = []
+    for band in range(LSH_BANDS):
+        rows = sig[band * LSH_ROWS:(band + 1) * LSH_ROWS].tobytes()
+        digest = hashlib.blake2b(bytes([band]) + rows, digest_size=8).digest()
+        buckets.append(int.from_bytes(digest, "big", signed=True))
+    return buckets
+
+
+def similarity(a: np.ndarray, b: np.ndarray) -> float:
+    """Estimated Jaccard similarity of the shingle sets behind two signatures"""
+    return float(np.count_nonzero(a == b)) / len(a)
+
+
+def to_blob(sig: np.ndarray) -> bytes:
+    return sig.astype("<u4").tobytes()
+
+
+def from_blob(blob: bytes) -> np.ndarray:
+    return np.frombuffer(blob, dtype="<u4")
@@ -0,0 +1,432 @@
+import asyncio
+import colorsys
+import json
+import os
+import re
+from collections import Counter
+from datetime import datetime
+from html.parser import HTMLParser
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urljoin, urlparse
+
+import httpx
+import requests
+
+from services.metrics import metrics
+
+# Linked stylesheets fetched per reference page (one level of @import included)
+STYLESHEET_MAX_FILES = int(os.getenv("STYLESHEET_MAX_FILES", "8"))
+# Bytes read from one stylesheet, and from all of a page's stylesheets together
+STYLESHEET_MAX_BYTES = int(os.getenv("STYLESHEET_MAX_BYTES", str(512 * 1024)))
+STYLESHEET_TOTAL_MAX_BYTES = int(os.getenv("STYLESHEET_TOTAL_MAX_BYTES", str(2 * 1024 * 1024)))
+# Stylesheet requests in flight per page (on top of the shared client's connection pool)
+STYLESHEET_CONCURRENCY = int(os.getenv("STYLESHEET_CONCURRENCY", "4"))
+STYLESHEET_TIMEOUT = float(os.getenv("STYLESHEET_TIMEOUT", "5"))
+# Cached summaries are redistilled after this long (seconds): the page's content hash does not
+# change when only its stylesheets do
+DESIGN_TOKENS_TTL = float(os.getenv("DESIGN_TOKENS_TTL", "86400"))
+# Stylesheet responses that are a lasting answer (the sheet is gone); other errors may pass
+STYLESHEET_GONE_STATUSES = (404, 410)
+
+# Entries kept per summary list (palette gets more: it is what the model copies most)
+DESIGN_TOKEN_TOP = 6
+DESIGN_TOKEN_PALETTE = 12
+# Inline script text scanned for library signatures, per script
+SCRIPT_SCAN_CHARS = 20000
+
+LIBRARY_SIGNATURES = {
+    "GSAP": r"\bgsap\b|tweenmax|tweenlite|scrolltrigger",
+    "Swiper": r"\bswiper\b",
+    "Slick": r"\bslick(-slider|-carousel)?\b",
+    "Splide": r"\bsplide\b",
+    "AOS": r"\baos\b|data-aos",
+    "Lenis": r"\blenis\b",
+    "Locomotive Scroll": r"locomotive-scroll",
+    "Barba.js": r"\bbarba\b",
+    "Three.js": r"\bthree(\.module)?(\.min)?\.js|/three@",
+    "Lottie": r"lottie",
+    "jQuery": r"jquery",
+    "Bootstrap": r"bootstrap",
+    "Tailwind CSS": r"tailwind",
+    "Font Awesome": r"font-?awesome",
+}
+_LIBRARIES = [(name, re.compile(pattern)) for name, pattern in LIBRARY_SIGNATURES.items()]
+
+GENERIC_FONTS = {
+    "serif", "sans-serif", "monospace", "cursive", "fantasy", "system-ui", "ui-sans-serif", "ui-serif",
+    "ui-monospace", "-apple-system", "blinkmacsystemfont", "inherit", "initial", "unset", "revert", "emoji",
+}
+LANDMARK_TAGS = ("header", "nav", "section", "article", "aside", "footer", "form", "img", "video")
+
+_COMMENT = re.compile(r"/\*.*?\*/", re.DOTALL)
+_FONT_FACE = re.compile(r"@font-face\s*\{([^}]*)\}", re.IGNORECASE)
+_IMPORT = re.compile(r"@import\s+(?:url\(\s*)?['\"]?([^'\")\s;]+)", re.IGNORECASE)
+_RULE = re.compile(r"([^{}]*)\{([^{}]*)\}")
+_DECLARATION = re.compile(r"(--[\w-]+|[a-zA-Z-]+)\s*:\s*([^;]+?)\s*(?=;|$)")
+_MEDIA = re.compile(r"@media([^{]+)\{", re.IGNORECASE)
+_MEDIA_WIDTH = re.compile(r"\(\s*(min|max)-width\s*:\s*([\d.]+(?:px|em|rem))\s*\)", re.IGNORECASE)
+_MEDIA_RANGE = re.compile(r"\(\s*width\s*([<>]=?)\s*([\d.]+(?:px|em|rem))\s*\)", re.IGNORECASE)
+_KEYFRAMES = re.compile(r"@(?:-webkit-)?keyframes\s", re.IGNORECASE)
+_COLOR = re.compile(r"#([0-9a-fA-F]{3,8})\b|\b(rgba?|hsla?)\(([^)]*)\)", re.IGNORECASE)
+_LENGTH = re.compile(r"^-?[\d.]+(px|rem|em|ch)$")
+_FONT_SHORTHAND = re.compile(r"([\d.]+(?:px|rem|em|%))(?:\s*/\s*\S+)?\s+(.+)$")
+_DURATION = re.compile(r"(?<![\w.-])([\d.]+m?s)\b")
+_EASING = re.compile(r"cubic-bezier\([^)]*\)|\bease(?:-in-out|-in|-out)?\b|\blinear\b")
+_GOOGLE_FAMILY = re.compile(r"family=([^&:]+)")
+
+
+def _hex_color(match: re.Match) -> Optional[str]:
+    """'#rrggbb' for a CSS color match, None when transparent or malformed"""
+    code, function, args = match.group(1), match.group(2), match.group(3)
+    if code is not None:
+        if len(code) not in (3, 4, 6, 8):
+            return None
+        if len(code) in (3, 4):
+            code = "".join(c * 2 for c in code)
+        if len(code) == 8 and code[6:] == "00":
+            return None
+        return f"#{code[:6].lower()}"
+
+    parts = [p for p in re.split(r"[\s,/]+", args.strip()) if p]
+    if len(parts) < 3 or "var(" in args:
+        return None
+    try:
+        if len(parts) > 3:
+            alpha = parts[3]
+            if (float(alpha[:-1]) / 100 if alpha.endswith("%") else float(alpha)) == 0:
+                return None
+        if function.lower().startswith("rgb"):
+            channels = [float(p[:-1]) * 2.55 if p.endswith("%") else float(p) for p in parts[:3]]
+        else:
+            hue = float(re.sub(r"deg$", "", parts[0])) / 360
+            saturation, lightness = (float(p.rstrip("%")) / 100 for p in parts[1:3])
+            channels = [c * 255 for c in colorsys.hls_to_rgb(hue % 1, lightness, saturation)]
+    except ValueError:
+        return None
+    return "#" + "".join(f"{min(255, max(0, round(c))):02x}" for c in channels)
+
+
+def _primary_family(value: str) -> Optional[str]:
+    for family in value.split(","):
+        family = family.strip().strip("'\"").strip()
+        if family and not family.startswith("var(") and family.lower() not in GENERIC_FONTS:
+            return family
+    return None
+
+
+def _top(counter: Counter, limit: int = DESIGN_TOKEN_TOP) -> Dict[str, int]:
+    return dict(counter.most_common(limit))
+
+
+class PageScan(HTMLParser):
+    """
+    What distillation needs from the reference HTML, in one tokenizer pass:
+    stylesheet URLs, inline <style> and style="" CSS, and the script/link
+    URLs, inline script text and class names that libraries are recognized by.
+    """
+
+    def __init__(self, base_url: str):
+        super().__init__(convert_charrefs=True)
+        self.base_url = base_url
+        self.stylesheets: List[str] = []
+        self.css: List[str] = []
+        self.evidence: List[str] = []
+        self.google_fonts: List[str] = []
+        self.landmarks: Counter = Counter()
+        self.title = ""
+        self.theme_color: Optional[str] = None
+        self._raw_tag: Optional[str] = None
+        self._raw_text: List[str] = []
+
+    def _url(self, href: str) -> Optional[str]:
+        url = urljoin(self.base_url, href.strip())
+        return url if urlparse(url).scheme in ("http", "https") else None
+
+    def handle_starttag(self, tag, attrs):
+        attrs = {key: value or "" for key, value in attrs}
+        if tag in LANDMARK_TAGS:
+            self.landmarks[tag] += 1
+        if attrs.get("style"):
+            # Every style="" is its own rule: each element using a color counts once
+            self.css.append(f"[style-{len(self.css)}]{{{attrs['style']}}}")
+        if attrs.get("class"):
+            self.evidence.append(attrs["class"])
+        self.evidence.extend(key for key in attrs if key.startswith("data-"))
+
+        if tag == "link" and attrs.get("href"):
+            self.evidence.append(attrs["href"])
+            rel = attrs.get("rel", "").lower().split()
+            url = self._url(attrs["href"])
+            if "stylesheet" in rel and url and attrs.get("media", "").lower() != "print" and url not in self.stylesheets:
+                self.stylesheets.append(url)
+                if "fonts.googleapis.com" in url:
+                    self.google_fonts += [family.replace("+", " ") for family in _GOOGLE_FAMILY.findall(url)]
+        elif tag == "script" and attrs.get("src"):
+            self.evidence.append(attrs["src"])
+        elif tag == "meta" and attrs.get("name", "").lower() == "theme-color":
+            self.theme_color = attrs.get("content")
+        if tag in ("style", "script", "title"):
+            self._raw_tag, self._raw_text = tag, []
+
+    def handle_data(self, data):
+        if self._raw_tag is not None:
+            self._raw_text.append(data)
+
+    def handle_endtag(self, tag):
+        if tag != self._raw_tag:
+            return
+        text = "".join(self._raw_text)
+        if tag == "style":
+            self.css.append(text)
+        elif tag == "script":
+            self.evidence.append(text[:SCRIPT_SCAN_CHARS])
+        else:
+            self.title = " ".join(text.split())[:80]
+        self._raw_tag, self._raw_text = None, []
+
+
+def scan_page(html: str, base_url: str) -> PageScan:
+    scan = PageScan(base_url)
+    scan.feed(html)
+    scan.close()
+    return scan
+
+
+def distill(scan: PageScan, stylesheets: List[str]) -> Dict[str, Any]:
+    """
+    Design-token summary of a page: colors by frequency, custom properties,
+    font families/sizes/weights, max-widths, media-query breakpoints, display
+    and motion usage, page landmarks and the JS/CSS libraries in use. Counts are
+    distinct (selector, property, value) declarations across inline and linked
+    CSS, so a rule repeated in a bundled or vendor sheet counts once; lists keep
+    the most used entries.
+    """
+    palette, families, sizes, weights = Counter(), Counter(), Counter(), Counter()
+    max_widths, radii, display, durations, easings = Counter(), Counter(), Counter(), Counter(), Counter()
+    breakpoints: Dict[str, Counter] = {"min-width": Counter(), "max-width": Counter()}
+    variables: Dict[str, str] = {}
+    webfonts: List[str] = []
+    keyframes = 0
+    seen = set()
+
+    for css in scan.css + stylesheets:
+        css = _COMMENT.sub("", css)
+        for block in _FONT_FACE.findall(css):
+            family = re.search(r"font-family\s*:\s*([^;]+)", block)
+            name = _primary_family(family.group(1)) if family else None
+            if name and name not in webfonts:
+                webfonts.append(name)
+        css = _FONT_FACE.sub("", css)
+        keyframes += len(_KEYFRAMES.findall(css))
+        for query in _MEDIA.findall(css):
+            for bound, width in _MEDIA_WIDTH.findall(query):
+                breakpoints[f"{bound.lower()}-width"][width] += 1
+            for operator, width in _MEDIA_RANGE.findall(query):
+                breakpoints["min-width" if ">" in operator else "max-width"][width] += 1
+
+        declarations = ((" ".join(selector.split()), prop.lower(), value.replace("!important", "").strip())
+                        for selector, body in _RULE.findall(css) for prop, value in _DECLARATION.findall(body))
+        for selector, prop, value in declarations:
+            if (selector, prop, value) in seen:
+                continue
+            seen.add((selector, prop, value))
+            for match in _COLOR.finditer(value):
+                color = _hex_color(match)
+                if color:
+                    palette[color] += 1
+            if prop.startswith("--"):
+                if len(variables) < DESIGN_TOKEN_PALETTE and prop not in variables and len(value) <= 60 \
+                        and (_COLOR.search(value) or "," in value and "(" not in value):
+                    variables[prop] = value
+            elif prop == "font-family":
+                family = _primary_family(value)
+                if family:
+                    families[family] += 1
+            elif prop == "font-size":
+                sizes[" ".join(value.split())] += 1
+            elif prop == "font":
+                shorthand = _FONT_SHORTHAND.search(value)
+                if shorthand:
+                    sizes[shorthand.group(1)] += 1
+                    family = _primary_family(shorthand.group(2))
+                    if family:
+                        families[family] += 1
+            elif prop == "font-weight":
+                weights[value] += 1
+            elif prop == "max-width" and _LENGTH.match(value):
+                max_widths[value] += 1
+            elif prop == "border-radius":
+                radii[" ".join(value.split())] += 1
+            elif prop == "display" and value in ("flex", "grid", "inline-flex", "inline-grid"):
+                display[value.replace("inline-", "")] += 1
+            elif prop.startswith("transition") or prop.startswith("animation"):
+                durations.update(_DURATION.findall(value))
+                easings.update(_EASING.findall(value))
+
+    evidence = " ".join(scan.evidence).lower()
+    libraries = [name for name, pattern in _LIBRARIES if pattern.search(evidence)]
+
+    def breakpoint_list(counter: Counter) -> List[str]:
+        return sorted(counter, key=lambda width: float(re.match(r"[\d.]+", width).group()))[:DESIGN_TOKEN_TOP * 2]
+
+    summary = {
+        "title": scan.title,
+        "palette": dict(palette.most_common(DESIGN_TOKEN_PALETTE)),
+        "theme_color": scan.theme_color,
+        "variables": variables,
+        "fonts": {
+            "families": _top(families),
+            "webfonts": (webfonts + [f for f in scan.google_fonts if f not in webfonts])[:DESIGN_TOKEN_TOP],
+            "sizes": _top(sizes),
+            "weights": _top(weights),
+        },
+        "layout": {
+            "max_width": _top(max_widths),
+            "breakpoints": {bound: breakpoint_list(counter) for bound, counter in breakpoints.items() if counter},
+            "display": dict(display),
+            "border_radius": _top(radii, 4),
+            "landmarks": dict(scan.landmarks),
+        },
+        "motion": {"durations": _top(durations, 4), "easings": _top(easings, 4), "keyframes": keyframes},
+        "libraries": libraries,
+    }
+    return _without_empty(summary)
+
+
+def _without_empty(value: Any) -> Any:
+    if isinstance(value, dict):
+        value = {key: _without_empty(item) for key, item in value.items()}
+        return {key: item for key, item in value.items() if item not in (None, "", [], {}, 0)}
+    return value
+
+
+def _imports(css: str, base_url: str) -> List[str]:
+    urls = (urljoin(base_url, href) for href in _IMPORT.findall(_COMMENT.sub("", css)))
+    return [url for url in urls if urlparse(url).scheme in ("http", "https")]
+
+
+class _ByteBudget:
+    """Bytes left for one page's stylesheets, shared by its concurrent fetches"""
+
+    def __init__(self, total: int):
+        self.left = total
+
+    def take(self, size: int) -> int:
+        size = min(size, self.left)
+        self.left -= size
+        return size
+
+
+async def _fetch_one(url: str, client: httpx.AsyncClient, headers: Dict[str, str], budget: _ByteBudget,
+                     failed: List[str]) -> Optional[str]:
+    """Text of one stylesheet, or None; failures that may not recur next time are added to `failed`"""
+    try:
+        async with client.stream("GET", url, headers=headers, timeout=STYLESHEET_TIMEOUT) as resp:
+            if resp.status_code != 200:
+                print(f"[{datetime.now()}] Stylesheet {url}: HTTP {resp.status_code}")
+                if resp.status_code not in STYLESHEET_GONE_STATUSES:
+                    failed.append(url)
+                return None
+            chunks, size = [], 0
+            async for chunk in resp.aiter_bytes():
+                chunk = chunk[:budget.take(min(len(chunk), STYLESHEET_MAX_BYTES - size))]
+                chunks.append(chunk)
+                size += len(chunk)
+                if size >= STYLESHEET_MAX_BYTES or budget.left <= 0:
+                    break
+            return b"".join(chunks).decode(resp.encoding or "utf-8", errors="replace")
+    except Exception as e:
+        print(f"[{datetime.now()}] Error fetching stylesheet {url}: {e}")
+        failed.append(url)
+        return None
+
+
+async def fetch_stylesheets(urls: List[str], client: httpx.AsyncClient, headers: Dict[str, str],
+                            failed: Optional[List[str]] = None) -> List[str]:
+    """
+    Text of the linked stylesheets, then of the sheets they @import, fetched
+    STYLESHEET_CONCURRENCY at a time over the shared client's pool. At most
+    STYLESHEET_MAX_FILES sheets; each is cut at STYLESHEET_MAX_BYTES and all of
+    them at STYLESHEET_TOTAL_MAX_BYTES. Failed sheets are left out; the URLs of
+    those that failed for a reason that may pass (network error, timeout, 5xx,
+    429) are appended to `failed`.
+    """
+    failed = [] if failed is None else failed
+    semaphore = asyncio.Semaphore(STYLESHEET_CONCURRENCY)
+    budget = _ByteBudget(STYLESHEET_TOTAL_MAX_BYTES)
+    seen = set(urls[:STYLESHEET_MAX_FILES])
+
+    async def fetch(url: str, follow_imports: bool) -> List[str]:
+        async with semaphore:
+            if budget.left <= 0:
+                return []
+            sheet = await _fetch_one(url, client, headers, budget, failed)
+        if sheet is None:
+            return []
+        # A sheet's @imports start as soon as it arrives, not after every linked sheet
+        imports = []
+        for imported in _imports(sheet, url) if follow_imports else []:
+            if imported not in seen and len(seen) < STYLESHEET_MAX_FILES:
+                seen.add(imported)
+                imports.append(imported)
+        nested = await asyncio.gather(*(fetch(imported, False) for imported in imports))
+        return [sheet] + [inner for sheets in nested for inner in sheets]
+
+    results = await asyncio.gather(*(fetch(url, True) for url in urls[:STYLESHEET_MAX_FILES]))
+    return [sheet for sheets in results for sheet in sheets]
+
+
+def fetch_stylesheets_sync(urls: List[str], headers: Dict[str, str]) -> List[str]:
+    """Blocking fetch_stylesheets for the sync pipeline: one sheet at a time, no @import"""
+    sheets, left = [], STYLESHEET_TOTAL_MAX_BYTES
+    for url in urls[:STYLESHEET_MAX_FILES]:
+        if left <= 0:
+            break
+        try:
+            with requests.get(url, headers=headers, timeout=STYLESHEET_TIMEOUT, stream=True) as resp:
+                if resp.status_code != 200:
+                    continue
+                body = b""
+                for chunk in resp.iter_content(64 * 1024):
+                    body += chunk
+                    if len(body) >= min(STYLESHEET_MAX_BYTES, left):
+                        break
+                body = body[:min(STYLESHEET_MAX_BYTES, left)]
+                left -= len(body)
+                sheets.append(body.decode(resp.encoding or "utf-8", errors="replace"))
+        except Exception as e:
+            print(f"[{datetime.now()}] Error fetching stylesheet {url}: {e}")
+    return sheets
+
+
+def _summarize(scan: PageScan, stylesheets: List[str]) -> str:
+    with metrics.stage("clean_html"):
+        tokens = distill(scan, stylesheets)
+    tokens["source"] = {"linked": len(scan.stylesheets), "fetched": len(stylesheets),
+                        "css_bytes": sum(map(len, stylesheets))}
+    print(f"[{datetime.now()}] Distilled design tokens from {len(stylesheets)} stylesheet(s): "
+          f"{len(tokens.get('palette', {}))} colors, libraries {tokens.get('libraries', [])}")
+    return json.dumps(tokens, ensure_ascii=False, separators=(",", ":"))
+
+
+def _scan(html: str, base_url: str) -> PageScan:
+    with metrics.stage("clean_html"):
+        return scan_page(html, base_url)
+
+
+async def distill_reference(html: str, base_url: str, client: httpx.AsyncClient,
+                            headers: Dict[str, str]) -> Tuple[str, bool]:
+    """
+    Design tokens of a reference page and its stylesheets, as compact JSON (parsing
+    runs in worker threads), and whether every sheet was fetched or is gone for good:
+    a summary missing a sheet that failed this time must not be cached.
+    """
+    scan = await asyncio.to_thread(_scan, html, base_url)
+    failed: List[str] = []
+    stylesheets = await fetch_stylesheets(scan.stylesheets, client, headers, failed)
+    return await asyncio.to_thread(_summarize, scan, stylesheets), not failed
+
+
+def distill_reference_sync(html: str, base_url: str, headers: Dict[str, str]) -> str:
+    scan = _scan(html, base_url)
+    return _summarize(scan, fetch_stylesheets_sync(scan.stylesheets, headers))
@@ -3,31 +3,70 @@ import os
 import json
 import time
 import requests
+import httpx
 from datetime import datetime
-from typing import Dict, Any, List, Optional
-from bs4 import BeautifulSoup, Comment
+from typing import Dict, Any, List, Optional, Tuple, Callable, Awaitable, AsyncIterator
+from services.rate_limiter import rate_limits
+from services.model_router import ModelRouter, GEMINI_FALLBACK_MODELS, api_keys_from_env
+from services.prompt_budget import PROMPT_TOKEN_BUDGET, count_tokens, fit_reference, token_estimator
+from services.reference_cache import reference_cache
+from services.html_cleaner import clean_html
+from services.design_tokens import DESIGN_TOKENS_TTL, distill_reference, distill_reference_sync
+from services.keyword_cache import KeywordCache, fallback_keywords
+from services.image_pool import ImagePool
+from services.stage_graph import Stage, StageGraph
+from services.metrics import metrics
+
+BROWSER_HEADERS = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'}
+UNSPLASH_RANDOM_URL = "https://api.unsplash.com/photos/random"
+METADATA_SEPARATOR = "<<<METADATA_SEPARATOR>>>"
+
+# Bump when _prepare_reference/_clean_html output changes, so cached outputs are recomputed
+REFERENCE_PREP_VERSION = 3
+
+# Smart Filtering output bound (bytes); the prompt budget decides how much of it is sent
+SMART_FILTER_MAX_BYTES = int(os.getenv("SMART_FILTER_MAX_BYTES", "300000"))
+# Raw mode keeps at most this much of the page (chars); the prompt budget decides how much is sent
+REFERENCE_RAW_MAX_CHARS = int(os.getenv("REFERENCE_RAW_MAX_CHARS", "300000"))
+# Stands in for the reference HTML while the rest of the prompt is measured
+REFERENCE_PLACEHOLDER = "<<<REFERENCE_HTML>>>"
+
+# Pre-generation stage deadlines, in seconds from the start of preparation (async pipeline)
+PREP_REFERENCE_DEADLINE = float(os.getenv("PREP_REFERENCE_DEADLINE", "8"))
+PREP_KEYWORDS_DEADLINE = float(os.getenv("PREP_KEYWORDS_DEADLINE", "4"))
+PREP_IMAGES_DEADLINE = float(os.getenv("PREP_IMAGES_DEADLINE", "6"))
+
+# Streamed HTML is handed to the progress callback at most this often (seconds)
+PARTIAL_FLUSH_INTERVAL = 1.5
+
+# on_progress(stage, html_delta, reset): stage name, newly streamed HTML, and
+# reset=True when a retry starts the HTML over
+ProgressCallback = Callable[[str, str, bool], Awaitable[None]]
 
 class GeminiService:
     def __init__(self):
-        # Get API keys from environment
-        api_key = os.getenv("GEMINI_API_KEY")
-        if not api_key:
+        # Get API keys from environment (GEMINI_API_KEYS for several, else GEMINI_API_KEY)
+        api_keys = api_keys_from_env()
+        if not api_keys:
             raise ValueError("GEMINI_API_KEY not found in environment variables")
-        
+
         self.unsplash_access_key = os.getenv("UNSPLASH_ACCESS_KEY")
         if not self.unsplash_access_key:
             print("WARNING: UNSPLASH_ACCESS_KEY not found, will use fallback images")
-        
-        # Configure Gemini
-        genai.configure(api_key=api_key)
-        
+
+        # Configure Gemini (default client; the router's backends carry their own keys)
+        genai.configure(api_key=api_keys[0])
+
         # Get model name from environment or use default
         model_name = os.getenv("GEMINI_MODEL", "gemini-1.5-pro")
-        print(f"Using Gemini model: {model_name}")
-        
-        # Initialize model with generation config
-        self.model = genai.GenerativeModel(
-            model_name=model_name,
+        print(f"Using Gemini model: {model_name}"
+              + (f" (fallback: {', '.join(GEMINI_FALLBACK_MODELS)})" if GEMINI_FALLBACK_MODELS else "")
+              + f", {len(api_keys)} API key(s)")
+
+        # One backend per (API key, model) with generation config, see services/model_router.py
+        self.router = ModelRouter(
+            api_keys,
+            [model_name] + GEMINI_FALLBACK_MODELS,
             generation_config={
                 "temperature": 0.8,
                 "top_p": 0.95,
@@ -35,11 +74,63 @@ class GeminiService:
                 "max_output_tokens": 64000,
             }
         )
-        
-        # Rate limiting
+
+        # Pipeline switch: "async" (default) never blocks the event loop,
+        # "sync" keeps the original blocking requests/SDK calls for benchmarking
+        self.pipeline = os.getenv("GEMINI_PIPELINE", "async").lower()
+        print(f"Generation pipeline: {self.pipeline}")
+        # Stream the main generation call so partial HTML can be shown while it runs
+        self.stream = os.getenv("GEMINI_STREAM", "1") != "0"
+
+        # Shared pooled HTTP client for the async pipeline (created lazily inside the loop)
+        self._http: Optional[httpx.AsyncClient] = None
+
+        # Product description -> search keywords memo (memory LRU + sites.db, batched misses)
+        self.keyword_cache = KeywordCache(self._translate_keywords_async, self._translate_keywords)
+
+        # Prefetched Unsplash photos per search keyword (refilled in the background)
+        self.image_pool = ImagePool(self._fetch_unsplash_photos, self._get_http_client)
+
+        # Rate limiting (sync pipeline only; the async pipeline uses services.rate_limiter)
         self.last_request_time = 0
         self.min_request_interval = 1.0  # seconds
-    
+
+    @property
+    def model(self):
+        """The primary backend's model (what the sync pipeline calls)"""
+        return self.router.primary.bound_model(use_async=False)
+
+    @model.setter
+    def model(self, model):
+        # Benchmarks swap in stand-in models; every backend gets the same one
+        for backend in self.router.backends:
+            backend.model = model
+
+    @property
+    def use_async(self) -> bool:
+        return self.pipeline != "sync"
+
+    def _get_http_client(self) -> httpx.AsyncClient:
+        if self._http is None or self._http.is_closed:
+            self._http = httpx.AsyncClient(
+                timeout=httpx.Timeout(10.0),
+                limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+                follow_redirects=True,
+            )
+        return self._http
+
+    def start(self):
+        """Start background work (image pool refresher); called from app startup"""
+        if self.unsplash_access_key:
+            self.image_pool.start()
+
+    async def aclose(self):
+        """Stop background work and close the shared HTTP client (app shutdown)"""
+        await self.image_pool.stop()
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+
     def _check_rate_limits(self):
         """Simple rate limiting to avoid hitting API limits"""
         current_time = time.time()
@@ -47,195 +138,304 @@ class GeminiService:
         if time_since_last < self.min_request_interval:
             time.sleep(self.min_request_interval - time_since_last)
         self.last_request_time = time.time()
-    
-    def _extract_search_keywords(self, product_type: str) -> str:
-        """Use Gemini to extract English search keywords from product description"""
-        try:
-            prompt = f"""
-            Translate this product description into 2-3 simple English keywords for stock photo search.
-            Input: "{product_type}"
-            
+
+    def _keyword_prompt(self, product_types: List[str]) -> str:
+        inputs = "\n".join(f"{i + 1}. {json.dumps(product_type, ensure_ascii=False)}" for i, product_type in enumerate(product_types))
+        return f"""
+            Translate each product description into 2-3 simple English keywords for stock photo search.
+            Inputs:
+            {inputs}
+
             Rules:
-            1. Output ONLY the keywords separated by spaces
-            2. No punctuation, no explanations
+            1. Output ONLY a JSON array of {len(product_types)} strings, one per input, in the same order
+            2. Each string is the keywords separated by spaces, no punctuation, no explanations
             3. Focus on the visual object (e.g. "warm roasted sweet potato lollipop" -> "lollipop candy dessert")
             """
-            
-            response = self.model.generate_content(prompt)
-            keywords = response.text.strip()
-            # Remove any accidental quotes or newlines
-            keywords = keywords.replace('"', '').replace('\n', ' ')
-            print(f"[{datetime.now()}] Translated '{product_type}' -> '{keywords}'")
-            return keywords
-        except Exception as e:
-            print(f"[{datetime.now()}] Keyword extraction failed: {e}")
-            # Fallback to simple replacement
-            return product_type.replace("천연 재료로 만든 ", "").replace("수제 ", "")
+
+    def _clean_keywords(self, product_type: str, text: str) -> str:
+        keywords = text.strip()
+        # Remove any accidental quotes or newlines
+        keywords = keywords.replace('"', '').replace('\n', ' ')
+        print(f"[{datetime.now()}] Translated '{product_type}' -> '{keywords}'")
+        return keywords
+
+    def _parse_keywords(self, product_types: List[str], text: str) -> List[Optional[str]]:
+        """Keywords per input from the model's JSON array (None for missing/blank entries)"""
+        text = text.strip()
+        if text.startswith("```"):
+            text = text.split("\n", 1)[-1].rsplit("```", 1)[0]
+        try:
+            items = json.loads(text[text.index("["):text.rindex("]") + 1])
+        except ValueError:
+            # Single input answered in the old plain-text format
+            items = [text] if len(product_types) == 1 else []
+        if not isinstance(items, list):
+            items = []
+        results: List[Optional[str]] = []
+        for i, product_type in enumerate(product_types):
+            item = items[i] if i < len(items) and isinstance(items[i], str) else ""
+            results.append(self._clean_keywords(product_type, item) if item.strip() else None)
+        return results
+
+    def _translate_keywords(self, product_types: List[str]) -> List[Optional[str]]:
+        response = self.model.generate_content(self._keyword_prompt(product_types))
+        return self._parse_keywords(product_types, response.text)
+
+    async def _translate_keywords_async(self, product_types: List[str]) -> List[Optional[str]]:
+        prompt = self._keyword_prompt(product_types)
+
+        async def consume(response) -> str:
+            return response.text
+
+        # Keyword misses have a fallback, so they do not wait out a long retry sequence
+        text = await self.router.call(prompt, consume, kind="keywords", max_attempts=2)
+        return self._parse_keywords(product_types, text)
+
+    def _extract_search_keywords(self, product_type: str) -> str:
+        """English search keywords for a product description (memoized, see services/keyword_cache.py)"""
+        with metrics.stage("keywords"):
+            return self.keyword_cache.get_sync(product_type)
+
+    async def _extract_search_keywords_async(self, product_type: str) -> str:
+        """Async form of _extract_search_keywords; concurrent misses share one model call"""
+        with metrics.stage("keywords"):
+            return await self.keyword_cache.get(product_type)
+
+    def _unsplash_request(self, search_query: str, count: int) -> Tuple[Dict[str, str], Dict[str, Any]]:
+        headers = {
+            "Authorization": f"Client-ID {self.unsplash_access_key}"
+        }
+        params = {
+            "query": search_query,
+            "count": count,
+            "orientation": "landscape"
+        }
+        print(f"[{datetime.now()}] Fetching {count} images from Unsplash for '{search_query}'...")
+        return headers, params
+
+    def _parse_unsplash_photos(self, photos: Any, count: int) -> List[str]:
+        image_urls = []
+
+        # Handle both single photo and array responses (Unsplash API quirk)
+        if isinstance(photos, list):
+            for i, photo in enumerate(photos):
+                try:
+                    # Use 'raw' URL for maximum stability, with quality params
+                    url = photo.get('urls', {}).get('raw', '')
+                    if url:
+                        # Add stable parameters to raw URL
+                        stable_url = f"{url}&fm=jpg&q=80&w=1200&fit=max"
+                        image_urls.append(stable_url)
+                        print(f"[{datetime.now()}] Image {i+1}: {stable_url[:80]}...")
+                except Exception as e:
+                    print(f"[{datetime.now()}] Failed to extract URL from photo {i+1}: {e}")
+
+        elif isinstance(photos, dict):
+            try:
+                url = photos.get('urls', {}).get('raw', '')
+                if url:
+                    stable_url = f"{url}&fm=jpg&q=80&w=1200&fit=max"
+                    image_urls.append(stable_url)
+                    print(f"[{datetime.now()}] Single image: {stable_url[:80]}...")
+            except Exception as e:
+                print(f"[{datetime.now()}] Failed to extract single photo URL: {e}")
+
+        # Filter out empty URLs
+        image_urls = [url for url in image_urls if url and len(url) > 50]
+
+        print(f"[{datetime.now()}] Successfully processed {len(image_urls)} valid images from Unsplash")
+
+        if len(image_urls) < count:
+            print(f"[{datetime.now()}] WARNING: Only got {len(image_urls)} valid images, requested {count}")
+
+        return image_urls
 
     def _get_unsplash_images(self, product_type: str, count: int = 8) -> List[str]:
         """Fetch product images from Unsplash API"""
         if not self.unsplash_access_key:
             print("No Unsplash key, using fallback")
             return []
-        
+
         try:
-            # Get optimized English keywords
-            search_query = self._extract_search_keywords(product_type)
-            
-            url = "https://api.unsplash.com/photos/random"
-            headers = {
-                "Authorization": f"Client-ID {self.unsplash_access_key}"
-            }
-            params = {
-                "query": search_query,
-                "count": count,
-                "orientation": "landscape"
-            }
-            
-            print(f"[{datetime.now()}] Fetching {count} images from Unsplash for '{search_query}'...")
-            response = requests.get(url, headers=headers, params=params, timeout=10)
-            
+            with metrics.stage("images"):
+                # Get optimized English keywords
+                search_query = self._extract_search_keywords(product_type)
+                headers, params = self._unsplash_request(search_query, count)
+                response = requests.get(UNSPLASH_RANDOM_URL, headers=headers, params=params, timeout=10)
+
             if response.status_code == 200:
-                photos = response.json()
-                
-                image_urls = []
-                
-                # Handle both single photo and array responses (Unsplash API quirk)
-                if isinstance(photos, list):
-                    for i, photo in enumerate(photos):
-                        try:
-                            # Use 'raw' URL for maximum stability, with quality params
-                            url = photo.get('urls', {}).get('raw', '')
-                            if url:
-                                # Add stable parameters to raw URL
-                                stable_url = f"{url}&fm=jpg&q=80&w=1200&fit=max"
-                                image_urls.append(stable_url)
-                                print(f"[{datetime.now()}] Image {i+1}: {stable_url[:80]}...")
-                        except Exception as e:
-                            print(f"[{datetime.now()}] Failed to extract URL from photo {i+1}: {e}")
-                            
-                elif isinstance(photos, dict):
-                    try:
-                        url = photos.get('urls', {}).get('raw', '')
-                        if url:
-                            stable_url = f"{url}&fm=jpg&q=80&w=1200&fit=max"
-                            image_urls.append(stable_url)
-                            print(f"[{datetime.now()}] Single image: {stable_url[:80]}...")
-                    except Exception as e:
-                        print(f"[{datetime.now()}] Failed to extract single photo URL: {e}")
-                
-                # Filter out empty URLs
-                image_urls = [url for url in image_urls if url and len(url) > 50]
-                
-                print(f"[{datetime.now()}] Successfully processed {len(image_urls)} valid images from Unsplash")
-                
-                if len(image_urls) < count:
-                    print(f"[{datetime.now()}] WARNING: Only got {len(image_urls)} valid images, requested {count}")
-                    
-                return image_urls
+                return self._parse_unsplash_photos(response.json(), count)
             else:
                 print(f"[{datetime.now()}] Unsplash API error: {response.status_code}")
                 return []
-                
+
+        except Exception as e:
+            print(f"[{datetime.now()}] Error fetching Unsplash images: {e}")
+            return []
+
+    async def _fetch_unsplash_photos(self, search_query: str, count: int) -> List[Tuple[str, str]]:
+        """One photos/random call for the image pool: [(photo_id, url)]"""
+        headers, params = self._unsplash_request(search_query, count)
+        await rate_limits.acquire_unsplash()
+        response = await self._get_http_client().get(UNSPLASH_RANDOM_URL, headers=headers, params=params)
+        rate_limits.observe_unsplash_response(response)
+        if response.status_code != 200:
+            raise RuntimeError(f"Unsplash API error: {response.status_code}")
+
+        photos = response.json()
+        if isinstance(photos, dict):
+            photos = [photos]
+        entries = []
+        for photo in photos:
+            url = photo.get('urls', {}).get('raw', '')
+            if photo.get('id') and url:
+                entries.append((photo['id'], f"{url}&fm=jpg&q=80&w=1200&fit=max"))
+        return entries
+
+    async def _take_unsplash_images(self, search_query: str, count: int) -> List[str]:
+        """Async counterpart of _get_unsplash_images: photos come from the per-keyword pool (services/image_pool.py)"""
+        try:
+            with metrics.stage("images"):
+                return await self.image_pool.take(search_query, count)
         except Exception as e:
             print(f"[{datetime.now()}] Error fetching Unsplash images: {e}")
             return []
-    
+
+    async def _prepare_inputs_async(self, product_type: str, reference_url: str, mode: str,
+                                    on_progress: Optional[ProgressCallback]) -> Tuple[str, bool, List[str]]:
+        """
+        Reference fetch and keywords -> images run concurrently, each bounded by a
+        deadline from the start of preparation. A late reference falls back to
+        URL-only mode (the fetch keeps running to warm the reference cache), late
+        keywords to the offline dictionary, late images to Lorem Flickr.
+        """
+        async def images(inputs: Dict[str, Any]) -> List[str]:
+            await self._emit(on_progress, "fetching_images")
+            return await self._take_unsplash_images(inputs["keywords"], 8)
+
+        stages = [
+            Stage("reference", lambda _: self._fetch_reference_async(reference_url, mode),
+                  deadline=PREP_REFERENCE_DEADLINE, fallback=lambda: ("", False), detach_on_timeout=True),
+        ]
+        if self.unsplash_access_key:
+            stages += [
+                Stage("keywords", lambda _: self._extract_search_keywords_async(product_type),
+                      deadline=PREP_KEYWORDS_DEADLINE, fallback=lambda: fallback_keywords(product_type)),
+                Stage("images", images, deadline=PREP_IMAGES_DEADLINE, fallback=list, depends_on=["keywords"]),
+            ]
+        else:
+            print("No Unsplash key, using fallback")
+
+        results = await StageGraph(stages).run()
+        reference_html, fetch_success = results["reference"]
+        return reference_html, fetch_success, results.get("images", [])
+
     def _clean_html(self, html_content: str) -> str:
         """
         Smart Filtering: Clean HTML to keep only structure and style-relevant tags.
         Removes noise like SVG paths, base64 images, and long text.
+        Single streaming pass; stops once SMART_FILTER_MAX_BYTES of output is produced.
         """
         try:
-            soup = BeautifulSoup(html_content, 'html.parser')
-            
-            # 1. Remove completely useless tags
-            for tag in soup(['noscript', 'iframe', 'object', 'embed']):
-                tag.decompose()
-            
-            # 2. Remove comments
-            for comment in soup.find_all(string=lambda text: isinstance(text, Comment)):
-                comment.extract()
-            
-            # 3. Clean SVG: Keep tag but remove paths (too long)
-            for svg in soup.find_all('svg'):
-                svg.clear() # Remove children (paths)
-                svg.attrs = {k: v for k, v in svg.attrs.items() if k in ['class', 'id', 'width', 'height', 'viewbox']}
-                svg.string = "SVG_ICON" # Placeholder
-            
-            # 4. Clean Images: Remove base64 src
-            for img in soup.find_all('img'):
-                src = img.get('src', '')
-                if src.startswith('data:'):
-                    img['src'] = 'BASE64_IMAGE_REMOVED'
-                # Remove other attributes except critical ones
-                img.attrs = {k: v for k, v in img.attrs.items() if k in ['src', 'class', 'id', 'alt']}
-            
-            # 5. Clean Scripts: Keep src (libraries), remove inline content
-            for script in soup.find_all('script'):
-                if script.get('src'):
-                    # Keep external scripts (libraries)
-                    script.string = "" 
-                else:
-                    # Remove inline scripts completely (usually logic, not style)
-                    script.decompose()
-            
-            # 6. Clean Text: Truncate long text nodes
-            for text in soup.find_all(string=True):
-                if len(text) > 50 and text.parent.name not in ['style', 'script']:
-                    text.replace_with(text[:50] + "...")
-            
-            # 7. Clean Attributes: Remove data-*, aria-*, on* events
-            for tag in soup.find_all(True):
-                attrs = dict(tag.attrs)
-                for key in attrs:
-                    if key.startswith('data-') or key.startswith('aria-') or key.startswith('on'):
-                        del tag.attrs[key]
-            
-            return str(soup)
-            
+            with metrics.stage("clean_html"):
+                return clean_html(html_content, max_bytes=SMART_FILTER_MAX_BYTES)
         except Exception as e:
             print(f"[{datetime.now()}] HTML cleaning failed: {e}")
             return html_content[:20000] # Fallback to truncation
 
-    async def generate_website_content(self, product_type: str, reference_url: str, design_style: str, mode: str = 'smart') -> dict:
-        print(f"[{datetime.now()}] Received generation request for: {product_type}")
-        print(f"[{datetime.now()}] Design style (user request): {design_style}")
-        print(f"[{datetime.now()}] Generation Mode: {mode.upper()}")
-        
-        self._check_rate_limits()
+    def _prepare_reference(self, raw_html: str, mode: str) -> str:
+        print(f"[{datetime.now()}] Fetched {len(raw_html)} chars")
+        if mode == 'smart':
+            print(f"[{datetime.now()}] Applying Smart Filtering...")
+            reference_html = self._clean_html(raw_html)
+            print(f"[{datetime.now()}] Cleaned HTML length: {len(reference_html)} chars")
+        else: # mode == 'raw'
+            reference_html = raw_html[:REFERENCE_RAW_MAX_CHARS]
+            print(f"[{datetime.now()}] Using Raw HTML ({len(reference_html)} chars, fitted to the prompt budget later)")
+        return reference_html
+
+    def _fetch_reference(self, reference_url: str, mode: str) -> Tuple[str, bool]:
+        """Fetch Reference URL content based on mode. Returns (reference_html, fetch_success)."""
+        if not (reference_url and reference_url.strip() and mode != 'none'):
+            return "", False
+        try:
+            print(f"[{datetime.now()}] Fetching reference URL content: {reference_url}")
+            with metrics.stage("reference_fetch"):
+                resp = requests.get(reference_url, headers=BROWSER_HEADERS, timeout=10)
+
+            if resp.status_code == 200:
+                if mode == 'design':
+                    return distill_reference_sync(resp.text, reference_url, BROWSER_HEADERS), True
+                return self._prepare_reference(resp.text, mode), True
+            print(f"[{datetime.now()}] Failed to fetch reference URL: {resp.status_code}")
+        except Exception as e:
+            print(f"[{datetime.now()}] Error fetching reference URL: {e}")
+        return "", False
 
-        # Fetch Reference URL content based on mode
-        reference_html = ""
-        fetch_success = False
-        
-        if reference_url and reference_url.strip() and mode != 'none':
-            try:
-                print(f"[{datetime.now()}] Fetching reference URL content: {reference_url}")
-                headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'}
-                resp = requests.get(reference_url, headers=headers, timeout=10)
-                
-                if resp.status_code == 200:
-                    raw_html = resp.text
-                    print(f"[{datetime.now()}] Fetched {len(raw_html)} chars")
-                    
-                    if mode == 'smart':
-                        print(f"[{datetime.now()}] Applying Smart Filtering...")
-                        reference_html = self._clean_html(raw_html)
-                        print(f"[{datetime.now()}] Cleaned HTML length: {len(reference_html)} chars")
-                    else: # mode == 'raw'
-                        reference_html = raw_html[:60000] # Limit to 60k chars
-                        print(f"[{datetime.now()}] Using Raw HTML (truncated to 60k)")
-                    
-                    fetch_success = True
-                else:
-                    print(f"[{datetime.now()}] Failed to fetch reference URL: {resp.status_code}")
-            except Exception as e:
-                print(f"[{datetime.now()}] Error fetching reference URL: {e}")
-        
-        # Fetch Unsplash images
-        unsplash_images = self._get_unsplash_images(product_type, count=8)
-        
+    async def _fetch_reference_async(self, reference_url: str, mode: str) -> Tuple[str, bool]:
+        """
+        Async form of _fetch_reference. Goes through the reference cache, so a repeat
+        URL usually skips the network and the cleaning pass; cleaning runs in a worker thread.
+        Design mode fetches the page's stylesheets concurrently and keeps only the distilled tokens.
+        """
+        if not (reference_url and reference_url.strip() and mode != 'none'):
+            return "", False
+
+        async def distill(raw_html: str) -> Tuple[str, bool]:
+            return await distill_reference(raw_html, reference_url, self._get_http_client(), BROWSER_HEADERS)
+
+        try:
+            with metrics.stage("reference_fetch"):
+                reference_html = await reference_cache.get_prepared(
+                    reference_url,
+                    f"{mode}:v{REFERENCE_PREP_VERSION}",
+                    self._get_http_client(),
+                    BROWSER_HEADERS,
+                    distill if mode == 'design' else lambda raw_html: self._prepare_reference(raw_html, mode),
+                    max_age=DESIGN_TOKENS_TTL if mode == 'design' else None,
+                )
+            if reference_html is not None:
+                return reference_html, True
+        except Exception as e:
+            print(f"[{datetime.now()}] Error fetching reference URL: {e}")
+        return "", False
+
+    def _build_budgeted_prompt(self, product_type: str, reference_url: str, design_style: str, mode: str,
+                               reference_html: str, fetch_success: bool, unsplash_images: List[str]) -> str:
+        """
+        _build_prompt with the reference HTML fitted into what PROMPT_TOKEN_BUDGET
+        leaves after the instructions (see services/prompt_budget.py). Token counts
+        are recorded in the generation metrics.
+        """
+        kept = dropped = 0
+        if fetch_success and reference_html:
+            prompt = self._build_prompt(product_type, reference_url, design_style, mode,
+                                        REFERENCE_PLACEHOLDER, fetch_success, unsplash_images)
+            instruction_tokens = count_tokens(prompt.replace(REFERENCE_PLACEHOLDER, ""))
+            if mode == 'design':
+                # Already a bounded summary, and JSON cannot be cut like HTML
+                kept = count_tokens(reference_html)
+            else:
+                reference_html, kept, dropped = fit_reference(reference_html, PROMPT_TOKEN_BUDGET - instruction_tokens)
+            if dropped:
+                print(f"[{datetime.now()}] Reference HTML fitted to {PROMPT_TOKEN_BUDGET - instruction_tokens} tokens: "
+                      f"kept {kept}, dropped {dropped}")
+        if fetch_success and reference_html:
+            prompt = prompt.replace(REFERENCE_PLACEHOLDER, reference_html)
+            estimate = instruction_tokens + kept
+        else:
+            prompt = self._build_prompt(product_type, reference_url, design_style, mode,
+                                        reference_html, fetch_success, unsplash_images)
+            estimate = count_tokens(prompt)
+
+        metrics.add("prompt_budget_tokens", PROMPT_TOKEN_BUDGET)
+        metrics.add("prompt_tokens_estimate", estimate)
+        metrics.add("reference_tokens", kept)
+        metrics.add("reference_tokens_dropped", dropped)
+        return prompt
+
+    def _build_prompt(self, product_type: str, reference_url: str, design_style: str, mode: str,
+                      reference_html: str, fetch_success: bool, unsplash_images: List[str]) -> str:
         # Build image instructions
         if unsplash_images:
             image_instruction = f"""
@@ -257,7 +457,17 @@ class GeminiService:
         # Build reference section
         if reference_url and reference_url.strip():
             reference_source_info = ""
-            if fetch_success and reference_html:
+            if fetch_success and reference_html and mode == 'design':
+                reference_source_info = f"""
+**참고 사이트 디자인 토큰 (HTML과 연결된 CSS 전체에서 추출한 요약)**:
+```json
+{reference_html}
+```
+- 숫자는 사용 빈도: palette·fonts는 많이 쓰인 값이 기본(배경/본문/제목), 적게 쓰인 값이 강조색
+- layout.max_width는 컨테이너 폭, layout.breakpoints는 반응형 기준, motion은 전환 속도/이징
+- libraries에 있는 라이브러리는 CDN으로 동일하게 사용
+"""
+            elif fetch_success and reference_html:
                 reference_source_info = f"""
 **참고 사이트 HTML 소스 (스타일 분석용)**:
 ```html
@@ -386,100 +596,223 @@ class GeminiService:
 - [ ] 레이아웃 제약 준수
 - [ ] 프리미엄 퀄리티
 """
-        
-        # Retry logic
+        return prompt
+
+    def _parse_response(self, raw_text: str) -> dict:
+        """Split model output into HTML and metadata. Raises ValueError if unusable."""
+        raw_text = raw_text.strip()
+        print(f"[{datetime.now()}] Raw response length: {len(raw_text)} chars")
+
+        # Clean up markdown fencing if present (sometimes Gemini still adds it)
+        if raw_text.startswith("```html"):
+            raw_text = raw_text[7:]
+        elif raw_text.startswith("```"):
+            raw_text = raw_text[3:]
+        if raw_text.endswith("```"):
+            raw_text = raw_text[:-3]
+
+        raw_text = raw_text.strip()
+
+        # Parse using the separator
+        separator = METADATA_SEPARATOR
+
+        if separator in raw_text:
+            parts = raw_text.split(separator)
+            html_content = parts[0].strip()
+            json_part = parts[1].strip()
+
+            # Clean up JSON part if it has markdown
+            if json_part.startswith("```json"):
+                json_part = json_part[7:]
+            if json_part.endswith("```"):
+                json_part = json_part[:-3]
+            json_part = json_part.strip()
+
+            try:
+                metadata = json.loads(json_part, strict=False)
+                print(f"[{datetime.now()}] Successfully parsed metadata JSON")
+            except json.JSONDecodeError as je:
+                print(f"[{datetime.now()}] Metadata JSON parsing failed: {je}")
+                # Fallback metadata
+                metadata = {
+                    "explanation": "디자인 생성 완료 (메타데이터 파싱 실패)",
+                    "key_points": ["반응형 디자인", "모던 스타일", "인터랙티브 요소"],
+                    "color_palette": ["#333333", "#ffffff"]
+                }
+
+            # Construct final result
+            result = {
+                "html": html_content,
+                "explanation": metadata.get("explanation", ""),
+                "key_points": metadata.get("key_points", []),
+                "color_palette": metadata.get("color_palette", [])
+            }
+
+            print(f"[{datetime.now()}] HTML length: {len(result['html'])} chars")
+            return result
+
+        else:
+            # Fallback: Maybe Gemini returned just JSON or just HTML?
+            # Try to parse as JSON (old way) just in case
+            try:
+                print(f"[{datetime.now()}] Separator not found, trying legacy JSON parse...")
+                # ... (legacy parsing logic omitted for brevity, assuming new prompt works)
+                # Actually, let's just treat the whole thing as HTML if it looks like HTML
+                if "<html" in raw_text.lower():
+                    print(f"[{datetime.now()}] Treating entire response as HTML")
+                    return {
+                        "html": raw_text,
+                        "explanation": "자동 생성된 디자인",
+                        "key_points": [],
+                        "color_palette": []
+                    }
+                else:
+                     raise ValueError("Response format invalid: Separator not found and not HTML")
+            except Exception as e:
+                raise ValueError(f"Failed to parse response: {str(e)}")
+
+    async def _emit(self, on_progress: Optional[ProgressCallback], stage: str, html_delta: str = "", reset: bool = False):
+        if on_progress is None:
+            return
+        try:
+            await on_progress(stage, html_delta, reset)
+        except Exception as e:
+            # Progress reporting must never fail a generation
+            print(f"[{datetime.now()}] Progress callback failed: {e}")
+
+    def _visible_html(self, text: str, final: bool = False) -> str:
+        """The HTML part of a (possibly incomplete) streamed response, without markdown fencing"""
+        text = text.lstrip()
+        if text.startswith("```html"):
+            text = text[7:]
+        elif text.startswith("```"):
+            text = text[3:]
+        if METADATA_SEPARATOR in text:
+            return text.split(METADATA_SEPARATOR)[0]
+        if not final:
+            # Hold back a tail that might be the start of the separator
+            text = text[:max(0, len(text) - len(METADATA_SEPARATOR))]
+        return text
+
+    async def _iter_chunks(self, response) -> AsyncIterator[str]:
+        if self.use_async:
+            async for chunk in response:
+                yield self._chunk_text(chunk)
+        else:
+            for chunk in response:
+                yield self._chunk_text(chunk)
+
+    def _chunk_text(self, chunk) -> str:
+        try:
+            return chunk.text
+        except Exception:
+            # Chunks without text parts (e.g. only safety ratings)
+            return ""
+
+    async def _consume_stream(self, response, on_progress: Optional[ProgressCallback]) -> str:
+        """Collect a streamed response, forwarding new HTML to on_progress at bounded intervals"""
+        parts: List[str] = []
+        sent = 0
+        last_flush = time.monotonic()
+
+        async def flush(final: bool = False):
+            nonlocal sent, last_flush
+            html = self._visible_html("".join(parts), final)
+            if len(html) > sent:
+                await self._emit(on_progress, "generating", html[sent:])
+                sent = len(html)
+            last_flush = time.monotonic()
+
+        async for text in self._iter_chunks(response):
+            parts.append(text)
+            if on_progress is not None and time.monotonic() - last_flush >= PARTIAL_FLUSH_INTERVAL:
+                await flush()
+        if on_progress is not None:
+            await flush(final=True)
+        return "".join(parts)
+
+    def _record_usage(self, response, prompt: str, raw_text: str):
+        """Sizes of one model call for the generation metrics; token counts from the API when it reports them"""
+        usage = getattr(response, "usage_metadata", None)
+        reported = getattr(usage, "prompt_token_count", 0)
+        if reported:
+            token_estimator.observe(prompt, reported)
+        prompt_tokens = reported or count_tokens(prompt)
+        response_tokens = getattr(usage, "candidates_token_count", 0) or count_tokens(raw_text)
+        metrics.add("prompt_tokens", prompt_tokens)
+        metrics.add("response_chars", len(raw_text))
+        metrics.add("response_tokens", response_tokens)
+
+    async def generate_website_content(self, product_type: str, reference_url: str, design_style: str, mode: str = 'smart',
+                                       on_progress: Optional[ProgressCallback] = None) -> dict:
+        print(f"[{datetime.now()}] Received generation request for: {product_type}")
+        print(f"[{datetime.now()}] Design style (user request): {design_style}")
+        print(f"[{datetime.now()}] Generation Mode: {mode.upper()}")
+
+        with metrics.stage("prepare"):
+            await self._emit(on_progress, "preparing")
+            if self.use_async:
+                reference_html, fetch_success, unsplash_images = await self._prepare_inputs_async(
+                    product_type, reference_url, mode, on_progress)
+            else:
+                self._check_rate_limits()
+                reference_html, fetch_success = self._fetch_reference(reference_url, mode)
+                await self._emit(on_progress, "fetching_images")
+                unsplash_images = self._get_unsplash_images(product_type, count=8)
+
+        with metrics.stage("prompt_build"):
+            prompt = self._build_budgeted_prompt(product_type, reference_url, design_style, mode,
+                                                 reference_html, fetch_success, unsplash_images)
+        metrics.add("prompt_chars", len(prompt))
+
+        async def consume(response) -> str:
+            # Runs once per router attempt; a retry starts the streamed HTML over
+            await self._emit(on_progress, "generating", reset=True)
+            if self.stream:
+                raw_text = await self._consume_stream(response, on_progress)
+            else:
+                raw_text = response.text
+            self._record_usage(response, prompt, raw_text)
+            return raw_text
+
+        # Retry logic: transport errors, 429s and failover are handled by the router;
+        # this loop re-asks when the model's answer cannot be parsed
         max_retries = 2
         last_error = None
-        
+
         for attempt in range(max_retries):
             try:
                 if attempt > 0:
                     print(f"[{datetime.now()}] Retry attempt {attempt + 1}/{max_retries}")
-                    
-                print(f"[{datetime.now()}] Sending request to Gemini API...")
-                response = self.model.generate_content(prompt)
-                print(f"[{datetime.now()}] Received response from Gemini")
-                
-                # Extract text
-                raw_text = response.text.strip()
-                print(f"[{datetime.now()}] Raw response length: {len(raw_text)} chars")
-                
-                # Clean up markdown fencing if present (sometimes Gemini still adds it)
-                if raw_text.startswith("```html"):
-                    raw_text = raw_text[7:]
-                elif raw_text.startswith("```"):
-                    raw_text = raw_text[3:]
-                if raw_text.endswith("```"):
-                    raw_text = raw_text[:-3]
-                
-                raw_text = raw_text.strip()
-                
-                # Parse using the separator
-                separator = "<<<METADATA_SEPARATOR>>>"
-                
-                if separator in raw_text:
-                    parts = raw_text.split(separator)
-                    html_content = parts[0].strip()
-                    json_part = parts[1].strip()
-                    
-                    # Clean up JSON part if it has markdown
-                    if json_part.startswith("```json"):
-                        json_part = json_part[7:]
-                    if json_part.endswith("```"):
-                        json_part = json_part[:-3]
-                    json_part = json_part.strip()
-                    
-                    try:
-                        metadata = json.loads(json_part, strict=False)
-                        print(f"[{datetime.now()}] Successfully parsed metadata JSON")
-                    except json.JSONDecodeError as je:
-                        print(f"[{datetime.now()}] Metadata JSON parsing failed: {je}")
-                        # Fallback metadata
-                        metadata = {
-                            "explanation": "디자인 생성 완료 (메타데이터 파싱 실패)",
-                            "key_points": ["반응형 디자인", "모던 스타일", "인터랙티브 요소"],
-                            "color_palette": ["#333333", "#ffffff"]
-                        }
-                    
-                    # Construct final result
-                    result = {
-                        "html": html_content,
-                        "explanation": metadata.get("explanation", ""),
-                        "key_points": metadata.get("key_points", []),
-                        "color_palette": metadata.get("color_palette", [])
-                    }
-                    
-                    print(f"[{datetime.now()}] HTML length: {len(result['html'])} chars")
-                    return result
-                    
+                    metrics.add("model_retries", 1)
+
+                if self.use_async:
+                    # The router logs the request with the backend it picked
+                    raw_text = await self.router.call(prompt, consume, stream=self.stream)
                 else:
-                    # Fallback: Maybe Gemini returned just JSON or just HTML?
-                    # Try to parse as JSON (old way) just in case
-                    try:
-                        print(f"[{datetime.now()}] Separator not found, trying legacy JSON parse...")
-                        # ... (legacy parsing logic omitted for brevity, assuming new prompt works)
-                        # Actually, let's just treat the whole thing as HTML if it looks like HTML
-                        if "<html" in raw_text.lower():
-                            print(f"[{datetime.now()}] Treating entire response as HTML")
-                            return {
-                                "html": raw_text,
-                                "explanation": "자동 생성된 디자인",
-                                "key_points": [],
-                                "color_palette": []
-                            }
+                    print(f"[{datetime.now()}] Sending request to Gemini API...")
+                    await self._emit(on_progress, "generating", reset=True)
+                    with metrics.stage("model_call"):
+                        if self.stream:
+                            response = self.model.generate_content(prompt, stream=True)
+                            raw_text = await self._consume_stream(response, on_progress)
                         else:
-                             raise ValueError("Response format invalid: Separator not found and not HTML")
-                    except Exception as e:
-                        raise ValueError(f"Failed to parse response: {str(e)}")
+                            response = self.model.generate_content(prompt)
+                            raw_text = response.text
+                    self._record_usage(response, prompt, raw_text)
+                with metrics.stage("parse"):
+                    print(f"[{datetime.now()}] Received response from Gemini")
+                    await self._emit(on_progress, "parsing")
+                    return self._parse_response(raw_text)
 
             except Exception as e:
                 print(f"[{datetime.now()}] Error during generation: {type(e).__name__}: {str(e)}")
-                if attempt == max_retries - 1:
+                if attempt == max_retries - 1 or (self.use_async and not isinstance(e, ValueError)):
                     raise
                 last_error = e
                 print(f"[{datetime.now()}] Will retry...")
                 continue
-        
+
         # If we get here, all retries failed
         raise ValueError(f"Failed to generate content after {max_retries} attempts. Last error: {last_error}")
 
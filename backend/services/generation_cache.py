@@ -0,0 +1,104 @@
+import hashlib
+import json
+import os
+import unicodedata
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import urlsplit, urlunsplit
+
+import database
+
+# Identical requests made while an earlier one is still pending attach to it (0 disables)
+GENERATION_SINGLE_FLIGHT = os.getenv("GENERATION_SINGLE_FLIGHT", "1") != "0"
+# Pending sites older than this (seconds) are not attached to (stuck or long-retrying jobs)
+GENERATION_SINGLE_FLIGHT_WINDOW = float(os.getenv("GENERATION_SINGLE_FLIGHT_WINDOW", "1800"))
+# Default freshness window for requests that opt into the result cache (seconds)
+GENERATION_CACHE_MAX_AGE = float(os.getenv("GENERATION_CACHE_MAX_AGE", "900"))
+
+
+def _normalize_text(text: Optional[str]) -> str:
+    return " ".join(unicodedata.normalize("NFKC", text or "").split()).lower()
+
+
+def _normalize_url(url: Optional[str]) -> str:
+    url = (url or "").strip()
+    if not url:
+        return ""
+    parts = urlsplit(url if "://" in url else f"https://{url}")
+    path = parts.path.rstrip("/")
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), path, parts.query, ""))
+
+
+def request_key(product_type: str, reference_url: Optional[str], design_style: str, generation_mode: Optional[str]) -> str:
+    """Hash of the normalized (product_type, reference_url, design_style, generation_mode)"""
+    normalized = [
+        _normalize_text(product_type),
+        _normalize_url(reference_url),
+        _normalize_text(design_style),
+        (generation_mode or "smart").strip().lower(),
+    ]
+    return hashlib.sha256(json.dumps(normalized, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+class GenerationCache:
+    """
+    Coalescing in front of the generation queue.
+
+    Single-flight: a request identical (after normalization) to one that is still
+    pending is answered with the pending site's id, so both clients follow one job.
+    Result cache (opt-in per request): a recent completed site with the same key
+    is cloned into a new completed site and no job is queued. The decision is made
+    in one write transaction, so it also holds across processes sharing sites.db.
+    """
+
+    def __init__(self, single_flight: bool = GENERATION_SINGLE_FLIGHT,
+                 pending_window: float = GENERATION_SINGLE_FLIGHT_WINDOW,
+                 default_max_age: float = GENERATION_CACHE_MAX_AGE):
+        self.single_flight = single_flight
+        self.pending_window = pending_window
+        self.default_max_age = default_max_age
+        self.stats: Dict[str, int] = {
+            "requests": 0,
+            "attached": 0,       # joined an in-flight generation
+            "cache_hits": 0,     # cloned a recent completed site
+            "cache_misses": 0,   # opted into the cache, nothing fresh enough
+            "created": 0,        # new generation queued
+        }
+
+    async def admit(self, site_id: str, data: Dict[str, Any], use_cache: bool = False,
+                    max_age: Optional[float] = None) -> Tuple[str, str]:
+        """Returns (site_id to report, "attached" | "cached" | "created")"""
+        self.stats["requests"] += 1
+        key = request_key(data.get("product_type"), data.get("reference_url"),
+                          data.get("design_style"), data.get("generation_mode"))
+        cache_max_age = (self.default_max_age if max_age is None else max_age) if use_cache else None
+        result_id, outcome = await database.aio.admit_generation(
+            site_id, data, key,
+            self.pending_window if self.single_flight else None,
+            cache_max_age,
+        )
+        if outcome == "attached":
+            self.stats["attached"] += 1
+            print(f"[{datetime.now()}] Request attached to in-flight generation {result_id}")
+        elif outcome == "cached":
+            self.stats["cache_hits"] += 1
+            print(f"[{datetime.now()}] Request served from result cache as {result_id}")
+        else:
+            self.stats["created"] += 1
+            if use_cache:
+                self.stats["cache_misses"] += 1
+        return result_id, outcome
+
+    def snapshot(self) -> Dict[str, Any]:
+        lookups = self.stats["cache_hits"] + self.stats["cache_misses"]
+        return {
+            **self.stats,
+            "cache_hit_rate": round(self.stats["cache_hits"] / lookups, 3) if lookups else 0.0,
+            "single_flight": self.single_flight,
+            "pending_window_seconds": self.pending_window,
+            "default_max_age_seconds": self.default_max_age,
+        }
+
+
+# Create singleton instance
+generation_cache = GenerationCache()
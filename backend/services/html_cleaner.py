@@ -0,0 +1,247 @@
+from html.parser import HTMLParser
+from typing import Dict, List, Optional, Tuple
+
+# Smart Filtering rules (shared with the original BeautifulSoup implementation)
+REMOVED_TAGS = {'noscript', 'iframe', 'object', 'embed'}
+SVG_ATTRS = {'class', 'id', 'width', 'height', 'viewbox'}
+IMG_ATTRS = {'src', 'class', 'id', 'alt'}
+DROPPED_ATTR_PREFIXES = ('data-', 'aria-', 'on')
+MAX_TEXT_LENGTH = 50
+
+# Serialization rules of the tree builder the old cleaner used (bs4 + html.parser)
+VOID_TAGS = {
+    'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'keygen', 'link', 'menuitem',
+    'meta', 'param', 'source', 'track', 'wbr', 'basefont', 'bgsound', 'command', 'frame',
+    'image', 'isindex', 'nextid', 'spacer',
+}
+RAW_TEXT_TAGS = {'style', 'script'}
+PRESERVE_WHITESPACE_TAGS = {'pre', 'textarea'}
+ASCII_SPACES = '\x20\x0a\x09\x0c\x0d'
+MULTI_VALUED_ATTRS = {
+    '*': {'class', 'accesskey', 'dropzone'},
+    'a': {'rel', 'rev'}, 'link': {'rel', 'rev'}, 'area': {'rel'},
+    'td': {'headers'}, 'th': {'headers'}, 'form': {'accept-charset'},
+    'object': {'archive'}, 'icon': {'sizes'}, 'iframe': {'sandbox'}, 'output': {'for'},
+}
+
+# Input is fed to the tokenizer in chunks so an exhausted budget stops parsing early
+FEED_CHUNK_SIZE = 64 * 1024
+
+KEEP, DROP, SVG = 0, 1, 2
+
+
+def _escape_text(text: str) -> str:
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+
+def _quote_attr(value: str) -> str:
+    value = _escape_text(value)
+    if '"' in value:
+        if "'" in value:
+            return '"' + value.replace('"', '&quot;') + '"'
+        return "'" + value + "'"
+    return '"' + value + '"'
+
+
+class StreamingCleaner(HTMLParser):
+    """
+    Single-pass Smart Filtering cleaner.
+
+    Tokens are filtered and serialized as they arrive; the only state kept is
+    the stack of open elements (mirroring how the tree builder nests and closes
+    tags) and the current text run. Output stops growing once max_bytes is
+    reached; open elements are still closed so the result stays well formed.
+    """
+
+    def __init__(self, max_bytes: Optional[int] = None):
+        super().__init__(convert_charrefs=True)
+        self.max_bytes = max_bytes
+        self.out: List[str] = []
+        self.size = 0
+        self.exhausted = False
+        # (tag name, KEEP/DROP/SVG) for every open element
+        self.stack: List[Tuple[str, int]] = []
+        # Number of open DROP/SVG elements: while > 0 nothing is emitted
+        self.hidden = 0
+        self.text: List[str] = []
+
+    # -- output -------------------------------------------------------------
+
+    def _emit(self, piece: str) -> bool:
+        if self.exhausted:
+            return False
+        if self.max_bytes is not None:
+            size = len(piece.encode('utf-8'))
+            if self.size + size > self.max_bytes:
+                # From here on the stack is frozen so finish() closes exactly what was emitted
+                self.exhausted = True
+                return False
+            self.size += size
+        self.out.append(piece)
+        return True
+
+    def _flush_text(self):
+        if not self.text:
+            return
+        text = ''.join(self.text)
+        self.text = []
+        if self.hidden:
+            return
+        if not text.strip(ASCII_SPACES) and not any(tag in PRESERVE_WHITESPACE_TAGS for tag, _ in self.stack):
+            # Whitespace-only runs collapse to a single newline or space
+            text = '\n' if '\n' in text else ' '
+        parent = self.stack[-1][0] if self.stack else None
+        if parent in RAW_TEXT_TAGS:
+            self._emit(text)
+            return
+        if len(text) > MAX_TEXT_LENGTH:
+            text = text[:MAX_TEXT_LENGTH] + '...'
+        self._emit(_escape_text(text))
+
+    def _attrs(self, tag: str, attrs: List[Tuple[str, Optional[str]]]) -> Dict[str, str]:
+        result: Dict[str, str] = {}
+        multi = MULTI_VALUED_ATTRS['*'] | MULTI_VALUED_ATTRS.get(tag, set())
+        for key, value in attrs:
+            value = '' if value is None else value
+            if key in multi:
+                value = ' '.join(value.split())
+            result[key] = value
+        if tag == 'img':
+            if result.get('src', '').startswith('data:'):
+                result['src'] = 'BASE64_IMAGE_REMOVED'
+            result = {k: v for k, v in result.items() if k in IMG_ATTRS}
+        elif tag == 'svg':
+            result = {k: v for k, v in result.items() if k in SVG_ATTRS}
+        return {k: v for k, v in result.items() if not k.startswith(DROPPED_ATTR_PREFIXES)}
+
+    def _open_tag(self, tag: str, attrs: Dict[str, str], void: bool) -> str:
+        parts = [f'<{tag}']
+        for key, value in sorted(attrs.items()):
+            parts.append(f' {key}={_quote_attr(value)}')
+        parts.append('/>' if void else '>')
+        return ''.join(parts)
+
+    # -- tokenizer events ----------------------------------------------------
+
+    def handle_starttag(self, tag, attrs):
+        self._flush_text()
+        if self.exhausted:
+            return
+        void = tag in VOID_TAGS
+
+        if self.hidden or tag in REMOVED_TAGS:
+            mode = DROP
+        elif tag == 'script' and not dict(attrs).get('src'):
+            # Inline scripts are logic, not style
+            mode = DROP
+        elif tag == 'svg':
+            mode = SVG
+        else:
+            mode = KEEP
+
+        if mode == KEEP:
+            if not self._emit(self._open_tag(tag, self._attrs(tag, attrs), void)):
+                return
+        elif mode == SVG:
+            # Paths are dropped; the icon is kept as a placeholder
+            if not self._emit(self._open_tag(tag, self._attrs(tag, attrs), False) + 'SVG_ICON'):
+                return
+
+        if void and mode != SVG:
+            return
+        self.stack.append((tag, mode))
+        if mode != KEEP:
+            self.hidden += 1
+
+    def handle_startendtag(self, tag, attrs):
+        # <div/>: an empty element, closed immediately
+        self.handle_starttag(tag, attrs)
+        if tag not in VOID_TAGS and not self.exhausted:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        self._flush_text()
+        if self.exhausted:
+            return
+        # Close the most recent open element with this name; stray end tags are ignored
+        for index in range(len(self.stack) - 1, -1, -1):
+            if self.stack[index][0] == tag:
+                break
+        else:
+            return
+        while len(self.stack) > index:
+            if not self._close():
+                return
+
+    def _close(self) -> bool:
+        """Close the innermost open element; False (and left open) if the budget ran out"""
+        tag, mode = self.stack[-1]
+        hidden = self.hidden - (mode != KEEP)
+        if mode != DROP and not hidden and not self._emit(f'</{tag}>'):
+            return False
+        self.stack.pop()
+        self.hidden = hidden
+        return True
+
+    def handle_data(self, data):
+        if self.hidden or self.exhausted:
+            return
+        if self.stack and self.stack[-1][0] == 'script':
+            # External scripts are kept as library hints, without content
+            return
+        self.text.append(data)
+
+    def handle_comment(self, data):
+        self._flush_text()
+
+    def _special(self, text: str, prefix: str, suffix: str):
+        # Doctype/PI/CDATA count as text nodes for truncation, like the tree-based cleaner
+        self._flush_text()
+        if self.hidden:
+            return
+        if len(text) > MAX_TEXT_LENGTH:
+            self._emit(_escape_text(text[:MAX_TEXT_LENGTH] + '...'))
+        else:
+            self._emit(prefix + text + suffix)
+
+    def handle_decl(self, decl):
+        if decl.lower().startswith('doctype '):
+            self._special(decl[8:], '<!DOCTYPE ', '>\n')
+        else:
+            self._special(decl, '<!', '>')
+
+    def handle_pi(self, data):
+        self._special(data, '<?', '>')
+
+    def unknown_decl(self, data):
+        if data.upper().startswith('CDATA['):
+            self._special(data[6:], '<![CDATA[', ']]>')
+        else:
+            # <![if IE]> etc.: BeautifulSoup keeps these as a Declaration, written <?...?>
+            self._special(data, '<?', '?>')
+
+    # -- driver ---------------------------------------------------------------
+
+    def finish(self) -> str:
+        self.close()
+        self._flush_text()
+        # Close whatever is still open, even past the budget
+        self.exhausted = False
+        self.max_bytes = None
+        while self.stack:
+            self._close()
+        return ''.join(self.out)
+
+
+def clean_html(html_content: str, max_bytes: Optional[int] = None) -> str:
+    """
+    Smart Filtering: keep only structure and style-relevant markup, in one pass.
+    Removes noscript/iframe/object/embed, comments, SVG paths, base64 images,
+    inline scripts, data-/aria-/on* attributes and truncates long text.
+    """
+    cleaner = StreamingCleaner(max_bytes)
+    for start in range(0, len(html_content), FEED_CHUNK_SIZE):
+        cleaner.feed(html_content[start:start + FEED_CHUNK_SIZE])
+        if cleaner.exhausted:
+            break
+    return cleaner.finish()
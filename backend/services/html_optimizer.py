@@ -0,0 +1,414 @@
+import os
+import re
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+# Images in document order that stay eager (logo, hero); the ones after them load lazily
+OPTIMIZE_EAGER_IMAGES = int(os.getenv("OPTIMIZE_EAGER_IMAGES", "2"))
+# Smaller widths offered next to an Unsplash image's own, and what they are sized for when the page
+# says nothing. Every candidate is a full URL, so the list is kept short.
+UNSPLASH_SRCSET_WIDTHS = (640,)
+UNSPLASH_SIZES = "100vw"
+# Query parameters that do not change the image Unsplash returns at a given w/q/fit
+UNSPLASH_DROP_PARAMS = ("fm", "ixlib", "crop")
+
+FONT_ORIGINS = ("https://fonts.googleapis.com", "https://fonts.gstatic.com")
+UNSPLASH_ORIGIN = "https://images.unsplash.com"
+
+# Whitespace between two of these tags never renders, so it is dropped; anywhere else it is
+# collapsed to one space. Tags pages commonly restyle as inline(-block) (li, td, option, ...)
+# are left out on purpose.
+BLOCK_TAGS = {
+    "!doctype", "html", "head", "body", "title", "meta", "link", "style", "script", "base",
+    "address", "article", "aside", "blockquote", "details", "dialog", "div", "dl", "fieldset",
+    "figcaption", "figure", "footer", "form", "h1", "h2", "h3", "h4", "h5", "h6", "header", "hgroup", "hr",
+    "main", "nav", "ol", "p", "pre", "section", "table", "tbody", "thead", "tfoot", "tr", "ul",
+}
+# <script type> values that are not JavaScript (kept as written, JSON only trimmed)
+NON_JS_SCRIPT_TYPES = ("text/template", "text/x-template", "text/html", "text/plain", "x-shader")
+
+# Rest of a tag after its name: up to the first > outside a quoted attribute value
+# (alt="Tom > Jerry"), or to the first > at all when a quote is never closed
+_TAG_REST = r"""(?:(?:[^>"']|"[^"]*"|'[^']*')*|[^>]*)>"""
+_SEGMENT = re.compile(
+    rf"<!--.*?-->|<(script|style|pre|textarea)\b{_TAG_REST}.*?(?:</\1\s*>|$)|<{_TAG_REST}|[^<]+|<",
+    re.IGNORECASE | re.DOTALL,
+)
+_RAW_ELEMENT = re.compile(rf"(<{_TAG_REST})(.*?)(</[^>]*>)?$", re.DOTALL)
+_TAG_NAME = re.compile(r"</?([!a-zA-Z][^\s/>]*)")
+_ATTR = re.compile(r"""([^\s"'=<>/]+)(?:\s*=\s*("[^"]*"|'[^']*'|[^\s"'=<>`]+))?""")
+_QUOTED = re.compile(r"(\"[^\"]*\"|'[^']*')")
+# HTML whitespace only: \s would also match U+00A0, which renders
+_SPACES = re.compile(r"[ \t\n\r\f]+")
+_FONT_IMPORT = re.compile(r"@import\s+url\([^)]*fonts\.googleapis\.com", re.IGNORECASE)
+
+# Characters JS/CSS tokens never need a space next to
+_JS_TIGHT = set("{}()[];,:=<>!?&|*%^~")
+_JS_LOOSE = set("+-/.")
+_JS_NO_NEWLINE_AFTER = set("{;,([")
+_JS_NO_NEWLINE_BEFORE = set("})],;")
+_JS_REGEX_AFTER = set("(,=:[!&|?{};+-*%<>~^")
+_JS_REGEX_KEYWORDS = {"return", "typeof", "case", "do", "else", "in", "of", "new", "delete", "void", "throw",
+                      "instanceof", "yield", "await"}
+# `if (...) /re/`: a regex can follow the ) of these statements
+_JS_REGEX_AFTER_PAREN = {"if", "while", "for", "with"}
+# Pairs a dropped space must not join: "<!--" inside a script opens an HTML comment
+_JS_UNSAFE_JOINS = {"<!"}
+_CSS_TIGHT = set("{};,>")
+
+
+def _js_word_before(out: List[str]) -> str:
+    text = "".join(out[-12:]).rstrip()
+    match = re.search(r"[A-Za-z_$][\w$]*$", text)
+    return match.group(0) if match else ""
+
+
+def minify_js(js: str) -> str:
+    """
+    Comments and indentation out, whitespace runs down to one space or newline.
+    Line breaks are kept wherever removing one could change automatic semicolon
+    insertion; strings, template literals and regex literals are copied verbatim.
+    """
+    out: List[str] = []
+    i, n = 0, len(js)
+    pending = ""  # whitespace seen since the last token: "", " " or "\n"
+    parens: List[str] = []  # word before each open "(", to tell `if (a) /re/` from `(a) / b`
+    closed_paren = ""
+
+    def last() -> str:
+        return out[-1][-1] if out else ""
+
+    def regex_allowed() -> bool:
+        if not out:
+            return True
+        if last() == ")":
+            return closed_paren in _JS_REGEX_AFTER_PAREN
+        if "".join(out[-2:]) in ("++", "--"):
+            return False  # i++ / 2
+        return last() in _JS_REGEX_AFTER or _js_word_before(out) in _JS_REGEX_KEYWORDS
+
+    def emit(token: str):
+        nonlocal pending
+        if pending and out:
+            before, after = last(), token[0]
+            if pending == "\n" and before not in _JS_NO_NEWLINE_AFTER and after not in _JS_NO_NEWLINE_BEFORE:
+                out.append("\n")
+            elif pending == " " or pending == "\n":
+                if (not ((before in _JS_TIGHT or after in _JS_TIGHT) and before not in _JS_LOOSE and after not in _JS_LOOSE)
+                        or before + after in _JS_UNSAFE_JOINS):
+                    out.append(" ")
+        pending = ""
+        out.append(token)
+
+    while i < n:
+        c = js[i]
+        if c in " \t\r\n\f\v":
+            j = i
+            while j < n and js[j] in " \t\r\n\f\v":
+                j += 1
+            pending = "\n" if "\n" in js[i:j] or pending == "\n" else " "
+            i = j
+        elif c == "/" and js.startswith("//", i):
+            end = js.find("\n", i)
+            i = n if end < 0 else end
+        elif c == "/" and js.startswith("/*", i):
+            end = js.find("*/", i + 2)
+            end = n if end < 0 else end + 2
+            if pending != "\n":
+                pending = "\n" if "\n" in js[i:end] else " "
+            i = end
+        elif c in "'\"":
+            j = i + 1
+            while j < n and js[j] != c and js[j] != "\n":
+                j += 2 if js[j] == "\\" else 1
+            emit(js[i:j + 1])
+            i = j + 1
+        elif c == "`":
+            j, depth = i + 1, 0
+            while j < n:
+                if js[j] == "\\":
+                    j += 2
+                    continue
+                if js.startswith("${", j):
+                    depth += 1
+                    j += 2
+                    continue
+                if js[j] == "{" and depth:
+                    depth += 1
+                elif js[j] == "}" and depth:
+                    depth -= 1
+                elif js[j] == "`" and not depth:
+                    break
+                j += 1
+            emit(js[i:j + 1])
+            i = j + 1
+        elif c == "/" and regex_allowed():
+            j, in_class = i + 1, False
+            while j < n and js[j] != "\n":
+                if js[j] == "\\":
+                    j += 2
+                    continue
+                if js[j] == "[":
+                    in_class = True
+                elif js[j] == "]":
+                    in_class = False
+                elif js[j] == "/" and not in_class:
+                    break
+                j += 1
+            j += 1
+            while j < n and (js[j].isalnum() or js[j] == "_"):
+                j += 1
+            emit(js[i:j])
+            i = j
+        else:
+            j = i + 1
+            if c.isalnum() or c in "_$":
+                while j < n and (js[j].isalnum() or js[j] in "_$"):
+                    j += 1
+            elif c == "(":
+                parens.append(_js_word_before(out))
+            elif c == ")":
+                closed_paren = parens.pop() if parens else ""
+            emit(js[i:j])
+            i = j
+    return "".join(out)
+
+
+def minify_css(css: str) -> str:
+    """Comments out, whitespace collapsed and dropped around braces, separators and combinators"""
+    out: List[str] = []
+    i, n = 0, len(css)
+    space = False
+    while i < n:
+        c = css[i]
+        if c.isspace():
+            space = True
+            i += 1
+            continue
+        if css.startswith("/*", i):
+            end = css.find("*/", i + 2)
+            i = n if end < 0 else end + 2
+            space = True
+            continue
+        if c in "'\"":
+            j = i + 1
+            while j < n and css[j] != c:
+                j += 2 if css[j] == "\\" else 1
+            token = css[i:j + 1]
+            i = j + 1
+        else:
+            token = c
+            i += 1
+        if token == "}" and out and out[-1] == ";":
+            out.pop()
+        if space and out and out[-1][-1] not in _CSS_TIGHT and out[-1][-1] != ":" and token[0] not in _CSS_TIGHT:
+            out.append(" ")
+        space = False
+        out.append(token)
+    return "".join(out)
+
+
+def _unsplash_variant(url: str, width: Optional[int] = None) -> str:
+    """The Unsplash URL in the best format the browser accepts, optionally at another width"""
+    parts = urlsplit(url.replace("&amp;", "&"))
+    params = dict(parse_qsl(parts.query, keep_blank_values=True))
+    for name in UNSPLASH_DROP_PARAMS:
+        if name != "crop" or params.get("fit") != "crop":
+            params.pop(name, None)
+    params["auto"] = "format"
+    if width is not None:
+        params["w"] = str(width)
+    return urlunsplit((parts.scheme, parts.netloc, parts.path, urlencode(params), "")).replace("&", "&amp;")
+
+
+def _google_fonts_swap(url: str) -> str:
+    """Google Fonts CSS URL with display=swap, so text renders before the font arrives"""
+    if "display=" in url:
+        return url
+    return url + ("&amp;" if "?" in url else "?") + "display=swap"
+
+
+def _unsplash_width(url: str) -> Optional[int]:
+    width = dict(parse_qsl(urlsplit(url.replace("&amp;", "&")).query)).get("w", "")
+    return int(width) if width.isdigit() else None
+
+
+class _Optimizer:
+    def __init__(self, responsive: bool = True, minify: bool = True):
+        self.responsive = responsive
+        self.minify = minify
+        self.images = 0
+        self.stats = {"lazy_images": 0, "srcset_images": 0, "preconnects": 0, "font_links": 0}
+        self.font_link_at: Optional[int] = None
+        self.head_at: Optional[int] = None
+        self.uses_fonts = False
+        self.uses_unsplash = False
+        self.preconnected: set = set()
+
+    def _tag(self, tag: str) -> str:
+        # Whitespace between attributes collapses; attribute values are kept as written
+        if not self.minify:
+            return tag
+        parts = _QUOTED.split(tag)
+        tag = "".join(part if i % 2 else _SPACES.sub(" ", part) for i, part in enumerate(parts))
+        return re.sub(r"\s+(/?>)$", r"\1", tag)
+
+    def _attrs(self, tag: str) -> Dict[str, str]:
+        body = tag[1 + len(_TAG_NAME.match(tag).group(1)):-1].rstrip("/")
+        return {name.lower(): (value or "").strip("\"'") for name, value in _ATTR.findall(body)}
+
+    def _add_attrs(self, tag: str, additions: List[str]) -> str:
+        if not additions:
+            return tag
+        end = len(tag) - (2 if tag.endswith("/>") else 1)
+        return tag[:end] + "".join(f" {a}" for a in additions) + tag[end:]
+
+    def _img(self, tag: str) -> str:
+        attrs = self._attrs(tag)
+        additions = []
+        if self.images >= OPTIMIZE_EAGER_IMAGES:
+            if "loading" not in attrs:
+                additions.append('loading="lazy"')
+                self.stats["lazy_images"] += 1
+            if "decoding" not in attrs:
+                additions.append('decoding="async"')
+        self.images += 1
+
+        src = attrs.get("src", "")
+        if src.startswith(UNSPLASH_ORIGIN + "/"):
+            self.uses_unsplash = True
+            own = _unsplash_width(src)
+            widths = [width for width in UNSPLASH_SRCSET_WIDTHS if own and width < own]
+            if self.responsive and widths and "srcset" not in attrs:
+                # The image's own width is the last candidate, so nothing is upscaled
+                srcset = ", ".join(f"{_unsplash_variant(src, width)} {width}w" for width in widths)
+                additions.append(f'srcset="{srcset}, {_unsplash_variant(src)} {own}w"')
+                if "sizes" not in attrs:
+                    additions.append(f'sizes="{UNSPLASH_SIZES}"')
+                self.stats["srcset_images"] += 1
+            if "srcset" not in attrs:
+                quoted = re.search(r"""(\bsrc\s*=\s*)("[^"]*"|'[^']*'|[^\s>]+)""", tag)
+                if quoted:
+                    tag = tag[:quoted.start(2)] + f'"{_unsplash_variant(src)}"' + tag[quoted.end(2):]
+        return self._add_attrs(tag, additions)
+
+    def _link(self, tag: str, index: int) -> str:
+        attrs = self._attrs(tag)
+        href, rel = attrs.get("href", ""), attrs.get("rel", "").lower().split()
+        if "preconnect" in rel or "dns-prefetch" in rel:
+            self.preconnected.add(href.rstrip("/"))
+        if href.startswith(FONT_ORIGINS[0]) and "stylesheet" in rel:
+            self.uses_fonts = True
+            self.stats["font_links"] += 1
+            if self.font_link_at is None:
+                self.font_link_at = index
+            tag = tag.replace(href, _google_fonts_swap(href), 1) if href in tag else tag
+        return tag
+
+    def _raw(self, segment: str, name: str) -> str:
+        match = _RAW_ELEMENT.match(segment)
+        open_tag, body, close_tag = self._tag(match.group(1)), match.group(2), match.group(3) or ""
+        if name == "style" and _FONT_IMPORT.search(body):
+            self.uses_fonts = True
+        if not self.minify:
+            return segment
+        if name == "style":
+            body = minify_css(body)
+        elif name == "script":
+            kind = self._attrs(open_tag).get("type", "").lower()
+            if "json" in kind:
+                body = body.strip()
+            elif not kind.startswith(NON_JS_SCRIPT_TYPES):
+                body = minify_js(body)
+        return open_tag + body + close_tag
+
+    def _hints(self) -> str:
+        origins = []
+        if self.uses_fonts:
+            origins += [(origin, origin == FONT_ORIGINS[1]) for origin in FONT_ORIGINS]
+        if self.uses_unsplash:
+            origins.append((UNSPLASH_ORIGIN, False))
+        hints = [f'<link rel="preconnect" href="{origin}"{" crossorigin" if crossorigin else ""}>'
+                 for origin, crossorigin in origins if origin not in self.preconnected]
+        self.stats["preconnects"] = len(hints)
+        return "".join(hints)
+
+    def run(self, html: str) -> str:
+        segments: List[Tuple[str, str]] = []  # (tag name or "" for text, optimized segment)
+        for match in _SEGMENT.finditer(html):
+            segment = match.group(0)
+            if segment.startswith("<!--"):
+                if segment.startswith("<!--[if") or not self.minify:
+                    segments.append(("!comment", segment))
+                continue
+            if match.group(1):
+                name = match.group(1).lower()
+                segments.append((name, self._raw(segment, name)))
+                continue
+            name_match = _TAG_NAME.match(segment)
+            if name_match is None:
+                if segments and segments[-1][0] == "":
+                    # Text on both sides of a dropped comment
+                    segment = segments.pop()[1] + segment
+                segments.append(("", segment))
+                continue
+            name = name_match.group(1).lower()
+            tag = self._tag(segment)
+            if name == "img":
+                tag = self._img(tag)
+            elif name == "link":
+                tag = self._link(tag, len(segments))
+            elif name == "head" and not segment.startswith("</") and self.head_at is None:
+                self.head_at = len(segments)
+            segments.append((name, tag))
+
+        # Hints go before the first font stylesheet, else first thing in <head>
+        hints = self._hints()
+        anchor = self.font_link_at if self.font_link_at is not None else (
+            self.head_at + 1 if self.head_at is not None else 0)
+        out = []
+        for i, (name, segment) in enumerate(segments):
+            if i == anchor:
+                out.append(hints)
+            if name == "" and self.minify:
+                if not segment.strip(" \t\n\r\f"):
+                    before = segments[i - 1][0] if i else "html"
+                    after = segments[i + 1][0] if i + 1 < len(segments) else "html"
+                    if before in BLOCK_TAGS and after in BLOCK_TAGS:
+                        continue
+                segment = _SPACES.sub(" ", segment)
+            out.append(segment)
+        if anchor >= len(segments):
+            out.append(hints)
+        return "".join(out)
+
+
+def optimize_html(html: str) -> Tuple[str, Dict[str, int]]:
+    """
+    Served version of a generated page: markup, inline CSS and inline JS minified,
+    images after the first OPTIMIZE_EAGER_IMAGES lazy-loaded and decoded off the
+    main thread, Unsplash images given a responsive srcset in the best format
+    the browser accepts, Google Fonts set to display=swap and the font (and
+    image) origins preconnected. Returns (html, stats).
+    """
+    original_bytes = len(html.encode("utf-8"))
+
+    def result(optimizer: _Optimizer, optimized: str) -> Tuple[str, Dict[str, int]]:
+        return optimized, {"original_bytes": original_bytes, "optimized_bytes": len(optimized.encode("utf-8")),
+                           **optimizer.stats}
+
+    # Lazy loading, decoding, display=swap and preconnect hints are always applied. srcset
+    # candidates add markup; on image-heavy pages they can outweigh what minifying saved, so
+    # they are only kept when the page still comes out smaller. The minified markup is kept
+    # unless it is larger than the page as written with the same additions (already compact
+    # pages, where the added attributes cost more than collapsing whitespace saves).
+    full = _Optimizer()
+    optimized = full.run(html)
+    if len(optimized.encode("utf-8")) < original_bytes or not full.stats["srcset_images"]:
+        best = result(full, optimized)
+    else:
+        minified = _Optimizer(responsive=False)
+        best = result(minified, minified.run(html))
+    as_written = _Optimizer(responsive=False, minify=False)
+    annotated = result(as_written, as_written.run(html))
+    return annotated if annotated[1]["optimized_bytes"] < best[1]["optimized_bytes"] else best
@@ -0,0 +1,159 @@
+import gzip
+import hashlib
+import os
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:  # optional: without it only gzip is offered
+    brotli = None
+
+# Responses smaller than this are sent uncompressed
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "500"))
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+COMPRESSIBLE_TYPES = ("text/html", "text/plain", "text/css", "application/json", "application/javascript", "image/svg+xml")
+
+# Cache-Control values used by the API
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+PENDING_MAX_AGE = int(os.getenv("PENDING_MAX_AGE", "2"))
+
+
+def make_etag(*parts: object) -> str:
+    """Strong ETag from the state that determines a response"""
+    digest = hashlib.sha256("\x1f".join(str(part) for part in parts).encode("utf-8")).hexdigest()
+    return f'"{digest[:32]}"'
+
+
+def parse_accept_encoding(headers: Headers) -> Dict[str, float]:
+    accepted: Dict[str, float] = {}
+    for item in headers.get("accept-encoding", "").split(","):
+        name, _, params = item.strip().partition(";")
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if name:
+            accepted[name.strip().lower()] = q
+    return accepted
+
+
+def accepts_encoding(headers: Headers, encoding: str) -> bool:
+    """Whether Accept-Encoding allows `encoding` (listed, or via *, with q > 0)"""
+    accepted = parse_accept_encoding(headers)
+    return accepted.get(encoding, accepted.get("*", 0.0)) > 0
+
+
+def choose_encoding(headers: Headers) -> Optional[str]:
+    """Best content coding we can produce for this request: br, then gzip"""
+    accepted = parse_accept_encoding(headers)
+    candidates: List[Tuple[float, int, str]] = []
+    for preference, encoding in enumerate(["br", "gzip"] if brotli is not None else ["gzip"]):
+        q = accepted.get(encoding, accepted.get("*", 0.0))
+        if q > 0:
+            candidates.append((q, -preference, encoding))
+    return max(candidates)[2] if candidates else None
+
+
+def is_not_modified(headers: Headers, etag: str) -> bool:
+    """
+    If-None-Match check. The compression middleware suffixes ETags of encoded
+    responses ("abc-br"), so those validators match the identity ETag too.
+    """
+    value = headers.get("if-none-match")
+    if not value:
+        return False
+    if value.strip() == "*":
+        return True
+    opaque = etag.strip('"')
+    for candidate in _split_etags(value):
+        candidate = candidate.strip('"')
+        if candidate == opaque or candidate in (f"{opaque}-br", f"{opaque}-gzip"):
+            return True
+    return False
+
+
+def _split_etags(value: str) -> Iterable[str]:
+    for item in value.split(","):
+        item = item.strip()
+        if item.startswith("W/"):
+            # Weak comparison is fine for If-None-Match
+            item = item[2:]
+        if item:
+            yield item
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+class CompressionMiddleware:
+    """
+    Negotiated br/gzip compression for complete (non-streamed) responses.
+
+    Responses that are already encoded (e.g. stored gzip blobs), streamed (SSE),
+    small, 304s or of a non-text type pass through untouched. A compressed
+    response gets Vary: Accept-Encoding and an encoding-specific ETag.
+    """
+
+    def __init__(self, app: ASGIApp, minimum_size: int = COMPRESS_MIN_BYTES):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = choose_encoding(Headers(scope=scope))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start: Optional[Message] = None
+        passthrough = False
+
+        async def wrapped_send(message: Message):
+            nonlocal start, passthrough
+            if message["type"] == "http.response.start":
+                start = message
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+
+            headers = MutableHeaders(raw=start["headers"])
+            body = message.get("body", b"")
+            negotiable = (
+                start["status"] == 200
+                and "content-encoding" not in headers
+                and headers.get("content-type", "").split(";")[0].strip() in COMPRESSIBLE_TYPES
+            )
+            if negotiable and not message.get("more_body", False):
+                headers.add_vary_header("Accept-Encoding")
+            if not negotiable or message.get("more_body", False) or len(body) < self.minimum_size:
+                passthrough = True
+                await send(start)
+                await send(message)
+                return
+
+            compressed = compress(body, encoding)
+            headers["Content-Encoding"] = encoding
+            headers["Content-Length"] = str(len(compressed))
+            etag = headers.get("etag")
+            if etag and etag.endswith('"'):
+                headers["ETag"] = f'{etag[:-1]}-{encoding}"'
+            await send(start)
+            await send({"type": "http.response.body", "body": compressed})
+
+        await self.app(scope, receive, wrapped_send)
@@ -0,0 +1,188 @@
+import asyncio
+import os
+import time
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+import httpx
+
+import database
+from services.rate_limiter import rate_limits
+
+# Photos requested per refill (photos/random returns at most 30 per call)
+IMAGE_POOL_BATCH = int(os.getenv("IMAGE_POOL_BATCH", "30"))
+# Refill a keyword's pool in the background once fewer unserved photos than this remain
+IMAGE_POOL_LOW_WATER = int(os.getenv("IMAGE_POOL_LOW_WATER", "16"))
+# Photos kept per keyword; the most-served ones are pruned beyond this
+IMAGE_POOL_MAX_PER_KEYWORD = int(os.getenv("IMAGE_POOL_MAX_PER_KEYWORD", "120"))
+# How often the refresher sweeps for low pools (seconds)
+IMAGE_POOL_REFRESH_INTERVAL = float(os.getenv("IMAGE_POOL_REFRESH_INTERVAL", "300"))
+# Keywords requested within this many seconds are kept warm
+IMAGE_POOL_ACTIVE_SECONDS = float(os.getenv("IMAGE_POOL_ACTIVE_SECONDS", str(7 * 24 * 3600)))
+# HEAD-check photo URLs before they enter the pool
+IMAGE_POOL_VALIDATE = os.getenv("IMAGE_POOL_VALIDATE", "1") != "0"
+# Background refills leave this many Unsplash requests for cold-pool generations
+IMAGE_POOL_RESERVED_REQUESTS = 2
+
+# fetch(search_query, count) -> [(photo_id, url)]
+PhotoFetcher = Callable[[str, int], Awaitable[List[Tuple[str, str]]]]
+
+
+def normalize_keyword(search_query: str) -> str:
+    return " ".join(search_query.lower().split())
+
+
+class ImagePool:
+    """
+    Per-keyword pools of Unsplash photo URLs, stored in sites.db.
+
+    take() hands out photos that have not been served before (least-served first
+    once a pool has been cycled through) and never the same photo twice in one
+    call. Only a cold or drained pool makes the caller wait for Unsplash; otherwise
+    a pool that drops below the low-water mark is queued for the background
+    refresher, which also sweeps recently requested keywords periodically. Refills
+    are single-flight per keyword, fetch a full batch per request, and in the
+    background only run while the Unsplash bucket has spare requests.
+    """
+
+    def __init__(
+        self,
+        fetch: PhotoFetcher,
+        get_client: Callable[[], httpx.AsyncClient],
+        batch: int = IMAGE_POOL_BATCH,
+        low_water: int = IMAGE_POOL_LOW_WATER,
+        max_per_keyword: int = IMAGE_POOL_MAX_PER_KEYWORD,
+        refresh_interval: float = IMAGE_POOL_REFRESH_INTERVAL,
+        validate: bool = IMAGE_POOL_VALIDATE,
+    ):
+        self.fetch = fetch
+        self.get_client = get_client
+        self.batch = batch
+        self.low_water = low_water
+        self.max_per_keyword = max_per_keyword
+        self.refresh_interval = refresh_interval
+        self.validate = validate
+        self._refills: Dict[str, asyncio.Task] = {}
+        self._wanted: Set[str] = set()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._refresher: Optional[asyncio.Task] = None
+        self.stats: Dict[str, int] = {
+            "takes": 0,
+            "warm": 0,          # served entirely from the pool
+            "cold": 0,          # had to wait for a refill
+            "reused": 0,        # photos served again because the pool ran dry
+            "refills": 0,
+            "refill_failures": 0,
+            "photos_added": 0,
+            "photos_rejected": 0,
+            "deferred": 0,      # background refills postponed to save quota
+        }
+
+    def start(self):
+        self._wakeup = asyncio.Event()
+        self._refresher = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self):
+        tasks = [task for task in [self._refresher, *self._refills.values()] if task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._refresher = None
+        self._refills = {}
+
+    async def take(self, search_query: str, count: int) -> List[str]:
+        keyword = normalize_keyword(search_query)
+        self.stats["takes"] += 1
+        urls, unserved = await database.aio.take_pool_images(keyword, count)
+
+        if len(urls) < count:
+            # Cold or drained pool: the only case where a generation waits on Unsplash
+            self.stats["cold"] += 1
+            await self._refill(keyword)
+            more, unserved = await database.aio.take_pool_images(keyword, count - len(urls), exclude=urls)
+            urls += more
+            if len(urls) < count:
+                reused, _ = await database.aio.take_pool_images(keyword, count - len(urls), exclude=urls, allow_reuse=True)
+                self.stats["reused"] += len(reused)
+                urls += reused
+        else:
+            self.stats["warm"] += 1
+
+        if unserved < self.low_water:
+            self._wanted.add(keyword)
+            if self._wakeup is not None:
+                self._wakeup.set()
+
+        print(f"[{datetime.now()}] Image pool '{keyword}': served {len(urls)}, {unserved} unserved left")
+        return urls
+
+    async def _refill(self, keyword: str):
+        task = self._refills.get(keyword)
+        if task is None:
+            task = asyncio.create_task(self._do_refill(keyword))
+            self._refills[keyword] = task
+            task.add_done_callback(lambda _: self._refills.pop(keyword, None))
+        await asyncio.shield(task)
+
+    async def _do_refill(self, keyword: str):
+        self.stats["refills"] += 1
+        try:
+            photos = await self.fetch(keyword, self.batch)
+            if self.validate and photos:
+                photos = await self._validated(photos)
+            added = await database.aio.add_pool_images(keyword, photos, self.max_per_keyword)
+            self.stats["photos_added"] += added
+            print(f"[{datetime.now()}] Image pool '{keyword}': refilled with {added} new photo(s)")
+        except Exception as e:
+            self.stats["refill_failures"] += 1
+            print(f"[{datetime.now()}] Image pool refill failed for '{keyword}': {e}")
+
+    async def _validated(self, photos: List[Tuple[str, str]]) -> List[Tuple[str, str]]:
+        """Keep photos whose URL answers a HEAD request with an image"""
+        client = self.get_client()
+
+        async def check(url: str) -> bool:
+            try:
+                response = await client.head(url)
+                return response.status_code == 200 and response.headers.get("content-type", "").startswith("image/")
+            except Exception:
+                return False
+
+        results = await asyncio.gather(*(check(url) for _, url in photos))
+        valid = [photo for photo, ok in zip(photos, results) if ok]
+        self.stats["photos_rejected"] += len(photos) - len(valid)
+        return valid
+
+    async def _refresh_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.refresh_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                keywords = list(self._wanted)
+                active_since = time.time() - IMAGE_POOL_ACTIVE_SECONDS
+                for keyword in await database.aio.get_low_image_pools(self.low_water, active_since):
+                    if keyword not in keywords:
+                        keywords.append(keyword)
+                for keyword in keywords:
+                    if rate_limits.buckets["unsplash"].available() < IMAGE_POOL_RESERVED_REQUESTS + 1:
+                        # Keep quota for cold pools; the next sweep tries again
+                        self.stats["deferred"] += len(keywords) - keywords.index(keyword)
+                        break
+                    self._wanted.discard(keyword)
+                    await self._refill(keyword)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[{datetime.now()}] Image pool refresh failed: {e}")
+
+    async def snapshot(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "warm_rate": round(self.stats["warm"] / self.stats["takes"], 3) if self.stats["takes"] else 0.0,
+            "refilling": sorted(self._refills),
+            "queued": sorted(self._wanted),
+            "usage": await database.aio.image_pool_usage(),
+        }
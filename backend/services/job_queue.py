@@ -0,0 +1,151 @@
+import asyncio
+import os
+import random
+import socket
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import database
+
+# Handler receives (job_id, payload) and raises on failure
+JobHandler = Callable[[str, Dict[str, Any]], Awaitable[None]]
+# Called once a job has used up its attempts: (job_id, error message)
+FailureHandler = Callable[[str, str], Awaitable[None]]
+
+
+class JobQueue:
+    """
+    Durable job queue stored in the `jobs` table of sites.db.
+
+    A fixed pool of worker tasks leases one job at a time. While a job runs its
+    lease is extended by a heartbeat; if the process dies the lease expires and
+    the job becomes runnable again (on restart, or by another process). Failed
+    attempts are re-queued with exponential backoff up to max_attempts.
+    """
+
+    def __init__(
+        self,
+        handler: JobHandler,
+        on_failure: FailureHandler,
+        concurrency: int = int(os.getenv("GENERATION_WORKERS", "2")),
+        lease_seconds: float = float(os.getenv("GENERATION_LEASE_SECONDS", "60")),
+        max_attempts: int = int(os.getenv("GENERATION_MAX_ATTEMPTS", "3")),
+        backoff_base: float = 5.0,
+        backoff_max: float = 300.0,
+        poll_interval: float = 2.0,
+    ):
+        self.handler = handler
+        self.on_failure = on_failure
+        self.concurrency = concurrency
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.poll_interval = poll_interval
+        self._workers: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._worker_prefix = f"{socket.gethostname()}-{os.getpid()}"
+
+    async def start(self):
+        recovered = await database.aio.recover_orphaned_jobs(self.max_attempts)
+        if recovered:
+            print(f"[{datetime.now()}] Job queue: re-queued {recovered} orphaned job(s)")
+        self._wakeup = asyncio.Event()
+        self._workers = [
+            asyncio.create_task(self._worker(f"{self._worker_prefix}-{n}"))
+            for n in range(self.concurrency)
+        ]
+        print(f"[{datetime.now()}] Job queue started with {self.concurrency} worker(s)")
+
+    async def stop(self):
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def enqueue(self, job_id: str, payload: Dict[str, Any]):
+        await database.aio.enqueue_job(job_id, payload, self.max_attempts)
+        self.notify()
+
+    def notify(self):
+        """Wake idle workers instead of waiting for the next poll"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _backoff(self, attempts: int) -> float:
+        delay = min(self.backoff_max, self.backoff_base * (2 ** (attempts - 1)))
+        return delay * random.uniform(0.5, 1.0)
+
+    async def _worker(self, worker_id: str):
+        while True:
+            # Cleared before looking, so a notify() that lands while the lease query
+            # runs is not lost: the wait below returns at once and we look again
+            self._wakeup.clear()
+            try:
+                job = await database.aio.lease_next_job(worker_id, self.lease_seconds)
+            except Exception as e:
+                print(f"[{datetime.now()}] Job queue: lease failed: {e}")
+                job = None
+
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            await self._run(job, worker_id)
+
+    async def _heartbeat(self, job_id: str, worker_id: str, handler: asyncio.Task):
+        """Extend the lease while the handler runs; cancel the handler once the lease is lost"""
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                held = await database.aio.heartbeat_job(job_id, worker_id, self.lease_seconds)
+            except Exception as e:
+                # Try again next beat; the lease only goes if it actually expires
+                print(f"[{datetime.now()}] Job queue: heartbeat for {job_id} failed: {e}")
+                continue
+            if not held:
+                print(f"[{datetime.now()}] Job queue: lost lease on {job_id}, abandoning attempt")
+                handler.cancel()
+                return
+
+    async def _run(self, job: Dict[str, Any], worker_id: str):
+        job_id = job["id"]
+        attempts = job["attempts"]
+        max_attempts = job["max_attempts"]
+
+        # A lease that expired after its last allowed attempt (worker crashed mid-run)
+        if attempts > max_attempts:
+            error = job.get("last_error") or "Generation interrupted too many times"
+            if await database.aio.fail_job(job_id, worker_id, error):
+                await self.on_failure(job_id, error)
+            return
+
+        print(f"[{datetime.now()}] Job queue: {worker_id} running {job_id} (attempt {attempts}/{max_attempts})")
+        handler = asyncio.create_task(self.handler(job_id, job["payload"]))
+        heartbeat = asyncio.create_task(self._heartbeat(job_id, worker_id, handler))
+        try:
+            await handler
+        except asyncio.CancelledError:
+            if asyncio.current_task().cancelling():
+                # Shutdown: leave the lease to expire so the job is picked up again
+                raise
+            # Cancelled by the heartbeat: the job belongs to whoever holds the lease now
+            return
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            if attempts < max_attempts:
+                delay = self._backoff(attempts)
+                print(f"[{datetime.now()}] Job queue: {job_id} failed ({error}), retrying in {delay:.1f}s")
+                await database.aio.fail_job(job_id, worker_id, error, retry_delay=delay)
+            else:
+                print(f"[{datetime.now()}] Job queue: {job_id} failed permanently ({error})")
+                if await database.aio.fail_job(job_id, worker_id, error):
+                    await self.on_failure(job_id, str(e))
+        else:
+            if not await database.aio.complete_job(job_id, worker_id):
+                print(f"[{datetime.now()}] Job queue: {job_id} finished after its lease was lost")
+        finally:
+            heartbeat.cancel()
@@ -0,0 +1,251 @@
+import asyncio
+import os
+import re
+import unicodedata
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import database
+
+# Translations kept in process memory in front of the keyword_translations table
+KEYWORD_CACHE_SIZE = int(os.getenv("KEYWORD_CACHE_SIZE", "1024"))
+# Misses arriving within this window (seconds) share one model call
+KEYWORD_BATCH_WINDOW = float(os.getenv("KEYWORD_BATCH_WINDOW", "0.05"))
+KEYWORD_BATCH_SIZE = int(os.getenv("KEYWORD_BATCH_SIZE", "8"))
+
+# translate_batch(product_types) -> keywords per input (None where the model gave nothing usable)
+BatchTranslator = Callable[[List[str]], Awaitable[List[Optional[str]]]]
+SyncBatchTranslator = Callable[[List[str]], List[Optional[str]]]
+
+# Offline fallback when the model is unavailable: Korean product words -> stock-photo keywords.
+# Longer entries win, so "막대사탕" matches before "사탕".
+FALLBACK_KEYWORDS = {
+    # food & drink
+    "고구마": "sweet potato", "감자": "potato", "막대사탕": "lollipop", "사탕": "candy",
+    "초콜릿": "chocolate", "쿠키": "cookie", "케이크": "cake", "빵": "bread", "떡": "rice cake",
+    "마카롱": "macaron", "디저트": "dessert", "커피": "coffee", "원두": "coffee beans", "차": "tea",
+    "녹차": "green tea", "와인": "wine", "맥주": "beer", "주스": "juice", "꿀": "honey", "잼": "jam",
+    "과일": "fruit", "사과": "apple", "딸기": "strawberry", "귤": "tangerine", "김치": "kimchi",
+    "반찬": "korean side dish", "도시락": "lunch box", "샐러드": "salad", "견과": "nuts",
+    # beauty & home
+    "비누": "soap", "향수": "perfume", "캔들": "candle", "양초": "candle", "디퓨저": "diffuser",
+    "화장품": "cosmetics", "립스틱": "lipstick", "크림": "cream", "샴푸": "shampoo", "로션": "lotion",
+    "수건": "towel", "이불": "bedding", "베개": "pillow", "그릇": "bowl", "접시": "plate", "컵": "cup",
+    "머그": "mug", "도자기": "ceramic pottery", "가구": "furniture", "의자": "chair", "책상": "desk",
+    "조명": "lamp", "꽃": "flower", "식물": "plant", "화분": "potted plant",
+    # fashion
+    "옷": "clothing", "의류": "clothing", "티셔츠": "t-shirt", "셔츠": "shirt", "원피스": "dress",
+    "바지": "pants", "청바지": "jeans", "니트": "knitwear", "코트": "coat", "신발": "shoes",
+    "운동화": "sneakers", "가방": "bag", "지갑": "wallet", "모자": "hat", "양말": "socks",
+    "안경": "glasses", "시계": "watch", "주얼리": "jewelry", "쥬얼리": "jewelry", "반지": "ring",
+    "목걸이": "necklace", "귀걸이": "earrings",
+    # other
+    "책": "book", "노트": "notebook", "문구": "stationery", "펜": "pen", "장난감": "toy",
+    "인형": "doll", "반려동물": "pet", "강아지": "dog", "고양이": "cat", "자전거": "bicycle",
+    "캠핑": "camping", "카메라": "camera", "이어폰": "earphones", "휴대폰": "smartphone",
+    "수제": "handmade", "천연": "natural", "유기농": "organic",
+}
+
+_FALLBACK_TERMS = sorted(FALLBACK_KEYWORDS, key=len, reverse=True)
+
+
+def normalize_product_type(text: str) -> str:
+    """Cache key: NFKC, lower case, punctuation dropped, whitespace collapsed"""
+    text = unicodedata.normalize("NFKC", text).lower()
+    text = re.sub(r"[^\w\s]", " ", text)
+    return " ".join(text.split())
+
+
+def fallback_keywords(product_type: str) -> str:
+    """Dictionary translation (objects first, modifiers last, at most three keywords)"""
+    normalized = normalize_product_type(product_type)
+    found: List[Tuple[int, str]] = []
+    remaining = normalized
+    for term in _FALLBACK_TERMS:
+        position = remaining.find(term)
+        if position >= 0:
+            found.append((position, FALLBACK_KEYWORDS[term]))
+            remaining = remaining.replace(term, " " * len(term))
+    if found:
+        # Korean puts the object last ("천연 재료로 만든 수제 비누"): take the rightmost matches
+        keywords = [english for _, english in sorted(found, reverse=True)]
+        return " ".join(dict.fromkeys(keywords[:3]))
+    if normalized.isascii():
+        return " ".join(normalized.split()[:3])
+    # Last resort: the original replacement rules
+    return product_type.replace("천연 재료로 만든 ", "").replace("수제 ", "")
+
+
+class KeywordCache:
+    """
+    Memo for product description -> stock-photo keywords.
+
+    Lookups go memory LRU -> keyword_translations table (shared by every process
+    using sites.db) -> model. Concurrent misses for the same normalized text wait
+    on one future, and distinct misses are collected for KEYWORD_BATCH_WINDOW (and
+    while the previous batch is in flight) so one model call translates several.
+    Model failures fall back to the offline dictionary; those results are not
+    stored, so the next request asks the model again.
+    """
+
+    def __init__(
+        self,
+        translate_batch: BatchTranslator,
+        translate_batch_sync: SyncBatchTranslator,
+        size: int = KEYWORD_CACHE_SIZE,
+        batch_window: float = KEYWORD_BATCH_WINDOW,
+        batch_size: int = KEYWORD_BATCH_SIZE,
+    ):
+        self.translate_batch = translate_batch
+        self.translate_batch_sync = translate_batch_sync
+        self.size = size
+        self.batch_window = batch_window
+        self.batch_size = batch_size
+        self._memory: "OrderedDict[str, str]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._pending: List[Tuple[str, str]] = []
+        self._drainer: Optional[asyncio.Task] = None
+        self.stats: Dict[str, int] = {
+            "memory_hits": 0,
+            "db_hits": 0,
+            "joined": 0,         # waited on another caller's miss
+            "misses": 0,
+            "model_calls": 0,
+            "fallbacks": 0,
+        }
+
+    def _remember(self, key: str, keywords: str):
+        self._memory[key] = keywords
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.size:
+            self._memory.popitem(last=False)
+
+    def _from_memory(self, key: str) -> Optional[str]:
+        keywords = self._memory.get(key)
+        if keywords is not None:
+            self._memory.move_to_end(key)
+            self.stats["memory_hits"] += 1
+        return keywords
+
+    def _fallback(self, product_type: str) -> str:
+        self.stats["fallbacks"] += 1
+        keywords = fallback_keywords(product_type)
+        print(f"[{datetime.now()}] Keyword fallback '{product_type}' -> '{keywords}'")
+        return keywords
+
+    async def get(self, product_type: str) -> str:
+        key = normalize_product_type(product_type)
+        if not key:
+            return self._fallback(product_type)
+        keywords = self._from_memory(key)
+        if keywords is not None:
+            return keywords
+
+        future = self._inflight.get(key)
+        if future is not None:
+            self.stats["joined"] += 1
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        queued = False
+        try:
+            try:
+                keywords = await database.aio.get_keyword_translation(key)
+            except Exception as e:
+                print(f"[{datetime.now()}] Keyword cache lookup failed: {e}")
+                keywords = None
+            if keywords is not None:
+                self.stats["db_hits"] += 1
+                self._remember(key, keywords)
+                future.set_result(keywords)
+            else:
+                self.stats["misses"] += 1
+                self._pending.append((key, product_type))
+                queued = True
+                if self._drainer is None:
+                    self._drainer = asyncio.create_task(self._drain())
+            return await asyncio.shield(future)
+        except BaseException:
+            # Cancelled (the keywords stage deadline) or failed before the key was queued: no
+            # batch will resolve the future, so callers that joined it get the fallback
+            if not queued and not future.done():
+                future.set_result(self._fallback(product_type))
+            raise
+        finally:
+            if self._inflight.get(key) is future and future.done():
+                del self._inflight[key]
+
+    async def _drain(self):
+        try:
+            await asyncio.sleep(self.batch_window)
+            while self._pending:
+                batch = self._pending[:self.batch_size]
+                del self._pending[:len(batch)]
+                await self._translate(batch)
+        finally:
+            self._drainer = None
+
+    async def _translate(self, batch: List[Tuple[str, str]]):
+        self.stats["model_calls"] += 1
+        try:
+            results = await self.translate_batch([product_type for _, product_type in batch])
+        except Exception as e:
+            print(f"[{datetime.now()}] Keyword extraction failed: {e}")
+            results = [None] * len(batch)
+
+        rows = []
+        for (key, product_type), keywords in zip(batch, results):
+            if keywords:
+                rows.append((key, product_type, keywords))
+                self._remember(key, keywords)
+            else:
+                keywords = self._fallback(product_type)
+            future = self._inflight.pop(key, None)
+            if future is not None and not future.done():
+                future.set_result(keywords)
+
+        if rows:
+            try:
+                await database.aio.store_keyword_translations(rows)
+            except Exception as e:
+                print(f"[{datetime.now()}] Keyword cache store failed: {e}")
+
+    def get_sync(self, product_type: str) -> str:
+        """Blocking form of get() for the sync pipeline (no batching)"""
+        key = normalize_product_type(product_type)
+        if not key:
+            return self._fallback(product_type)
+        keywords = self._from_memory(key)
+        if keywords is not None:
+            return keywords
+        keywords = database.get_keyword_translation(key)
+        if keywords is not None:
+            self.stats["db_hits"] += 1
+            self._remember(key, keywords)
+            return keywords
+
+        self.stats["misses"] += 1
+        self.stats["model_calls"] += 1
+        try:
+            keywords = self.translate_batch_sync([product_type])[0]
+        except Exception as e:
+            print(f"[{datetime.now()}] Keyword extraction failed: {e}")
+            keywords = None
+        if not keywords:
+            return self._fallback(product_type)
+        self._remember(key, keywords)
+        database.store_keyword_translations([(key, product_type, keywords)])
+        return keywords
+
+    async def snapshot(self) -> Dict[str, Any]:
+        lookups = self.stats["memory_hits"] + self.stats["db_hits"] + self.stats["joined"] + self.stats["misses"]
+        cached = self.stats["memory_hits"] + self.stats["db_hits"] + self.stats["joined"]
+        return {
+            **self.stats,
+            "hit_rate": round(cached / lookups, 3) if lookups else 0.0,
+            "keywords_per_call": round(self.stats["misses"] / self.stats["model_calls"], 2) if self.stats["model_calls"] else 0.0,
+            "memory_entries": len(self._memory),
+            "stored_entries": await database.aio.count_keyword_translations(),
+        }
@@ -0,0 +1,230 @@
+import asyncio
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from datetime import datetime
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Tuple
+
+import database
+
+# Pipeline stages timed per generation. Times add up when a stage runs more than
+# once in a job (model_call and parse on retries, progress_write on every flush).
+# prepare is the wall time of input preparation, covering reference_fetch and
+# keywords -> images running concurrently; reference_fetch includes clean_html on a
+# reference cache miss, images includes waiting for keywords in the sync pipeline.
+# progress_write overlaps the stage whose status it reports (prepare, model_call, parse).
+# model_queue is the wait for a Gemini slot and RPM/TPM quota (async pipeline).
+STAGES = database.GENERATION_METRIC_STAGES
+
+# Histogram buckets (seconds): the fast stages sit in the first few, model calls in the last
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+SIZE_BUCKETS = (1_000, 5_000, 10_000, 25_000, 50_000, 100_000, 250_000)
+
+LabelValues = Tuple[str, ...]
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name, self.help, self.labels = name, help, labels
+        self._values: Dict[LabelValues, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, *labels: str):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0.0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_labels(self.labels, labels)} {_number(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets: Tuple[float, ...], labels: Tuple[str, ...] = ()):
+        self.name, self.help, self.labels, self.buckets = name, help, labels, buckets
+        # label values -> [count per bucket (+Inf last), sum]
+        self._series: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str):
+        with self._lock:
+            counts, total = self._series.setdefault(labels, ([0] * (len(self.buckets) + 1), [0.0]))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            total[0] += value
+
+    def count(self, *labels: str) -> int:
+        series = self._series.get(labels)
+        return sum(series[0]) if series else 0
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((labels, list(counts), total[0]) for labels, (counts, total) in self._series.items())
+        for labels, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else _number(bound)
+                lines.append(f"{self.name}_bucket{_labels(self.labels + ('le',), labels + (le,))} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, labels)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labels, labels)} {cumulative}")
+        return lines
+
+
+def _labels(names: Tuple[str, ...], values: LabelValues) -> str:
+    if not names:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in values)
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(names, escaped)) + "}"
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class GenerationTrace:
+    """Stage times and sizes of one generation attempt"""
+
+    def __init__(self, site_id: str, attempt: int):
+        self.site_id = site_id
+        self.attempt = attempt
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+        self.values: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def add_time(self, stage: str, seconds: float):
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def add(self, name: str, amount: int):
+        with self._lock:
+            self.values[name] = self.values.get(name, 0) + amount
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self._start
+
+
+_trace: contextvars.ContextVar[Optional[GenerationTrace]] = contextvars.ContextVar("generation_trace", default=None)
+
+
+class Metrics:
+    """
+    Per-stage generation latency and sizes. The generation in progress is kept in
+    a context variable, so stages deep in the pipeline (including worker threads
+    started with asyncio.to_thread and StageGraph tasks) record into the right job
+    without passing it around. Finished jobs are observed into in-process
+    histograms (rendered at /metrics) and written to generation_metrics.
+    """
+
+    def __init__(self):
+        self.stage_seconds = Histogram(
+            "generation_stage_seconds", "Time spent in a pipeline stage per generation attempt",
+            STAGE_BUCKETS, ("stage",))
+        self.generation_seconds = Histogram(
+            "generation_duration_seconds", "End-to-end generation attempt time", STAGE_BUCKETS, ("status",))
+        self.prompt_chars = Histogram("generation_prompt_chars", "Prompt size per model call attempt", SIZE_BUCKETS)
+        self.response_chars = Histogram("generation_response_chars", "Model response size per generation", SIZE_BUCKETS)
+        self.generations = Counter("generations_total", "Finished generation attempts", ("status",))
+        self.tokens = Counter("generation_tokens_total", "Model tokens (reported by the API, else estimated)", ("kind",))
+        self.model_retries = Counter("generation_model_retries_total", "Model calls retried within a generation attempt")
+        self.stage_errors = Counter("generation_stage_errors_total", "Stages that raised", ("stage",))
+        self.persist_errors = 0
+
+    # -- recording (no-ops outside a generation) --------------------------------
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        trace = _trace.get()
+        if trace is None:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.stage_errors.inc(1, name)
+            raise
+        finally:
+            trace.add_time(name, time.perf_counter() - start)
+
+    def add_time(self, name: str, seconds: float):
+        """Add time measured outside a stage() block (e.g. waiting to enter a context manager)"""
+        trace = _trace.get()
+        if trace is not None:
+            trace.add_time(name, seconds)
+
+    def add(self, name: str, amount: int):
+        """Add to a per-generation value (prompt_chars, response_tokens, model_retries, ...)"""
+        trace = _trace.get()
+        if trace is not None:
+            trace.add(name, amount)
+
+    @asynccontextmanager
+    async def track_generation(self, site_id: str, attempt: int) -> AsyncIterator[GenerationTrace]:
+        trace = GenerationTrace(site_id, attempt)
+        token = _trace.set(trace)
+        error: Optional[BaseException] = None
+        try:
+            yield trace
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            _trace.reset(token)
+            await self._finish(trace, error)
+
+    async def _finish(self, trace: GenerationTrace, error: Optional[BaseException]):
+        if isinstance(error, asyncio.CancelledError):
+            # Shutdown: the job will run again
+            return
+        status = "error" if error is not None else "completed"
+        total = trace.elapsed()
+        self.generations.inc(1, status)
+        self.generation_seconds.observe(total, status)
+        for stage, seconds in trace.stages.items():
+            self.stage_seconds.observe(seconds, stage)
+        values = trace.values
+        if "prompt_chars" in values:
+            self.prompt_chars.observe(values["prompt_chars"])
+        if "response_chars" in values:
+            self.response_chars.observe(values["response_chars"])
+        for kind in ("prompt", "response"):
+            if values.get(f"{kind}_tokens"):
+                self.tokens.inc(values[f"{kind}_tokens"], kind)
+        if values.get("model_retries"):
+            self.model_retries.inc(values["model_retries"])
+        try:
+            await database.aio.record_generation_metrics({
+                "site_id": trace.site_id,
+                "attempt": trace.attempt,
+                "status": status,
+                "started_at": trace.started_at,
+                "total_ms": round(total * 1000, 1),
+                **{f"{stage}_ms": round(trace.stages[stage] * 1000, 1) for stage in STAGES if stage in trace.stages},
+                **{name: values.get(name, 0) for name in database.GENERATION_METRIC_VALUES},
+                "error": f"{type(error).__name__}: {error}"[:500] if error is not None else None,
+            })
+        except Exception as e:
+            # Metrics must never fail a generation
+            self.persist_errors += 1
+            print(f"[{datetime.now()}] Recording generation metrics failed: {e}")
+
+    # -- exposition ------------------------------------------------------------
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in (self.generations, self.generation_seconds, self.stage_seconds, self.prompt_chars,
+                       self.response_chars, self.tokens, self.model_retries, self.stage_errors):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
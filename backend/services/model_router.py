@@ -0,0 +1,423 @@
+import asyncio
+import os
+import random
+import time
+from contextlib import nullcontext
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+import google.generativeai as genai
+from google.api_core import exceptions as api_exceptions
+from google.generativeai import client as genai_client
+from google.generativeai.types import BlockedPromptException, StopCandidateException
+
+from services.metrics import metrics
+from services.prompt_budget import count_tokens
+from services.rate_limiter import (
+    DEFAULT_RETRY_AFTER,
+    is_rate_limit_error,
+    rate_limits,
+    retry_after_from_error,
+)
+
+# Secondary models (comma-separated) tried when every backend of GEMINI_MODEL is
+# tripped, rate-limited or slower to reach than FAILOVER_WAIT
+GEMINI_FALLBACK_MODELS = [m.strip() for m in os.getenv("GEMINI_FALLBACK_MODELS", "").split(",") if m.strip()]
+# Model calls per request, over all backends (the first call included)
+MODEL_ROUTER_MAX_ATTEMPTS = int(os.getenv("MODEL_ROUTER_MAX_ATTEMPTS", "4"))
+# Full-jitter backoff before calling the same backend again: uniform(0, min(MAX, BASE * 2^n)) seconds
+MODEL_ROUTER_BACKOFF_BASE = float(os.getenv("MODEL_ROUTER_BACKOFF_BASE", "1"))
+MODEL_ROUTER_BACKOFF_MAX = float(os.getenv("MODEL_ROUTER_BACKOFF_MAX", "20"))
+# Give up (ModelUnavailableError) rather than wait longer than this for any backend to reopen
+MODEL_ROUTER_MAX_WAIT = float(os.getenv("MODEL_ROUTER_MAX_WAIT", "30"))
+# Prefer a lower-tier (fallback) model once the best primary backend is this many seconds away
+MODEL_ROUTER_FAILOVER_WAIT = float(os.getenv("MODEL_ROUTER_FAILOVER_WAIT", "5"))
+# Consecutive 5xx/timeouts that open a backend's breaker, and how long it stays open
+# (doubling on every failed half-open probe, up to BREAKER_MAX_COOLDOWN)
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", "3"))
+BREAKER_COOLDOWN = float(os.getenv("BREAKER_COOLDOWN", "30"))
+BREAKER_MAX_COOLDOWN = 300.0
+# Weight of the newest call in a backend's latency average
+LATENCY_EWMA_ALPHA = 0.3
+# Re-check interval while every backend is half-open with its probe still running
+PROBE_POLL_INTERVAL = 0.25
+
+RATE_LIMITED = "rate_limited"
+SERVER_ERROR = "server_error"
+CLIENT_ERROR = "client_error"
+OTHER_ERROR = "other_error"
+
+
+class ModelUnavailableError(RuntimeError):
+    """No backend can take a call within MODEL_ROUTER_MAX_WAIT"""
+
+
+class KeyClients:
+    """
+    Clients for one API key. google-generativeai only configures keys process-wide
+    (genai.configure), so per-key clients come from its private _ClientManager and are
+    attached to a GenerativeModel's private _client / _async_client. This class is the
+    only place that touches those internals: it checks they exist when a backend is
+    built, so an SDK upgrade that moves them stops the server at startup instead of
+    failing every call. requirements.txt pins the version this was written against.
+    """
+
+    def __init__(self, api_key: str):
+        manager = getattr(genai_client, "_ClientManager", None)
+        probe = genai.GenerativeModel(model_name="models/probe")
+        if manager is None or not hasattr(probe, "_client") or not hasattr(probe, "_async_client"):
+            raise RuntimeError(
+                f"google-generativeai {getattr(genai, '__version__', '?')} no longer has the per-key client "
+                "internals services/model_router.py relies on; install the version pinned in requirements.txt"
+            )
+        self._manager = manager()
+        self._manager.configure(api_key=api_key)
+
+    def bind(self, model: Any, use_async: bool) -> Any:
+        if isinstance(model, genai.GenerativeModel):
+            # The async client must be created inside the running loop, so each is bound on first use
+            if use_async and model._async_client is None:
+                model._async_client = self._manager.get_default_client("generative_async")
+            elif not use_async and model._client is None:
+                model._client = self._manager.get_default_client("generative")
+        return model
+
+
+def api_keys_from_env() -> List[str]:
+    """GEMINI_API_KEYS (comma-separated), falling back to the single GEMINI_API_KEY"""
+    keys = [k.strip() for k in os.getenv("GEMINI_API_KEYS", "").split(",") if k.strip()]
+    if not keys and os.getenv("GEMINI_API_KEY"):
+        keys = [os.getenv("GEMINI_API_KEY")]
+    return keys
+
+
+def classify_error(error: Exception) -> str:
+    """
+    How a failed call reflects on the backend:
+    - rate_limited (429): open the breaker until Retry-After, try another backend
+    - server_error (5xx, timeouts, dropped connections): counts toward tripping the breaker
+    - client_error (bad request, blocked prompt, unusable answer): the same request
+      would fail anywhere, so it is not retried
+    - other_error: retried, no effect on the breaker
+    """
+    if isinstance(error, (api_exceptions.TooManyRequests, api_exceptions.ResourceExhausted)):
+        return RATE_LIMITED
+    if isinstance(error, (api_exceptions.ServerError, api_exceptions.RetryError, asyncio.TimeoutError,
+                          ConnectionError, OSError)):
+        return SERVER_ERROR
+    if isinstance(error, (api_exceptions.ClientError, BlockedPromptException, StopCandidateException, ValueError)):
+        return CLIENT_ERROR
+    if is_rate_limit_error(error):
+        return RATE_LIMITED
+    return OTHER_ERROR
+
+
+class CircuitBreaker:
+    """
+    closed -> open after BREAKER_FAILURES consecutive server errors (or at once on a
+    429, for its Retry-After); open -> half_open when the cooldown ends, where a
+    single probe call decides between closed and open again with a doubled cooldown.
+    """
+
+    def __init__(self, failures: int = BREAKER_FAILURES, cooldown: float = BREAKER_COOLDOWN):
+        self.failure_threshold = failures
+        self.base_cooldown = cooldown
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.failures = 0
+        self.open_until = 0.0
+        self.probing = False
+        self.trips = 0
+
+    def _refresh(self):
+        if self.state == "open" and time.monotonic() >= self.open_until:
+            self.state = "half_open"
+            self.probing = False
+
+    def wait(self) -> float:
+        """Seconds until a call may go through (0 = now)"""
+        self._refresh()
+        if self.state == "open":
+            return self.open_until - time.monotonic()
+        if self.state == "half_open" and self.probing:
+            return PROBE_POLL_INTERVAL
+        return 0.0
+
+    def admits(self) -> bool:
+        return self.wait() == 0.0
+
+    def claim(self) -> bool:
+        """The caller is about to call; in half_open it becomes the probe (returns True)"""
+        if self.state == "half_open":
+            self.probing = True
+            return True
+        return False
+
+    def release(self):
+        """The call ended without telling anything about the backend's health"""
+        self.probing = False
+
+    def on_success(self):
+        self.state = "closed"
+        self.failures = 0
+        self.cooldown = self.base_cooldown
+        self.probing = False
+
+    def on_failure(self, open_for: Optional[float] = None) -> bool:
+        """Count a failure; open_for forces the breaker open that long. True if it tripped."""
+        self.failures += 1
+        was_probe = self.state == "half_open"
+        self.probing = False
+        if open_for is None:
+            if not was_probe and self.failures < self.failure_threshold:
+                return False
+            open_for = self.cooldown
+            self.cooldown = min(BREAKER_MAX_COOLDOWN, self.cooldown * 2)
+        self.state = "open"
+        self.open_until = max(self.open_until, time.monotonic() + open_for)
+        self.trips += 1
+        return True
+
+    def snapshot(self) -> Dict[str, Any]:
+        self._refresh()
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "open_for": round(max(0.0, self.open_until - time.monotonic()), 2) if self.state == "open" else 0.0,
+            "cooldown": self.cooldown,
+            "trips": self.trips,
+        }
+
+
+class Backend:
+    """One (API key, model) pair with its own client, rate-limit buckets, breaker and health stats"""
+
+    def __init__(self, model_name: str, key_index: int, api_key: Optional[str], tier: int,
+                 generation_config: Optional[Dict[str, Any]] = None):
+        self.name = f"{model_name}@key{key_index + 1}"
+        self.model_name = model_name
+        self.tier = tier
+        # Per-key clients; genai.configure() would switch the key for every model in the process
+        self._clients = KeyClients(api_key) if api_key else None
+        self.model = genai.GenerativeModel(model_name=model_name, generation_config=generation_config)
+        self.rpm, self.tpm = rate_limits.gemini_buckets(self.name)
+        self.breaker = CircuitBreaker()
+        self.in_flight = 0
+        # Seconds per call, per kind of call (keyword lookups and page generations differ by ~100x)
+        self.latency: Dict[str, float] = {}
+        self.stats = {
+            "calls": 0,
+            "successes": 0,
+            RATE_LIMITED: 0,
+            SERVER_ERROR: 0,
+            CLIENT_ERROR: 0,
+            OTHER_ERROR: 0,
+        }
+        self.last_error: Optional[str] = None
+        self.last_error_at: Optional[str] = None
+
+    def bound_model(self, use_async: bool = True):
+        """The model with this backend's key attached (stand-ins from benchmarks are returned as they are)"""
+        if self._clients is None:
+            return self.model
+        return self._clients.bind(self.model, use_async)
+
+    def expected_wait(self, tokens: int) -> float:
+        breaker_wait = self.breaker.wait()
+        return max(breaker_wait, self.rpm.expected_wait(1), self.tpm.expected_wait(tokens))
+
+    def score(self, tokens: int, kind: str) -> float:
+        """Expected seconds until this backend would have answered"""
+        latency = self.latency.get(kind, 0.0)
+        return self.expected_wait(tokens) + latency * (1 + self.in_flight)
+
+    def observe_latency(self, kind: str, seconds: float):
+        previous = self.latency.get(kind)
+        self.latency[kind] = seconds if previous is None else previous + LATENCY_EWMA_ALPHA * (seconds - previous)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "model": self.model_name,
+            "tier": self.tier,
+            "in_flight": self.in_flight,
+            "latency_ewma": {kind: round(seconds, 3) for kind, seconds in self.latency.items()},
+            "success_rate": round(self.stats["successes"] / self.stats["calls"], 4) if self.stats["calls"] else None,
+            **self.stats,
+            "breaker": self.breaker.snapshot(),
+            "last_error": self.last_error,
+            "last_error_at": self.last_error_at,
+        }
+
+
+class ModelRouter:
+    """
+    Spreads Gemini calls over every (API key, model) backend.
+
+    Each call goes to the backend of the lowest model tier (GEMINI_MODEL first,
+    then GEMINI_FALLBACK_MODELS in order) that can be reached within
+    MODEL_ROUTER_FAILOVER_WAIT, picking within the tier by expected wait on its
+    rate-limit buckets plus observed latency times its load. Failures feed the
+    backend's breaker and buckets (see classify_error) and the call moves on at
+    once to the best backend it has not failed on yet, the fallback model
+    included; only when every backend has failed it does one get called again,
+    after a full-jitter backoff. All backends share the process-wide gemini
+    concurrency governor.
+    """
+
+    def __init__(self, api_keys: List[str], models: List[str], generation_config: Optional[Dict[str, Any]] = None,
+                 max_attempts: int = MODEL_ROUTER_MAX_ATTEMPTS):
+        self.backends = [
+            Backend(model_name, key_index, api_key, tier, generation_config)
+            for tier, model_name in enumerate(dict.fromkeys(models))
+            for key_index, api_key in enumerate(api_keys or [None])
+        ]
+        self.max_attempts = max_attempts
+        self.stats = {
+            "calls": 0,
+            "failed_calls": 0,
+            "retries": 0,
+            "failovers": 0,
+            "fallback_model_calls": 0,
+            "backoff_seconds": 0.0,
+            "unavailable": 0,
+        }
+
+    @property
+    def primary(self) -> Backend:
+        return self.backends[0]
+
+    def _pick(self, tokens: int, kind: str, failed: Set[Backend]) -> Optional[Backend]:
+        ready = [b for b in self.backends if b.breaker.admits()]
+        # Backends that already failed this call come last
+        ready = [b for b in ready if b not in failed] or ready
+        if not ready:
+            return None
+        for tier in sorted({b.tier for b in ready}):
+            candidates = [b for b in ready if b.tier == tier]
+            if min(b.expected_wait(tokens) for b in candidates) <= MODEL_ROUTER_FAILOVER_WAIT:
+                break
+        else:
+            candidates = ready
+        return min(candidates, key=lambda b: (b.score(tokens, kind), random.random()))
+
+    async def _assign(self, tokens: int, kind: str, failed: Set[Backend]) -> Backend:
+        """The backend for the next attempt (in_flight already counted), waiting for a breaker to reopen if all are open"""
+        deadline = time.monotonic() + MODEL_ROUTER_MAX_WAIT
+        while True:
+            backend = self._pick(tokens, kind, failed)
+            if backend is not None:
+                backend.in_flight += 1
+                return backend
+            wait = min(b.breaker.wait() for b in self.backends)
+            if time.monotonic() + wait > deadline:
+                self.stats["unavailable"] += 1
+                raise ModelUnavailableError(
+                    f"All {len(self.backends)} Gemini backends are unavailable for at least {wait:.0f}s")
+            await asyncio.sleep(wait)
+
+    def _backoff(self, retry: int) -> float:
+        return random.uniform(0, min(MODEL_ROUTER_BACKOFF_MAX, MODEL_ROUTER_BACKOFF_BASE * 2 ** (retry - 1)))
+
+    def _on_failure(self, backend: Backend, error: Exception) -> str:
+        kind = classify_error(error)
+        backend.stats[kind] += 1
+        backend.last_error = f"{type(error).__name__}: {str(error)[:200]}"
+        backend.last_error_at = datetime.now().isoformat()
+        if kind == RATE_LIMITED:
+            retry_after = retry_after_from_error(error) or DEFAULT_RETRY_AFTER
+            backend.rpm.penalize(retry_after)
+            backend.tpm.penalize()
+            backend.breaker.on_failure(open_for=retry_after)
+        elif kind == SERVER_ERROR:
+            if backend.breaker.on_failure():
+                print(f"[{datetime.now()}] Circuit breaker opened for {backend.name} "
+                      f"({backend.breaker.failures} failures, open {backend.breaker.open_until - time.monotonic():.0f}s)")
+        elif kind == CLIENT_ERROR:
+            # The backend answered; the request itself is the problem
+            backend.breaker.on_success()
+        else:
+            backend.breaker.release()
+        return kind
+
+    async def call(self, prompt: str, consume: Callable[[Any], Awaitable[Any]], stream: bool = False,
+                   kind: str = "generation", max_attempts: Optional[int] = None) -> Any:
+        """
+        Send prompt to the best backend and return await consume(response).
+
+        consume runs inside the attempt, so an error while reading a stream is
+        retried like any other. Generation calls record model_queue, model_call
+        and model_retries in the current generation trace.
+        """
+        # model_queue runs from here to the model call, then from each failed call to the next
+        queued = time.perf_counter()
+        tokens = count_tokens(prompt)
+        attempts = max_attempts or self.max_attempts
+        record = kind == "generation"
+        self.stats["calls"] += 1
+        previous: Optional[Backend] = None
+        failed: Set[Backend] = set()
+        last_error: Optional[Exception] = None
+
+        for attempt in range(attempts):
+            backend = await self._assign(tokens, kind, failed)
+            probe = backend.breaker.claim()
+            try:
+                if attempt > 0:
+                    self.stats["retries"] += 1
+                    if record:
+                        metrics.add("model_retries", 1)
+                    if backend is previous:
+                        delay = self._backoff(attempt)
+                        self.stats["backoff_seconds"] += delay
+                        await asyncio.sleep(delay)
+                    else:
+                        self.stats["failovers"] += 1
+                        print(f"[{datetime.now()}] Failing over from {previous.name} to {backend.name}")
+                if backend.tier > 0:
+                    self.stats["fallback_model_calls"] += 1
+
+                async with rate_limits.governors["gemini"].slot():
+                    await backend.rpm.acquire(1)
+                    await backend.tpm.acquire(tokens)
+                    if record:
+                        print(f"[{datetime.now()}] Sending request to {backend.name}...")
+                        metrics.add_time("model_queue", time.perf_counter() - queued)
+                    backend.stats["calls"] += 1
+                    started = time.monotonic()
+                    try:
+                        with metrics.stage("model_call") if record else nullcontext():
+                            response = await backend.bound_model().generate_content_async(prompt, stream=stream)
+                            result = await consume(response)
+                    except Exception as e:
+                        queued = time.perf_counter()
+                        error_kind = self._on_failure(backend, e)
+                        print(f"[{datetime.now()}] {backend.name} failed ({error_kind}): {type(e).__name__}: {e}")
+                        if error_kind == CLIENT_ERROR:
+                            self.stats["failed_calls"] += 1
+                            raise
+                        last_error = e
+                        previous = backend
+                        failed.add(backend)
+                        continue
+
+                    backend.stats["successes"] += 1
+                    backend.observe_latency(kind, time.monotonic() - started)
+                    backend.breaker.on_success()
+                    backend.rpm.reward()
+                    backend.tpm.reward()
+                    return result
+            finally:
+                backend.in_flight -= 1
+                # Cancelled while holding a half-open probe: let the next caller probe
+                if probe and backend.breaker.state == "half_open":
+                    backend.breaker.release()
+
+        self.stats["failed_calls"] += 1
+        raise last_error
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "max_attempts": self.max_attempts,
+            **{key: round(value, 3) if isinstance(value, float) else value for key, value in self.stats.items()},
+            "backends": {backend.name: backend.snapshot() for backend in self.backends},
+        }
@@ -0,0 +1,79 @@
+import asyncio
+import os
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import database
+from minhash import LSH_BANDS, LSH_ROWS, MINHASH_PERMUTATIONS, NEAR_DUPLICATE_THRESHOLD
+
+# Sites fingerprinted per backfill pass, and the pause between passes in seconds.
+# New sites are fingerprinted when they complete; the backfill only covers sites
+# stored before fingerprinting existed.
+FINGERPRINT_BACKFILL_BATCH = int(os.getenv("FINGERPRINT_BACKFILL_BATCH", "200"))
+FINGERPRINT_BACKFILL_INTERVAL = float(os.getenv("FINGERPRINT_BACKFILL_INTERVAL", "5"))
+
+
+class NearDuplicates:
+    """
+    Near-duplicate lookups over the MinHash/LSH tables in sites.db, plus a
+    background pass that fingerprints sites completed before they existed.
+    """
+
+    def __init__(self, batch: int = FINGERPRINT_BACKFILL_BATCH, interval: float = FINGERPRINT_BACKFILL_INTERVAL):
+        self.batch = batch
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+        self.stats: Dict[str, Any] = {
+            "queries": 0,
+            "query_ms_total": 0.0,
+            "backfilled": 0,
+            "backfill_complete": False,
+        }
+
+    async def find(self, site_id: str, threshold: float, limit: int) -> Optional[List[Dict[str, Any]]]:
+        start = time.perf_counter()
+        matches = await database.aio.get_near_duplicates(site_id, threshold, limit)
+        self.stats["queries"] += 1
+        self.stats["query_ms_total"] += (time.perf_counter() - start) * 1000
+        return matches
+
+    def start(self):
+        self._task = asyncio.create_task(self._backfill_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _backfill_loop(self):
+        cursor = None
+        while True:
+            try:
+                done, cursor = await database.aio.backfill_fingerprints(self.batch, cursor)
+                self.stats["backfilled"] += done
+                if done < self.batch:
+                    self.stats["backfill_complete"] = True
+                    if self.stats["backfilled"]:
+                        print(f"[{datetime.now()}] Fingerprint backfill complete ({self.stats['backfilled']} sites)")
+                    return
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[{datetime.now()}] Fingerprint backfill failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    async def snapshot(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "query_ms_avg": round(self.stats["query_ms_total"] / self.stats["queries"], 2) if self.stats["queries"] else 0.0,
+            **await database.aio.fingerprint_usage(),
+            "threshold": NEAR_DUPLICATE_THRESHOLD,
+            "permutations": MINHASH_PERMUTATIONS,
+            "bands": LSH_BANDS,
+            "rows_per_band": LSH_ROWS,
+        }
+
+
+near_duplicates = NearDuplicates()
@@ -0,0 +1,351 @@
+import asyncio
+import os
+import re
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+import database
+
+# Colors kept per site (the model usually returns 4-6)
+PALETTE_MAX_COLORS = int(os.getenv("PALETTE_MAX_COLORS", "6"))
+# How often unsaved changes are written and the index is reconciled with the database
+# (only when the gallery changed since the last pass), in seconds
+PALETTE_INDEX_SYNC_INTERVAL = float(os.getenv("PALETTE_INDEX_SYNC_INTERVAL", "60"))
+# Sync reads every completed site's palette in one scan when more than this many are missing
+PALETTE_SCAN_THRESHOLD = 2000
+# Bumped when the on-disk layout or the color conversion changes
+PALETTE_INDEX_VERSION = 1
+
+_HEX = re.compile(r"#?\b([0-9a-fA-F]{6}|[0-9a-fA-F]{3})\b")
+
+# sRGB (D65) -> XYZ, and the D65 white point
+_RGB_TO_XYZ = np.array([
+    [0.4124564, 0.3575761, 0.1804375],
+    [0.2126729, 0.7151522, 0.0721750],
+    [0.0193339, 0.1191920, 0.9503041],
+], dtype=np.float64)
+_WHITE = np.array([0.95047, 1.0, 1.08883])
+
+
+def parse_palette(colors: Any) -> List[str]:
+    """
+    Normalized "#rrggbb" codes from a palette: a list of strings (entries like
+    "#FF5733 (primary)" are fine) or a comma-separated string. Unparseable
+    entries are skipped; at most PALETTE_MAX_COLORS are kept.
+    """
+    if isinstance(colors, str):
+        colors = colors.split(",")
+    if not isinstance(colors, (list, tuple)):
+        return []
+    parsed: List[str] = []
+    for color in colors:
+        match = _HEX.search(str(color))
+        if not match:
+            continue
+        code = match.group(1).lower()
+        if len(code) == 3:
+            code = "".join(c * 2 for c in code)
+        if f"#{code}" not in parsed:
+            parsed.append(f"#{code}")
+        if len(parsed) == PALETTE_MAX_COLORS:
+            break
+    return parsed
+
+
+def hex_to_lab(codes: List[str]) -> np.ndarray:
+    """(n, 3) CIELAB (D65) for "#rrggbb" codes"""
+    raw = bytes.fromhex("".join(code[1:] for code in codes))
+    rgb = np.frombuffer(raw, dtype=np.uint8).reshape(-1, 3).astype(np.float64) / 255.0
+    linear = np.where(rgb <= 0.04045, rgb / 12.92, ((rgb + 0.055) / 1.055) ** 2.4)
+    xyz = linear @ _RGB_TO_XYZ.T / _WHITE
+    f = np.where(xyz > (6 / 29) ** 3, np.cbrt(xyz), xyz / (3 * (6 / 29) ** 2) + 4 / 29)
+    lab = np.stack([116 * f[:, 1] - 16, 500 * (f[:, 0] - f[:, 1]), 200 * (f[:, 1] - f[:, 2])], axis=1)
+    return lab.astype(np.float32)
+
+
+def index_path() -> str:
+    """Cache file next to the database (sites.db -> sites.palettes.npz)"""
+    return os.path.splitext(database.DB_PATH)[0] + ".palettes.npz"
+
+
+class PaletteIndex:
+    """
+    In-memory CIELAB palettes of completed sites for "similar colors" queries.
+
+    Colors are stored slot-major in a float32 (3, K, capacity) array: channel c
+    of color slot k of every site is one contiguous vector, so a query is a few
+    whole-array operations per query color. Sites with fewer than K colors
+    repeat their first color in the spare slots and weight them 0. The distance
+    between palettes is the symmetric best-match ΔE: each color's distance to
+    the nearest color of the other palette, averaged both ways.
+
+    Sites are added when a generation finishes and removed on delete. The
+    arrays are saved to index_path() in the background and loaded at startup,
+    then reconciled with the database by site id, so only sites completed or
+    deleted while the index was not running are read from the database.
+    """
+
+    def __init__(self, max_colors: int = PALETTE_MAX_COLORS, sync_interval: float = PALETTE_INDEX_SYNC_INTERVAL):
+        self.max_colors = max_colors
+        self.sync_interval = sync_interval
+        self._lock = threading.Lock()
+        self._lab = np.zeros((3, max_colors, 0), dtype=np.float32)
+        # 1/count for used slots, 0 for padding (the site -> query average)
+        self._weights = np.zeros((max_colors, 0), dtype=np.float32)
+        self._counts = np.zeros(0, dtype=np.int32)
+        self._ids: List[str] = []
+        self._rows: Dict[str, int] = {}
+        # Completed sites without a usable palette (not re-read on every sync)
+        self._empty: Set[str] = set()
+        self._dirty = False
+        self._gallery_version: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self.stats: Dict[str, Any] = {
+            "queries": 0,
+            "query_ms_total": 0.0,
+            "added": 0,
+            "removed": 0,
+            "syncs": 0,
+            "saves": 0,
+            "loaded_from_file": False,
+        }
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    # -- maintenance ---------------------------------------------------------
+
+    def _reserve(self, size: int):
+        capacity = self._lab.shape[2]
+        if size <= capacity:
+            return
+        old = capacity
+        capacity = max(size, capacity * 2, 1024)
+        lab = np.zeros((3, self.max_colors, capacity), dtype=np.float32)
+        weights = np.zeros((self.max_colors, capacity), dtype=np.float32)
+        counts = np.zeros(capacity, dtype=np.int32)
+        lab[:, :, :old], weights[:, :old], counts[:old] = self._lab, self._weights, self._counts
+        self._lab, self._weights, self._counts = lab, weights, counts
+
+    def _slots(self, palettes: List[List[str]]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """(3, K, b) Lab, (K, b) weights and (b,) counts for non-empty palettes"""
+        counts = np.array([len(codes) for codes in palettes], dtype=np.int32)
+        padded = [codes + [codes[0]] * (self.max_colors - len(codes)) for codes in palettes]
+        lab = hex_to_lab([code for codes in padded for code in codes]).reshape(len(palettes), self.max_colors, 3)
+        used = np.arange(self.max_colors)[:, None] < counts[None, :]
+        return lab.transpose(2, 1, 0), np.where(used, 1.0 / counts, 0).astype(np.float32), counts
+
+    def _put_many(self, items: List[Tuple[str, List[str]]]):
+        """Index palettes (replacing existing rows); empty palettes mark the site as having none"""
+        for site_id, codes in items:
+            if not codes:
+                self._drop(site_id)
+                self._empty.add(site_id)
+        items = [(site_id, codes) for site_id, codes in items if codes]
+        if not items:
+            return
+        rows = []
+        for site_id, _ in items:
+            self._empty.discard(site_id)
+            row = self._rows.get(site_id)
+            if row is None:
+                row = len(self._ids)
+                self._ids.append(site_id)
+                self._rows[site_id] = row
+            rows.append(row)
+        self._reserve(len(self._ids))
+        lab, weights, counts = self._slots([codes for _, codes in items])
+        self._lab[:, :, rows], self._weights[:, rows], self._counts[rows] = lab, weights, counts
+
+    def _drop(self, site_id: str) -> bool:
+        """Forget a site, moving the last row into its place. Returns whether it was known."""
+        was_empty = site_id in self._empty
+        self._empty.discard(site_id)
+        row = self._rows.pop(site_id, None)
+        if row is None:
+            return was_empty
+        last = len(self._ids) - 1
+        if row != last:
+            moved = self._ids[last]
+            self._lab[:, :, row], self._weights[:, row], self._counts[row] = \
+                self._lab[:, :, last], self._weights[:, last], self._counts[last]
+            self._ids[row] = moved
+            self._rows[moved] = row
+        self._ids.pop()
+        self._weights[:, last] = 0
+        self._counts[last] = 0
+        return True
+
+    def add(self, site_id: str, colors: Any):
+        """Index (or re-index) a completed site's palette"""
+        with self._lock:
+            self._put_many([(site_id, parse_palette(colors))])
+            self._dirty = True
+        self.stats["added"] += 1
+
+    def remove(self, site_id: str):
+        with self._lock:
+            if self._drop(site_id):
+                self._dirty = True
+                self.stats["removed"] += 1
+
+    # -- queries ---------------------------------------------------------------
+
+    def search(self, colors: Any, limit: int) -> List[Tuple[str, float]]:
+        """
+        Sites whose palettes are closest to `colors`, as (site_id, ΔE distance),
+        nearest first. Raises ValueError if `colors` has no parseable color.
+        """
+        codes = parse_palette(colors)
+        if not codes:
+            raise ValueError("No valid hex colors in palette")
+        return self._rank(hex_to_lab(codes), limit, exclude=None)
+
+    def similar_to(self, site_id: str, limit: int) -> Optional[List[Tuple[str, float]]]:
+        """search() with an indexed site's palette, excluding the site; None if not indexed"""
+        with self._lock:
+            row = self._rows.get(site_id)
+            if row is None:
+                return None
+            lab = self._lab[:, :self._counts[row], row].T.copy()
+        return self._rank(lab, limit, exclude=site_id)
+
+    def _rank(self, query: np.ndarray, limit: int, exclude: Optional[str]) -> List[Tuple[str, float]]:
+        start = time.perf_counter()
+        with self._lock:
+            n = len(self._ids)
+            if n == 0:
+                return []
+            lab, weights = self._lab[:, :, :n], self._weights[:, :n]
+            d2 = np.empty((self.max_colors, n), dtype=np.float32)
+            scratch = np.empty_like(d2)
+            nearest = np.empty(n, dtype=np.float32)
+            query_to_site = np.zeros(n, dtype=np.float32)
+            site_to_query = np.full((self.max_colors, n), np.inf, dtype=np.float32)
+            for color in query:
+                # Squared ΔE from this query color to every slot of every site
+                np.subtract(lab[0], color[0], out=d2)
+                np.square(d2, out=d2)
+                for channel in (1, 2):
+                    np.subtract(lab[channel], color[channel], out=scratch)
+                    np.square(scratch, out=scratch)
+                    d2 += scratch
+                np.min(d2, axis=0, out=nearest)
+                query_to_site += np.sqrt(nearest)
+                np.minimum(site_to_query, d2, out=site_to_query)
+            np.sqrt(site_to_query, out=site_to_query)
+            site_to_query *= weights
+            scores = (query_to_site / len(query) + site_to_query.sum(axis=0)) / 2
+            if exclude is not None and exclude in self._rows:
+                scores[self._rows[exclude]] = np.inf
+            k = min(limit, n)
+            top = np.argpartition(scores, k - 1)[:k] if k < n else np.arange(n)
+            top = top[np.argsort(scores[top], kind="stable")]
+            results = [(self._ids[i], round(float(scores[i]), 2)) for i in top if np.isfinite(scores[i])]
+
+        self.stats["queries"] += 1
+        self.stats["query_ms_total"] += (time.perf_counter() - start) * 1000
+        return results
+
+    # -- persistence & sync --------------------------------------------------
+
+    def load(self):
+        """Load the cache file (if compatible) and reconcile it with the database"""
+        path = index_path()
+        if os.path.exists(path):
+            try:
+                with np.load(path, allow_pickle=False) as data:
+                    if int(data["version"]) == PALETTE_INDEX_VERSION and data["lab"].shape[:2] == (3, self.max_colors):
+                        with self._lock:
+                            n = len(data["ids"])
+                            self._reserve(n)
+                            self._lab[:, :, :n] = data["lab"]
+                            self._counts[:n] = data["counts"]
+                            used = np.arange(self.max_colors)[:, None] < self._counts[None, :n]
+                            self._weights[:, :n] = np.where(used, 1.0 / np.maximum(self._counts[:n], 1), 0)
+                            self._ids = [str(site_id) for site_id in data["ids"]]
+                            self._rows = {site_id: row for row, site_id in enumerate(self._ids)}
+                            self._empty = {str(site_id) for site_id in data["empty"]}
+                        self.stats["loaded_from_file"] = True
+            except Exception as e:
+                print(f"[{datetime.now()}] Palette index file unreadable, rebuilding: {e}")
+        self.sync()
+        print(f"[{datetime.now()}] Palette index: {len(self)} site(s)")
+
+    def sync(self):
+        """Add completed sites missing from the index, drop the ones no longer completed"""
+        version = database.get_change_counter("gallery")
+        completed = set(database.get_completed_site_ids())
+        with self._lock:
+            known = set(self._rows) | self._empty
+        missing = sorted(completed - known)
+        gone = known - completed
+        if len(missing) > PALETTE_SCAN_THRESHOLD:
+            # Cold start: one pass over the table beats looking up each id
+            palettes = database.get_site_palettes()
+        else:
+            palettes = database.get_site_palettes(missing) if missing else {}
+        with self._lock:
+            for site_id in gone:
+                self._drop(site_id)
+            self._put_many([(site_id, parse_palette(palettes.get(site_id))) for site_id in missing])
+            if missing or gone:
+                self._dirty = True
+        self._gallery_version = version
+        self.stats["syncs"] += 1
+
+    def save(self):
+        if not self._dirty:
+            return
+        with self._lock:
+            n = len(self._ids)
+            lab, counts = self._lab[:, :, :n].copy(), self._counts[:n].copy()
+            ids, empty = np.array(self._ids, dtype=str), np.array(sorted(self._empty), dtype=str)
+            self._dirty = False
+        path = index_path()
+        tmp = f"{path}.tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, version=PALETTE_INDEX_VERSION, lab=lab, counts=counts, ids=ids, empty=empty)
+        os.replace(tmp, path)
+        self.stats["saves"] += 1
+
+    def start(self):
+        self._task = asyncio.create_task(self._sync_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await asyncio.to_thread(self.save)
+
+    async def _sync_loop(self):
+        while True:
+            await asyncio.sleep(self.sync_interval)
+            try:
+                # Other processes sharing sites.db only show up through the gallery counter
+                if await database.aio.get_change_counter("gallery") != self._gallery_version:
+                    await asyncio.to_thread(self.sync)
+                await asyncio.to_thread(self.save)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[{datetime.now()}] Palette index sync failed: {e}")
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "query_ms_avg": round(self.stats["query_ms_total"] / self.stats["queries"], 2) if self.stats["queries"] else 0.0,
+            "sites": len(self),
+            "sites_without_palette": len(self._empty),
+            "memory_bytes": int(self._lab.nbytes + self._weights.nbytes + self._counts.nbytes),
+            "file": index_path(),
+            "unsaved_changes": self._dirty,
+        }
+
+
+palette_index = PaletteIndex()
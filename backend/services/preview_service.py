@@ -0,0 +1,126 @@
+import re
+from datetime import datetime
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from bs4 import BeautifulSoup, Comment, Tag
+
+# Rough size of the markup kept from <body>; enough for the hero + first section
+PREVIEW_BODY_BUDGET = 15000
+PREVIEW_IMAGE_WIDTH = 480
+PREVIEW_IMAGE_QUALITY = 60
+
+UNSPLASH_URL_RE = re.compile(r'https://images\.unsplash\.com/[^\s"\'()<>]+')
+LOREMFLICKR_URL_RE = re.compile(r'https://loremflickr\.com/(\d+)/(\d+)/')
+FONT_IMPORT_RE = re.compile(r'@import\s+url\([^)]*fonts\.(?:googleapis|gstatic)\.com[^)]*\)\s*;?', re.IGNORECASE)
+
+# Freezes the page in its initial state: no animations, transitions or scroll effects
+FREEZE_CSS = (
+    "*,*::before,*::after{animation:none!important;transition:none!important;"
+    "scroll-behavior:auto!important}html,body{overflow:hidden!important}"
+)
+
+
+class PreviewService:
+    """
+    Builds the static thumbnail version of a generated site for the gallery:
+    no scripts, no web fonts, downsized images, body cut to roughly the first screen.
+    """
+
+    def _downsize_unsplash(self, match: re.Match) -> str:
+        parts = urlsplit(match.group(0).replace("&amp;", "&"))
+        params = dict(parse_qsl(parts.query, keep_blank_values=True))
+        params.update({"w": str(PREVIEW_IMAGE_WIDTH), "q": str(PREVIEW_IMAGE_QUALITY), "fm": "jpg", "fit": "max"})
+        return urlunsplit((parts.scheme, parts.netloc, parts.path, urlencode(params), ""))
+
+    def _downsize_loremflickr(self, match: re.Match) -> str:
+        width, height = int(match.group(1)), int(match.group(2))
+        if width <= PREVIEW_IMAGE_WIDTH:
+            return match.group(0)
+        scaled_height = max(1, height * PREVIEW_IMAGE_WIDTH // width)
+        return f"https://loremflickr.com/{PREVIEW_IMAGE_WIDTH}/{scaled_height}/"
+
+    def downsize_image_urls(self, text: str) -> str:
+        """Rewrite known image CDN URLs inside markup, CSS or attribute values to thumbnail size"""
+        text = UNSPLASH_URL_RE.sub(self._downsize_unsplash, text)
+        return LOREMFLICKR_URL_RE.sub(self._downsize_loremflickr, text)
+
+    def _truncate(self, node: Tag, budget: int) -> int:
+        """
+        Keep children of node in document order until budget chars are used.
+        The child that crosses the budget is truncated recursively (so a single
+        wrapper <div> does not keep the whole page); everything after it is dropped.
+        """
+        used = 0
+        for child in list(node.children):
+            if used >= budget:
+                child.extract()
+                continue
+            size = len(str(child))
+            if used + size > budget and isinstance(child, Tag) and child.name not in ('style', 'svg'):
+                size = self._truncate(child, budget - used)
+            used += size
+        return used
+
+    def render_preview(self, html_content: str) -> str:
+        soup = BeautifulSoup(html_content, 'html.parser')
+
+        # 1. Drop everything executable or embedded
+        for tag in soup(['script', 'noscript', 'iframe', 'object', 'embed', 'video', 'audio', 'canvas', 'template']):
+            tag.decompose()
+        for comment in soup.find_all(string=lambda text: isinstance(text, Comment)):
+            comment.extract()
+
+        # 2. Drop web fonts and resource hints; the thumbnail falls back to system fonts
+        for link in soup.find_all('link'):
+            href = link.get('href', '')
+            rel = [r.lower() for r in link.get('rel', [])]
+            if 'fonts.googleapis.com' in href or 'fonts.gstatic.com' in href or \
+                    any(r in ('preconnect', 'preload', 'prefetch', 'modulepreload', 'dns-prefetch') for r in rel):
+                link.decompose()
+
+        for style in soup.find_all('style'):
+            css = style.string or ""
+            style.string = self.downsize_image_urls(FONT_IMPORT_RE.sub('', css))
+
+        # 3. Strip event handlers, downsize images
+        for tag in soup.find_all(True):
+            for key in list(tag.attrs):
+                if key.lower().startswith('on'):
+                    del tag.attrs[key]
+            if 'style' in tag.attrs:
+                tag['style'] = self.downsize_image_urls(tag['style'])
+
+        for img in soup.find_all('img'):
+            img.attrs.pop('srcset', None)
+            img.attrs.pop('sizes', None)
+            if img.get('src'):
+                img['src'] = self.downsize_image_urls(img['src'])
+            img['loading'] = 'lazy'
+            img['decoding'] = 'async'
+
+        # 4. Keep only the top of the page
+        if soup.body is not None:
+            self._truncate(soup.body, PREVIEW_BODY_BUDGET)
+
+        # 5. Freeze the page and forbid scripts even if some slipped through
+        head = soup.head
+        if head is None:
+            head = soup.new_tag('head')
+            if soup.html is not None:
+                soup.html.insert(0, head)
+            else:
+                soup.insert(0, head)
+        csp = soup.new_tag('meta')
+        csp['http-equiv'] = 'Content-Security-Policy'
+        csp['content'] = "script-src 'none'"
+        head.insert(0, csp)
+        freeze = soup.new_tag('style')
+        freeze.string = FREEZE_CSS
+        head.append(freeze)
+
+        preview = str(soup)
+        print(f"[{datetime.now()}] Preview rendered: {len(html_content)} -> {len(preview)} chars")
+        return preview
+
+
+# Create singleton instance
+preview_service = PreviewService()
@@ -0,0 +1,37 @@
+import asyncio
+from collections import defaultdict
+from typing import Dict, Set
+
+
+class ProgressHub:
+    """
+    In-process wake-up signal for SSE streams. The database stays the source of
+    truth: publishers write progress first, then publish(site_id) so subscribers
+    re-read it immediately instead of waiting for their poll timeout. Streams
+    served by another process still see updates on the timeout.
+    """
+
+    def __init__(self):
+        self._waiters: Dict[str, Set[asyncio.Event]] = defaultdict(set)
+
+    def publish(self, key: str):
+        for event in self._waiters.get(key, ()):
+            event.set()
+
+    async def wait(self, key: str, timeout: float):
+        event = asyncio.Event()
+        self._waiters[key].add(event)
+        try:
+            await asyncio.wait_for(event.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            waiters = self._waiters.get(key)
+            if waiters is not None:
+                waiters.discard(event)
+                if not waiters:
+                    del self._waiters[key]
+
+
+# Create singleton instance
+progress_hub = ProgressHub()
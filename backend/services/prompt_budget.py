@@ -0,0 +1,183 @@
+import os
+import re
+from typing import List, Optional, Tuple
+
+from services.html_cleaner import VOID_TAGS
+
+# Whole generation prompt, in (estimated) model tokens; the reference HTML gets what
+# the instructions leave over
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "24000"))
+# Share of the reference budget <head> may take when the page does not fit; the body gets the rest
+REFERENCE_HEAD_SHARE = float(os.getenv("REFERENCE_HEAD_SHARE", "0.4"))
+# Below this many tokens a truncated reference is not worth sending
+MIN_REFERENCE_TOKENS = 200
+# Left for the omission comment and the end tags that close a cut body
+CUT_MARKER_TOKENS = 64
+# Prefix search counts whole chunks of this many characters before bisecting one
+PREFIX_CHUNK_CHARS = 4096
+
+# Texts at least this long have their last count memoized
+MEMO_MIN_CHARS = 1024
+
+# Calibration: weight of the newest API-reported count, and the range the factor may drift in
+CALIBRATION_ALPHA = 0.2
+CALIBRATION_RANGE = (0.5, 2.0)
+
+_WORDS = re.compile(r"[A-Za-z]+")
+_DIGITS = re.compile(r"\d")
+_HANGUL = re.compile(r"[가-힣ㄱ-ㆎ]")
+_SPACE_RUNS = re.compile(r"\s{2,}")
+_SPACES = re.compile(r"\s")
+_NON_ASCII = re.compile(r"[^\x00-\x7f]")
+
+_BODY_OPEN = re.compile(r"<body\b", re.IGNORECASE)
+_INLINE_SCRIPT = re.compile(r"(<script\b[^>]*>)(.*?)(</script\s*>)", re.IGNORECASE | re.DOTALL)
+_TAG = re.compile(r"<(/?)([a-zA-Z][\w:-]*)[^>]*?(/?)>")
+
+
+class TokenEstimator:
+    """
+    Local token count for Gemini prompts, without a count_tokens round trip.
+
+    Per character class: ~4 letters per token for Latin words, one per digit
+    (Gemini splits numbers), ~0.7 per Hangul syllable, ~0.5 per symbol (HTML
+    punctuation merges into pairs like `="` or `</`), one per whitespace run
+    and per other non-ASCII character. The result is scaled by a factor that
+    tracks the API's own prompt_token_count (observe()), so the estimate
+    converges on the real tokenizer for this app's prompts.
+    """
+
+    def __init__(self):
+        self.scale = 1.0
+        self.observations = 0
+        # The same prompt is counted for the metrics, the rate limiter and calibration
+        self._last: Tuple[Optional[str], float] = (None, 0.0)
+
+    def raw(self, text: str) -> float:
+        last_text, last_raw = self._last
+        if text is last_text:
+            return last_raw
+        raw = self._raw(text)
+        if len(text) >= MEMO_MIN_CHARS:
+            self._last = (text, raw)
+        return raw
+
+    def _raw(self, text: str) -> float:
+        words = _WORDS.findall(text)
+        letters = sum(map(len, words))
+        digits = len(_DIGITS.findall(text))
+        hangul = len(_HANGUL.findall(text))
+        spaces = len(_SPACES.findall(text))
+        other = len(_NON_ASCII.findall(text)) - hangul
+        symbols = len(text) - letters - digits - hangul - spaces - other
+        # A word of n letters is ceil(n / 4) tokens: n / 4 plus 0.375 on average
+        return (letters / 4 + 0.375 * len(words) + digits + 0.7 * hangul
+                + 0.5 * symbols + len(_SPACE_RUNS.findall(text)) + other)
+
+    def count(self, text: str) -> int:
+        return max(1, round(self.raw(text) * self.scale))
+
+    def observe(self, text: str, actual_tokens: int):
+        """Fold in the token count the API reported for `text`"""
+        raw = self.raw(text)
+        if raw <= 0 or actual_tokens <= 0:
+            return
+        low, high = CALIBRATION_RANGE
+        ratio = min(high, max(low, actual_tokens / raw))
+        self.scale += CALIBRATION_ALPHA * (ratio - self.scale) if self.observations else ratio - self.scale
+        self.observations += 1
+
+    def snapshot(self) -> dict:
+        return {"scale": round(self.scale, 4), "observations": self.observations}
+
+
+token_estimator = TokenEstimator()
+
+
+def count_tokens(text: str) -> int:
+    return token_estimator.count(text)
+
+
+def _prefix_within(text: str, budget: int, boundary: str) -> str:
+    """Longest prefix of text within `budget` tokens that ends right after `boundary`"""
+    if count_tokens(text) <= budget:
+        return text
+    # Whole chunks while they fit, then a binary search inside the chunk that does not
+    used, start = 0.0, 0
+    while start < len(text):
+        tokens = token_estimator.raw(text[start:start + PREFIX_CHUNK_CHARS]) * token_estimator.scale
+        if used + tokens > budget:
+            break
+        used += tokens
+        start += PREFIX_CHUNK_CHARS
+    low, high = start, min(len(text), start + PREFIX_CHUNK_CHARS)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if used + token_estimator.raw(text[start:middle]) * token_estimator.scale <= budget:
+            low = middle
+        else:
+            high = middle - 1
+    cut = text.rfind(boundary, 0, low)
+    return text[:cut + len(boundary)] if cut >= 0 else ""
+
+
+def _closing_tags(html: str, keep_open: Tuple[str, ...] = ()) -> str:
+    """End tags for the elements left open in `html`, innermost first"""
+    stack: List[str] = []
+    for closing, name, self_closing in _TAG.findall(html):
+        name = name.lower()
+        if self_closing or name in VOID_TAGS:
+            continue
+        if not closing:
+            stack.append(name)
+        elif name in stack:
+            # Implicitly closes anything opened inside it
+            del stack[len(stack) - 1 - stack[::-1].index(name):]
+    return "".join(f"</{name}>" for name in reversed(stack) if name not in keep_open)
+
+
+def _fit_head(head: str, budget: int) -> str:
+    if count_tokens(head) <= budget:
+        return head
+    # Inline scripts say little about the design; empty them before touching styles
+    head = _INLINE_SCRIPT.sub(lambda m: m.group(1) + m.group(3), head)
+    if count_tokens(head) <= budget:
+        return head
+    # Earliest rules first (resets, variables, base layout); cut after a complete rule or tag
+    kept = _prefix_within(head, budget, "}") or _prefix_within(head, budget, ">")
+    if kept.rfind("<") > kept.rfind(">"):
+        kept = kept[:kept.rfind(">") + 1]
+    return kept + _closing_tags(kept, keep_open=("html",))
+
+
+def fit_reference(html: str, budget: int) -> Tuple[str, int, int]:
+    """
+    The reference HTML cut to `budget` tokens: (html, tokens kept, tokens dropped).
+
+    <head> (styles, fonts, meta) is kept first, up to REFERENCE_HEAD_SHARE of the
+    budget or more if the body is small; inline head scripts go before any CSS
+    does. The body is kept from the top of the page down to a tag boundary, so
+    the header, navigation and hero survive and deep content is what is lost;
+    open elements are closed and the cut is marked in a comment.
+    """
+    total = count_tokens(html)
+    if total <= budget:
+        return html, total, 0
+    if budget < MIN_REFERENCE_TOKENS:
+        return "", 0, total
+
+    match = _BODY_OPEN.search(html)
+    head, body = (html[:match.start()], html[match.start():]) if match else ("", html)
+    body_tokens = count_tokens(body)
+    head_budget = max(int(budget * REFERENCE_HEAD_SHARE), budget - body_tokens)
+    head = _fit_head(head, head_budget)
+
+    body_budget = budget - count_tokens(head) - CUT_MARKER_TOKENS
+    kept_body = _prefix_within(body, body_budget, ">")
+    if len(kept_body) < len(body):
+        dropped = body_tokens - count_tokens(kept_body)
+        kept_body += f"\n<!-- ... {dropped} tokens of lower page content omitted -->\n"
+        kept_body += _closing_tags(head + kept_body)
+    fitted = head + kept_body
+    kept = count_tokens(fitted)
+    return fitted, kept, max(0, total - kept)
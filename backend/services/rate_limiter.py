@@ -0,0 +1,278 @@
+import asyncio
+import os
+import re
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+# Default wait after a 429 that carries no Retry-After information (seconds)
+DEFAULT_RETRY_AFTER = 30.0
+
+RETRY_AFTER_PATTERNS = [
+    re.compile(r'retry in ([\d.]+)\s*s', re.IGNORECASE),
+    re.compile(r'retry_delay\s*\{\s*seconds:\s*(\d+)', re.IGNORECASE),
+    re.compile(r'retry[- ]after[:\s]+([\d.]+)', re.IGNORECASE),
+]
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    if getattr(error, "code", None) == 429 or getattr(error, "status_code", None) == 429:
+        return True
+    text = str(error).lower()
+    return "429" in text or "resource exhausted" in text or "quota" in text
+
+
+def _retry_after_seconds(value: Optional[str]) -> Optional[float]:
+    """Retry-After in seconds; None when absent or an HTTP date"""
+    try:
+        return float(value) if value else None
+    except ValueError:
+        return None
+
+
+def retry_after_from_error(error: Exception) -> Optional[float]:
+    """Retry delay advertised by a Gemini/HTTP rate-limit error, if any"""
+    for detail in getattr(error, "details", None) or []:
+        delay = getattr(detail, "retry_delay", None)
+        if delay is not None and (delay.seconds or delay.nanos):
+            return delay.seconds + delay.nanos / 1e9
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    retry_after = _retry_after_seconds(headers.get("retry-after")) if headers is not None else None
+    if retry_after is not None:
+        return retry_after
+    for pattern in RETRY_AFTER_PATTERNS:
+        match = pattern.search(str(error))
+        if match:
+            return float(match.group(1))
+    return None
+
+
+class TokenBucket:
+    """
+    Async token bucket with FIFO fairness: waiters queue on an asyncio.Lock (which
+    wakes in arrival order) and the head of the queue sleeps until it can be served.
+
+    Rate-limit feedback is adaptive (AIMD): penalize() halves the refill rate and can
+    block the bucket until a Retry-After deadline; reward() recovers 10% of the
+    configured rate per successful call.
+    """
+
+    def __init__(self, name: str, capacity: float, refill_per_second: float, min_rate_fraction: float = 0.1):
+        self.name = name
+        self.capacity = float(capacity)
+        self.base_rate = float(refill_per_second)
+        self.rate = self.base_rate
+        self.min_rate = self.base_rate * min_rate_fraction
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock: Optional[asyncio.Lock] = None
+
+        # Metrics
+        self.acquired = 0
+        self.waiting = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self.throttled = 0
+
+    def _get_lock(self) -> asyncio.Lock:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, tokens: float = 1.0) -> float:
+        """Wait until `tokens` are available and take them. Returns seconds waited."""
+        # A request larger than the bucket could never be served; cap it at a full bucket
+        tokens = min(float(tokens), self.capacity)
+        start = time.monotonic()
+        self.waiting += 1
+        try:
+            async with self._get_lock():
+                while True:
+                    self._refill()
+                    now = time.monotonic()
+                    if now < self.blocked_until:
+                        await asyncio.sleep(self.blocked_until - now)
+                        continue
+                    if self.tokens >= tokens:
+                        self.tokens -= tokens
+                        break
+                    await asyncio.sleep((tokens - self.tokens) / self.rate)
+        finally:
+            self.waiting -= 1
+
+        waited = time.monotonic() - start
+        self.acquired += 1
+        self.wait_seconds_total += waited
+        self.wait_seconds_max = max(self.wait_seconds_max, waited)
+        return waited
+
+    def penalize(self, retry_after: Optional[float] = None):
+        """The upstream said 429: slow down and, if told how long, stop until then"""
+        self._refill()
+        self.throttled += 1
+        self.rate = max(self.min_rate, self.rate * 0.5)
+        self.tokens = min(self.tokens, 0.0)
+        if retry_after:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+        print(f"[{datetime.now()}] Rate limit hit on {self.name}: rate -> {self.rate * 60:.2f}/min"
+              + (f", blocked {retry_after:.1f}s" if retry_after else ""))
+
+    def reward(self):
+        if self.rate < self.base_rate:
+            self.rate = min(self.base_rate, self.rate + self.base_rate * 0.1)
+
+    def sync_remaining(self, remaining: float):
+        """Never believe we have more tokens than the upstream says are left"""
+        self._refill()
+        self.tokens = min(self.tokens, float(remaining))
+
+    def expected_wait(self, tokens: float = 1.0) -> float:
+        """Rough seconds until `tokens` could be taken, counting callers already queued ahead"""
+        self._refill()
+        tokens = min(float(tokens), self.capacity)
+        blocked = max(0.0, self.blocked_until - time.monotonic())
+        deficit = tokens * (self.waiting + 1) - self.tokens
+        return blocked + max(0.0, deficit) / self.rate
+
+    def available(self) -> float:
+        """Tokens that could be taken right now without waiting"""
+        self._refill()
+        if time.monotonic() < self.blocked_until:
+            return 0.0
+        return self.tokens
+
+    def snapshot(self) -> Dict[str, Any]:
+        self._refill()
+        return {
+            "capacity": self.capacity,
+            "tokens": round(self.tokens, 2),
+            "rate_per_minute": round(self.rate * 60, 3),
+            "base_rate_per_minute": round(self.base_rate * 60, 3),
+            "blocked_for": round(max(0.0, self.blocked_until - time.monotonic()), 2),
+            "acquired": self.acquired,
+            "waiting": self.waiting,
+            "wait_seconds_total": round(self.wait_seconds_total, 3),
+            "wait_seconds_avg": round(self.wait_seconds_total / self.acquired, 3) if self.acquired else 0.0,
+            "wait_seconds_max": round(self.wait_seconds_max, 3),
+            "throttled": self.throttled,
+        }
+
+
+class ConcurrencyGovernor:
+    """Caps in-flight calls to one upstream and records how long callers queue for a slot"""
+
+    def __init__(self, name: str, limit: int):
+        self.name = name
+        self.limit = limit
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.in_flight = 0
+        self.waiting = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    @asynccontextmanager
+    async def slot(self):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.limit)
+        start = time.monotonic()
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        waited = time.monotonic() - start
+        self.wait_seconds_total += waited
+        self.wait_seconds_max = max(self.wait_seconds_max, waited)
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "limit": self.limit,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "wait_seconds_total": round(self.wait_seconds_total, 3),
+            "wait_seconds_max": round(self.wait_seconds_max, 3),
+        }
+
+
+def _positive_env(name: str, default: str) -> float:
+    """A limit from the environment; 0 or less would divide by zero or never refill, so it is refused"""
+    raw = os.getenv(name, default)
+    try:
+        value = float(raw)
+    except ValueError:
+        value = 0.0
+    if not value > 0:
+        raise ValueError(f"{name} must be a positive number, got {raw!r}")
+    return value
+
+
+class RateLimits:
+    """
+    Named limits for every outbound API, shared by all generations in the process:
+    - gemini_rpm:<backend> / gemini_tpm:<backend>: requests and (estimated) input
+      tokens per minute for each (API key, model) pair, registered by the model
+      router (services/model_router.py) with GEMINI_RPM / GEMINI_TPM each
+    - unsplash: requests per hour
+    - gemini concurrency: simultaneous model calls over all backends
+    """
+
+    def __init__(self):
+        # Read (and validated) here so a bad value stops the server at startup
+        unsplash_per_hour = _positive_env("UNSPLASH_PER_HOUR", "50")
+        self.gemini_rpm = _positive_env("GEMINI_RPM", "15")
+        self.gemini_tpm = _positive_env("GEMINI_TPM", "1000000")
+
+        self.buckets: Dict[str, TokenBucket] = {
+            "unsplash": TokenBucket("unsplash", max(1.0, unsplash_per_hour / 10), unsplash_per_hour / 3600),
+        }
+        self.governors: Dict[str, ConcurrencyGovernor] = {
+            "gemini": ConcurrencyGovernor("gemini", int(_positive_env("GEMINI_MAX_CONCURRENCY", "4"))),
+        }
+
+    def gemini_buckets(self, backend: str) -> Tuple[TokenBucket, TokenBucket]:
+        """RPM and TPM buckets of one Gemini backend, created on first use"""
+        rpm_name, tpm_name = f"gemini_rpm:{backend}", f"gemini_tpm:{backend}"
+        if rpm_name not in self.buckets:
+            self.buckets[rpm_name] = TokenBucket(rpm_name, max(1.0, self.gemini_rpm / 4), self.gemini_rpm / 60)
+            self.buckets[tpm_name] = TokenBucket(tpm_name, self.gemini_tpm / 4, self.gemini_tpm / 60)
+        return self.buckets[rpm_name], self.buckets[tpm_name]
+
+    async def acquire_unsplash(self) -> float:
+        return await self.buckets["unsplash"].acquire(1)
+
+    def observe_unsplash_response(self, response):
+        """Sync the bucket with Unsplash's X-Ratelimit-Remaining and react to exhaustion"""
+        bucket = self.buckets["unsplash"]
+        remaining = response.headers.get("x-ratelimit-remaining")
+        if remaining is not None and remaining.isdigit():
+            bucket.sync_remaining(int(remaining))
+        if response.status_code == 429 or (response.status_code == 403 and remaining == "0"):
+            retry_after = _retry_after_seconds(response.headers.get("retry-after"))
+            # Unsplash's window is hourly; without a usable hint wait a while before trying again
+            bucket.penalize(retry_after if retry_after is not None else 15 * 60)
+        elif response.status_code == 200:
+            bucket.reward()
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "buckets": {name: bucket.snapshot() for name, bucket in self.buckets.items()},
+            "concurrency": {name: gov.snapshot() for name, gov in self.governors.items()},
+        }
+
+
+# Create singleton instance
+rate_limits = RateLimits()
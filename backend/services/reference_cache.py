@@ -0,0 +1,150 @@
+import asyncio
+import os
+import time
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple, Union
+
+import httpx
+
+import database
+
+# Serve a cached page without touching the network for this long (seconds)
+REFERENCE_CACHE_TTL = float(os.getenv("REFERENCE_CACHE_TTL", "3600"))
+# Raw + prepared bytes kept before least-recently-used pages are evicted
+REFERENCE_CACHE_MAX_BYTES = int(os.getenv("REFERENCE_CACHE_MAX_BYTES", str(50 * 1024 * 1024)))
+
+
+class ReferenceCache:
+    """
+    Cache for reference-site HTML, stored in sites.db.
+
+    Raw pages are content-addressed (identical HTML from different URLs is stored
+    once) and the mode-specific prepared output (cleaned / truncated) is memoized
+    per (content hash, variant), so a repeat reference skips both the network
+    round-trip and the cleaning pass. After the TTL a page is revalidated with
+    If-None-Match / If-Modified-Since; if the origin is unreachable the stale copy
+    is served.
+    """
+
+    def __init__(self, ttl: float = REFERENCE_CACHE_TTL, max_bytes: int = REFERENCE_CACHE_MAX_BYTES):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.stats: Dict[str, int] = {
+            "hits": 0,          # fresh, no network
+            "revalidated": 0,   # 304 Not Modified
+            "misses": 0,        # fetched (new or changed)
+            "stale": 0,         # origin failed, served cached copy
+            "errors": 0,        # origin failed, nothing cached
+            "output_hits": 0,   # prepared output reused
+            "output_misses": 0, # prepared output computed
+            "evicted": 0,
+        }
+
+    async def _fetch(self, url: str, client: httpx.AsyncClient, headers: Dict[str, str]) -> Optional[str]:
+        """Return the content hash of the current page, fetching/revalidating as needed"""
+        page = await database.aio.get_reference_page(url)
+        if page and time.time() - page["fetched_at"] < self.ttl:
+            self.stats["hits"] += 1
+            await database.aio.touch_reference_page(url)
+            print(f"[{datetime.now()}] Reference cache hit: {url}")
+            return page["content_hash"]
+
+        request_headers = dict(headers)
+        if page:
+            if page["etag"]:
+                request_headers["If-None-Match"] = page["etag"]
+            if page["last_modified"]:
+                request_headers["If-Modified-Since"] = page["last_modified"]
+
+        try:
+            print(f"[{datetime.now()}] Fetching reference URL content: {url}")
+            resp = await client.get(url, headers=request_headers)
+        except Exception as e:
+            print(f"[{datetime.now()}] Error fetching reference URL: {e}")
+            return self._stale(page)
+
+        if resp.status_code == 304 and page:
+            self.stats["revalidated"] += 1
+            await database.aio.touch_reference_page(url, revalidated=True)
+            print(f"[{datetime.now()}] Reference revalidated (304): {url}")
+            return page["content_hash"]
+
+        if resp.status_code == 200:
+            self.stats["misses"] += 1
+            content_hash = await database.aio.store_reference_page(
+                url, resp.text, resp.headers.get("etag"), resp.headers.get("last-modified")
+            )
+            # The page being served stays, even one larger than the whole cache
+            evicted = await database.aio.evict_reference_cache(self.max_bytes, keep=url)
+            self.stats["evicted"] += evicted
+            return content_hash
+
+        print(f"[{datetime.now()}] Failed to fetch reference URL: {resp.status_code}")
+        return self._stale(page)
+
+    def _stale(self, page: Optional[Dict[str, Any]]) -> Optional[str]:
+        if page:
+            self.stats["stale"] += 1
+            return page["content_hash"]
+        self.stats["errors"] += 1
+        return None
+
+    async def get_prepared(
+        self,
+        url: str,
+        variant: str,
+        client: httpx.AsyncClient,
+        headers: Dict[str, str],
+        prepare: Callable[[str], Union[str, Awaitable[Union[str, Tuple[str, bool]]]]],
+        max_age: Optional[float] = None,
+    ) -> Optional[str]:
+        """
+        Prepared reference HTML for `url`, or None if it cannot be fetched.
+        `prepare(raw_html)` runs in a worker thread on a prepared-output miss, or is
+        awaited if it is a coroutine function (preparation that fetches more, like
+        stylesheets); `variant` must identify everything that changes its output
+        (mode, cleaner version). Preparation that depends on more than the page can
+        return (output, cacheable) to keep an incomplete output out of the cache,
+        and pass `max_age` (seconds) so a stored output is eventually recomputed.
+        """
+        content_hash = await self._fetch(url, client, headers)
+        if content_hash is None:
+            return None
+
+        output = await database.aio.get_reference_output(content_hash, variant, max_age)
+        if output is not None:
+            self.stats["output_hits"] += 1
+            return output
+
+        raw_html = await database.aio.get_reference_blob(content_hash)
+        if raw_html is None:
+            # Evicted between lookup and read
+            return None
+        self.stats["output_misses"] += 1
+        if asyncio.iscoroutinefunction(prepare):
+            output = await prepare(raw_html)
+        else:
+            output = await asyncio.to_thread(prepare, raw_html)
+        output, cacheable = output if isinstance(output, tuple) else (output, True)
+        if cacheable:
+            await database.aio.store_reference_output(content_hash, variant, output)
+        else:
+            print(f"[{datetime.now()}] Prepared reference for {url} is incomplete, not cached")
+        return output
+
+    async def snapshot(self) -> Dict[str, Any]:
+        lookups = self.stats["hits"] + self.stats["revalidated"] + self.stats["misses"] + self.stats["stale"] + self.stats["errors"]
+        served_from_cache = self.stats["hits"] + self.stats["revalidated"] + self.stats["stale"]
+        outputs = self.stats["output_hits"] + self.stats["output_misses"]
+        return {
+            **self.stats,
+            "hit_rate": round(served_from_cache / lookups, 3) if lookups else 0.0,
+            "output_hit_rate": round(self.stats["output_hits"] / outputs, 3) if outputs else 0.0,
+            "ttl_seconds": self.ttl,
+            "max_bytes": self.max_bytes,
+            "usage": await database.aio.reference_cache_usage(),
+        }
+
+
+# Create singleton instance
+reference_cache = ReferenceCache()
@@ -0,0 +1,116 @@
+import asyncio
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Set
+
+# A stage receives the results of the stages it depends on, keyed by name
+StageFn = Callable[[Dict[str, Any]], Awaitable[Any]]
+
+# Stages left running after a timeout (the loop only keeps weak references to tasks)
+_detached: Set[asyncio.Task] = set()
+
+
+@dataclass
+class Stage:
+    name: str
+    run: StageFn
+    # Seconds from the start of the graph (waiting on dependencies counts)
+    deadline: float
+    # Result used when the stage fails or misses its deadline
+    fallback: Callable[[], Any]
+    depends_on: List[str] = field(default_factory=list)
+    # On timeout let the stage finish in the background (e.g. to warm a cache)
+    # instead of cancelling it
+    detach_on_timeout: bool = False
+
+
+class StageGraph:
+    """
+    Runs a small DAG of async stages concurrently. Each stage starts as soon as
+    its dependencies have a result (real or fallback), so total latency is the
+    longest dependency chain capped by the deadlines rather than the sum of all
+    stages. A stage never raises: errors and timeouts resolve to its fallback.
+    """
+
+    def __init__(self, stages: List[Stage]):
+        self.stages = {stage.name: stage for stage in stages}
+        for stage in stages:
+            for dep in stage.depends_on:
+                if dep not in self.stages:
+                    raise ValueError(f"Stage '{stage.name}' depends on unknown stage '{dep}'")
+        # name -> {"status": ok/timeout/error, "seconds": float}
+        self.report: Dict[str, Dict[str, Any]] = {}
+
+    async def run(self) -> Dict[str, Any]:
+        start = time.monotonic()
+        tasks: Dict[str, asyncio.Task] = {}
+
+        async def run_stage(stage: Stage) -> Any:
+            inputs = {}
+            for dep in stage.depends_on:
+                inputs[dep] = await tasks[dep]
+            remaining = stage.deadline - (time.monotonic() - start)
+            task = asyncio.ensure_future(stage.run(inputs))
+            status = "ok"
+            try:
+                done, _ = await asyncio.wait({task}, timeout=max(0.0, remaining))
+                if task in done:
+                    result = task.result()
+                else:
+                    status = "timeout"
+                    if stage.detach_on_timeout:
+                        _detached.add(task)
+                        task.add_done_callback(_consume_result)
+                    else:
+                        task.cancel()
+                    result = stage.fallback()
+            except asyncio.CancelledError:
+                task.cancel()
+                raise
+            except Exception as e:
+                status = "error"
+                print(f"[{datetime.now()}] Stage '{stage.name}' failed: {e}")
+                result = stage.fallback()
+            self.report[stage.name] = {"status": status, "seconds": round(time.monotonic() - start, 3)}
+            if status == "timeout":
+                print(f"[{datetime.now()}] Stage '{stage.name}' missed its {stage.deadline}s deadline, using fallback")
+            return result
+
+        for name in self._order():
+            tasks[name] = asyncio.ensure_future(run_stage(self.stages[name]))
+        try:
+            await asyncio.gather(*tasks.values())
+        finally:
+            for task in tasks.values():
+                task.cancel()
+
+        print(f"[{datetime.now()}] Stages done in {time.monotonic() - start:.2f}s: "
+              + ", ".join(f"{name}={info['status']}@{info['seconds']}s" for name, info in self.report.items()))
+        return {name: task.result() for name, task in tasks.items()}
+
+    def _order(self) -> List[str]:
+        """Dependencies before dependents (raises on cycles)"""
+        order: List[str] = []
+        visiting: set = set()
+
+        def visit(name: str):
+            if name in order:
+                return
+            if name in visiting:
+                raise ValueError(f"Stage cycle through '{name}'")
+            visiting.add(name)
+            for dep in self.stages[name].depends_on:
+                visit(dep)
+            visiting.discard(name)
+            order.append(name)
+
+        for name in self.stages:
+            visit(name)
+        return order
+
+
+def _consume_result(task: asyncio.Task):
+    _detached.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        print(f"[{datetime.now()}] Detached stage failed: {task.exception()}")
@@ -7,29 +7,49 @@ interface Site {
     product_type: string;
     design_style: string;
     created_at: string;
-    html_content?: string;
+}
+
+interface GalleryResponse {
+    items: Site[];
+    next_cursor: string | null;
+    total: number;
 }
 
 const ITEMS_PER_PAGE = 8;
+const GALLERY_FIELDS = 'id,product_type,design_style,created_at';
+const API_URL = import.meta.env.VITE_API_URL || 'http://localhost:8000';
 
 const GalleryPage: React.FC = () => {
     const [sites, setSites] = useState<Site[]>([]);
+    const [total, setTotal] = useState(0);
     const [loading, setLoading] = useState(true);
     const [currentPage, setCurrentPage] = useState(1);
+    // cursors[i] is the cursor that loads page i + 1 (page 1 has no cursor)
+    const [cursors, setCursors] = useState<(string | null)[]>([null]);
     const navigate = useNavigate();
 
     useEffect(() => {
         const fetchSites = async () => {
+            setLoading(true);
             try {
-                const API_URL = import.meta.env.VITE_API_URL || 'http://localhost:8000';
-                const res = await fetch(`${API_URL}/gallery`);
+                const params = new URLSearchParams({
+                    limit: String(ITEMS_PER_PAGE),
+                    fields: GALLERY_FIELDS
+                });
+                const cursor = cursors[currentPage - 1];
+                if (cursor) params.set('cursor', cursor);
+
+                const res = await fetch(`${API_URL}/gallery?${params.toString()}`);
                 if (res.ok) {
-                    const data = await res.json();
-                    // Sort by created_at string comparison (more reliable for ISO-like strings)
-                    const sortedData = data.sort((a: Site, b: Site) =>
-                        (b.created_at || '').localeCompare(a.created_at || '')
-                    );
-                    setSites(sortedData);
+                    const data: GalleryResponse = await res.json();
+                    // Server already returns newest first
+                    setSites(data.items);
+                    setTotal(data.total);
+                    setCursors(prev => {
+                        const next = prev.slice(0, currentPage);
+                        next[currentPage] = data.next_cursor;
+                        return next;
+                    });
                 }
             } catch (e) {
                 console.error(e);
@@ -38,14 +58,15 @@ const GalleryPage: React.FC = () => {
             }
         };
         fetchSites();
-    }, []);
+        // eslint-disable-next-line react-hooks/exhaustive-deps
+    }, [currentPage]);
 
-    const totalPages = Math.ceil(sites.length / ITEMS_PER_PAGE);
-    const startIndex = (currentPage - 1) * ITEMS_PER_PAGE;
-    const endIndex = startIndex + ITEMS_PER_PAGE;
-    const currentSites = sites.slice(startIndex, endIndex);
+    const totalPages = Math.ceil(total / ITEMS_PER_PAGE);
+    const hasNextPage = Boolean(cursors[currentPage]);
 
     const goToPage = (page: number) => {
+        // Keyset pagination: only pages already reached (or the next one) are addressable
+        if (page < 1 || (page > 1 && !cursors[page - 1])) return;
         setCurrentPage(page);
         window.scrollTo({ top: 0, behavior: 'smooth' });
     };
@@ -74,7 +95,7 @@ const GalleryPage: React.FC = () => {
                 <div>
                     <h1 style={{ fontSize: '1.75rem', fontWeight: '800', margin: 0, letterSpacing: '-0.03em' }}>갤러리</h1>
                     <p style={{ margin: '0.25rem 0 0 0', fontSize: '0.875rem', color: '#6b7280' }}>
-                        생성된 사이트 {sites.length}개
+                        생성된 사이트 {total}개
                     </p>
                 </div>
                 <button
@@ -110,7 +131,7 @@ const GalleryPage: React.FC = () => {
                     }}>
                         로딩 중...
                     </div>
-                ) : sites.length === 0 ? (
+                ) : total === 0 ? (
                     <div style={{
                         display: 'flex',
                         flexDirection: 'column',
@@ -167,7 +188,7 @@ const GalleryPage: React.FC = () => {
                             margin: '0 auto',
                             marginBottom: '2rem'
                         }}>
-                            {currentSites.map(site => (
+                            {sites.map(site => (
                                 <div
                                     key={site.id}
                                     onClick={() => navigate(`/result/${site.id}`)}
@@ -199,47 +220,33 @@ const GalleryPage: React.FC = () => {
                                         position: 'relative',
                                         overflow: 'hidden'
                                     }}>
-                                        {site.html_content ? (
-                                            <div style={{
-                                                width: '312.5%', // 100% / 0.32
-                                                height: '312.5%',
-                                                transform: 'scale(0.32)',
-                                                transformOrigin: 'top left',
-                                                position: 'absolute',
-                                                top: 0,
-                                                left: 0,
-                                                pointerEvents: 'none',
-                                                overflow: 'hidden',
-                                                backgroundColor: 'white'
-                                            }}>
-                                                <iframe
-                                                    srcDoc={site.html_content}
-                                                    title={`Preview of ${site.product_type}`}
-                                                    style={{
-                                                        width: '100%',
-                                                        height: '100%',
-                                                        border: 'none',
-                                                        backgroundColor: 'white',
-                                                        display: 'block'
-                                                    }}
-                                                    loading="lazy"
-                                                />
-                                            </div>
-                                        ) : (
-                                            <div style={{
-                                                display: 'flex',
-                                                alignItems: 'center',
-                                                justifyContent: 'center',
-                                                height: '100%',
-                                                backgroundColor: 'white'
-                                            }}>
-                                                <p style={{
-                                                    fontSize: '0.875rem',
-                                                    color: '#9ca3af',
-                                                    margin: 0
-                                                }}>미리보기 없음</p>
-                                            </div>
-                                        )}
+                                        <div style={{
+                                            width: '312.5%', // 100% / 0.32
+                                            height: '312.5%',
+                                            transform: 'scale(0.32)',
+                                            transformOrigin: 'top left',
+                                            position: 'absolute',
+                                            top: 0,
+                                            left: 0,
+                                            pointerEvents: 'none',
+                                            overflow: 'hidden',
+                                            backgroundColor: 'white'
+                                        }}>
+                                            {/* Static, script-free preview rendered by the backend */}
+                                            <iframe
+                                                src={`${API_URL}/sites/${site.id}/preview`}
+                                                title={`Preview of ${site.product_type}`}
+                                                sandbox=""
+                                                style={{
+                                                    width: '100%',
+                                                    height: '100%',
+                                                    border: 'none',
+                                                    backgroundColor: 'white',
+                                                    display: 'block'
+                                                }}
+                                                loading="lazy"
+                                            />
+                                        </div>
                                     </div>
 
                                     {/* Info Section */}
@@ -329,17 +336,20 @@ const GalleryPage: React.FC = () => {
 
                                 {[...Array(totalPages)].map((_, index) => {
                                     const page = index + 1;
+                                    const reachable = page === 1 || Boolean(cursors[page - 1]);
                                     return (
                                         <button
                                             key={page}
                                             onClick={() => goToPage(page)}
+                                            disabled={!reachable}
                                             style={{
                                                 padding: '0.5rem 1rem',
                                                 backgroundColor: currentPage === page ? 'black' : 'white',
                                                 color: currentPage === page ? 'white' : '#374151',
                                                 border: '1px solid #e5e7eb',
                                                 borderRadius: '6px',
-                                                cursor: 'pointer',
+                                                cursor: reachable ? 'pointer' : 'not-allowed',
+                                                opacity: reachable ? 1 : 0.5,
                                                 fontSize: '0.875rem',
                                                 fontWeight: currentPage === page ? '600' : '400',
                                                 minWidth: '40px'
@@ -352,16 +362,16 @@ const GalleryPage: React.FC = () => {
 
                                 <button
                                     onClick={() => goToPage(currentPage + 1)}
-                                    disabled={currentPage === totalPages}
+                                    disabled={!hasNextPage}
                                     style={{
                                         padding: '0.5rem',
-                                        backgroundColor: currentPage === totalPages ? '#f3f4f6' : 'white',
+                                        backgroundColor: !hasNextPage ? '#f3f4f6' : 'white',
                                         border: '1px solid #e5e7eb',
                                         borderRadius: '6px',
-                                        cursor: currentPage === totalPages ? 'not-allowed' : 'pointer',
+                                        cursor: !hasNextPage ? 'not-allowed' : 'pointer',
                                         display: 'flex',
                                         alignItems: 'center',
-                                        opacity: currentPage === totalPages ? 0.5 : 1
+                                        opacity: !hasNextPage ? 0.5 : 1
                                     }}
                                 >
                                     <ChevronRight size={20} />
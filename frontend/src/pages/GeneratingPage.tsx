@@ -8,11 +8,13 @@ const GeneratingPage: React.FC = () => {
 
     const [status, setStatus] = useState('준비 중...');
     const [elapsedTime, setElapsedTime] = useState(0);
+    const [partialHtml, setPartialHtml] = useState('');
 
     // Refs for cleanup and state management
     const isMounted = useRef(true);
     const pollTimeoutRef = useRef<ReturnType<typeof setTimeout> | null>(null);
     const timerIntervalRef = useRef<ReturnType<typeof setInterval> | null>(null);
+    const eventSourceRef = useRef<EventSource | null>(null);
 
     useEffect(() => {
         isMounted.current = true;
@@ -56,7 +58,20 @@ const GeneratingPage: React.FC = () => {
                 if (!isMounted.current) return;
                 setStatus('코드를 작성하고 있습니다...');
 
-                // 2. Start Polling (Recursive setTimeout with 3s delay)
+                const finish = () => {
+                    setStatus('완성되었습니다!');
+                    clearInterval(timerIntervalRef.current!);
+                    setTimeout(() => {
+                        if (isMounted.current) navigate(`/result/${siteId}`);
+                    }, 800);
+                };
+
+                const fail = (message: string) => {
+                    setStatus('오류가 발생했습니다: ' + message);
+                    clearInterval(timerIntervalRef.current!);
+                };
+
+                // 2b. Fallback: Polling (Recursive setTimeout with 3s delay)
                 let pollAttempts = 0;
                 const maxPollAttempts = 120;
 
@@ -76,16 +91,15 @@ const GeneratingPage: React.FC = () => {
                         if (resultRes.ok) {
                             const site = await resultRes.json();
                             if (site.status === 'completed') {
-                                setStatus('완성되었습니다!');
-                                clearInterval(timerIntervalRef.current!);
-                                setTimeout(() => {
-                                    if (isMounted.current) navigate(`/result/${siteId}`);
-                                }, 800);
+                                finish();
                                 return; // Stop polling
                             } else if (site.status === 'error') {
-                                setStatus('오류가 발생했습니다: ' + site.error_message);
-                                clearInterval(timerIntervalRef.current!);
+                                fail(site.error_message);
                                 return; // Stop polling
+                            } else if (site.queue?.state === 'queued' && site.queue.position) {
+                                setStatus(`대기열 ${site.queue.position}번째입니다 (전체 ${site.queue.depth}건)`);
+                            } else if (site.queue?.state === 'running') {
+                                setStatus('코드를 작성하고 있습니다...');
                             }
                         }
                     } catch (e) {
@@ -99,8 +113,50 @@ const GeneratingPage: React.FC = () => {
                     }
                 };
 
-                // Start first poll
-                poll();
+                // 2a. Server-Sent Events: progress + partial HTML pushed as it is generated
+                if (typeof EventSource === 'undefined') {
+                    poll();
+                    return;
+                }
+
+                let streamed = '';
+                const source = new EventSource(`${API_URL}/results/${siteId}/stream`);
+                eventSourceRef.current = source;
+
+                source.addEventListener('progress', (e) => {
+                    if (!isMounted.current) return;
+                    const data = JSON.parse((e as MessageEvent).data);
+                    if (data.queue?.state === 'queued' && data.queue.position) {
+                        setStatus(`대기열 ${data.queue.position}번째입니다 (전체 ${data.queue.depth}건)`);
+                    } else if (data.stage === 'generating') {
+                        setStatus('코드를 작성하고 있습니다...');
+                    }
+                });
+
+                source.addEventListener('partial', (e) => {
+                    if (!isMounted.current) return;
+                    const data = JSON.parse((e as MessageEvent).data);
+                    streamed = data.reset ? '' : streamed.slice(0, data.offset) + data.html;
+                    setPartialHtml(streamed);
+                });
+
+                source.addEventListener('complete', () => {
+                    source.close();
+                    if (isMounted.current) finish();
+                });
+
+                source.addEventListener('error', (e) => {
+                    source.close();
+                    if (!isMounted.current) return;
+                    const data = (e as MessageEvent).data;
+                    if (data) {
+                        // Generation failed (server-sent error event)
+                        fail(JSON.parse(data).message);
+                    } else {
+                        // Connection problem: fall back to polling
+                        poll();
+                    }
+                });
 
             } catch (err) {
                 if (isMounted.current) {
@@ -117,6 +173,7 @@ const GeneratingPage: React.FC = () => {
             isMounted.current = false;
             if (timerIntervalRef.current) clearInterval(timerIntervalRef.current);
             if (pollTimeoutRef.current) clearTimeout(pollTimeoutRef.current);
+            if (eventSourceRef.current) eventSourceRef.current.close();
         };
     }, [formData, navigate]);
 
@@ -296,6 +353,37 @@ const GeneratingPage: React.FC = () => {
                                 </p>
                             </div>
                         </div>
+
+                        {/* Live preview of the HTML streamed so far (scripts disabled) */}
+                        {partialHtml && (
+                            <div style={{
+                                marginTop: '1.5rem',
+                                height: '240px',
+                                borderRadius: '16px',
+                                border: '1px solid #e5e7eb',
+                                overflow: 'hidden',
+                                position: 'relative',
+                                backgroundColor: 'white'
+                            }}>
+                                <div style={{
+                                    width: '250%', // 100% / 0.4
+                                    height: '250%',
+                                    transform: 'scale(0.4)',
+                                    transformOrigin: 'top left',
+                                    position: 'absolute',
+                                    top: 0,
+                                    left: 0,
+                                    pointerEvents: 'none'
+                                }}>
+                                    <iframe
+                                        srcDoc={partialHtml}
+                                        title="Live preview"
+                                        sandbox=""
+                                        style={{ width: '100%', height: '100%', border: 'none', display: 'block' }}
+                                    />
+                                </div>
+                            </div>
+                        )}
                     </div>
                 </div>
             </div>
@@ -244,6 +244,7 @@ const InputPage: React.FC = () => {
                                     <option value="smart">✨ 스마트 필터링 (권장 - 핵심 구조만 분석)</option>
                                     <option value="none">🔗 HTML 소스 미제공 (URL만 전달)</option>
                                     <option value="raw">📄 전체 소스 제공 (기존 방식)</option>
+                                    <option value="design">🎨 디자인 토큰만 제공 (색상·폰트·레이아웃 요약)</option>
                                 </select>
                                 <p style={{
                                     fontSize: '0.75rem',
@@ -6,7 +6,13 @@ interface SiteData {
     id: string;
     html_content: string;
     status: string;
-    meta_data: string;
+    product_type: string | null;
+    design_style: string | null;
+    reference_url: string | null;
+    explanation: string | null;
+    key_points: string[] | null;
+    color_palette: string[] | null;
+    generation_mode: string | null;
 }
 
 const ResultPage: React.FC = () => {
@@ -45,8 +51,7 @@ const ResultPage: React.FC = () => {
     if (loading) return <div style={{ display: 'flex', alignItems: 'center', justifyContent: 'center', minHeight: '60vh' }}>로딩 중...</div>;
     if (!site) return <div style={{ display: 'flex', alignItems: 'center', justifyContent: 'center', minHeight: '60vh' }}>사이트를 찾을 수 없습니다.</div>;
 
-    const meta = JSON.parse(site.meta_data || '{}');
-    const { explanation, color_palette, product_type, design_style, reference_url } = meta;
+    const { explanation, color_palette, product_type, design_style, reference_url } = site;
 
     const getFrameWidth = () => {
         switch (device) {